@@ -0,0 +1,493 @@
+"""
+Dynamic blocklist (kernel hash sets with timeouts)
+Addresses and networks that should simply be dropped for a while - auto-bans
+from the detection code, manual bans from the API - do not become firewall
+rules. They go into one kernel set per address family, checked by a single
+drop rule in front of everything else:
+  - iptables: ipset `hash:net` sets kobi-block4 / kobi-block6 created with
+    `timeout`, matched from the KOBI-BLOCK chain that raw/PREROUTING jumps to
+  - nftables: interval sets with the timeout flag in their own
+    `inet kobi_block` table (the rule compiler replaces `inet kobi` wholesale),
+    matched from a prerouting chain at raw priority
+Membership is one set lookup in the kernel however many entries there are,
+and the kernel drops entries on its own when their timeout runs out. Changes
+are queued and written in batches - one `ipset restore` / `nft -f` call per
+batch_size entries. The firewall_blocklist collection mirrors the set so it
+can be reloaded after a restart (tasks/blocklist.py).
+
+New bans are refused when they are wider than the configured minimum prefix
+or overlap a protected network: loopback, the server's own interface
+addresses, firewall_blocklist_protected and the caller's own address.
+"""
+import ipaddress
+import logging
+import math
+import subprocess
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from app.firewall_ruleset import FirewallApplyError
+from app.nftables_firewall import ADDRESS_KEYWORDS, ADDRESS_TYPES, NFT_FAMILY, NftablesFirewall
+from app.settings import get_settings
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    psutil = None
+    PSUTIL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+IPSET_NAMES = {4: "kobi-block4", 6: "kobi-block6"}
+IPSET_FAMILIES = {4: "inet", 6: "inet6"}
+IPSET_STAGING_SUFFIX = "-new"
+IPSET_MAX_TIMEOUT = 2147483     # seconds; longer bans are re-armed when the set is reloaded
+IPTABLES_BINARIES = {4: "iptables", 6: "ip6tables"}
+BLOCK_TABLE = "raw"             # before conntrack and before the filter table's KOBI-* chains
+BLOCK_HOOK = "PREROUTING"
+BLOCK_CHAIN = "KOBI-BLOCK"
+NFT_BLOCK_TABLE = "kobi_block"
+NFT_SET_NAMES = {4: "block4", 6: "block6"}
+HOST_PREFIXES = {4: 32, 6: 128}
+ALWAYS_PROTECTED = ("127.0.0.0/8", "::1/128")
+LOCAL_ADDRESS_TTL = 30.0        # seconds the interface address list is reused
+
+_local_addresses: Tuple[float, List[Any]] = (0.0, [])
+
+
+def normalize_address(value: Any) -> str:
+    """'10.0.0.5' / '10.0.0.0/24' / '2001:db8::/48' -> canonical text (single hosts without /32, /128)"""
+    try:
+        network = ipaddress.ip_network(str(value).strip(), strict=False)
+    except ValueError:
+        raise ValueError(f"Invalid IP address or network: {value}")
+    if network.prefixlen == 0:
+        raise ValueError(f"Refusing to block the whole address space: {value}")
+    if network.num_addresses == 1:
+        return str(network.network_address)
+    return str(network)
+
+
+def local_addresses() -> List[Any]:
+    """The server's own interface addresses as host networks (cached for LOCAL_ADDRESS_TTL)"""
+    global _local_addresses
+    checked_at, networks = _local_addresses
+    if not PSUTIL_AVAILABLE or time.monotonic() - checked_at < LOCAL_ADDRESS_TTL:
+        return networks
+    networks = []
+    for addresses in psutil.net_if_addrs().values():
+        for address in addresses:
+            try:
+                networks.append(ipaddress.ip_network(address.address.split("%")[0]))
+            except ValueError:
+                continue        # MAC addresses and other non-IP families
+    _local_addresses = (time.monotonic(), networks)
+    return networks
+
+
+def protected_networks(extra: Iterable[Any] = ()) -> List[Any]:
+    """Networks no ban may overlap: loopback, own interfaces, configured and caller addresses"""
+    networks = [ipaddress.ip_network(network) for network in ALWAYS_PROTECTED] + local_addresses()
+    for value in [*get_settings().firewall_blocklist_protected, *extra]:
+        try:
+            networks.append(ipaddress.ip_network(str(value).strip(), strict=False))
+        except ValueError:
+            logger.warning(f"⚠️ Ignoring invalid protected blocklist address: {value}")
+    return networks
+
+
+def ensure_blockable(address: str, protected: Iterable[Any]) -> None:
+    """Raise ValueError for a normalized entry that is too wide or covers a protected address"""
+    network = ipaddress.ip_network(address)
+    settings = get_settings()
+    minimum = settings.firewall_blocklist_min_prefix_v4 if network.version == 4 \
+        else settings.firewall_blocklist_min_prefix_v6
+    if network.prefixlen < minimum:
+        raise ValueError(f"Refusing to block {address}: networks wider than /{minimum} are not allowed")
+    for other in protected:
+        if other.version == network.version and network.overlaps(other):
+            raise ValueError(f"Refusing to block {address}: it covers protected address {other}")
+
+
+@dataclass
+class BlocklistEntry:
+    """One blocked address or network"""
+    address: str                            # normalize_address form
+    expires_at: Optional[datetime] = None   # None: until removed
+    reason: Optional[str] = None
+    source: str = "api"
+
+    @property
+    def version(self) -> int:
+        # Cheap on the canonical text: no re-parsing for every kernel line of a 1M entry reload
+        return 6 if ":" in self.address else 4
+
+    @property
+    def prefixlen(self) -> int:
+        _, _, prefix = self.address.partition("/")
+        return int(prefix) if prefix else HOST_PREFIXES[self.version]
+
+    def expired(self, now: datetime) -> bool:
+        return self.expires_at is not None and self.expires_at <= now
+
+    def timeout(self, now: datetime) -> Optional[int]:
+        """Seconds left (None: permanent, 0: already expired)"""
+        if self.expires_at is None:
+            return None
+        return max(0, math.ceil((self.expires_at - now).total_seconds()))
+
+    def to_document(self, now: datetime) -> Dict[str, Any]:
+        return {
+            "_id": self.address,
+            "address": self.address,
+            "version": self.version,
+            "expires_at": self.expires_at,
+            "reason": self.reason,
+            "source": self.source,
+            "updated_at": now,
+        }
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "BlocklistEntry":
+        return cls(
+            address=normalize_address(document.get("address") or document["_id"]),
+            expires_at=document.get("expires_at"),
+            reason=document.get("reason"),
+            source=document.get("source") or "api",
+        )
+
+
+def make_entry(address: Any, ttl_seconds: Optional[int] = None, reason: Optional[str] = None,
+               source: str = "api", now: Optional[datetime] = None) -> BlocklistEntry:
+    """Entry expiring after ttl_seconds (None: the configured default, 0: permanent)"""
+    if ttl_seconds is None:
+        ttl_seconds = get_settings().firewall_blocklist_default_ttl_seconds
+    if ttl_seconds < 0:
+        raise ValueError("ttl_seconds must not be negative")
+    now = now or datetime.utcnow()
+    expires_at = now + timedelta(seconds=ttl_seconds) if ttl_seconds else None
+    return BlocklistEntry(normalize_address(address), expires_at, reason, source)
+
+
+def _batches(items: Sequence[Any], size: int) -> Iterable[Sequence[Any]]:
+    for start in range(0, len(items), max(size, 1)):
+        yield items[start:start + size]
+
+
+# =============================================================================
+# KERNEL BACKENDS
+# =============================================================================
+
+class IpsetBlocklistBackend:
+    """ipset hash:net sets dropped from raw/PREROUTING (iptables backend)"""
+    name = "ipset"
+
+    def __init__(self, ipset_binary: str = "ipset", max_entries: Optional[int] = None,
+                 runner: Callable[..., subprocess.CompletedProcess] = subprocess.run):
+        self.ipset_binary = ipset_binary
+        self.max_entries = max_entries or get_settings().firewall_blocklist_max_entries
+        self.runner = runner
+
+    def _run(self, args: List[str], payload: Optional[str] = None) -> subprocess.CompletedProcess:
+        try:
+            return self.runner(args, input=payload, capture_output=True, text=True)
+        except OSError as e:
+            raise FirewallApplyError(f"{args[0]} unavailable: {e}")
+
+    def restore(self, lines: Sequence[str]):
+        """One `ipset restore -exist` call (del of a missing entry is a no-op, add re-arms the timeout)"""
+        result = self._run([self.ipset_binary, "restore", "-exist"], "\n".join(lines) + "\n")
+        if result.returncode != 0:
+            raise FirewallApplyError(f"ipset restore failed: {result.stderr.strip() or result.returncode}")
+
+    def _create_line(self, name: str, version: int) -> str:
+        return f"create {name} hash:net family {IPSET_FAMILIES[version]} timeout 0 maxelem {self.max_entries}"
+
+    def _ensure_rule(self, binary: str, chain: str, rule: List[str], append: bool = False):
+        if self._run([binary, "-w", "-t", BLOCK_TABLE, "-C", chain] + rule).returncode == 0:
+            return
+        position = ["-A", chain] if append else ["-I", chain, "1"]
+        result = self._run([binary, "-w", "-t", BLOCK_TABLE] + position + rule)
+        if result.returncode != 0:
+            raise FirewallApplyError(f"{binary} {' '.join(position + rule)} failed: "
+                                     f"{result.stderr.strip() or result.returncode}")
+
+    def ensure(self):
+        """Create the sets and the drop chain if missing (idempotent)"""
+        self.restore([self._create_line(name, version) for version, name in IPSET_NAMES.items()])
+        for version, binary in IPTABLES_BINARIES.items():
+            try:
+                self._run([binary, "-w", "-t", BLOCK_TABLE, "-N", BLOCK_CHAIN])  # fails when it exists
+                self._ensure_rule(binary, BLOCK_CHAIN, ["-m", "set", "--match-set", IPSET_NAMES[version], "src",
+                                                        "-j", "DROP"], append=True)
+                self._ensure_rule(binary, BLOCK_HOOK, ["-j", BLOCK_CHAIN])
+            except FirewallApplyError as e:
+                if version == 4:
+                    raise
+                logger.warning(f"⚠️ IPv6 blocklist not hooked: {e}")
+
+    def _add_lines(self, entries: Iterable[BlocklistEntry], now: datetime,
+                   names: Dict[int, str] = IPSET_NAMES) -> List[str]:
+        lines = []
+        for entry in entries:
+            timeout = entry.timeout(now)
+            if timeout == 0:
+                continue
+            lines.append(f"add {names[entry.version]} {entry.address} timeout {min(timeout or 0, IPSET_MAX_TIMEOUT)}")
+        return lines
+
+    def apply(self, added: Sequence[BlocklistEntry], removed: Sequence[str], now: datetime,
+              batch_size: int, refreshed: Set[str] = frozenset()):
+        """Write queued changes, batch_size entries per ipset restore (add -exist also re-arms `refreshed`)"""
+        lines = [f"del {IPSET_NAMES[6 if ':' in address else 4]} {address}" for address in removed]
+        lines += self._add_lines(added, now)
+        for batch in _batches(lines, batch_size):
+            self.restore(batch)
+
+    def replace(self, entries: Sequence[BlocklistEntry], now: datetime, batch_size: int):
+        """Fill a staging set per family and swap it in, so a reload never leaves the set empty"""
+        self.ensure()
+        for version, name in IPSET_NAMES.items():
+            staging = name + IPSET_STAGING_SUFFIX
+            staging_names = {version: staging}
+            lines = [self._create_line(staging, version), f"flush {staging}"]
+            lines += self._add_lines([entry for entry in entries if entry.version == version], now, staging_names)
+            lines += [f"swap {staging} {name}", f"destroy {staging}"]
+            for batch in _batches(lines, batch_size):
+                self.restore(batch)
+
+
+class NftBlocklistBackend:
+    """Interval sets with timeouts in their own `inet kobi_block` table (nftables backend)"""
+    name = "nftables"
+
+    def __init__(self, nft_binary: str = "nft", max_entries: Optional[int] = None,
+                 runner: Callable[..., subprocess.CompletedProcess] = subprocess.run):
+        self.nft = NftablesFirewall(nft_binary, runner=runner)
+        self.max_entries = max_entries or get_settings().firewall_blocklist_max_entries
+
+    def table_script(self) -> str:
+        lines = [f"table {NFT_FAMILY} {NFT_BLOCK_TABLE} {{"]
+        for version, name in NFT_SET_NAMES.items():
+            lines += [f"\tset {name} {{", f"\t\ttype {ADDRESS_TYPES[version]}", "\t\tflags interval, timeout",
+                      f"\t\tsize {self.max_entries}", "\t}"]
+        lines += ["\tchain prerouting {", "\t\ttype filter hook prerouting priority raw; policy accept;"]
+        lines += [f"\t\t{ADDRESS_KEYWORDS[version]} saddr @{name} counter drop" for version, name in NFT_SET_NAMES.items()]
+        lines += ["\t}", "}"]
+        return "\n".join(lines) + "\n"
+
+    def _exists(self) -> bool:
+        try:
+            result = self.nft.runner([self.nft.nft_binary, "list", "table", NFT_FAMILY, NFT_BLOCK_TABLE],
+                                     capture_output=True, text=True)
+        except OSError as e:
+            raise FirewallApplyError(f"nft unavailable: {e}")
+        return result.returncode == 0
+
+    def ensure(self):
+        """Create the table if missing (declaring an existing chain again would duplicate its rules)"""
+        if not self._exists():
+            self.nft.run_script(self.table_script())
+
+    @staticmethod
+    def _element(entry: BlocklistEntry, now: datetime) -> str:
+        timeout = entry.timeout(now)
+        return entry.address if timeout is None else f"{entry.address} timeout {timeout}s"
+
+    @staticmethod
+    def _command(verb: str, version: int, elements: Sequence[str]) -> str:
+        return f"{verb} element {NFT_FAMILY} {NFT_BLOCK_TABLE} {NFT_SET_NAMES[version]} {{ {', '.join(elements)} }}"
+
+    def _script(self, added: Sequence[BlocklistEntry], removed: Sequence[str], now: datetime) -> List[str]:
+        commands = []
+        deletions: Dict[int, List[str]] = {}
+        for address in removed:
+            deletions.setdefault(6 if ":" in address else 4, []).append(address)
+        additions: Dict[int, List[str]] = {}
+        for entry in added:
+            additions.setdefault(entry.version, []).append(self._element(entry, now))
+        commands += [self._command("delete", version, elements) for version, elements in deletions.items()]
+        commands += [self._command("add", version, elements) for version, elements in additions.items()]
+        return commands
+
+    def _run_batch(self, added: Sequence[BlocklistEntry], removed: Sequence[str], now: datetime):
+        """One transaction; if it fails (e.g. an element the kernel already timed out), element by element"""
+        try:
+            self.nft.run_script("\n".join(self._script(added, removed, now)) + "\n")
+            return
+        except FirewallApplyError as e:
+            logger.warning(f"⚠️ Blocklist batch rejected, retrying per element: {e}")
+        failed = 0
+        for address in removed:
+            try:
+                self.nft.run_script(self._script([], [address], now)[0] + "\n")
+            except FirewallApplyError:
+                failed += 1
+        for entry in added:
+            try:
+                self.nft.run_script("\n".join(self._script([entry], [], now)) + "\n")
+            except FirewallApplyError as e:
+                failed += 1
+                logger.warning(f"⚠️ Blocklist entry {entry.address} not added: {e}")
+        if failed:
+            logger.info(f"🚫 Blocklist batch applied with {failed} skipped elements")
+
+    def apply(self, added: Sequence[BlocklistEntry], removed: Sequence[str], now: datetime,
+              batch_size: int, refreshed: Set[str] = frozenset()):
+        """Write queued changes, batch_size entries per `nft -f` (refreshed entries are re-added to re-arm)"""
+        live = [entry for entry in added if entry.timeout(now) != 0]
+        for batch in _batches(list(removed), batch_size):
+            self._run_batch([], batch, now)
+        for batch in _batches(live, batch_size):
+            # `add element` leaves an existing element's timeout alone: delete it in the same transaction
+            self._run_batch(batch, [entry.address for entry in batch if entry.address in refreshed], now)
+
+    def replace(self, entries: Sequence[BlocklistEntry], now: datetime, batch_size: int):
+        """Flush and refill both sets; the flush commits together with the first batch"""
+        self.ensure()
+        flush = [f"flush set {NFT_FAMILY} {NFT_BLOCK_TABLE} {name}" for name in NFT_SET_NAMES.values()]
+        live = [entry for entry in entries if entry.timeout(now) != 0]
+        batches = list(_batches(live, batch_size)) or [[]]
+        self.nft.run_script("\n".join(flush + self._script(batches[0], [], now)) + "\n")
+        for batch in batches[1:]:
+            self._run_batch(batch, [], now)
+
+
+def blocklist_backend(system: Optional[str] = None):
+    """Kernel backend for the configured firewall backend (None where there is no Linux kernel set)"""
+    # Imported here: firewall_os imports every driver, including the Windows one
+    from app.firewall_os import SYSTEM
+
+    if (system or SYSTEM) != "linux":
+        return None
+    if get_settings().firewall_backend == "nftables":
+        return NftBlocklistBackend()
+    return IpsetBlocklistBackend()
+
+
+# =============================================================================
+# IN-MEMORY VIEW + CHANGE QUEUE
+# =============================================================================
+
+class DynamicBlocklist:
+    """
+    Active entries and the changes not written to the kernel yet. Thread-safe:
+    detection code adds from wherever it runs, the flusher drains.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._active: Dict[str, BlocklistEntry] = {}
+        self._prefixes: Counter = Counter()         # (version, prefixlen) -> active entries
+        self._added: Dict[str, BlocklistEntry] = {}
+        self._removed: Set[str] = set()
+        self._refreshed: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._active)
+
+    @property
+    def pending(self) -> int:
+        return len(self._added) + len(self._removed)
+
+    def _index(self, entry: BlocklistEntry):
+        if entry.address not in self._active:
+            self._prefixes[(entry.version, entry.prefixlen)] += 1
+        self._active[entry.address] = entry
+
+    def _unindex(self, address: str) -> Optional[BlocklistEntry]:
+        entry = self._active.pop(address, None)
+        if entry is not None:
+            key = (entry.version, entry.prefixlen)
+            self._prefixes[key] -= 1
+            if self._prefixes[key] <= 0:
+                del self._prefixes[key]
+        return entry
+
+    def add(self, entry: BlocklistEntry, now: Optional[datetime] = None):
+        """Block (or extend the block of) an address; written out by the next flush"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            current = self._active.get(entry.address)
+            if current is not None and not current.expired(now) and entry.address not in self._added:
+                self._refreshed.add(entry.address)
+            self._index(entry)
+            self._added[entry.address] = entry
+            self._removed.discard(entry.address)
+
+    def remove(self, address: str) -> bool:
+        """Unblock an address; False when it was not blocked"""
+        address = normalize_address(address)
+        with self._lock:
+            entry = self._unindex(address)
+            queued = self._added.pop(address, None)
+            refreshed = address in self._refreshed
+            self._refreshed.discard(address)
+            if entry is None:
+                return False
+            if queued is None or refreshed:
+                # Already in the kernel
+                self._removed.add(address)
+            return True
+
+    def lookup(self, ip: Any, now: Optional[datetime] = None) -> Optional[BlocklistEntry]:
+        """Active entry covering an address: one dict probe per prefix length in use"""
+        address = ipaddress.ip_address(str(ip).strip())
+        value, bits = int(address), HOST_PREFIXES[address.version]
+        now = now or datetime.utcnow()
+        with self._lock:
+            for version, prefixlen in list(self._prefixes):
+                if version != address.version:
+                    continue
+                network = type(address)(value >> (bits - prefixlen) << (bits - prefixlen))
+                key = str(network) if prefixlen == bits else f"{network}/{prefixlen}"
+                entry = self._active.get(key)
+                if entry is not None and not entry.expired(now):
+                    return entry
+        return None
+
+    def expire(self, now: Optional[datetime] = None) -> int:
+        """Forget entries past their expiry (the kernel and the TTL index drop them by themselves)"""
+        now = now or datetime.utcnow()
+        with self._lock:
+            expired = [address for address, entry in self._active.items()
+                       if entry.expired(now) and address not in self._added]
+            for address in expired:
+                self._unindex(address)
+                self._refreshed.discard(address)
+        return len(expired)
+
+    def drain(self) -> Tuple[List[BlocklistEntry], List[str], Set[str]]:
+        """(added, removed, refreshed) since the previous drain"""
+        with self._lock:
+            added, removed, refreshed = list(self._added.values()), list(self._removed), self._refreshed
+            self._added, self._removed, self._refreshed = {}, set(), set()
+        return added, removed, refreshed
+
+    def load(self, entries: Iterable[BlocklistEntry]):
+        """Replace the active entries (startup reload); queued changes are kept"""
+        with self._lock:
+            self._active, self._prefixes = {}, Counter()
+            for entry in entries:
+                self._index(entry)
+            for entry in self._added.values():
+                self._index(entry)
+            for address in self._removed:
+                self._unindex(address)
+
+    def snapshot(self) -> List[BlocklistEntry]:
+        with self._lock:
+            return list(self._active.values())
+
+
+__all__ = [
+    "BlocklistEntry", "DynamicBlocklist", "IpsetBlocklistBackend", "NftBlocklistBackend",
+    "normalize_address", "make_entry", "blocklist_backend",
+    "IPSET_NAMES", "BLOCK_CHAIN", "NFT_BLOCK_TABLE", "NFT_SET_NAMES",
+]
@@ -0,0 +1,128 @@
+"""
+Async LRU + TTL cache with single-flight and stale-while-revalidate
+Entries are keyed by tuples (for example report, period, filters), expire per
+entry, and are evicted least-recently-used beyond max_entries. Concurrent
+misses for the same key share one computation; an expired entry is still
+served during its stale window while one background task refreshes it.
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    stored_at: float
+    expires_at: float
+    stale_until: float
+
+
+class AsyncTTLCache:
+    """Keyed async cache; hit/miss counters are written into a caller-owned metrics dict"""
+
+    def __init__(self, name: str, max_entries: int = 128, ttl_seconds: float = 300,
+                 stale_seconds: float = 0, metrics: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        self.metrics = metrics if metrics is not None else {}
+        for counter in ("cache_hits", "cache_misses", "cache_stale_hits", "cache_coalesced",
+                        "cache_evictions", "cache_refresh_errors"):
+            self.metrics.setdefault(counter, 0)
+
+    @staticmethod
+    def make_key(report: str, period: Optional[str] = None, **filters) -> tuple:
+        """Build a stable key; filters are order-independent"""
+        frozen = json.dumps(filters, sort_keys=True, default=str) if filters else ""
+        return (report, period, frozen)
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]],
+                             ttl_seconds: Optional[float] = None) -> Any:
+        """Return the cached value for key, computing it at most once concurrently"""
+        now = time.monotonic()
+        entry = self._entries.get(key)
+
+        if entry is not None and now < entry.expires_at:
+            self._entries.move_to_end(key)
+            self.metrics["cache_hits"] += 1
+            return entry.value
+
+        if entry is not None and now < entry.stale_until:
+            # Serve stale, refresh once in the background
+            self._entries.move_to_end(key)
+            self.metrics["cache_stale_hits"] += 1
+            if key not in self._inflight:
+                task = self._start(key, compute, ttl_seconds)
+                task.add_done_callback(self._log_refresh_error)
+            return entry.value
+
+        self.metrics["cache_misses"] += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.metrics["cache_coalesced"] += 1
+        else:
+            task = self._start(key, compute, ttl_seconds)
+        # shield: a cancelled caller must not cancel the computation other callers wait on
+        return await asyncio.shield(task)
+
+    def _start(self, key: Hashable, compute: Callable[[], Awaitable[Any]],
+               ttl_seconds: Optional[float]) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(self._compute(key, compute, ttl_seconds))
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]],
+                       ttl_seconds: Optional[float]) -> Any:
+        value = await compute()
+        self.set(key, value, ttl_seconds)
+        return value
+
+    def _log_refresh_error(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            self.metrics["cache_refresh_errors"] += 1
+            logger.warning(f"⚠️ {self.name} cache background refresh failed: {task.exception()}")
+
+    def set(self, key: Hashable, value: Any, ttl_seconds: Optional[float] = None):
+        """Store a value, evicting least-recently-used entries beyond max_entries"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        now = time.monotonic()
+        self._entries[key] = CacheEntry(value, now, now + ttl, now + ttl + self.stale_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.metrics["cache_evictions"] += 1
+
+    def invalidate(self, report: Optional[str] = None):
+        """Drop all entries, or only those of one report"""
+        if report is None:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if isinstance(key, tuple) and key and key[0] == report]:
+            del self._entries[key]
+
+    def get_status(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "name": self.name,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "fresh_entries": sum(1 for entry in self._entries.values() if now < entry.expires_at),
+            "inflight": len(self._inflight),
+            "ttl_seconds": self.ttl_seconds,
+            "stale_seconds": self.stale_seconds,
+        }
+
+
+__all__ = ["AsyncTTLCache", "CacheEntry"]
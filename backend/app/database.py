@@ -20,6 +20,12 @@ from typing import Optional, Dict, Any, List, Union
 import bcrypt
 from pathlib import Path
 from .settings import get_settings
+from .durability import DurableDatabase, BatchedWriter, get_durability_policy
+from .storage import SQLiteClient
+from .timeseries import ensure_timeseries_collections
+from .index_planner import apply_index_plan, verify_query_shapes
+from .spool import DiskSpool
+from .latency import install_db_latency_listener
 
 # Enhanced Logger setup
 logging.basicConfig(level=logging.INFO)
@@ -42,6 +48,24 @@ class DatabaseManager:
         self.connection_start_time = None
         self.reconnect_count = 0
 
+        # Local disk spool for telemetry while MongoDB is slow or down (see spool.py)
+        self.spool: Optional[DiskSpool] = None
+        if self.settings.spool_enabled and self.settings.storage_backend != "sqlite":
+            self.spool = DiskSpool(
+                self.settings.spool_dir,
+                max_bytes=self.settings.spool_max_mb * 1024 * 1024,
+                segment_bytes=self.settings.spool_segment_mb * 1024 * 1024,
+                fsync_interval=self.settings.spool_fsync_interval_ms / 1000.0,
+                replay_batch_size=self.settings.spool_replay_batch_size,
+            )
+
+        # Batched writer for telemetry-class collections (see durability.py)
+        self.batch_writer = BatchedWriter(
+            self.get_database,
+            spool=self.spool,
+            write_timeout=self.settings.telemetry_write_timeout_ms / 1000.0,
+        )
+
         # Enhanced connection monitoring
         self.connection_history: List[Dict[str, Any]] = []
         self.performance_metrics = {
@@ -61,8 +85,16 @@ class DatabaseManager:
             'deletes': 0
         }
 
+    @property
+    def uses_sqlite(self) -> bool:
+        """True when the embedded SQLite backend is configured instead of MongoDB"""
+        return self.settings.storage_backend == "sqlite"
+
     async def connect(self) -> bool:
         """Enhanced MongoDB connection with comprehensive retry logic and monitoring"""
+        if self.uses_sqlite:
+            return await self._connect_sqlite()
+
         if self.is_connected and self.client:
             # Verify existing connection
             try:
@@ -97,11 +129,11 @@ class DatabaseManager:
                     'retryWrites': True,
                     'retryReads': True,
                     'heartbeatFrequencyMS': 10000,       # 10 seconds heartbeat
-                    'serverSelectionTimeoutMS': 15000,
-                    # Enhanced write concern for data consistency
-                    'w': 'majority',
+                    # Default write concern = STANDARD class; critical and telemetry
+                    # collections override it per collection (see durability.py)
+                    'w': 1,
                     'wtimeout': 10000,
-                    'j': True  # Journal write concern
+                    'j': True
                 }
 
                 # Create MongoDB client with enhanced settings
@@ -119,8 +151,8 @@ class DatabaseManager:
                 except asyncio.TimeoutError:
                     raise ServerSelectionTimeoutError("Connection ping timeout")
 
-                # Get database reference
-                self.database = self.client[self.settings.database_name]
+                # Get database reference (collections carry their durability class)
+                self.database = DurableDatabase(self.client[self.settings.database_name])
 
                 # Verify database access with additional checks
                 try:
@@ -150,6 +182,10 @@ class DatabaseManager:
                     'collections_count': len(collections)
                 })
 
+                # Drain telemetry spooled during a previous outage
+                if self.spool is not None:
+                    self.spool.start_replayer(self.get_database)
+
                 logger.info(f"🎉 MongoDB connection established in {connection_time:.2f}s")
                 return True
 
@@ -216,6 +252,36 @@ class DatabaseManager:
 
         return False
 
+    async def _connect_sqlite(self) -> bool:
+        """Open the embedded SQLite (WAL) store - no server, no retries needed"""
+        if self.is_connected and self.client:
+            return True
+
+        connection_start = time.time()
+        self.connection_start_time = datetime.utcnow()
+        try:
+            self.client = SQLiteClient(self.settings.sqlite_path)
+            self.database = self.client[self.settings.database_name]
+
+            # Schema and seed data; Mongo-only index options are ignored by the backend
+            await self._initialize_database()
+
+            self.is_connected = True
+            connection_time = time.time() - connection_start
+            self.performance_metrics['connection_time'] = connection_time
+            self._log_connection_event('success', {
+                'backend': 'sqlite',
+                'path': self.settings.sqlite_path,
+                'connection_time': connection_time
+            })
+            logger.info(f"🎉 SQLite storage ready in {connection_time:.2f}s ({self.settings.sqlite_path})")
+            return True
+        except Exception as e:
+            logger.error(f"❌ SQLite storage initialization failed: {e}")
+            self.performance_metrics['error_count'] += 1
+            self.performance_metrics['last_error'] = str(e)
+            raise DatabaseConnectionError(f"Failed to open SQLite storage: {e}")
+
     def _log_connection_event(self, event_type: str, data: Dict[str, Any]):
         """Log connection events for monitoring"""
         event = {
@@ -231,6 +297,13 @@ class DatabaseManager:
     async def disconnect(self):
         """Enhanced disconnect with cleanup"""
         if self.client:
+            try:
+                # Write out buffered telemetry before the client goes away
+                await self.batch_writer.close()
+                if self.spool is not None:
+                    await self.spool.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to flush buffered writes: {e}")
             try:
                 # Graceful closure
                 self.client.close()
@@ -270,11 +343,29 @@ class DatabaseManager:
 
         return self.database
 
+    async def insert_document(self, collection_name: str, document: Dict[str, Any]) -> None:
+        """
+        Insert a document using the durability policy of its collection.
+        Batched (telemetry) collections are buffered and written with insert_many;
+        everything else is written immediately with the class write concern.
+        """
+        if get_durability_policy(collection_name).batched:
+            await self.batch_writer.enqueue(collection_name, document)
+            return
+
+        database = await self.get_database()
+        await database[collection_name].insert_one(document)
+
+    async def flush_writes(self, collection_name: Optional[str] = None) -> None:
+        """Flush buffered telemetry writes"""
+        await self.batch_writer.flush(collection_name)
+
     async def _initialize_database(self):
         """Enhanced database initialization with comprehensive setup including Settings"""
         try:
             logger.info("🔧 Initializing database schema and data...")
             # Initialize in order of dependency
+            await self._create_timeseries_collections()
             await self._create_indexes()
             await self._initialize_admin_user()
             await self._initialize_default_configs()
@@ -291,6 +382,17 @@ class DatabaseManager:
             self.performance_metrics['last_error'] = f"Init failed: {str(e)}"
             raise
 
+    async def _create_timeseries_collections(self):
+        """Create metric collections as time-series collections (must run before index creation)"""
+        if self.uses_sqlite:
+            return
+        try:
+            logger.info("⏱️ Ensuring time-series collections...")
+            status = await ensure_timeseries_collections(self.database)
+            logger.info(f"✅ Time-series collections: {status}")
+        except Exception as e:
+            logger.warning(f"⚠️ Time-series collections setup warning: {e}")
+
     async def _create_indexes(self):
         """Enhanced index creation with comprehensive performance optimization"""
         try:
@@ -307,11 +409,36 @@ class DatabaseManager:
             await self._create_settings_indexes()
             # NEW: Reports-specific indexes
             await self._create_reports_indexes()
+            # Indexes derived from the query shapes services declare
+            await self.apply_index_plan()
             logger.info("✅ All database indexes created successfully")
         except Exception as e:
             logger.error(f"❌ Index creation failed: {str(e)}")
             raise
 
+    async def apply_index_plan(self, database=None) -> Dict[str, Any]:
+        """Create/drop the index planner's indexes and optionally explain() every query shape"""
+        database = database if database is not None else self.database
+        if self.uses_sqlite or database is None:
+            return {}
+        try:
+            report = await apply_index_plan(database, drop_stale=self.settings.index_planner_drop_stale)
+            created = sum(len(status["created"]) for status in report.values())
+            dropped = sum(len(status["dropped"]) for status in report.values())
+            logger.info(f"✅ Index plan applied: {created} created, {dropped} dropped")
+
+            if self.settings.index_planner_verify:
+                results = await verify_query_shapes(database)
+                collscans = [name for name, result in results.items() if result.get("collscan")]
+                if collscans:
+                    logger.warning(f"⚠️ Query shapes without index support: {collscans}")
+                else:
+                    logger.info(f"✅ All {len(results)} query shapes use an index")
+            return report
+        except Exception as e:
+            logger.warning(f"⚠️ Index planner warning: {e}")
+            return {}
+
     async def _create_users_indexes(self):
         """Create comprehensive user collection indexes"""
         try:
@@ -400,6 +527,19 @@ class DatabaseManager:
                 except Exception as e:
                     logger.warning(f"⚠️ Firewall groups index warning: {e}")
 
+            # Dynamic blocklist mirror: MongoDB drops entries when expires_at passes
+            firewall_blocklist = self.database.firewall_blocklist
+            blocklist_indexes = [
+                ('expires_at', {'expireAfterSeconds': 0}),
+                ('source', {}),
+            ]
+
+            for index_spec, options in blocklist_indexes:
+                try:
+                    await firewall_blocklist.create_index(index_spec, **options)
+                except Exception as e:
+                    logger.warning(f"⚠️ Firewall blocklist index warning: {e}")
+
             logger.info("✅ Created firewall collection indexes")
         except Exception as e:
             logger.error(f"❌ Firewall indexes creation failed: {e}")
@@ -754,15 +894,12 @@ class DatabaseManager:
                 except Exception as e:
                     logger.warning(f"⚠️ Report schedules index warning ({index_spec}): {e}")
 
-            # Traffic analytics collection with TTL
+            # Traffic analytics time-series collection (retention via expireAfterSeconds)
             traffic_analytics = self.database.traffic_analytics
             traffic_indexes = [
-                ('timestamp', {'expireAfterSeconds': 2592000}),  # 30 days retention
-                ('interface', {}),
-                ('protocol', {}),
-                ('direction', {}),
-                (('interface', 'timestamp'), {}),
-                (('protocol', 'timestamp'), {}),
+                (('meta.interface', 'timestamp'), {}),
+                (('meta.protocol', 'timestamp'), {}),
+                (('meta.direction', 'timestamp'), {}),
             ]
 
             for index_spec, options in traffic_indexes:
@@ -781,12 +918,9 @@ class DatabaseManager:
                 except Exception as e:
                     logger.warning(f"⚠️ Traffic analytics index warning ({index_spec}): {e}")
 
-            # Performance metrics collection with TTL
+            # Performance metrics time-series collection (retention via expireAfterSeconds)
             performance_metrics = self.database.performance_metrics
             performance_indexes = [
-                ('timestamp', {'expireAfterSeconds': 2592000}),  # 30 days retention
-                ('metric_type', {}),
-                ('source', {}),
                 (('metric_type', 'timestamp'), {}),
                 (('source', 'timestamp'), {}),
             ]
@@ -1435,8 +1569,8 @@ class DatabaseManager:
                 'settings_history': 7776000,  # 90 days for settings audit trail
                 'system_operations': 2592000, # 30 days for operations log
                 'generated_reports': 7776000, # 90 days for generated reports
-                'traffic_analytics': 2592000, # 30 days for traffic data
-                'performance_metrics': 2592000, # 30 days for performance data
+                # traffic_analytics / performance_metrics are time-series collections
+                # and expire through expireAfterSeconds (see timeseries.py)
             }
 
             for collection_name, ttl_seconds in ttl_collections.items():
@@ -1618,7 +1752,11 @@ class DatabaseManager:
             "performance_metrics": self.performance_metrics,
             "settings_operations": self.settings_operations,  # NEW: Settings operations
             "connection_history": self.connection_history[-10:],  # Last 10 events
-            "last_health_check": self.last_health_check
+            "last_health_check": self.last_health_check,
+            "write_pipeline": {
+                "batch_writer": {**self.batch_writer.metrics, "pending": self.batch_writer.pending()},
+                "spool": self.spool.get_metrics() if self.spool is not None else None
+            }
         }
 
     async def cleanup_old_data(self):
@@ -1663,13 +1801,6 @@ class DatabaseManager:
             })
             cleanup_results["generated_reports"] = result.deleted_count
 
-            # NEW: Clean old traffic analytics (beyond 30 days)
-            analytics_cutoff = datetime.utcnow() - timedelta(days=30)
-            result = await self.database.traffic_analytics.delete_many({
-                "timestamp": {"$lt": analytics_cutoff}
-            })
-            cleanup_results["traffic_analytics"] = result.deleted_count
-
             logger.info(f"✅ Manual cleanup completed: {cleanup_results}")
             return cleanup_results
         except Exception as e:
@@ -1686,6 +1817,13 @@ def _sync_init():
     global client, db
     try:
         settings = get_settings()
+        if settings.storage_backend == "sqlite":
+            # Embedded backend: same file as db_manager, no server connection
+            client = SQLiteClient(settings.sqlite_path)
+            db = client[settings.database_name]
+            logger.info("✅ SQLite client and db references created (sync)")
+            return
+
         # Create client with basic configuration for immediate use
         client = motor.motor_asyncio.AsyncIOMotorClient(
             settings.mongodb_url,
@@ -1695,14 +1833,15 @@ def _sync_init():
             minPoolSize=10
         )
         # Database reference for immediate use
-        db = client[settings.database_name]
+        db = DurableDatabase(client[settings.database_name])
         logger.info("✅ MongoDB client and db references created (sync)")
     except Exception as e:
         logger.error(f"❌ Sync initialization failed: {str(e)}")
         client = None
         db = None
 
-# Initialize client and db
+# Initialize client and db (the latency listener must be registered before any client exists)
+install_db_latency_listener()
 _sync_init()
 
 # Enhanced legacy functions for backward compatibility
@@ -1729,6 +1868,10 @@ async def get_database():
         logger.error(f"❌ Legacy get_database function failed: {e}")
         raise
 
+async def insert_document(collection_name: str, document: Dict[str, Any]) -> None:
+    """Insert a document honouring the collection's durability class"""
+    await db_manager.insert_document(collection_name, document)
+
 async def check_database_health() -> Dict[str, Any]:
     """Enhanced legacy function - check database health"""
     try:
@@ -1824,6 +1967,11 @@ async def get_performance_metrics_collection():
     database = await get_database()
     return database.performance_metrics
 
+async def get_interface_stats_collection():
+    """Get interface counters time-series collection with connection verification"""
+    database = await get_database()
+    return database.interface_stats
+
 # Collection references for backward compatibility
 users_collection = None
 logs_collection = None
@@ -2002,6 +2150,7 @@ __all__ = [
     'client', 'db', 'db_manager', 'DatabaseManager', 'DatabaseConnectionError',
     # Connection functions
     'connect_to_mongo', 'close_mongo_connection', 'get_database', 'check_database_health',
+    'insert_document',
     # Collection getters
     'get_users_collection', 'get_logs_collection', 'get_firewall_rules_collection',
     'get_network_activity_collection', 'get_security_alerts_collection', 'get_system_config_collection',
@@ -2010,7 +2159,7 @@ __all__ = [
     # NEW: Reports collection getters
     'get_reports_config_collection', 'get_report_templates_collection', 'get_generated_reports_collection',
     'get_report_schedules_collection', 'get_report_history_collection', 'get_traffic_analytics_collection',
-    'get_performance_metrics_collection',
+    'get_performance_metrics_collection', 'get_interface_stats_collection',
     # Collection references
     'init_collection_references', 'users_collection', 'logs_collection', 'firewall_rules_collection',
     'network_activity_collection', 'security_alerts_collection', 'system_config_collection',
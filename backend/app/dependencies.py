@@ -281,16 +281,24 @@ class SecurityManager:
         if self.failed_attempts[ip]['count'] >= self.settings.max_login_attempts:
             self.blocked_ips[ip] = current_time
             logger.warning(f"🚫 IP {ip} blocked for {self.settings.lockout_duration_minutes} minutes")
+            self._ban_in_kernel(ip, f"{activity_type}: too many failed attempts")
             return True
 
         # Check for rapid suspicious activities
         if len(self.suspicious_activities[ip]) > 20:  # More than 20 activities in an hour
             self.blocked_ips[ip] = current_time
             logger.warning(f"🚫 IP {ip} blocked for suspicious activity pattern")
+            self._ban_in_kernel(ip, f"{activity_type}: suspicious activity pattern")
             return True
 
         return False
 
+    def _ban_in_kernel(self, ip: str, reason: str):
+        """Lockouts only protect the API; with firewall_blocklist_auto_ban the kernel drops the IP too"""
+        # Imported here to keep the firewall stack out of the dependency module's import path
+        from .tasks.blocklist import auto_ban
+        auto_ban(ip, self.settings.lockout_duration_minutes * 60, reason)
+
     def clear_failed_attempts(self, ip: str):
         """Clear failed attempts for successful authentication"""
         self.failed_attempts.pop(ip, None)
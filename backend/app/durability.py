@@ -0,0 +1,317 @@
+"""
+Per-collection durability classes for MongoDB writes
+Replaces the global w='majority', j=True client setting with a registry that
+maps every collection to a durability class (critical / standard / telemetry).
+Each class carries its own write concern and batching policy.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo.write_concern import WriteConcern
+
+from .settings import get_settings
+from .spool import insert_isolating, is_transient_error
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+
+class DurabilityClass(str, Enum):
+    """Durability classes a collection can be registered under"""
+    CRITICAL = "critical"     # Configuration / identity data - never lose a write
+    STANDARD = "standard"     # Regular application data
+    TELEMETRY = "telemetry"   # High-volume, append-only measurements and logs
+
+
+@dataclass(frozen=True)
+class DurabilityPolicy:
+    """Write concern and batching policy for a durability class"""
+    write_concern: WriteConcern
+    batch_size: int = 1              # 1 = write immediately, >1 = buffer and insert_many
+    flush_interval: float = 0.0      # Max seconds a buffered document may wait
+    ordered: bool = True             # insert_many ordering for batched writes
+
+    @property
+    def batched(self) -> bool:
+        return self.batch_size > 1
+
+
+DURABILITY_POLICIES: Dict[DurabilityClass, DurabilityPolicy] = {
+    DurabilityClass.CRITICAL: DurabilityPolicy(
+        write_concern=WriteConcern(w="majority", j=True, wtimeout=10000),
+    ),
+    DurabilityClass.STANDARD: DurabilityPolicy(
+        write_concern=WriteConcern(w=1, j=True, wtimeout=10000),
+    ),
+    DurabilityClass.TELEMETRY: DurabilityPolicy(
+        write_concern=WriteConcern(w=1, j=False),
+        batch_size=settings.telemetry_batch_size,
+        flush_interval=settings.telemetry_flush_interval_ms / 1000.0,
+        ordered=False,
+    ),
+}
+
+# Collection -> durability class registry (unregistered collections are STANDARD)
+COLLECTION_DURABILITY: Dict[str, DurabilityClass] = {
+    # Critical: identity, rules and configuration
+    "users": DurabilityClass.CRITICAL,
+    "firewall_rules": DurabilityClass.CRITICAL,
+    "firewall_groups": DurabilityClass.CRITICAL,
+    "settings_config": DurabilityClass.CRITICAL,
+    "system_config": DurabilityClass.CRITICAL,
+    "system_configs": DurabilityClass.CRITICAL,
+    "nat_config": DurabilityClass.CRITICAL,
+    "network_interfaces": DurabilityClass.CRITICAL,
+    "static_routes": DurabilityClass.CRITICAL,
+    "blocked_domains": DurabilityClass.CRITICAL,
+    "dns_proxy_config": DurabilityClass.CRITICAL,
+    "reports_config": DurabilityClass.CRITICAL,
+    "report_schedules": DurabilityClass.CRITICAL,
+    # Telemetry: per-packet logs, interface stats, health samples, HTTP access logs
+    "system_logs": DurabilityClass.TELEMETRY,
+    "network_activity": DurabilityClass.TELEMETRY,
+    "blocked_packets": DurabilityClass.TELEMETRY,
+    "pc_to_pc_traffic": DurabilityClass.TELEMETRY,
+    "system_health": DurabilityClass.TELEMETRY,
+    "database_health": DurabilityClass.TELEMETRY,
+    "system_stats": DurabilityClass.TELEMETRY,
+    "performance_metrics": DurabilityClass.TELEMETRY,
+    "traffic_analytics": DurabilityClass.TELEMETRY,
+    "interface_stats": DurabilityClass.TELEMETRY,
+}
+
+
+def register_collection(collection_name: str, durability_class: DurabilityClass) -> None:
+    """Register (or re-register) a collection under a durability class"""
+    COLLECTION_DURABILITY[collection_name] = DurabilityClass(durability_class)
+
+
+def get_durability_class(collection_name: str) -> DurabilityClass:
+    """Get the durability class of a collection"""
+    return COLLECTION_DURABILITY.get(collection_name, DurabilityClass.STANDARD)
+
+
+def get_durability_policy(collection_name: str) -> DurabilityPolicy:
+    """Get the durability policy that applies to a collection"""
+    return DURABILITY_POLICIES[get_durability_class(collection_name)]
+
+
+def apply_durability(collection):
+    """Return the collection re-bound to the write concern of its durability class"""
+    policy = get_durability_policy(collection.name)
+    return collection.with_options(write_concern=policy.write_concern)
+
+
+class DurableDatabase:
+    """
+    Thin proxy around a Motor database.
+    Every collection handed out (db.users, db["system_logs"]) is bound to the
+    write concern of its durability class; everything else is delegated.
+    """
+
+    def __init__(self, database):
+        self._database = database
+
+    @property
+    def delegate(self):
+        return self._database
+
+    def __getitem__(self, collection_name: str):
+        return apply_durability(self._database[collection_name])
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        attribute = getattr(self._database, name)
+        # Motor resolves unknown attributes to collections
+        if hasattr(attribute, "with_options") and hasattr(attribute, "insert_one"):
+            return apply_durability(attribute)
+        return attribute
+
+    def get_collection(self, collection_name: str, **kwargs):
+        if "write_concern" not in kwargs:
+            kwargs["write_concern"] = get_durability_policy(collection_name).write_concern
+        return self._database.get_collection(collection_name, **kwargs)
+
+    def __eq__(self, other):
+        if isinstance(other, DurableDatabase):
+            return self._database == other._database
+        return self._database == other
+
+    def __hash__(self):
+        return hash(self._database)
+
+    def __repr__(self):
+        return f"DurableDatabase({self._database!r})"
+
+
+class BatchedWriter:
+    """
+    Buffers documents for batched collections and flushes them with a single
+    insert_many once the batch is full or the flush interval has elapsed.
+    With a spool attached, batches that hit a network error, time out or arrive
+    while too many flushes are already in flight go to the local disk spool
+    (see spool.py); documents the database rejects for good are quarantined.
+    """
+
+    MAX_INFLIGHT_FLUSHES = 4
+
+    def __init__(self, database_getter, spool=None, write_timeout: Optional[float] = None):
+        self._database_getter = database_getter
+        self._spool = spool
+        self._write_timeout = write_timeout
+        self._buffers: Dict[str, List[Dict[str, Any]]] = {}
+        self._first_enqueued: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._inflight = 0
+        self.metrics = {
+            "enqueued": 0,
+            "flushed_documents": 0,
+            "flush_batches": 0,
+            "flush_errors": 0,
+            "spooled_documents": 0,
+            "last_flush": None,
+        }
+
+    async def enqueue(self, collection_name: str, document: Dict[str, Any]) -> None:
+        """Add a document to the collection's buffer; flush if the batch is full"""
+        policy = get_durability_policy(collection_name)
+        async with self._lock:
+            buffer = self._buffers.setdefault(collection_name, [])
+            if not buffer:
+                self._first_enqueued[collection_name] = time.monotonic()
+            buffer.append(document)
+            self.metrics["enqueued"] += 1
+            full = len(buffer) >= policy.batch_size
+            batch = self._take(collection_name) if full else None
+
+        self._ensure_flush_loop()
+        if batch:
+            await self._write(collection_name, batch, policy)
+
+    async def flush(self, collection_name: Optional[str] = None) -> None:
+        """Flush one collection (or every buffered collection)"""
+        async with self._lock:
+            names = [collection_name] if collection_name else list(self._buffers)
+            batches = {name: self._take(name) for name in names}
+
+        for name, batch in batches.items():
+            if batch:
+                await self._write(name, batch, get_durability_policy(name))
+
+    def pending(self) -> Dict[str, int]:
+        """Number of buffered documents per collection"""
+        return {name: len(docs) for name, docs in self._buffers.items() if docs}
+
+    async def close(self) -> None:
+        """Stop the flush loop and write everything that is still buffered"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    def _take(self, collection_name: str) -> List[Dict[str, Any]]:
+        batch = self._buffers.get(collection_name) or []
+        self._buffers[collection_name] = []
+        self._first_enqueued.pop(collection_name, None)
+        return batch
+
+    async def _write(self, collection_name: str, batch: List[Dict[str, Any]],
+                     policy: DurabilityPolicy) -> None:
+        # Stable _ids make a later spool replay idempotent (duplicates are rejected)
+        for document in batch:
+            document.setdefault("_id", ObjectId())
+
+        if self._spool is not None and (self._spool.diverting or self._inflight >= self.MAX_INFLIGHT_FLUSHES):
+            await self._spool_batch(collection_name, batch)
+            return
+
+        async def _insert():
+            database = await self._database_getter()
+            await database[collection_name].insert_many(batch, ordered=policy.ordered)
+
+        self._inflight += 1
+        try:
+            if self._write_timeout:
+                await asyncio.wait_for(_insert(), timeout=self._write_timeout)
+            else:
+                await _insert()
+            self.metrics["flushed_documents"] += len(batch)
+            self.metrics["flush_batches"] += 1
+            self.metrics["last_flush"] = time.time()
+        except Exception as e:
+            self.metrics["flush_errors"] += 1
+            if self._spool is None:
+                logger.error(f"❌ Batched write to {collection_name} failed ({len(batch)} docs): {e}")
+                raise
+            if is_transient_error(e):
+                logger.warning(f"⚠️ Batched write to {collection_name} failed, spooling {len(batch)} docs: {e!r}")
+                self._spool.trip(e)
+                await self._spool_batch(collection_name, batch)
+            else:
+                await self._quarantine_rejected(collection_name, batch, e)
+        finally:
+            self._inflight -= 1
+
+    async def _quarantine_rejected(self, collection_name: str, batch: List[Dict[str, Any]],
+                                   error: Exception) -> None:
+        """Keep the accepted documents of a permanently failed batch, quarantine the rest"""
+        try:
+            database = await self._database_getter()
+            rejected = await insert_isolating(database[collection_name], batch, error)
+        except Exception as e:
+            # The database went away while isolating; replay sorts the batch out later
+            self._spool.trip(e)
+            await self._spool_batch(collection_name, batch)
+            return
+        self.metrics["flushed_documents"] += len(batch) - len(rejected)
+        await self._spool.quarantine(collection_name, [document for document, _ in rejected], error)
+
+    async def _spool_batch(self, collection_name: str, batch: List[Dict[str, Any]]) -> None:
+        await self._spool.append(collection_name, batch)
+        self.metrics["spooled_documents"] += len(batch)
+        self._spool.start_replayer(self._database_getter)
+
+    def _ensure_flush_loop(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+            except RuntimeError:
+                self._flush_task = None
+
+    async def _flush_loop(self) -> None:
+        """Flush buffers whose oldest document exceeded the flush interval"""
+        while True:
+            intervals = [
+                get_durability_policy(name).flush_interval
+                for name in self._buffers
+            ] or [1.0]
+            await asyncio.sleep(max(min(intervals), 0.05))
+
+            now = time.monotonic()
+            async with self._lock:
+                due = {
+                    name: self._take(name)
+                    for name, started in list(self._first_enqueued.items())
+                    if now - started >= get_durability_policy(name).flush_interval
+                }
+
+            for name, batch in due.items():
+                if batch:
+                    try:
+                        await self._write(name, batch, get_durability_policy(name))
+                    except Exception:
+                        pass  # already logged and counted
+
+
+__all__ = [
+    "DurabilityClass", "DurabilityPolicy", "DURABILITY_POLICIES", "COLLECTION_DURABILITY",
+    "register_collection", "get_durability_class", "get_durability_policy",
+    "apply_durability", "DurableDatabase", "BatchedWriter",
+]
@@ -12,3 +12,7 @@ class FirewallDriver:
 
     def update_rule(self, old_rule, new_rule):
         raise NotImplementedError
+
+    def apply_ruleset(self, rules, groups=None):
+        """Replace the managed ruleset with all enabled rules (and group chains) in one operation"""
+        raise NotImplementedError
@@ -0,0 +1,481 @@
+"""
+Firewall ruleset optimizer
+Runs between firewall_rules and the drivers, on rules already normalized and
+sorted by priority:
+  1. rules completely covered by one earlier rule are dropped - they are
+     either unreachable (different verdict) or redundant (same verdict)
+  2. within one priority, rules that do not conflict with each other are
+     ordered by observed hit count, busiest first
+  3. neighbouring rules that differ only in one address or port list are
+     merged into one rule, which the drivers render as an address set /
+     multiport match
+Replaying a traffic sample through the original and the optimized list
+measures the saving as average rules evaluated per packet, and checks that
+every sampled packet still gets the same verdict.
+"""
+import bisect
+import hashlib
+import heapq
+import ipaddress
+import logging
+from dataclasses import asdict, dataclass, field, replace
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.firewall_ruleset import FirewallGroupSpec, FirewallRuleSpec, normalize_rules
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+ALL_PROTOCOLS = frozenset({"tcp", "udp", "icmp", "other"})
+PORT_PROTOCOLS = frozenset({"tcp", "udp"})
+DEFAULT_VERDICT = "ACCEPT"      # hook chain policy when no rule matches
+MERGED_PREFIX = "@"
+
+# Fields that must be equal for two rules to merge; exactly one of the
+# MERGEABLE_FIELDS may differ
+MERGE_KEY_FIELDS = ("action", "directions", "protocol", "interface", "schedule", "days_of_week", "group_id")
+MERGEABLE_FIELDS = ("sources", "destinations", "source_ports", "destination_ports")
+
+
+class RuleShape:
+    """Parsed match space of one rule, for coverage/overlap checks and replay"""
+    __slots__ = ("spec", "directions", "protocols", "sources", "destinations", "source_spans",
+                 "destination_spans", "days")
+
+    def __init__(self, spec: FirewallRuleSpec):
+        self.spec = spec
+        self.directions = frozenset(spec.directions)
+        self.sources = [ipaddress.ip_network(item) for item in spec.sources]
+        self.destinations = [ipaddress.ip_network(item) for item in spec.destinations]
+        self.source_spans = [_span(network) for network in self.sources]
+        self.destination_spans = [_span(network) for network in self.destinations]
+        self.days = frozenset(spec.days_of_week)
+        has_ports = bool(spec.source_ports or spec.destination_ports)
+        if spec.protocol == "any":
+            self.protocols = PORT_PROTOCOLS if has_ports else ALL_PROTOCOLS
+        else:
+            self.protocols = frozenset({spec.protocol})
+
+    # -- set relations -------------------------------------------------------
+
+    def covers(self, other: "RuleShape") -> bool:
+        """Every packet other matches is matched by self"""
+        mine, theirs = self.spec, other.spec
+        return (
+            self.directions >= other.directions
+            and self.protocols >= other.protocols
+            and _networks_cover(self.sources, other.sources)
+            and _networks_cover(self.destinations, other.destinations)
+            and _ports_cover(mine.source_ports, theirs.source_ports)
+            and _ports_cover(mine.destination_ports, theirs.destination_ports)
+            and (mine.interface is None or mine.interface == theirs.interface)
+            and _schedule_covers(mine, theirs)
+        )
+
+    def overlaps(self, other: "RuleShape") -> bool:
+        """Some packet could match both (schedules are assumed to overlap)"""
+        mine, theirs = self.spec, other.spec
+        return bool(
+            self.directions & other.directions
+            and self.protocols & other.protocols
+            and _networks_overlap(self.sources, other.sources)
+            and _networks_overlap(self.destinations, other.destinations)
+            and _ports_overlap(mine.source_ports, theirs.source_ports)
+            and _ports_overlap(mine.destination_ports, theirs.destination_ports)
+            and (mine.interface is None or theirs.interface is None or mine.interface == theirs.interface)
+        )
+
+    def conflicts(self, other: "RuleShape") -> bool:
+        """Relative order changes the outcome for some packet"""
+        return self.spec.target != other.spec.target and self.overlaps(other)
+
+    # -- packet matching -----------------------------------------------------
+
+    def matches(self, packet: Dict[str, Any]) -> bool:
+        """packet as returned by prepare_packet"""
+        spec = self.spec
+        if packet["direction"] not in self.directions:
+            return False
+        protocol = packet["protocol"]
+        if protocol not in self.protocols:
+            return False
+        if spec.interface and packet.get("interface") != spec.interface:
+            return False
+        if self.source_spans and not _address_in(packet["_source"], self.source_spans):
+            return False
+        if self.destination_spans and not _address_in(packet["_destination"], self.destination_spans):
+            return False
+        if spec.source_ports and not _port_in(packet.get("source_port"), spec.source_ports):
+            return False
+        if spec.destination_ports and not _port_in(packet.get("destination_port"), spec.destination_ports):
+            return False
+        return _in_schedule(spec, self.days, packet.get("timestamp"))
+
+
+def _networks_cover(outer: List[Any], inner: List[Any]) -> bool:
+    if not outer:
+        return True
+    if not inner:
+        return False
+    return all(any(network.version == container.version and network.subnet_of(container) for container in outer)
+               for network in inner)
+
+
+def _networks_overlap(first: List[Any], second: List[Any]) -> bool:
+    if not first or not second:
+        return True
+    return any(a.version == b.version and a.overlaps(b) for a in first for b in second)
+
+
+def coalesce_ports(ranges: Iterable[Tuple[int, int]]) -> Tuple[Tuple[int, int], ...]:
+    """Sorted port ranges with overlapping / adjacent ranges joined"""
+    merged: List[List[int]] = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return tuple((low, high) for low, high in merged)
+
+
+def _ports_cover(outer: Sequence[Tuple[int, int]], inner: Sequence[Tuple[int, int]]) -> bool:
+    if not outer:
+        return True
+    if not inner:
+        return False
+    joined = coalesce_ports(outer)
+    return all(any(low <= inner_low and inner_high <= high for low, high in joined)
+               for inner_low, inner_high in inner)
+
+
+def _ports_overlap(first: Sequence[Tuple[int, int]], second: Sequence[Tuple[int, int]]) -> bool:
+    if not first or not second:
+        return True
+    return any(a_low <= b_high and b_low <= a_high for a_low, a_high in first for b_low, b_high in second)
+
+
+def _schedule_covers(outer: FirewallRuleSpec, inner: FirewallRuleSpec) -> bool:
+    if outer.schedule is None:
+        return True
+    if outer.schedule != inner.schedule:
+        return False
+    return not outer.days_of_week or (bool(inner.days_of_week) and set(inner.days_of_week) <= set(outer.days_of_week))
+
+
+def _span(network: Any) -> Tuple[int, int, int]:
+    return network.version, int(network.network_address), int(network.broadcast_address)
+
+
+def _address_key(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    try:
+        address = ipaddress.ip_address(value)
+    except (TypeError, ValueError):
+        return None
+    return address.version, int(address)
+
+
+def _address_in(address: Optional[Tuple[int, int]], spans: List[Tuple[int, int, int]]) -> bool:
+    if address is None:
+        return False
+    version, value = address
+    return any(span_version == version and low <= value <= high for span_version, low, high in spans)
+
+
+def _port_in(value: Any, ranges: Sequence[Tuple[int, int]]) -> bool:
+    try:
+        port = int(value)
+    except (TypeError, ValueError):
+        return False
+    return any(low <= port <= high for low, high in ranges)
+
+
+def _in_schedule(spec: FirewallRuleSpec, days: frozenset, timestamp: Optional[datetime]) -> bool:
+    if spec.schedule is None or timestamp is None:
+        return True
+    clock = timestamp.strftime("%H:%M")
+    start, end = spec.schedule
+    inside = start <= clock <= end if start <= end else (clock >= start or clock <= end)
+    return inside and (not days or timestamp.weekday() in days)
+
+
+# =============================================================================
+# PASSES
+# =============================================================================
+
+def remove_shadowed(shapes: List[RuleShape]) -> Tuple[List[RuleShape], List[Dict[str, Any]]]:
+    """Drop rules fully covered by a single earlier rule (O(n^2) pairwise)"""
+    kept: List[RuleShape] = []
+    shadowed = []
+    for shape in shapes:
+        cover = next((earlier for earlier in kept if earlier.covers(shape)), None)
+        if cover is None:
+            kept.append(shape)
+            continue
+        shadowed.append({
+            "rule_id": shape.spec.rule_id,
+            "name": shape.spec.name,
+            "shadowed_by": cover.spec.rule_id,
+            # Different verdict: the rule can never take effect, which is usually a mistake
+            "conflicting": cover.spec.target != shape.spec.target,
+        })
+    return kept, shadowed
+
+
+def order_by_hits(shapes: List[RuleShape], hits: Dict[str, int]) -> Tuple[List[RuleShape], int]:
+    """
+    Within each priority, emit the busiest rule whose conflicting
+    predecessors have all been emitted (a topological order of the
+    conflict graph); returns (ordered shapes, rules that moved)
+    """
+    ordered: List[RuleShape] = []
+    start = 0
+    while start < len(shapes):
+        end = start
+        while end < len(shapes) and shapes[end].spec.priority == shapes[start].spec.priority:
+            end += 1
+        group = shapes[start:end]
+        blockers = [0] * len(group)
+        successors: List[List[int]] = [[] for _ in group]
+        for later in range(len(group)):
+            for earlier in range(later):
+                if group[earlier].conflicts(group[later]):
+                    blockers[later] += 1
+                    successors[earlier].append(later)
+
+        ready = [(-hits.get(group[index].spec.rule_id, 0), index) for index in range(len(group)) if not blockers[index]]
+        heapq.heapify(ready)
+        while ready:
+            _, index = heapq.heappop(ready)
+            ordered.append(group[index])
+            for successor in successors[index]:
+                blockers[successor] -= 1
+                if not blockers[successor]:
+                    heapq.heappush(ready, (-hits.get(group[successor].spec.rule_id, 0), successor))
+        start = end
+
+    # A rule moved if it now runs ahead of a rule that used to precede it
+    original = {id(shape): index for index, shape in enumerate(shapes)}
+    moved, lowest_after = 0, len(shapes)
+    for shape in reversed(ordered):
+        index = original[id(shape)]
+        moved += index > lowest_after
+        lowest_after = min(lowest_after, index)
+    return ordered, moved
+
+
+def _merge_field(first: FirewallRuleSpec, second: FirewallRuleSpec) -> Optional[str]:
+    """The single list field two rules differ in, if they are otherwise identical"""
+    if any(getattr(first, name) != getattr(second, name) for name in MERGE_KEY_FIELDS):
+        return None
+    differing = [name for name in MERGEABLE_FIELDS if getattr(first, name) != getattr(second, name)]
+    if len(differing) != 1:
+        return None
+    name = differing[0]
+    # An empty list means "any": the union would be "any" too, which shadowing already handles
+    if not getattr(first, name) or not getattr(second, name):
+        return None
+    return name
+
+
+def _union(name: str, first: Tuple, second: Tuple) -> Tuple:
+    if name.endswith("ports"):
+        return coalesce_ports(first + second)
+    return tuple(dict.fromkeys(first + second))
+
+
+def merge_neighbours(shapes: List[RuleShape]) -> Tuple[List[RuleShape], Dict[str, List[str]]]:
+    """Merge runs of adjacent rules differing in one list field; returns merged id -> rule ids"""
+    result: List[RuleShape] = []
+    merged: Dict[str, List[str]] = {}
+    run: List[FirewallRuleSpec] = []
+    run_field: Optional[str] = None
+
+    def flush():
+        if len(run) == 1:
+            result.append(RuleShape(run[0]))
+        elif run:
+            rule_ids = [spec.rule_id for spec in run]
+            merged_id = MERGED_PREFIX + hashlib.sha1("|".join(rule_ids).encode()).hexdigest()[:12]
+            value = getattr(run[0], run_field)
+            for spec in run[1:]:
+                value = _union(run_field, value, getattr(spec, run_field))
+            spec = replace(run[0], rule_id=merged_id, name=f"{run[0].name} (+{len(run) - 1} merged)",
+                           **{run_field: value})
+            merged[merged_id] = rule_ids
+            result.append(RuleShape(spec))
+        run.clear()
+
+    for shape in shapes:
+        if run:
+            name = _merge_field(run[-1], shape.spec)
+            if name is not None and (run_field is None or name == run_field):
+                run.append(shape.spec)
+                run_field = name
+                continue
+            flush()
+        run.append(shape.spec)
+        run_field = None
+    flush()
+    return result, merged
+
+
+# =============================================================================
+# REPORT / REPLAY
+# =============================================================================
+
+@dataclass
+class OptimizationReport:
+    rules_in: int = 0
+    rules_out: int = 0
+    shadowed: List[Dict[str, Any]] = field(default_factory=list)
+    merged: Dict[str, List[str]] = field(default_factory=dict)
+    reordered: int = 0
+    replay: Optional[Dict[str, Any]] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+@dataclass
+class OptimizedRuleset:
+    specs: List[FirewallRuleSpec]
+    merged: Dict[str, List[str]]
+    report: OptimizationReport
+
+
+def optimize_rules(specs: Sequence[FirewallRuleSpec], hits: Optional[Dict[str, int]] = None) -> OptimizedRuleset:
+    """Shadow removal, hit ordering and merging over priority-sorted specs"""
+    shapes = [RuleShape(spec) for spec in specs]
+    kept, shadowed = remove_shadowed(shapes)
+    ordered, moved = order_by_hits(kept, hits or {})
+    final, merged = merge_neighbours(ordered)
+    report = OptimizationReport(
+        rules_in=len(specs), rules_out=len(final), shadowed=shadowed, merged=merged, reordered=moved
+    )
+    return OptimizedRuleset([shape.spec for shape in final], merged, report)
+
+
+def prepare_packet(packet: Dict[str, Any]) -> Dict[str, Any]:
+    """Packet with its addresses parsed once, for RuleShape.matches"""
+    return {**packet, "_source": _address_key(packet.get("source_ip")),
+            "_destination": _address_key(packet.get("destination_ip"))}
+
+
+def first_match(shapes: Sequence[RuleShape], packet: Dict[str, Any]) -> Tuple[int, str]:
+    """(rules evaluated, verdict) for a linear first-match walk"""
+    for index, shape in enumerate(shapes):
+        if shape.matches(packet):
+            return index + 1, shape.spec.target
+    return len(shapes), DEFAULT_VERDICT
+
+
+def replay(original: Sequence[FirewallRuleSpec], optimized: Sequence[FirewallRuleSpec],
+           packets: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """Average rules evaluated per packet before/after, plus verdict mismatches"""
+    before_shapes = [RuleShape(spec) for spec in original]
+    after_shapes = [RuleShape(spec) for spec in optimized]
+    before_total = after_total = mismatches = 0
+    for packet in map(prepare_packet, packets):
+        before_count, before_verdict = first_match(before_shapes, packet)
+        after_count, after_verdict = first_match(after_shapes, packet)
+        before_total += before_count
+        after_total += after_count
+        mismatches += before_verdict != after_verdict
+    count = len(packets) or 1
+    before_avg, after_avg = before_total / count, after_total / count
+    return {
+        "packets": len(packets),
+        "avg_rules_evaluated_before": round(before_avg, 2),
+        "avg_rules_evaluated_after": round(after_avg, 2),
+        "reduction_percent": round((1 - after_avg / before_avg) * 100, 1) if before_avg else 0.0,
+        "verdict_mismatches": mismatches,
+    }
+
+
+def packet_from_log(document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Replay packet from a system_logs traffic entry (None if it lacks addresses)"""
+    if not document.get("source_ip") or not document.get("destination_ip"):
+        return None
+    protocol = str(document.get("protocol") or "").lower()
+    timestamp = document.get("timestamp")
+    return {
+        "direction": "IN" if document.get("interface_in") else "OUT",
+        "interface": document.get("interface_in") or document.get("interface_out"),
+        "protocol": protocol if protocol in ALL_PROTOCOLS else "other",
+        "source_ip": document["source_ip"],
+        "destination_ip": document["destination_ip"],
+        "source_port": document.get("source_port"),
+        "destination_port": document.get("destination_port"),
+        "timestamp": timestamp if isinstance(timestamp, datetime) else None,
+    }
+
+
+def rule_hits(documents: Iterable[Dict[str, Any]]) -> Dict[str, int]:
+    """rule id (as normalize_rule derives it) -> hit_count"""
+    hits = {}
+    for document in documents:
+        rule_id = document.get("_id") or document.get("id") or document.get("rule_name")
+        if rule_id:
+            hits[str(rule_id)] = int(document.get("hit_count") or 0)
+    return hits
+
+
+def expand_merged(kernel_merged: Dict[str, List[str]], merged: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Combine optimizer merges with kernel-level ones, resolving to firewall_rules ids"""
+    combined = dict(merged)
+    for name, members in kernel_merged.items():
+        combined[name] = [rule_id for member in members for rule_id in merged.get(member, [member])]
+    return combined
+
+
+def prepare_ruleset(documents: Iterable[Dict[str, Any]], groups: Optional[Dict[str, FirewallGroupSpec]] = None
+                    ) -> Tuple[List[FirewallRuleSpec], List[Tuple[str, str]], Dict[str, List[str]]]:
+    """
+    normalize_rules plus the optimizer (when enabled): (specs, skipped, merged id -> rule ids).
+    With groups, each group chain is optimized on its own: a group can be
+    switched off without recompiling, so no rule may be dropped or reordered
+    because of a rule in another chain. The dedicated chain is split at the
+    group jumps as well, so no merge moves a rule across a jump.
+    """
+    documents = list(documents)
+    specs, skipped = normalize_rules(documents)
+    if not get_settings().firewall_optimizer_enabled:
+        return specs, skipped, {}
+
+    groups = groups or {}
+    # layout_rules puts a group's jump after the dedicated rules of its priority
+    jump_priorities = sorted({groups[spec.group_id].priority for spec in specs if spec.group_id in groups})
+    segments: Dict[Tuple[Optional[str], int], List[FirewallRuleSpec]] = {}
+    for spec in specs:
+        if spec.group_id in groups:
+            key = (spec.group_id, 0)
+        else:
+            key = (None, bisect.bisect_left(jump_priorities, spec.priority))
+        segments.setdefault(key, []).append(spec)
+    hits = rule_hits(documents)
+    optimized_specs: List[FirewallRuleSpec] = []
+    merged: Dict[str, List[str]] = {}
+    for segment in segments.values():
+        optimized = optimize_rules(segment, hits)
+        _log_report(optimized.report)
+        optimized_specs += optimized.specs
+        merged.update(optimized.merged)
+    return optimized_specs, skipped, merged
+
+
+def _log_report(report: OptimizationReport):
+    for entry in report.shadowed:
+        if entry["conflicting"]:
+            logger.warning(f"⚠️ Firewall rule {entry['name']} ({entry['rule_id']}) can never match: "
+                           f"shadowed by {entry['shadowed_by']}")
+    if report.rules_out != report.rules_in or report.reordered:
+        logger.info(f"🧹 Firewall optimizer: {report.rules_in} -> {report.rules_out} rules "
+                    f"({len(report.shadowed)} shadowed, {len(report.merged)} merges, {report.reordered} reordered)")
+
+
+__all__ = [
+    "RuleShape", "OptimizationReport", "OptimizedRuleset", "optimize_rules", "prepare_ruleset", "replay",
+    "first_match", "prepare_packet", "packet_from_log", "rule_hits", "expand_merged", "remove_shadowed", "order_by_hits",
+    "merge_neighbours", "coalesce_ports", "DEFAULT_VERDICT",
+]
@@ -1,28 +1,39 @@
 import platform
 from app.linux_firewall import LinuxFirewall
+from app.nftables_firewall import NftablesFirewall
+from app.settings import get_settings
 from app.win_firewall import WinFirewall
 
+# The platform never changes at runtime; the driver only when firewall_backend does
+SYSTEM = platform.system().lower()
+_driver = None
+_driver_key = None
+
+def get_firewall_driver():
+    """Cached OS firewall driver (rebuilt only if the configured backend changes)"""
+    global _driver, _driver_key
+    key = "windows" if SYSTEM.startswith("win") else get_settings().firewall_backend
+    if _driver is None or key != _driver_key:
+        if key == "windows":
+            _driver = WinFirewall()
+        elif key == "nftables":
+            _driver = NftablesFirewall()
+        else:
+            _driver = LinuxFirewall()
+        _driver_key = key
+    return _driver
+
 def remove_firewall_rule_os(rule_name: str):
-    sysname = platform.system().lower()
-    if sysname.startswith("win"):
-        fw = WinFirewall()
-        fw.remove_rule(rule_name)
-    else:
-        fw = LinuxFirewall()
-        fw.remove_rule(rule_name)
+    get_firewall_driver().remove_rule(rule_name)
 
 def add_firewall_rule_os(rule):
-    sysname = platform.system().lower()
-    if sysname.startswith("win"):
-        fw = WinFirewall()
-    else:
-        fw = LinuxFirewall()
-    fw.add_rule(rule)
+    get_firewall_driver().add_rule(rule)
 
 def update_firewall_rule_os(old_rule, new_rule):
-    sysname = platform.system().lower()
-    if sysname.startswith("win"):
-        fw = WinFirewall()
-    else:
-        fw = LinuxFirewall()
-    fw.update_rule(old_rule, new_rule)
+    get_firewall_driver().update_rule(old_rule, new_rule)
+
+def apply_ruleset_os(rules, groups=None):
+    fw = get_firewall_driver()
+    if not hasattr(fw, "apply_ruleset"):
+        raise NotImplementedError(f"{type(fw).__name__} has no batch apply")
+    return fw.apply_ruleset(rules, groups)
@@ -0,0 +1,411 @@
+"""
+Firewall reconciler
+Reads the live ruleset once (iptables-save, or `nft -j list table` for the
+nftables backend), normalizes the managed chains into ordered lists keyed by
+the `kobi:<rule id>/<digest>` comment tag and diffs them against the rules
+compiled from firewall_rules. Only the kernel rules that differ are deleted
+or inserted, in one iptables-restore --noflush / nft -f transaction, so
+unchanged rules keep their counters and are never briefly missing. Group
+chains are diffed like the dedicated chains; chains of groups that no longer
+have rules are flushed and deleted. Every pass returns a DriftReport
+describing what had drifted.
+"""
+import difflib
+import logging
+import re
+import shlex
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.firewall_optimizer import prepare_ruleset
+from app.firewall_ruleset import (
+    BASE_CHAINS, GROUP_CHAIN_PREFIX, TABLE, FirewallGroupSpec, FirewallRuleSpec, IptablesRestoreApplier,
+    iptables_chain_lines, layout_rules, normalize_groups, parse_comment
+)
+from app.nftables_firewall import (
+    GROUP_CHAIN_PREFIX as NFT_GROUP_CHAIN_PREFIX, HOOK_CHAINS, NFT_FAMILY, NFT_TABLE, NftablesFirewall,
+    NftRulesetBuilder, NftSet, compile_nft_ruleset, hook_definition, log_chain_rules
+)
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+NFT_COMMENT = re.compile(r'comment "([^"]*)"$')
+IPTABLES_COUNTERS = re.compile(r'^\[(\d+):(\d+)\]\s+')
+
+
+@dataclass(frozen=True)
+class KernelRule:
+    """One rule of a live or desired chain"""
+    chain: str
+    body: str                       # rule text after the chain name
+    comment: Optional[str] = None
+    handle: Optional[int] = None    # nftables rule handle
+    packets: Optional[int] = None   # counters, when the listing carried them
+    bytes: Optional[int] = None
+
+    @property
+    def owner(self) -> Tuple[str, str]:
+        """(rule id, digest); ("", body) for rules without our comment tag"""
+        return parse_comment(self.comment) or ("", self.body)
+
+
+@dataclass
+class LiveRuleset:
+    """Normalized view of the kernel state the reconciler cares about"""
+    chains: Dict[str, List[KernelRule]] = field(default_factory=dict)
+    sets: Dict[str, str] = field(default_factory=dict)      # nftables set/map name -> kind
+    table_exists: bool = True
+
+
+@dataclass
+class DriftReport:
+    """What differed between firewall_rules and the kernel, and what was done about it"""
+    backend: str
+    checked_at: datetime = field(default_factory=datetime.utcnow)
+    rules: int = 0                  # enabled rules in firewall_rules
+    live_kernel_rules: int = 0      # rules found in the managed chains
+    missing_rules: List[str] = field(default_factory=list)      # not in the kernel at all
+    stale_rules: List[str] = field(default_factory=list)        # in the kernel, no longer wanted
+    changed_rules: List[str] = field(default_factory=list)      # present but different / misordered
+    duplicate_kernel_rules: int = 0
+    foreign_kernel_rules: int = 0   # rules in our chains without our comment tag
+    inserted: int = 0
+    deleted: int = 0
+    repaired: List[str] = field(default_factory=list)           # chains, jumps, sets and maps
+    skipped: List[Tuple[str, str]] = field(default_factory=list)
+    full_replace: bool = False
+    applied: bool = False
+    error: Optional[str] = None
+
+    @property
+    def in_sync(self) -> bool:
+        return not (self.inserted or self.deleted or self.repaired or self.full_replace)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = asdict(self)
+        data["checked_at"] = self.checked_at.isoformat()
+        data["in_sync"] = self.in_sync
+        return data
+
+
+@dataclass
+class ChainDiff:
+    """Edit script turning one live chain into its desired content"""
+    chain: str
+    live: List[KernelRule]
+    desired: List[KernelRule]
+    opcodes: List[Tuple[str, int, int, int, int]]
+
+    @property
+    def deleted(self) -> List[int]:
+        return [index for _, i1, i2, _, _ in self.opcodes for index in range(i1, i2)]
+
+    @property
+    def inserted(self) -> List[int]:
+        return [index for _, _, _, j1, j2 in self.opcodes for index in range(j1, j2)]
+
+
+def _keys(rules: Sequence[KernelRule]) -> List[Tuple[str, str, int]]:
+    """Owner plus occurrence number, so the n-th line of a rule only matches the n-th"""
+    seen: Counter = Counter()
+    keys = []
+    for rule in rules:
+        owner = rule.owner
+        keys.append(owner + (seen[owner],))
+        seen[owner] += 1
+    return keys
+
+
+def diff_chain(chain: str, live: Sequence[KernelRule], desired: Sequence[KernelRule]) -> ChainDiff:
+    matcher = difflib.SequenceMatcher(None, _keys(live), _keys(desired), autojunk=False)
+    opcodes = [opcode for opcode in matcher.get_opcodes() if opcode[0] != "equal"]
+    return ChainDiff(chain, list(live), list(desired), opcodes)
+
+
+def _fill_report(report: DriftReport, diffs: Sequence[ChainDiff]):
+    live_owners: Counter = Counter()
+    desired_owners: Counter = Counter()
+    touched = set()
+    for diff in diffs:
+        live_owners.update(rule.owner for rule in diff.live)
+        desired_owners.update(rule.owner for rule in diff.desired)
+        touched.update(diff.live[index].owner[0] for index in diff.deleted)
+        touched.update(diff.desired[index].owner[0] for index in diff.inserted)
+        report.inserted += len(diff.inserted)
+        report.deleted += len(diff.deleted)
+        report.live_kernel_rules += len(diff.live)
+
+    live_ids = {rule_id for rule_id, _ in live_owners if rule_id}
+    desired_ids = {rule_id for rule_id, _ in desired_owners}
+    report.missing_rules = sorted(desired_ids - live_ids)
+    report.stale_rules = sorted(live_ids - desired_ids)
+    report.changed_rules = sorted(touched & live_ids & desired_ids)
+    report.foreign_kernel_rules = sum(count for (rule_id, _), count in live_owners.items() if not rule_id)
+    report.duplicate_kernel_rules = sum(
+        count - desired_owners[owner] for owner, count in live_owners.items()
+        if owner[0] and desired_owners[owner] and count > desired_owners[owner]
+    )
+
+
+# =============================================================================
+# IPTABLES
+# =============================================================================
+
+def _iptables_comment(body: str) -> Optional[str]:
+    try:
+        tokens = shlex.split(body)
+    except ValueError:
+        return None
+    for index, token in enumerate(tokens[:-1]):
+        if token == "--comment":
+            return tokens[index + 1]
+    return None
+
+
+def parse_iptables_save(text: str) -> LiveRuleset:
+    """Every chain of the filter table from `iptables-save` output (with counters for `-c`)"""
+    live = LiveRuleset()
+    table = None
+    for line in text.splitlines():
+        line = line.strip()
+        counters = IPTABLES_COUNTERS.match(line)
+        if counters:
+            line = line[counters.end():]
+        if line.startswith("*"):
+            table = line[1:]
+        elif table != TABLE:
+            continue
+        elif line.startswith(":"):
+            live.chains.setdefault(line[1:].split()[0], [])
+        elif line.startswith("-A "):
+            _, chain, body = (line + " ").split(" ", 2)
+            body = body.strip()
+            packets, byte_count = (int(value) for value in counters.groups()) if counters else (None, None)
+            live.chains.setdefault(chain, []).append(
+                KernelRule(chain, body, _iptables_comment(body), packets=packets, bytes=byte_count)
+            )
+    return live
+
+
+class IptablesReconcileBackend:
+    """Diffs KOBI-INPUT / KOBI-OUTPUT, the group chains and the hook jumps"""
+    name = "iptables"
+
+    def __init__(self, applier: Optional[IptablesRestoreApplier] = None):
+        self.applier = applier or IptablesRestoreApplier()
+
+    def read_live(self) -> LiveRuleset:
+        return parse_iptables_save(self.applier.save())
+
+    def desired(self, specs: Sequence[FirewallRuleSpec], groups: Dict[str, FirewallGroupSpec]
+                ) -> Tuple[Dict[str, List[KernelRule]], Dict[str, NftSet]]:
+        chains: Dict[str, List[KernelRule]] = {}
+        for chain, lines in iptables_chain_lines(layout_rules(specs, groups)).items():
+            chains[chain] = []
+            for line in lines:
+                body = line.split(" ", 2)[2]
+                chains[chain].append(KernelRule(chain, body, _iptables_comment(body)))
+        return chains, {}
+
+    def render(self, specs, groups, live: LiveRuleset, diffs: Sequence[ChainDiff], desired_sets,
+               report: DriftReport) -> str:
+        lines = []
+        for diff in diffs:
+            if diff.chain not in live.chains:
+                # Declaring a chain under --noflush creates it (and would flush an existing one)
+                lines.append(f":{diff.chain} - [0:0]")
+                report.repaired.append(f"chain {diff.chain}")
+        for diff in diffs:
+            # Deleting from the bottom keeps the remaining rule numbers valid; the
+            # kept rules are then in order, so each insertion goes to its final slot
+            lines += [f"-D {diff.chain} {index + 1}" for index in reversed(diff.deleted)]
+            lines += [f"-I {diff.chain} {index + 1} {diff.desired[index].body}" for index in diff.inserted]
+        desired_chains = {diff.chain for diff in diffs}
+        for chain in live.chains:
+            # The jumps into it went with the diffs above
+            if chain.startswith(GROUP_CHAIN_PREFIX) and chain not in desired_chains:
+                lines += [f"-F {chain}", f"-X {chain}"]
+                report.repaired.append(f"stale chain {chain}")
+        for hook, chain in BASE_CHAINS.values():
+            jumps = sum(1 for rule in live.chains.get(hook, []) if rule.body == f"-j {chain}")
+            if jumps == 0:
+                lines.append(f"-I {hook} 1 -j {chain}")
+                report.repaired.append(f"jump {hook} -> {chain}")
+            for _ in range(jumps - 1):
+                lines.append(f"-D {hook} -j {chain}")
+                report.repaired.append(f"duplicate jump {hook} -> {chain}")
+        if not lines:
+            return ""
+        return "\n".join([f"*{TABLE}"] + lines + ["COMMIT"]) + "\n"
+
+    def apply(self, payload: str):
+        self.applier.restore(payload)
+
+
+# =============================================================================
+# NFTABLES
+# =============================================================================
+
+def parse_nft_json(objects: Iterable[Dict[str, Any]]) -> LiveRuleset:
+    """Chains, rules (with handles) and sets of the `inet kobi` table from `nft -j -a` output"""
+    live = LiveRuleset(table_exists=False)
+    for item in objects:
+        if "table" in item:
+            live.table_exists = True
+        elif "chain" in item:
+            live.chains.setdefault(item["chain"]["name"], [])
+        elif "rule" in item:
+            rule = item["rule"]
+            counter = next((expression["counter"] for expression in rule.get("expr", [])
+                            if isinstance(expression, dict) and isinstance(expression.get("counter"), dict)), {})
+            live.chains.setdefault(rule["chain"], []).append(
+                KernelRule(rule["chain"], "", rule.get("comment"), rule.get("handle"),
+                           counter.get("packets"), counter.get("bytes"))
+            )
+        elif "set" in item or "map" in item:
+            kind = "set" if "set" in item else "map"
+            live.sets[item[kind]["name"]] = kind
+    return live
+
+
+class NftablesReconcileBackend:
+    """Diffs the input/output chains, group chains, log chains and named sets of `inet kobi`"""
+    name = "nftables"
+
+    def __init__(self, driver: Optional[NftablesFirewall] = None):
+        self.driver = driver or NftablesFirewall()
+
+    def read_live(self) -> LiveRuleset:
+        return parse_nft_json(self.driver.list_table())
+
+    def desired(self, specs: Sequence[FirewallRuleSpec], groups: Dict[str, FirewallGroupSpec]
+                ) -> Tuple[Dict[str, List[KernelRule]], Dict[str, NftSet]]:
+        builder = NftRulesetBuilder()
+        builder.add_layout(layout_rules(specs, groups))
+        chains: Dict[str, List[KernelRule]] = {}
+        # Group chains first: they must exist before a hook chain jumps into them
+        for key in builder.group_chain_names() + list(HOOK_CHAINS):
+            chain = HOOK_CHAINS.get(key, key)
+            chains[chain] = []
+            for body in builder.chains[key]:
+                match = NFT_COMMENT.search(body)
+                chains[chain].append(KernelRule(chain, body, match.group(1) if match else None))
+        return chains, builder.sets
+
+    def render(self, specs, groups, live: LiveRuleset, diffs: Sequence[ChainDiff],
+               desired_sets: Dict[str, NftSet], report: DriftReport) -> str:
+        if not live.table_exists:
+            report.full_replace = True
+            report.repaired.append(f"table {NFT_FAMILY} {NFT_TABLE}")
+            return compile_nft_ruleset(specs, groups=groups).payload
+
+        table = f"{NFT_FAMILY} {NFT_TABLE}"
+        commands = []
+        for chain, rule in log_chain_rules().items():
+            if chain not in live.chains or not live.chains[chain]:
+                commands += [f"add chain {table} {chain}", f"flush chain {table} {chain}",
+                             f"add rule {table} {chain} {rule}"]
+                report.repaired.append(f"chain {chain}")
+        for direction, chain in HOOK_CHAINS.items():
+            if chain not in live.chains:
+                commands.append(f"add chain {table} {chain} {{ {hook_definition(direction)} }}")
+                report.repaired.append(f"chain {chain}")
+        for diff in diffs:
+            if diff.chain.startswith(NFT_GROUP_CHAIN_PREFIX) and diff.chain not in live.chains:
+                commands.append(f"add chain {table} {diff.chain}")
+                report.repaired.append(f"chain {diff.chain}")
+        for name, declared in desired_sets.items():
+            if name not in live.sets:
+                commands += declared.commands()
+                report.repaired.append(f"{declared.kind} {name}")
+
+        for diff in diffs:
+            commands += [f"delete rule {table} {diff.chain} handle {diff.live[index].handle}"
+                         for index in reversed(diff.deleted)]
+            for _, i1, i2, j1, j2 in diff.opcodes:
+                bodies = [diff.desired[index].body for index in range(j1, j2)]
+                if i1 > 0:
+                    # After the kept rule before the gap: add in reverse so each lands above the last
+                    anchor = diff.live[i1 - 1].handle
+                    commands += [f"add rule {table} {diff.chain} handle {anchor} {body}" for body in reversed(bodies)]
+                elif i2 < len(diff.live):
+                    anchor = diff.live[i2].handle
+                    commands += [f"insert rule {table} {diff.chain} handle {anchor} {body}" for body in bodies]
+                else:
+                    commands += [f"add rule {table} {diff.chain} {body}" for body in bodies]
+
+        desired_chains = {diff.chain for diff in diffs}
+        for chain in live.chains:
+            if chain.startswith(NFT_GROUP_CHAIN_PREFIX) and chain not in desired_chains:
+                commands += [f"flush chain {table} {chain}", f"delete chain {table} {chain}"]
+                report.repaired.append(f"stale chain {chain}")
+
+        # Sets can only be dropped once no rule references them any more
+        for name, kind in live.sets.items():
+            if name not in desired_sets:
+                commands.append(f"delete {kind} {table} {name}")
+                report.repaired.append(f"stale {kind} {name}")
+        return "\n".join(commands) + "\n" if commands else ""
+
+    def apply(self, payload: str):
+        self.driver.run_script(payload)
+
+
+# =============================================================================
+# RECONCILER
+# =============================================================================
+
+@dataclass
+class ReconcilePlan:
+    payload: str                    # "" when the kernel already matches
+    report: DriftReport
+
+
+class FirewallReconciler:
+    """Brings the kernel ruleset in line with firewall_rules using a minimal diff"""
+
+    def __init__(self, backend=None):
+        if backend is None:
+            nftables = get_settings().firewall_backend == "nftables"
+            backend = NftablesReconcileBackend() if nftables else IptablesReconcileBackend()
+        self.backend = backend
+
+    def plan(self, documents: Iterable[Dict[str, Any]],
+             group_documents: Optional[Iterable[Dict[str, Any]]] = None) -> ReconcilePlan:
+        groups = normalize_groups(group_documents)
+        specs, skipped, _ = prepare_ruleset(documents, groups)
+        report = DriftReport(backend=self.backend.name, rules=len(specs), skipped=skipped)
+        live = self.backend.read_live()
+        desired_chains, desired_sets = self.backend.desired(specs, groups)
+        diffs = [diff_chain(chain, live.chains.get(chain, []), rules) for chain, rules in desired_chains.items()]
+        _fill_report(report, diffs)
+        payload = self.backend.render(specs, groups, live, diffs, desired_sets, report)
+        return ReconcilePlan(payload, report)
+
+    def reconcile(self, documents: Iterable[Dict[str, Any]], dry_run: bool = False,
+                  group_documents: Optional[Iterable[Dict[str, Any]]] = None) -> DriftReport:
+        """Diff and (unless dry_run) apply in one transaction; raises FirewallApplyError"""
+        plan = self.plan(documents, group_documents)
+        report = plan.report
+        if plan.payload and not dry_run:
+            self.backend.apply(plan.payload)
+            report.applied = True
+        if report.in_sync:
+            logger.info(f"✅ Firewall in sync ({report.rules} rules, {report.live_kernel_rules} kernel rules)")
+        else:
+            logger.warning(
+                f"⚠️ Firewall drift: {len(report.missing_rules)} missing, {len(report.stale_rules)} stale, "
+                f"{len(report.changed_rules)} changed, {report.duplicate_kernel_rules} duplicate, "
+                f"{report.foreign_kernel_rules} foreign -> +{report.inserted}/-{report.deleted} kernel rules"
+                + ("" if report.applied else " (not applied)")
+            )
+        return report
+
+
+__all__ = [
+    "FirewallReconciler", "DriftReport", "KernelRule", "LiveRuleset", "ChainDiff", "diff_chain",
+    "parse_iptables_save", "parse_nft_json", "IptablesReconcileBackend", "NftablesReconcileBackend",
+]
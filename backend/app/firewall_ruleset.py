@@ -0,0 +1,545 @@
+"""
+Firewall ruleset compiler (iptables-restore)
+Every enabled firewall_rules document is normalized and rendered into a
+single iptables-restore payload for the dedicated KOBI-INPUT / KOBI-OUTPUT
+chains. The payload is applied with `iptables-restore --noflush`: declaring
+the chains flushes only them, so the whole ruleset is replaced in one atomic
+commit and a failure leaves the previous ruleset untouched. Each kernel rule
+carries a `kobi:<rule id>/<digest>` comment that maps it back to its document;
+the digest changes whenever the rendered rule would, which lets the reconciler
+compare live and desired rules without re-parsing their matches.
+Rules of a firewall group live in the group's own chain (KOBI-G-<key>-I/-O),
+entered by one jump from the dedicated chain at the group's priority. The jump
+is only present while the group is enabled, so toggling or reordering a group
+touches one kernel rule however many rules it holds.
+"""
+import hashlib
+import ipaddress
+import itertools
+import logging
+import subprocess
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+TABLE = "filter"
+# direction -> (built-in hook chain, dedicated chain)
+BASE_CHAINS = {
+    "IN": ("INPUT", "KOBI-INPUT"),
+    "OUT": ("OUTPUT", "KOBI-OUTPUT"),
+}
+GROUP_CHAIN_PREFIX = "KOBI-G-"
+GROUP_CHAIN_SUFFIXES = {"IN": "I", "OUT": "O"}
+COMMENT_TAG = "kobi:"
+GROUP_TAG = "group:"            # owner prefix of group jump rules: kobi:group:<group id>/<digest>
+DIGEST_SEPARATOR = "/"
+# Bump when the rendering of an unchanged rule changes, so live rules get replaced
+RULESET_FORMAT = 1
+LOG_PREFIX = "FWDROP: "
+MULTIPORT_LIMIT = 15            # xt_multiport slots; a range uses two
+IPTABLES_WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+ACTION_TARGETS = {"ALLOW": "ACCEPT", "DENY": "DROP", "DROP": "DROP", "REJECT": "REJECT"}
+PORT_PROTOCOLS = ("tcp", "udp")
+
+
+class RulesetError(ValueError):
+    """A rule document cannot be compiled"""
+
+
+class FirewallApplyError(RuntimeError):
+    """The firewall backend rejected a ruleset"""
+
+
+@dataclass(frozen=True)
+class FirewallRuleSpec:
+    """A firewall_rules document normalized for compilation and matching"""
+    rule_id: str
+    name: str
+    action: str                              # ALLOW / DENY / DROP / REJECT
+    directions: Tuple[str, ...]              # subset of ("IN", "OUT")
+    protocol: str                            # tcp / udp / icmp / any
+    sources: Tuple[str, ...] = ()            # CIDRs; empty = any
+    destinations: Tuple[str, ...] = ()
+    source_ports: Tuple[Tuple[int, int], ...] = ()       # inclusive ranges; empty = any
+    destination_ports: Tuple[Tuple[int, int], ...] = ()
+    interface: Optional[str] = None
+    schedule: Optional[Tuple[str, str]] = None          # ("HH:MM", "HH:MM")
+    days_of_week: Tuple[int, ...] = ()                   # 0 = Monday
+    priority: int = 100
+    group_id: Optional[str] = None
+    enabled: bool = True
+
+    @property
+    def target(self) -> str:
+        return ACTION_TARGETS[self.action]
+
+    @property
+    def logged(self) -> bool:
+        return self.action != "ALLOW"
+
+    @property
+    def digest(self) -> str:
+        """Short hash of everything that shapes the kernel rules (not name/priority)"""
+        shape = (RULESET_FORMAT, self.action, self.directions, self.protocol, self.sources, self.destinations,
+                 self.source_ports, self.destination_ports, self.interface, self.schedule, self.days_of_week)
+        return hashlib.sha1(repr(shape).encode()).hexdigest()[:8]
+
+    @property
+    def comment(self) -> str:
+        return f"{COMMENT_TAG}{self.rule_id}{DIGEST_SEPARATOR}{self.digest}"
+
+
+def parse_comment(comment: Optional[str]) -> Optional[Tuple[str, str]]:
+    """`kobi:<rule id>/<digest>` -> (rule id, digest); None for rules we do not own"""
+    if not comment or not comment.startswith(COMMENT_TAG):
+        return None
+    rule_id, separator, digest = comment[len(COMMENT_TAG):].rpartition(DIGEST_SEPARATOR)
+    if not separator:
+        return digest, ""
+    return rule_id, digest
+
+
+@dataclass(frozen=True)
+class FirewallGroupSpec:
+    """A firewall_groups document: its rules get their own chain behind one jump"""
+    group_id: str
+    name: str
+    enabled: bool = True
+    priority: int = 100
+
+    @property
+    def key(self) -> str:
+        """Short, chain-name-safe hash of the group id"""
+        return hashlib.sha1(self.group_id.encode()).hexdigest()[:10]
+
+    def chain(self, direction: str) -> str:
+        return f"{GROUP_CHAIN_PREFIX}{self.key}-{GROUP_CHAIN_SUFFIXES[direction]}"
+
+    @property
+    def comment(self) -> str:
+        digest = hashlib.sha1(repr((RULESET_FORMAT, self.key)).encode()).hexdigest()[:8]
+        return f"{COMMENT_TAG}{GROUP_TAG}{self.group_id}{DIGEST_SEPARATOR}{digest}"
+
+
+# =============================================================================
+# NORMALIZATION
+# =============================================================================
+
+def parse_port_range(value: Any) -> Tuple[int, int]:
+    """'80' / '1000-2000' / 443 -> inclusive (low, high)"""
+    text = str(value).strip()
+    low_text, _, high_text = text.partition("-")
+    try:
+        low = int(low_text)
+        high = int(high_text) if high_text else low
+    except ValueError:
+        raise RulesetError(f"Invalid port: {value}")
+    if not (1 <= low <= high <= 65535):
+        raise RulesetError(f"Invalid port range: {value}")
+    return low, high
+
+
+def _normalize_networks(values: Iterable[Any]) -> Tuple[str, ...]:
+    networks = []
+    for value in values or ():
+        try:
+            networks.append(ipaddress.ip_network(str(value).strip(), strict=False))
+        except ValueError:
+            raise RulesetError(f"Invalid IP address or network: {value}")
+    everything = {network.version for network in networks if network.prefixlen == 0}
+    if everything == {4, 6}:
+        return ()  # 0.0.0.0/0 and ::/0 together mean "any"
+    # A /0 only covers its own family: ::/0 must not turn into "any IPv4 address" as well
+    return tuple(dict.fromkeys(
+        str(network) for network in networks if network.prefixlen == 0 or network.version not in everything
+    ))
+
+
+def _normalize_ports(values: Iterable[Any]) -> Tuple[Tuple[int, int], ...]:
+    ranges = []
+    for value in values or ():
+        for part in str(value).split(","):
+            if part.strip():
+                ranges.append(parse_port_range(part))
+    return tuple(sorted(set(ranges)))
+
+
+def normalize_rule(document: Dict[str, Any]) -> FirewallRuleSpec:
+    """Canonical form of a firewall_rules document (raises RulesetError)"""
+    action = str(document.get("action") or "ALLOW").upper()
+    if action not in ACTION_TARGETS:
+        raise RulesetError(f"Unsupported action: {action}")
+
+    direction = str(document.get("direction") or "IN").upper()
+    directions = ("IN", "OUT") if direction == "BOTH" else (direction,)
+    if any(item not in BASE_CHAINS for item in directions):
+        raise RulesetError(f"Unsupported direction: {direction}")
+
+    protocol = str(document.get("protocol") or "ANY").lower()
+    if protocol not in ("tcp", "udp", "icmp", "any"):
+        raise RulesetError(f"Unsupported protocol: {protocol}")
+
+    destination_ports = _normalize_ports(document.get("destination_ports"))
+    if not destination_ports and document.get("port"):
+        destination_ports = _normalize_ports([document["port"]])
+
+    schedule = None
+    if document.get("schedule_start") and document.get("schedule_end"):
+        schedule = (document["schedule_start"], document["schedule_end"])
+
+    rule_id = document.get("_id") or document.get("id") or document.get("rule_name")
+    if not rule_id:
+        raise RulesetError("Rule has no id or name")
+
+    return FirewallRuleSpec(
+        rule_id=str(rule_id),
+        name=str(document.get("rule_name") or rule_id),
+        action=action,
+        directions=directions,
+        protocol=protocol,
+        sources=_normalize_networks(document.get("source_ips")),
+        destinations=_normalize_networks(document.get("destination_ips")),
+        source_ports=_normalize_ports(document.get("source_ports")),
+        destination_ports=destination_ports,
+        interface=document.get("interface") or None,
+        schedule=schedule,
+        days_of_week=tuple(sorted({day for day in document.get("days_of_week") or () if 0 <= day <= 6})),
+        priority=int(document.get("priority") or 100),
+        group_id=str(document["group_id"]) if document.get("group_id") else None,
+        enabled=bool(document.get("enabled", True)),
+    )
+
+
+def normalize_rules(documents: Iterable[Dict[str, Any]]) -> Tuple[List[FirewallRuleSpec], List[Tuple[str, str]]]:
+    """(enabled specs in evaluation order, [(rule, reason)] for rules that were skipped)"""
+    specs, skipped = [], []
+    for document in documents:
+        try:
+            spec = normalize_rule(document)
+        except RulesetError as e:
+            skipped.append((str(document.get("_id") or document.get("rule_name")), str(e)))
+            continue
+        if spec.enabled:
+            specs.append(spec)
+    # Lower priority value is evaluated first; ties keep document order
+    specs.sort(key=lambda spec: spec.priority)
+    return specs, skipped
+
+
+def normalize_groups(documents: Optional[Iterable[Dict[str, Any]]]) -> Dict[str, FirewallGroupSpec]:
+    """group id -> FirewallGroupSpec for firewall_groups documents (None -> no groups)"""
+    groups = {}
+    for document in documents or ():
+        group_id = document.get("_id") or document.get("id")
+        if not group_id:
+            continue
+        groups[str(group_id)] = FirewallGroupSpec(
+            group_id=str(group_id),
+            name=str(document.get("group_name") or group_id),
+            enabled=bool(document.get("enabled", True)),
+            priority=int(document.get("priority") or 100),
+        )
+    return groups
+
+
+@dataclass
+class ChainLayout:
+    """Base chain entries (rules and group jumps) in evaluation order, plus each group's rules"""
+    entries: List[Union[FirewallRuleSpec, FirewallGroupSpec]]
+    members: Dict[str, List[FirewallRuleSpec]]
+
+    def base_entries(self, direction: str) -> List[Union[FirewallRuleSpec, FirewallGroupSpec]]:
+        """What the dedicated chain of one direction holds: its rules and the jumps of enabled groups"""
+        return [
+            entry for entry in self.entries
+            if (entry.enabled and any(direction in spec.directions for spec in self.members[entry.group_id])
+                if isinstance(entry, FirewallGroupSpec) else direction in entry.directions)
+        ]
+
+    def group_chains(self, direction: str) -> List[Tuple[FirewallGroupSpec, List[FirewallRuleSpec]]]:
+        """(group, its rules for this direction) for every group chain, enabled or not"""
+        chains = []
+        for entry in self.entries:
+            if isinstance(entry, FirewallGroupSpec):
+                rules = [spec for spec in self.members[entry.group_id] if direction in spec.directions]
+                if rules:
+                    chains.append((entry, rules))
+        return chains
+
+    def evaluation_order(self) -> List[FirewallRuleSpec]:
+        """The rules a packet meets, in order (disabled groups left out)"""
+        order = []
+        for entry in self.entries:
+            if isinstance(entry, FirewallGroupSpec):
+                if entry.enabled:
+                    order += self.members[entry.group_id]
+            else:
+                order.append(entry)
+        return order
+
+
+def layout_rules(specs: Sequence[FirewallRuleSpec],
+                 groups: Optional[Dict[str, FirewallGroupSpec]] = None) -> ChainLayout:
+    """
+    Split rules into the dedicated chain and group chains. A group's jump sits
+    at the group's priority (after rules of the same priority); rules keep
+    their order inside their chain. Rules of unknown groups stay in the
+    dedicated chain, so without groups the layout is the plain rule list.
+    """
+    groups = groups or {}
+    entries: List[Union[FirewallRuleSpec, FirewallGroupSpec]] = []
+    members: Dict[str, List[FirewallRuleSpec]] = {}
+    for spec in specs:
+        if spec.group_id in groups:
+            members.setdefault(spec.group_id, []).append(spec)
+        else:
+            entries.append(spec)
+    entries += [groups[group_id] for group_id in members]
+    entries.sort(key=lambda entry: entry.priority)
+    return ChainLayout(entries, members)
+
+
+# =============================================================================
+# IPTABLES RENDERING
+# =============================================================================
+
+def _quote(value: str) -> str:
+    if value and not any(char.isspace() or char in "\"'" for char in value):
+        return value
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _port_text(port_range: Tuple[int, int]) -> str:
+    low, high = port_range
+    return str(low) if low == high else f"{low}:{high}"
+
+
+def _port_matches(option: str, ranges: Sequence[Tuple[int, int]]) -> List[List[str]]:
+    """Match arguments for a port list: one --sport/--dport, or multiport chunks of 15 slots"""
+    if not ranges:
+        return [[]]
+    if len(ranges) == 1:
+        return [[f"--{option}", _port_text(ranges[0])]]
+
+    chunks, current, used = [], [], 0
+    for port_range in ranges:
+        cost = 1 if port_range[0] == port_range[1] else 2
+        if used + cost > MULTIPORT_LIMIT:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(port_range)
+        used += cost
+    chunks.append(current)
+    return [["-m", "multiport", f"--{option}s", ",".join(_port_text(item) for item in chunk)] for chunk in chunks]
+
+
+def _schedule_args(spec: FirewallRuleSpec) -> List[str]:
+    if not spec.schedule:
+        return []
+    args = ["-m", "time", "--timestart", spec.schedule[0], "--timestop", spec.schedule[1]]
+    if spec.days_of_week:
+        args += ["--weekdays", ",".join(IPTABLES_WEEKDAYS[day] for day in spec.days_of_week)]
+    return args
+
+
+def _ipv4(networks: Tuple[str, ...]) -> Optional[List[Optional[str]]]:
+    """IPv4 members of a network list ([None] = any; None = only IPv6 members, nothing to emit)"""
+    if not networks:
+        return [None]
+    selected = [network for network in networks if ":" not in network]
+    return selected or None
+
+
+def iptables_matches(spec: FirewallRuleSpec, direction: str) -> List[List[str]]:
+    """Match argument lists (one per kernel rule) for one direction of a rule"""
+    sources, destinations = _ipv4(spec.sources), _ipv4(spec.destinations)
+    if sources is None or destinations is None:
+        return []
+
+    has_ports = bool(spec.source_ports or spec.destination_ports)
+    if spec.protocol == "any":
+        protocols = list(PORT_PROTOCOLS) if has_ports else [None]
+    else:
+        protocols = [spec.protocol]
+
+    interface_args = []
+    if spec.interface:
+        interface_args = ["-i" if direction == "IN" else "-o", spec.interface]
+    tail = _schedule_args(spec) + ["-m", "comment", "--comment", spec.comment]
+
+    matches = []
+    for protocol, source, destination in itertools.product(protocols, sources, destinations):
+        base = list(interface_args)
+        if protocol:
+            base += ["-p", protocol]
+        if source:
+            base += ["-s", source]
+        if destination:
+            base += ["-d", destination]
+        if protocol in PORT_PROTOCOLS:
+            port_combinations = itertools.product(
+                _port_matches("sport", spec.source_ports), _port_matches("dport", spec.destination_ports)
+            )
+        else:
+            port_combinations = [([], [])]
+        for source_ports, destination_ports in port_combinations:
+            matches.append(base + source_ports + destination_ports + tail)
+    return matches
+
+
+def iptables_rule_lines(spec: FirewallRuleSpec, directions: Optional[Sequence[str]] = None,
+                        group: Optional[FirewallGroupSpec] = None) -> List[str]:
+    """`-A <chain> ...` lines for one rule (LOG line first for blocking actions), in its group chain if given"""
+    lines = []
+    for direction in directions or spec.directions:
+        chain = group.chain(direction) if group else BASE_CHAINS[direction][1]
+        for match in iptables_matches(spec, direction):
+            rendered = " ".join(_quote(arg) for arg in match)
+            if spec.logged:
+                lines.append(f"-A {chain} {rendered} -j LOG --log-prefix {_quote(LOG_PREFIX)}")
+            lines.append(f"-A {chain} {rendered} -j {spec.target}")
+    return lines
+
+
+def iptables_group_jump(group: FirewallGroupSpec, direction: str) -> str:
+    """`-A` line jumping from the dedicated chain into a group chain"""
+    return (f"-A {BASE_CHAINS[direction][1]} -m comment --comment {_quote(group.comment)} "
+            f"-j {group.chain(direction)}")
+
+
+def iptables_chain_lines(layout: ChainLayout) -> Dict[str, List[str]]:
+    """chain -> `-A` lines for the dedicated chains and every group chain"""
+    chains: Dict[str, List[str]] = {}
+    for direction, (_, base_chain) in BASE_CHAINS.items():
+        lines = chains.setdefault(base_chain, [])
+        for entry in layout.base_entries(direction):
+            if isinstance(entry, FirewallGroupSpec):
+                lines.append(iptables_group_jump(entry, direction))
+            else:
+                lines += iptables_rule_lines(entry, (direction,))
+        for group, rules in layout.group_chains(direction):
+            chains[group.chain(direction)] = [line for spec in rules
+                                              for line in iptables_rule_lines(spec, (direction,), group)]
+    return chains
+
+
+@dataclass
+class CompiledRuleset:
+    """A restore payload (iptables-restore or nft -f) plus what went into it"""
+    payload: str
+    rules: int
+    kernel_rules: int
+    skipped: List[Tuple[str, str]] = field(default_factory=list)
+    # Kernel objects that stand for several rules (e.g. nft verdict maps) -> rule ids
+    merged: Dict[str, List[str]] = field(default_factory=dict)
+
+
+def compile_iptables_restore(specs: Sequence[FirewallRuleSpec], missing_jumps: Sequence[str] = (),
+                             skipped: Optional[List[Tuple[str, str]]] = None,
+                             groups: Optional[Dict[str, FirewallGroupSpec]] = None) -> CompiledRuleset:
+    """
+    Render the dedicated chains (and group chains) as one iptables-restore
+    --noflush payload. missing_jumps lists directions whose hook chain still
+    needs the jump into its dedicated chain (inserted at the top of the hook).
+    """
+    skipped = list(skipped or [])
+    renderable = []
+    for spec in specs:
+        if iptables_matches(spec, spec.directions[0]):
+            renderable.append(spec)
+        else:
+            skipped.append((spec.rule_id, "no IPv4 addresses to match"))
+
+    chains = iptables_chain_lines(layout_rules(renderable, groups))
+    lines = [f"*{TABLE}"]
+    lines += [f":{chain} - [0:0]" for chain in chains]
+    kernel_rules = 0
+    for chain_lines in chains.values():
+        lines.extend(chain_lines)
+        kernel_rules += len(chain_lines)
+
+    for direction in missing_jumps:
+        hook, chain = BASE_CHAINS[direction]
+        lines.append(f"-I {hook} 1 -j {chain}")
+    lines.append("COMMIT")
+    return CompiledRuleset("\n".join(lines) + "\n", len(specs), kernel_rules, skipped)
+
+
+# =============================================================================
+# APPLY
+# =============================================================================
+
+class IptablesRestoreApplier:
+    """Applies compiled rulesets with a single iptables-restore call"""
+
+    def __init__(self, restore_binary: str = "iptables-restore", iptables_binary: str = "iptables",
+                 runner: Callable[..., subprocess.CompletedProcess] = subprocess.run,
+                 save_binary: str = "iptables-save"):
+        self.restore_binary = restore_binary
+        self.iptables_binary = iptables_binary
+        self.save_binary = save_binary
+        self.runner = runner
+        self._jumps_installed = False
+
+    def missing_jumps(self) -> List[str]:
+        """Directions whose hook chain does not jump to the dedicated chain yet"""
+        if self._jumps_installed:
+            return []
+        missing = []
+        for direction, (hook, chain) in BASE_CHAINS.items():
+            result = self.runner([self.iptables_binary, "-w", "-C", hook, "-j", chain],
+                                 capture_output=True, text=True)
+            if result.returncode != 0:
+                missing.append(direction)
+        return missing
+
+    def compile(self, documents: Iterable[Dict[str, Any]],
+                group_documents: Optional[Iterable[Dict[str, Any]]] = None) -> CompiledRuleset:
+        # Imported here because the optimizer is built on this module's rule model
+        from app.firewall_optimizer import prepare_ruleset
+
+        groups = normalize_groups(group_documents)
+        specs, skipped, merged = prepare_ruleset(documents, groups)
+        compiled = compile_iptables_restore(specs, self.missing_jumps(), skipped, groups)
+        compiled.merged = merged
+        return compiled
+
+    def save(self, counters: bool = False) -> str:
+        """Current filter table as printed by iptables-save (counters=True: with [packets:bytes])"""
+        result = self.runner([self.save_binary, "-t", TABLE] + (["-c"] if counters else []),
+                             capture_output=True, text=True)
+        if result.returncode != 0:
+            raise FirewallApplyError(f"iptables-save failed: {result.stderr.strip() or result.returncode}")
+        return result.stdout
+
+    def restore(self, payload: str):
+        """Commit an iptables-restore --noflush payload as one transaction"""
+        result = self.runner([self.restore_binary, "--noflush", "-w"], input=payload,
+                             capture_output=True, text=True)
+        if result.returncode != 0:
+            raise FirewallApplyError(f"iptables-restore failed: {result.stderr.strip() or result.returncode}")
+
+    def apply_compiled(self, compiled: CompiledRuleset):
+        self.restore(compiled.payload)
+        self._jumps_installed = True
+
+    def apply(self, documents: Iterable[Dict[str, Any]],
+              group_documents: Optional[Iterable[Dict[str, Any]]] = None) -> CompiledRuleset:
+        """Compile and atomically apply the enabled rules; raises FirewallApplyError"""
+        compiled = self.compile(documents, group_documents)
+        self.apply_compiled(compiled)
+        for rule_id, reason in compiled.skipped:
+            logger.warning(f"⚠️ Firewall rule {rule_id} not applied: {reason}")
+        logger.info(f"✅ Applied {compiled.rules} firewall rules ({compiled.kernel_rules} kernel rules)")
+        return compiled
+
+
+__all__ = [
+    "FirewallRuleSpec", "CompiledRuleset", "IptablesRestoreApplier", "RulesetError", "FirewallApplyError",
+    "normalize_rule", "normalize_rules", "parse_port_range", "parse_comment", "compile_iptables_restore",
+    "iptables_rule_lines", "iptables_group_jump", "iptables_chain_lines",
+    "FirewallGroupSpec", "ChainLayout", "normalize_groups", "layout_rules",
+    "BASE_CHAINS", "TABLE", "COMMENT_TAG", "GROUP_TAG", "GROUP_CHAIN_PREFIX", "LOG_PREFIX", "ACTION_TARGETS",
+]
@@ -0,0 +1,123 @@
+"""
+Kernel hit counters -> firewall_rules.hit_count / last_hit
+Every interval the collector reads all packet/byte counters with a single
+call (`iptables-save -c -t filter`, or `nft -j -a list table inet kobi`
+whose rules all carry a `counter` statement), maps each kernel rule back to
+its firewall_rules document through the `kobi:<rule id>/<digest>` comment
+and turns the readings into deltas against the previous pass:
+  - a rule expands to several kernel rules (directions, address families);
+    their deltas are summed per rule
+  - the iptables `-j LOG` line in front of a blocking rule carries the same
+    comment and sees the same packets, so only the verdict line is counted
+  - optimizer merges (`@<hash>`) and nftables verdict maps (`@v_...`) are
+    resolved to their member rules and the delta is split between them
+  - a counter lower than last time means the kernel rule was re-inserted
+    (reconcile, full apply) and counts from zero again
+The first pass after startup only records a baseline, so counters that were
+already in the kernel are not added a second time.
+"""
+import logging
+from collections import Counter
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from app.firewall_optimizer import prepare_ruleset
+from app.firewall_reconciler import LiveRuleset, parse_iptables_save, parse_nft_json
+from app.firewall_ruleset import IptablesRestoreApplier, normalize_groups
+from app.nftables_firewall import NftablesFirewall
+from app.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+MERGED_MARK = "@"
+LOG_TARGET = "-j LOG"
+
+
+def counter_readings(live: LiveRuleset) -> Dict[Hashable, Tuple[str, int, int]]:
+    """kernel rule identity -> (owner id, packets, bytes) for our rules that carry counters"""
+    readings = {}
+    for chain, rules in live.chains.items():
+        seen: Counter = Counter()
+        for rule in rules:
+            rule_id, digest = rule.owner
+            if not rule_id or rule.packets is None:
+                continue
+            if f" {LOG_TARGET} " in f" {rule.body} ":
+                continue
+            # nftables rules have a stable handle; iptables lines are told apart by occurrence
+            key = (chain, rule.handle) if rule.handle is not None else (chain, rule_id, digest, seen[rule.owner])
+            seen[rule.owner] += 1
+            readings[key] = (rule_id, rule.packets, rule.bytes or 0)
+    return readings
+
+
+def split_merged(deltas: Dict[str, List[int]], merged: Dict[str, List[str]]) -> Dict[str, List[int]]:
+    """Resolve merged ids to member rules, splitting packets/bytes evenly (remainder to the first member)"""
+    resolved: Dict[str, List[int]] = {}
+    for owner, (packets, byte_count) in deltas.items():
+        members = None
+        if owner.startswith(MERGED_MARK):
+            members = merged.get(owner) or merged.get(owner[len(MERGED_MARK):])
+        members = members or [owner]
+        share_packets, extra_packets = divmod(packets, len(members))
+        share_bytes, extra_bytes = divmod(byte_count, len(members))
+        for position, rule_id in enumerate(members):
+            entry = resolved.setdefault(rule_id, [0, 0])
+            entry[0] += share_packets + (extra_packets if position == 0 else 0)
+            entry[1] += share_bytes + (extra_bytes if position == 0 else 0)
+    return resolved
+
+
+class HitCounterCollector:
+    """Turns successive kernel counter readings into per-rule deltas"""
+
+    def __init__(self, backend: Optional[str] = None):
+        self.backend = backend or get_settings().firewall_backend
+        self._driver = None
+        self._previous: Optional[Dict[Hashable, Tuple[str, int, int]]] = None
+        self._merged: Dict[str, List[str]] = {}
+
+    def read(self) -> LiveRuleset:
+        """All counters in one call to the firewall tool"""
+        if self.backend == "nftables":
+            if self._driver is None:
+                self._driver = NftablesFirewall()
+            return parse_nft_json(self._driver.list_table())
+        if self._driver is None:
+            self._driver = IptablesRestoreApplier()
+        return parse_iptables_save(self._driver.save(counters=True))
+
+    def deltas(self, live: LiveRuleset) -> Dict[str, List[int]]:
+        """owner id -> [packets, bytes] since the previous pass (empty on the first pass)"""
+        current = counter_readings(live)
+        previous, self._previous = self._previous, current
+        totals: Dict[str, List[int]] = {}
+        if previous is None:
+            return totals
+        for key, (owner, packets, byte_count) in current.items():
+            _, last_packets, last_bytes = previous.get(key, (owner, 0, 0))
+            if packets < last_packets:
+                last_packets, last_bytes = 0, 0
+            if packets > last_packets:
+                entry = totals.setdefault(owner, [0, 0])
+                entry[0] += packets - last_packets
+                entry[1] += max(byte_count - last_bytes, 0)
+        return totals
+
+    def unresolved(self, deltas: Dict[str, List[int]]) -> bool:
+        """Whether some merged id is missing from the cached merge map"""
+        return any(owner.startswith(MERGED_MARK) and owner not in self._merged
+                   and owner[len(MERGED_MARK):] not in self._merged for owner in deltas)
+
+    def refresh_merged(self, documents: List[Dict[str, Any]], group_documents: Optional[List[Dict[str, Any]]] = None):
+        """Recompile the rules to learn the merged ids in the kernel (content hashes, so cacheable)"""
+        if self.backend == "nftables":
+            self._merged = NftablesFirewall().compile(documents, group_documents).merged
+        else:
+            self._merged = prepare_ruleset(documents, normalize_groups(group_documents))[2]
+
+    def resolve(self, deltas: Dict[str, List[int]]) -> Dict[str, List[int]]:
+        """Per firewall_rules id, merged ids split between their members"""
+        return split_merged(deltas, self._merged)
+
+
+__all__ = ["HitCounterCollector", "counter_readings", "split_merged"]
@@ -0,0 +1,112 @@
+"""
+HTTP Range support for file downloads
+Starlette 0.27's FileResponse ignores Range headers; report artifacts are
+served through ranged_file_response so interrupted downloads can resume.
+Only single byte ranges are supported (multipart/byteranges is not).
+When the caller knows a strong ETag for the file, GET requests honour
+If-None-Match (304) and If-Range (a stale validator gets the full body).
+"""
+import os
+from typing import Iterator, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(ValueError):
+    """The requested byte range lies outside the file"""
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse 'bytes=start-end' into an inclusive (start, end); None means the whole file"""
+    if not header or not header.startswith("bytes="):
+        return None
+    spec = header[len("bytes="):].strip()
+    if "," in spec:
+        return None  # multiple ranges: answer with the full body
+    start_text, _, end_text = spec.partition("-")
+    try:
+        if start_text == "":
+            # Suffix range: last N bytes
+            length = int(end_text)
+        else:
+            start = int(start_text)
+            end = int(end_text) if end_text else size - 1
+    except ValueError:
+        return None
+    if start_text == "":
+        if length <= 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, per RFC 9110): '*' or any listed tag"""
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in header.split(","))
+    return any(tag.removeprefix("W/").strip('"') == etag for tag in candidates)
+
+
+def _iter_file(path: str, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as handle:
+        handle.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = handle.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def ranged_file_response(request: Request, path: str, media_type: str, filename: str,
+                         headers: Optional[dict] = None, etag: Optional[str] = None) -> Response:
+    """200 with the full file, 206 for a satisfiable Range, 416 otherwise (304 for a fresh ETag)"""
+    size = os.path.getsize(path)
+    base_headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={filename}",
+        **(headers or {})
+    }
+
+    range_header = request.headers.get("range")
+    if etag:
+        base_headers["ETag"] = f'"{etag}"'
+        if request.method in ("GET", "HEAD") and etag_matches(request.headers.get("if-none-match"), etag):
+            not_modified = {key: value for key, value in base_headers.items() if key != "Content-Disposition"}
+            return Response(status_code=304, headers=not_modified)
+        if_range = request.headers.get("if-range")
+        if if_range and if_range.strip() != f'"{etag}"':
+            range_header = None  # the client's partial copy is stale
+
+    try:
+        byte_range = parse_range_header(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**base_headers, "Content-Range": f"bytes */{size}"})
+
+    if byte_range is None:
+        return StreamingResponse(
+            _iter_file(path, 0, size - 1), media_type=media_type,
+            headers={**base_headers, "Content-Length": str(size)}
+        )
+
+    start, end = byte_range
+    return StreamingResponse(
+        _iter_file(path, start, end), status_code=206, media_type=media_type,
+        headers={
+            **base_headers,
+            "Content-Range": f"bytes {start}-{end}/{size}",
+            "Content-Length": str(end - start + 1)
+        }
+    )
+
+
+__all__ = ["ranged_file_response", "parse_range_header", "etag_matches", "RangeNotSatisfiable"]
@@ -0,0 +1,269 @@
+"""
+Query-shape driven index planner
+Services declare the query shapes they run (equality fields, sort, range
+fields). The planner derives compound indexes in ESR order (Equality, Sort,
+Range), folds indexes that are a prefix of another one, and creates/drops its
+own "qp_" indexes idempotently at startup. verify_query_shapes() runs explain()
+for every shape and flags any shape whose winning plan is a COLLSCAN.
+
+Shapes are declared next to the code that runs them; QUERY_SHAPE_MODULES lists
+those modules so the plan is loaded in full before it is applied, whatever
+has been imported so far.
+"""
+import hashlib
+import importlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+INDEX_PREFIX = "qp_"
+
+IndexKeys = Tuple[Tuple[str, int], ...]
+
+
+@dataclass(frozen=True)
+class QueryShape:
+    """A query a service runs: which fields are matched how, and how it is sorted"""
+    collection: str
+    name: str
+    equality: Tuple[str, ...] = ()               # equality or small $in matches
+    sort: Tuple[Tuple[str, int], ...] = ()       # sort specification
+    range: Tuple[str, ...] = ()                  # $gt/$lt/$exists/$ne style predicates
+    covering: Tuple[str, ...] = ()               # extra fields read by the query (covered plans)
+    owner: str = ""
+
+    def index_keys(self) -> IndexKeys:
+        """Derive the compound index in ESR order"""
+        keys: List[Tuple[str, int]] = []
+        seen = set()
+
+        def _add(field_name: str, direction: int):
+            if field_name not in seen:
+                seen.add(field_name)
+                keys.append((field_name, direction))
+
+        for field_name in self.equality:
+            _add(field_name, 1)
+        for field_name, direction in self.sort:
+            _add(field_name, direction)
+        for field_name in self.range:
+            # Time ranges follow the repo-wide descending timestamp convention
+            _add(field_name, -1 if field_name == "timestamp" else 1)
+        for field_name in self.covering:
+            _add(field_name, 1)
+        return tuple(keys)
+
+    def sample_filter(self) -> Dict[str, Any]:
+        """Representative filter used for explain() verification"""
+        sample: Dict[str, Any] = {field_name: "sample" for field_name in self.equality}
+        for field_name in self.range:
+            if field_name == "timestamp":
+                sample[field_name] = {"$gte": datetime.utcnow() - timedelta(hours=1)}
+            else:
+                sample[field_name] = {"$exists": True, "$ne": None}
+        return sample
+
+
+@dataclass
+class IndexPlan:
+    """An index the planner wants on a collection"""
+    collection: str
+    keys: IndexKeys
+    shapes: List[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        name = INDEX_PREFIX + "_".join(f"{field_name}_{direction}" for field_name, direction in self.keys)
+        if len(name) > 100:
+            digest = hashlib.sha1(name.encode()).hexdigest()[:10]
+            name = f"{name[:80]}_{digest}"
+        return name
+
+
+# Registry of declared query shapes (name -> shape)
+_QUERY_SHAPES: Dict[str, QueryShape] = {}
+
+# Modules that declare query shapes at import time
+QUERY_SHAPE_MODULES = (
+    ".services.log_service",
+    ".services.reports_service",
+    ".services.report_scheduler",
+    ".tasks.log_watcher",
+)
+
+
+def register_query_shape(collection: str, name: str, equality=(), sort=(), range=(),
+                         covering=(), owner: str = "") -> QueryShape:
+    """Declare a query shape; re-registering a name replaces the previous declaration"""
+    shape = QueryShape(
+        collection=collection,
+        name=name,
+        equality=tuple(equality),
+        sort=tuple(tuple(item) for item in sort),
+        range=tuple(range),
+        covering=tuple(covering),
+        owner=owner,
+    )
+    _QUERY_SHAPES[name] = shape
+    return shape
+
+
+def get_query_shapes(collection: Optional[str] = None) -> List[QueryShape]:
+    """Get registered query shapes, optionally for one collection"""
+    return [shape for shape in _QUERY_SHAPES.values() if collection is None or shape.collection == collection]
+
+
+def load_query_shapes() -> List[str]:
+    """Import every shape-declaring module; returns the modules that failed to import"""
+    failed = []
+    for module in QUERY_SHAPE_MODULES:
+        try:
+            importlib.import_module(module, __package__)
+        except Exception as e:
+            failed.append(module)
+            logger.warning(f"⚠️ Index planner could not load query shapes from {module}: {e}")
+    return failed
+
+
+def _is_prefix(short: IndexKeys, long: IndexKeys) -> bool:
+    return len(short) <= len(long) and long[:len(short)] == short
+
+
+def _satisfies(planned: IndexKeys, existing: IndexKeys) -> bool:
+    """An index serves the plan if the planned keys prefix it, walked forwards or backwards"""
+    reversed_keys = tuple((field_name, -direction) for field_name, direction in planned)
+    return _is_prefix(planned, existing) or _is_prefix(reversed_keys, existing)
+
+
+def plan_indexes(shapes: Optional[List[QueryShape]] = None) -> Dict[str, List[IndexPlan]]:
+    """Derive the index plan per collection; indexes that prefix another planned index are folded in"""
+    shapes = get_query_shapes() if shapes is None else shapes
+    by_collection: Dict[str, Dict[IndexKeys, IndexPlan]] = {}
+
+    for shape in shapes:
+        keys = shape.index_keys()
+        if not keys:
+            continue
+        plans = by_collection.setdefault(shape.collection, {})
+        plans.setdefault(keys, IndexPlan(shape.collection, keys)).shapes.append(shape.name)
+
+    result: Dict[str, List[IndexPlan]] = {}
+    for collection, plans in by_collection.items():
+        ordered = sorted(plans.values(), key=lambda plan: len(plan.keys), reverse=True)
+        kept: List[IndexPlan] = []
+        for plan in ordered:
+            wider = next((other for other in kept if _is_prefix(plan.keys, other.keys)), None)
+            if wider is not None:
+                wider.shapes.extend(plan.shapes)
+            else:
+                kept.append(plan)
+        result[collection] = kept
+    return result
+
+
+async def apply_index_plan(database, drop_stale: bool = False) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Create missing planned indexes and, with drop_stale, drop qp_ indexes no
+    shape needs anymore. An existing index whose key pattern starts with the
+    planned keys in either direction (for example a TTL index on timestamp)
+    satisfies the plan and nothing is created. Stale indexes are never dropped
+    while a shape module failed to load.
+    """
+    if load_query_shapes() and drop_stale:
+        logger.warning("⚠️ Index planner keeps stale qp_ indexes: not every query shape could be loaded")
+        drop_stale = False
+    report: Dict[str, Dict[str, List[str]]] = {}
+    for collection_name, plans in plan_indexes().items():
+        collection = database[collection_name]
+        status = report.setdefault(collection_name, {"created": [], "existing": [], "dropped": []})
+        try:
+            existing = await collection.list_indexes().to_list(length=None)
+        except Exception as e:
+            logger.warning(f"⚠️ Index planner could not list indexes of {collection_name}: {e}")
+            continue
+
+        existing_keys = {
+            index["name"]: tuple((key, int(direction)) for key, direction in index.get("key", {}).items())
+            for index in existing
+        }
+        wanted = {plan.name for plan in plans}
+
+        for plan in plans:
+            satisfied_by = next(
+                (name for name, keys in existing_keys.items() if _satisfies(plan.keys, keys)), None
+            )
+            if satisfied_by:
+                status["existing"].append(satisfied_by)
+                continue
+            try:
+                await collection.create_index(list(plan.keys), name=plan.name)
+                status["created"].append(plan.name)
+                logger.info(f"✅ Index planner created {collection_name}.{plan.name} for {plan.shapes}")
+            except Exception as e:
+                logger.warning(f"⚠️ Index planner failed to create {collection_name}.{plan.name}: {e}")
+
+        if drop_stale:
+            for name in existing_keys:
+                if name.startswith(INDEX_PREFIX) and name not in wanted and name not in status["existing"]:
+                    try:
+                        await collection.drop_index(name)
+                        status["dropped"].append(name)
+                        logger.info(f"🗑️ Index planner dropped unused index {collection_name}.{name}")
+                    except Exception as e:
+                        logger.warning(f"⚠️ Index planner failed to drop {collection_name}.{name}: {e}")
+    return report
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Flatten an explain() plan tree into its stages"""
+    stages = [plan]
+    for child_key in ("inputStage", "queryPlan"):
+        if isinstance(plan.get(child_key), dict):
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get("inputStages", []) or []:
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def explain_shape(database, shape: QueryShape, query_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Run explain() for a shape and summarise the winning plan"""
+    command: Dict[str, Any] = {"find": shape.collection, "filter": query_filter or shape.sample_filter()}
+    if shape.sort:
+        command["sort"] = dict(shape.sort)
+    explained = await database.command({"explain": command, "verbosity": "queryPlanner"})
+
+    winning = explained.get("queryPlanner", {}).get("winningPlan", {})
+    stages = _plan_stages(winning)
+    stage_names = [stage.get("stage") for stage in stages if stage.get("stage")]
+    index_names = [stage.get("indexName") for stage in stages if stage.get("indexName")]
+    return {
+        "shape": shape.name,
+        "collection": shape.collection,
+        "stages": stage_names,
+        "indexes": index_names,
+        "collscan": "COLLSCAN" in stage_names,
+        "in_memory_sort": "SORT" in stage_names,
+    }
+
+
+async def verify_query_shapes(database, collection: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """Explain every registered shape; logs a warning for each COLLSCAN"""
+    load_query_shapes()
+    results: Dict[str, Dict[str, Any]] = {}
+    for shape in get_query_shapes(collection):
+        try:
+            results[shape.name] = await explain_shape(database, shape)
+            if results[shape.name]["collscan"]:
+                logger.warning(f"⚠️ Query shape {shape.name} ({shape.owner or 'unknown'}) runs a COLLSCAN")
+        except Exception as e:
+            results[shape.name] = {"shape": shape.name, "error": str(e)}
+    return results
+
+
+__all__ = [
+    "QueryShape", "IndexPlan", "QUERY_SHAPE_MODULES", "register_query_shape", "get_query_shapes",
+    "load_query_shapes", "plan_indexes", "apply_index_plan", "explain_shape", "verify_query_shapes",
+]
@@ -0,0 +1,225 @@
+"""
+In-process latency digests
+HTTP request latency (per route template, from the logging middleware) and
+MongoDB command latency (per command + collection, from a PyMongo command
+listener) are recorded into t-digests. Once a minute the digests are swapped
+out and written to performance_metrics as one mergeable document per key, so
+percentiles for any period come from merging digests instead of storing a row
+per request.
+"""
+import asyncio
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .settings import get_settings
+from .sketches import TDigest
+
+try:
+    from pymongo import monitoring
+
+    PYMONGO_MONITORING_AVAILABLE = True
+except ImportError:
+    PYMONGO_MONITORING_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+METRIC_TYPE = "latency_digest"
+KIND_HTTP = "http"
+KIND_DB = "db"
+
+# Handshake / session housekeeping is not application work
+IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "endSessions",
+    "saslStart", "saslContinue", "getMore", "killCursors", "getnonce"
+}
+
+
+class _Series:
+    """Latency digest plus request counters for one key within a flush window"""
+    __slots__ = ("digest", "errors", "sum_ms")
+
+    def __init__(self):
+        self.digest = TDigest()
+        self.errors = 0
+        self.sum_ms = 0.0
+
+
+class LatencyRecorder:
+    """Thread-safe per-key latency digests, flushed to performance_metrics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, str], _Series] = {}
+        self._window_start = datetime.utcnow()
+        self.metrics = {"recorded": 0, "flushes": 0, "documents_written": 0, "flush_errors": 0}
+
+    def record(self, kind: str, name: str, seconds: float, error: bool = False):
+        milliseconds = seconds * 1000.0
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None:
+                series = self._series[(kind, name)] = _Series()
+            series.digest.add(milliseconds)
+            series.sum_ms += milliseconds
+            if error:
+                series.errors += 1
+            self.metrics["recorded"] += 1
+
+    def drain(self) -> Tuple[datetime, Dict[Tuple[str, str], _Series]]:
+        """Swap out the current window (recording continues into a fresh one)"""
+        with self._lock:
+            series, self._series = self._series, {}
+            window_start, self._window_start = self._window_start, datetime.utcnow()
+        return window_start, series
+
+    @staticmethod
+    def to_documents(window_start: datetime, series: Dict[Tuple[str, str], _Series]) -> List[Dict[str, Any]]:
+        timestamp = window_start.replace(second=0, microsecond=0)
+        return [
+            {
+                "timestamp": timestamp,
+                "metric_type": METRIC_TYPE,
+                "kind": kind,
+                "name": name,
+                "count": int(entry.digest.count),
+                "errors": entry.errors,
+                "sum_ms": round(entry.sum_ms, 3),
+                "min_ms": round(entry.digest.min, 3),
+                "max_ms": round(entry.digest.max, 3),
+                "digest": entry.digest.to_bytes()
+            }
+            for (kind, name), entry in series.items()
+            if entry.digest.count
+        ]
+
+    async def flush(self, database) -> int:
+        """Write the drained window; returns the number of digest documents"""
+        window_start, series = self.drain()
+        documents = self.to_documents(window_start, series)
+        if not documents:
+            return 0
+        try:
+            await database.performance_metrics.insert_many(documents, ordered=False)
+            self.metrics["flushes"] += 1
+            self.metrics["documents_written"] += len(documents)
+            return len(documents)
+        except Exception as e:
+            self.metrics["flush_errors"] += 1
+            logger.warning(f"⚠️ Latency digest flush failed ({len(documents)} digests dropped): {e}")
+            return 0
+
+
+latency_recorder = LatencyRecorder()
+
+
+# =============================================================================
+# DATABASE COMMAND LATENCY
+# =============================================================================
+
+if PYMONGO_MONITORING_AVAILABLE:
+    class DatabaseLatencyListener(monitoring.CommandListener):
+        """Records MongoDB command durations as '<command> <collection>'"""
+
+        def __init__(self, recorder: LatencyRecorder):
+            self.recorder = recorder
+            self._names: Dict[Tuple[Any, int], str] = {}
+            self._lock = threading.Lock()
+
+        def started(self, event):
+            if event.command_name in IGNORED_COMMANDS:
+                return
+            target = event.command.get(event.command_name)
+            name = f"{event.command_name} {target}" if isinstance(target, str) else event.command_name
+            with self._lock:
+                self._names[(event.connection_id, event.request_id)] = name
+
+        def _finish(self, event, error: bool):
+            with self._lock:
+                name = self._names.pop((event.connection_id, event.request_id), None)
+            if name is not None:
+                self.recorder.record(KIND_DB, name, event.duration_micros / 1_000_000, error)
+
+        def succeeded(self, event):
+            self._finish(event, error=False)
+
+        def failed(self, event):
+            self._finish(event, error=True)
+
+
+_listener_installed = False
+
+
+def install_db_latency_listener():
+    """Register the command listener; must run before MongoDB clients are created"""
+    global _listener_installed
+    if _listener_installed or not PYMONGO_MONITORING_AVAILABLE or not get_settings().latency_tracking_enabled:
+        return
+    monitoring.register(DatabaseLatencyListener(latency_recorder))
+    _listener_installed = True
+
+
+# =============================================================================
+# HTTP REQUEST LATENCY
+# =============================================================================
+
+def record_request(request, status_code: int, seconds: float):
+    """Record one HTTP request under its route template (not the raw URL)"""
+    if not get_settings().latency_tracking_enabled:
+        return
+    route = request.scope.get("route")
+    path = getattr(route, "path", None) or "unmatched"
+    latency_recorder.record(KIND_HTTP, f"{request.method} {path}", seconds, error=status_code >= 500)
+
+
+# =============================================================================
+# FLUSHER
+# =============================================================================
+
+_flusher_task: Optional[asyncio.Task] = None
+
+
+async def _flush_loop(get_db, interval: int):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            database = await get_db()
+            if database is not None:
+                await latency_recorder.flush(database)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Latency flusher error: {e}")
+
+
+def start_latency_flusher(get_db):
+    """Start the per-interval digest flusher (idempotent)"""
+    global _flusher_task
+    settings = get_settings()
+    if not settings.latency_tracking_enabled:
+        return
+    if _flusher_task is not None and not _flusher_task.done():
+        return
+    _flusher_task = asyncio.create_task(_flush_loop(get_db, settings.latency_flush_interval_seconds))
+    logger.info(f"⏱️ Latency digests flushed every {settings.latency_flush_interval_seconds}s")
+
+
+async def stop_latency_flusher(database=None):
+    """Stop the flusher and write the partial window"""
+    global _flusher_task
+    if _flusher_task is not None:
+        _flusher_task.cancel()
+        try:
+            await _flusher_task
+        except asyncio.CancelledError:
+            pass
+        _flusher_task = None
+    if database is not None:
+        await latency_recorder.flush(database)
+
+
+__all__ = [
+    "latency_recorder", "LatencyRecorder", "record_request", "install_db_latency_listener",
+    "start_latency_flusher", "stop_latency_flusher", "METRIC_TYPE", "KIND_HTTP", "KIND_DB",
+]
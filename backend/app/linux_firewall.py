@@ -1,6 +1,8 @@
 import subprocess
 from fastapi import HTTPException
 from app.firewall_driver import FirewallDriver
+from app.firewall_reconciler import parse_iptables_save
+from app.firewall_ruleset import IptablesRestoreApplier, FirewallApplyError, TABLE
 
 day_mapping = ["MO","TU","WE","TH","FR","SA","SU"]
 
@@ -22,6 +24,14 @@ def build_time_params(rule):
     return time_params
 
 class LinuxFirewall(FirewallDriver):
+    def __init__(self, applier: IptablesRestoreApplier = None):
+        self.applier = applier or IptablesRestoreApplier()
+
+    def apply_ruleset(self, rules, groups=None):
+        # Tüm kurallar tek bir iptables-restore --noflush çağrısı ile atomik olarak uygulanır
+        # (grup kuralları kendi zincirlerine, grup açıkken tek bir jump ile bağlanır)
+        return self.applier.apply(rules, groups)
+
     def add_rule(self, rule):
         chain = "INPUT" if rule["direction"].upper() == "IN" else "OUTPUT"
         if rule["action"].upper() == "ALLOW":
@@ -80,8 +90,20 @@ class LinuxFirewall(FirewallDriver):
             raise HTTPException(400, f"Linux firewall add rule error: {res.stderr.strip()}")
 
     def remove_rule(self, rule_name):
-        # iptables -D ... vs. (henüz tam uygulanmadı)
-        pass
+        # Kurala ait tüm satırlar (tekil eklenenler: comment = rule_name, toplu uygulananlar:
+        # kobi:<id>/<digest>) iptables-save çıktısından bulunur ve tek işlemde silinir
+        try:
+            live = parse_iptables_save(self.applier.save())
+            lines = []
+            for chain, rules in live.chains.items():
+                doomed = [index for index, rule in enumerate(rules)
+                          if rule.comment == rule_name or rule.owner[0] == rule_name]
+                # Alttan silinir ki kalan satır numaraları geçerli kalsın
+                lines += [f"-D {chain} {index + 1}" for index in reversed(doomed)]
+            if lines:
+                self.applier.restore("\n".join([f"*{TABLE}"] + lines + ["COMMIT"]) + "\n")
+        except FirewallApplyError as e:
+            raise HTTPException(400, f"Linux firewall remove rule error: {e}")
 
     def update_rule(self, old_rule, new_rule):
         self.remove_rule(old_rule["rule_name"])
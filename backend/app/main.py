@@ -18,7 +18,15 @@ import time
 
 # Import existing configurations - ENHANCED
 from .config import settings  # Updated settings import
-from .database import client, db
+from .database import client, db, db_manager
+from .latency import record_request, start_latency_flusher, stop_latency_flusher
+from .traffic_analytics import start_traffic_producer, stop_traffic_producer
+from .tasks.firewall_sync import (
+    start_firewall_reconciler, stop_firewall_reconciler, start_hit_counter_collector, stop_hit_counter_collector,
+    start_firewall_sync_worker, stop_firewall_sync_worker
+)
+from .tasks.blocklist import start_blocklist, stop_blocklist
+from .tasks.cleanup import start_retention_sweeper, stop_retention_sweeper
 from .dependencies import get_current_user, get_database
 
 
@@ -163,7 +171,7 @@ async def initialize_database():
             'users', 'system_config', 'firewall_rules', 'firewall_groups',
             'network_interfaces', 'static_routes', 'blocked_domains',
             'system_logs', 'network_activity', 'security_alerts',
-            'nat_config', 'dns_proxy_config'
+            'nat_config', 'dns_proxy_config', 'firewall_blocklist'
         ]
 
         existing_collections = await db.list_collection_names()
@@ -286,6 +294,9 @@ async def initialize_database():
                 if "already exists" not in str(e).lower():
                     logger.warning(f"System logs source index: {e}")
 
+            # Compound indexes for the query shapes declared by services
+            await db_manager.apply_index_plan(db)
+
             logger.info("✅ Database indexes created successfully")
 
         except Exception as index_error:
@@ -295,6 +306,39 @@ async def initialize_database():
         logger.error(f"❌ Database initialization failed: {str(e)}")
 
 
+async def start_reports():
+    """Reports service, snapshot materializer and scheduler (the reports module is optional, so import lazily)"""
+    try:
+        from .services.reports_service import reports_service
+        from .tasks.report_materializer import start_report_materializer
+        from .tasks.report_scheduler import start_report_scheduler
+    except Exception as e:
+        logger.warning(f"⚠️ [STARTUP] Reports service not available: {e}")
+        return
+    try:
+        await reports_service.initialize()
+        # Fail jobs a restart interrupted and remove expired artifacts
+        await reports_service.jobs.recover()
+        await start_report_materializer()
+        await start_report_scheduler()
+        logger.info("✅ [STARTUP] Reports service initialized")
+    except Exception as e:
+        logger.error(f"❌ [STARTUP] Reports service initialization failed: {e}")
+
+
+async def stop_reports():
+    try:
+        from .services.reports_service import reports_service
+        from .tasks.report_materializer import stop_report_materializer
+        from .tasks.report_scheduler import stop_report_scheduler
+    except Exception:
+        return
+    await stop_report_scheduler()
+    await stop_report_materializer()
+    # Render worker processes
+    reports_service.jobs.shutdown()
+
+
 # Lifespan context manager for startup and shutdown events
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -317,6 +361,30 @@ async def lifespan(app: FastAPI):
         # Create admin user
         await create_admin_user()
 
+        # delete_many retention where the server does not expire metric collections
+        start_retention_sweeper(db_manager.get_database, native_expiry=not db_manager.uses_sqlite)
+
+        # Per-minute latency digests -> performance_metrics
+        start_latency_flusher(db_manager.get_database)
+
+        # Interface counter deltas + flow records -> traffic_analytics
+        start_traffic_producer(db_manager.get_database)
+
+        # Serialized OS firewall changes (one compiled apply per burst)
+        start_firewall_sync_worker()
+
+        # Kernel ruleset <-> firewall_rules drift repair (startup + rule changes)
+        start_firewall_reconciler(db_manager.get_database)
+
+        # Kernel rule counters -> firewall_rules.hit_count + firewall_rule_hits
+        start_hit_counter_collector(db_manager.get_database)
+
+        # Dynamic blocklist: firewall_blocklist -> kernel sets, queued bans written in batches
+        start_blocklist(db_manager.get_database)
+
+        # Reports: collections, templates, dashboard snapshot materializer and report scheduler
+        await start_reports()
+
         # Log startup completion
         startup_time = time.time() - startup_start
         logger.info(f"✅ [STARTUP] KOBI Firewall started successfully in {startup_time:.2f}s")
@@ -342,6 +410,17 @@ async def lifespan(app: FastAPI):
     # Shutdown
     logger.info("🔄 [SHUTDOWN] Shutting down KOBI Firewall...")
     try:
+        # Write the partial latency window, flush batched telemetry and seal the
+        # disk spool before closing clients
+        await stop_reports()
+        await stop_latency_flusher(db_manager.database)
+        await stop_traffic_producer(db_manager.database)
+        await stop_firewall_reconciler()
+        await stop_hit_counter_collector()
+        await stop_blocklist(db_manager.database)
+        await stop_firewall_sync_worker()
+        await stop_retention_sweeper()
+        await db_manager.disconnect()
         client.close()
         logger.info("✅ [SHUTDOWN] Database disconnected")
     except Exception as e:
@@ -466,6 +545,7 @@ async def logging_middleware(request: Request, call_next):
 
         # Calculate processing time
         process_time = time.time() - start_time
+        record_request(request, response.status_code, process_time)
 
         # Log response
         status_code = response.status_code
@@ -483,6 +563,7 @@ async def logging_middleware(request: Request, call_next):
 
     except Exception as e:
         process_time = time.time() - start_time
+        record_request(request, 500, process_time)
         logger.error(f"❌ [ERROR] Request failed: {str(e)} - {process_time:.4f}s - {method} {url}")
         raise
 
@@ -159,7 +159,8 @@ class LoggingMiddleware(BaseHTTPMiddleware):
             "message": f"{request_log['method']} {request_log['path']} - {response_log.get('status_code', 'ERROR')}"
         }
 
-        await db_manager.database.system_logs.insert_one(log_entry)
+        # Telemetry class: buffered and flushed with insert_many
+        await db_manager.insert_document("system_logs", log_entry)
 
 class ErrorHandlerMiddleware(BaseHTTPMiddleware):
     """Global error handling middleware"""
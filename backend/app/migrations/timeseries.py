@@ -0,0 +1,127 @@
+"""
+Migration: convert metric collections to MongoDB time-series collections
+Each legacy collection is renamed aside, the time-series collection is created
+with its spec, documents are copied over in batches (reshaped for nested
+metaFields) and the legacy copy is dropped unless --keep-legacy is given.
+Interface counters are moved out of network_activity into interface_stats.
+
+    python -m app.migrations.timeseries [--keep-legacy] [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List
+
+from ..settings import get_settings
+from ..timeseries import (
+    TIME_FIELD, TIMESERIES_COLLECTIONS, TimeSeriesSpec,
+    get_collection_info, to_timeseries_document,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 1000
+
+
+async def _copy_documents(source, target_name: str, target, query: Dict[str, Any]) -> Dict[str, int]:
+    """Copy documents in time order; documents without a datetime timestamp are skipped"""
+    copied = skipped = 0
+    batch: List[Dict[str, Any]] = []
+
+    async for document in source.find(query).sort(TIME_FIELD, 1):
+        if not isinstance(document.get(TIME_FIELD), datetime):
+            skipped += 1
+            continue
+        batch.append(to_timeseries_document(target_name, document))
+        if len(batch) >= BATCH_SIZE:
+            await target.insert_many(batch, ordered=False)
+            copied += len(batch)
+            batch = []
+
+    if batch:
+        await target.insert_many(batch, ordered=False)
+        copied += len(batch)
+
+    return {"copied": copied, "skipped": skipped}
+
+
+async def migrate_collection(database, spec: TimeSeriesSpec, keep_legacy: bool = False,
+                             dry_run: bool = False) -> Dict[str, Any]:
+    """Convert one regular collection into a time-series collection"""
+    info = await get_collection_info(database, spec.name)
+    if info is not None and info.get("type") == "timeseries":
+        return {"status": "already_timeseries"}
+
+    if info is None:
+        if not dry_run:
+            await database.create_collection(spec.name, **spec.create_options)
+        return {"status": "created"}
+
+    count = await database[spec.name].count_documents({})
+    if dry_run:
+        return {"status": "would_migrate", "documents": count}
+
+    legacy_name = f"{spec.name}_legacy_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}"
+    await database[spec.name].rename(legacy_name)
+    await database.create_collection(spec.name, **spec.create_options)
+    logger.info(f"🔄 Migrating {count} documents: {legacy_name} → {spec.name}")
+
+    result = await _copy_documents(database[legacy_name], spec.name, database[spec.name], {})
+
+    if not keep_legacy:
+        await database.drop_collection(legacy_name)
+    return {"status": "migrated", "legacy_collection": None if not keep_legacy else legacy_name, **result}
+
+
+async def migrate_interface_stats(database, dry_run: bool = False) -> Dict[str, Any]:
+    """Move interface counter samples from network_activity into interface_stats"""
+    query = {"event_type": "interface_stats"}
+    count = await database.network_activity.count_documents(query)
+    if dry_run or count == 0:
+        return {"status": "would_migrate" if dry_run else "nothing_to_move", "documents": count}
+
+    result = await _copy_documents(database.network_activity, "interface_stats", database.interface_stats, query)
+    await database.network_activity.delete_many(query)
+    return {"status": "moved", **result}
+
+
+async def migrate_to_timeseries(database, keep_legacy: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    """Run the full migration; safe to re-run (converted collections are skipped)"""
+    results: Dict[str, Any] = {}
+    for name, spec in TIMESERIES_COLLECTIONS.items():
+        try:
+            results[name] = await migrate_collection(database, spec, keep_legacy, dry_run)
+            logger.info(f"✅ {name}: {results[name]}")
+        except Exception as e:
+            results[name] = {"status": "error", "error": str(e)}
+            logger.error(f"❌ Time-series migration failed for {name}: {e}")
+
+    try:
+        results["network_activity.interface_stats"] = await migrate_interface_stats(database, dry_run)
+    except Exception as e:
+        results["network_activity.interface_stats"] = {"status": "error", "error": str(e)}
+        logger.error(f"❌ Interface stats migration failed: {e}")
+    return results
+
+
+async def main(keep_legacy: bool, dry_run: bool):
+    import motor.motor_asyncio
+
+    settings = get_settings()
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.mongodb_url)
+    try:
+        results = await migrate_to_timeseries(client[settings.database_name], keep_legacy, dry_run)
+        for name, result in results.items():
+            print(f"  {name:<36} {result}")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert metric collections to time-series collections")
+    parser.add_argument("--keep-legacy", action="store_true", help="Keep the renamed legacy collections")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    args = parser.parse_args()
+    asyncio.run(main(args.keep_legacy, args.dry_run))
@@ -139,6 +139,7 @@ class FirewallGroup(BaseDbModel):
     group_name: str = Field(..., min_length=1, max_length=100)
     description: Optional[str] = Field(None, max_length=500)
     enabled: bool = True
+    priority: int = Field(default=100, ge=1, le=1000)
     rule_count: int = 0
     tags: List[str] = Field(default_factory=list)
 
@@ -0,0 +1,431 @@
+"""
+nftables firewall driver
+Rules live in their own `inet kobi` table. Address lists compile into named
+interval sets (one per rule and family), port lists into anonymous sets, and
+blocking verdicts jump to shared log chains. Consecutive rules that differ
+only in source addresses and verdict are folded into one interval verdict map,
+so a long allow/deny list costs a single lookup instead of one rule each.
+Group rules go to a regular chain per group (g_<key>_in / g_<key>_out) that the
+hook chain jumps to while the group is enabled.
+The full ruleset is applied with one `nft -f` transaction; the generated text
+is returned by compile_nft_ruleset so it can be inspected and tested as-is.
+"""
+import hashlib
+import ipaddress
+import json
+import logging
+import subprocess
+from bisect import bisect_right, insort
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from app.firewall_driver import FirewallDriver
+from app.firewall_optimizer import expand_merged, prepare_ruleset
+from app.firewall_ruleset import (
+    FirewallGroupSpec, FirewallRuleSpec, ChainLayout, CompiledRuleset, FirewallApplyError, COMMENT_TAG, LOG_PREFIX,
+    layout_rules, normalize_groups, normalize_rule, parse_comment
+)
+
+logger = logging.getLogger(__name__)
+
+NFT_FAMILY = "inet"
+NFT_TABLE = "kobi"
+HOOK_CHAINS = {"IN": "input", "OUT": "output"}
+INTERFACE_KEYS = {"IN": "iifname", "OUT": "oifname"}
+LOG_CHAINS = {"DROP": "log_drop", "REJECT": "log_reject"}
+ADDRESS_TYPES = {4: "ipv4_addr", 6: "ipv6_addr"}
+ADDRESS_KEYWORDS = {4: "ip", 6: "ip6"}
+ICMP_PROTOCOLS = {4: "icmp", 6: "ipv6-icmp", None: "{ icmp, ipv6-icmp }"}
+GROUP_CHAIN_PREFIX = "g_"
+NFT_WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+Network = Any  # ipaddress.IPv4Network | ipaddress.IPv6Network
+
+
+def rule_set_prefix(rule_id: str) -> str:
+    """Stable, nft-safe name prefix for the sets owned by one rule"""
+    return "r" + hashlib.sha1(rule_id.encode()).hexdigest()[:12]
+
+
+def group_chain(group: FirewallGroupSpec, direction: str) -> str:
+    return f"{GROUP_CHAIN_PREFIX}{group.key}_{HOOK_CHAINS[direction]}"
+
+
+def group_jump_line(group: FirewallGroupSpec, direction: str) -> str:
+    return f'jump {group_chain(group, direction)} comment "{group.comment}"'
+
+
+def _verdict(spec: FirewallRuleSpec) -> str:
+    if spec.target == "ACCEPT":
+        return "accept"
+    return f"jump {LOG_CHAINS[spec.target]}"
+
+
+def _by_family(networks: Sequence[str]) -> Dict[int, List[Network]]:
+    families: Dict[int, List[Network]] = {}
+    for text in networks:
+        network = ipaddress.ip_network(text)
+        families.setdefault(network.version, []).append(network)
+    return {family: list(ipaddress.collapse_addresses(members)) for family, members in families.items()}
+
+
+def address_families(spec: FirewallRuleSpec) -> List[Tuple[Optional[int], List[Network], List[Network]]]:
+    """(family, sources, destinations) per address family the rule can match; family None = any"""
+    if not spec.sources and not spec.destinations:
+        return [(None, [], [])]
+    sources, destinations = _by_family(spec.sources), _by_family(spec.destinations)
+    result = []
+    for family in (4, 6):
+        family_sources, family_destinations = sources.get(family, []), destinations.get(family, [])
+        if (spec.sources and not family_sources) or (spec.destinations and not family_destinations):
+            continue
+        result.append((family, family_sources, family_destinations))
+    return result
+
+
+def _port_text(port_range: Tuple[int, int]) -> str:
+    low, high = port_range
+    return str(low) if low == high else f"{low}-{high}"
+
+
+def _port_set(ranges: Sequence[Tuple[int, int]]) -> str:
+    if len(ranges) == 1:
+        return _port_text(ranges[0])
+    return "{ " + ", ".join(_port_text(item) for item in ranges) + " }"
+
+
+def protocol_matches(spec: FirewallRuleSpec, family: Optional[int]) -> List[str]:
+    if spec.protocol == "icmp":
+        return [f"meta l4proto {ICMP_PROTOCOLS[family]}"]
+    if not spec.source_ports and not spec.destination_ports:
+        return [] if spec.protocol == "any" else [f"meta l4proto {spec.protocol}"]
+
+    if spec.protocol == "any":
+        parts, header = ["meta l4proto { tcp, udp }"], "th"
+    else:
+        parts, header = [], spec.protocol
+    if spec.source_ports:
+        parts.append(f"{header} sport {_port_set(spec.source_ports)}")
+    if spec.destination_ports:
+        parts.append(f"{header} dport {_port_set(spec.destination_ports)}")
+    return parts
+
+
+def schedule_matches(spec: FirewallRuleSpec) -> List[str]:
+    if not spec.schedule:
+        return []
+    parts = [f'meta hour "{spec.schedule[0]}"-"{spec.schedule[1]}"']
+    if spec.days_of_week:
+        days = [f'"{NFT_WEEKDAYS[day]}"' for day in spec.days_of_week]
+        parts.append(f"meta day {days[0]}" if len(days) == 1 else "meta day { " + ", ".join(days) + " }")
+    return parts
+
+
+@dataclass
+class NftSet:
+    """A named interval set, or an interval verdict map when verdicts are given"""
+    name: str
+    family: int
+    elements: List[str]
+    verdicts: Optional[List[str]] = None
+
+    @property
+    def kind(self) -> str:
+        return "set" if self.verdicts is None else "map"
+
+    def _element_text(self) -> str:
+        if self.verdicts is None:
+            return ", ".join(self.elements)
+        return ", ".join(f"{element} : {verdict}" for element, verdict in zip(self.elements, self.verdicts))
+
+    def declaration(self) -> List[str]:
+        kind = self.kind
+        key_type = ADDRESS_TYPES[self.family] + ("" if self.verdicts is None else " : verdict")
+        lines = [f"{kind} {self.name} {{", f"\ttype {key_type}", "\tflags interval"]
+        if self.verdicts is not None:
+            lines.append("\tcounter")
+        lines += [f"\telements = {{ {self._element_text()} }}", "}"]
+        return lines
+
+    def commands(self) -> List[str]:
+        """Idempotent add/flush/fill commands for incremental updates"""
+        kind = self.kind
+        key_type = ADDRESS_TYPES[self.family] + ("" if self.verdicts is None else " : verdict")
+        target = f"{NFT_FAMILY} {NFT_TABLE} {self.name}"
+        return [
+            f"add {kind} {target} {{ type {key_type}; flags interval; }}",
+            f"flush {kind} {target}",
+            f"add element {target} {{ {self._element_text()} }}",
+        ]
+
+
+class _Intervals:
+    """Non-overlapping integer intervals with O(log n) overlap checks"""
+
+    def __init__(self):
+        self._starts: List[int] = []
+        self._ends: Dict[int, int] = {}
+
+    def overlaps(self, start: int, end: int) -> bool:
+        index = bisect_right(self._starts, end) - 1
+        return index >= 0 and self._ends[self._starts[index]] >= start
+
+    def add(self, start: int, end: int):
+        insort(self._starts, start)
+        self._ends[start] = end
+
+
+def _span(network: Network) -> Tuple[int, int]:
+    return int(network.network_address), int(network.broadcast_address)
+
+
+class NftRulesetBuilder:
+    """Collects sets, maps and chain rules for one compilation"""
+
+    def __init__(self, merge_verdict_maps: bool = True):
+        self.merge_verdict_maps = merge_verdict_maps
+        self.sets: Dict[str, NftSet] = {}
+        self.chains: Dict[str, List[str]] = {direction: [] for direction in HOOK_CHAINS}
+        self.merged: Dict[str, List[str]] = {}
+
+    def address_ref(self, spec: FirewallRuleSpec, role: str, family: int, networks: List[Network]) -> str:
+        if len(networks) == 1:
+            return str(networks[0])
+        # The digest keeps set names content-addressed, so a changed list is a new set
+        name = f"{rule_set_prefix(spec.rule_id)}_{spec.digest}_{role}{family}"
+        self.sets.setdefault(name, NftSet(name, family, [str(network) for network in networks]))
+        return "@" + name
+
+    def _common_matches(self, spec: FirewallRuleSpec, direction: str, family: Optional[int],
+                        destinations: List[Network]) -> List[str]:
+        parts = []
+        if spec.interface:
+            parts.append(f'{INTERFACE_KEYS[direction]} "{spec.interface}"')
+        if destinations:
+            parts.append(f"{ADDRESS_KEYWORDS[family]} daddr {self.address_ref(spec, 'd', family, destinations)}")
+        return parts + protocol_matches(spec, family) + schedule_matches(spec)
+
+    def rule_line(self, spec: FirewallRuleSpec, direction: str, family: Optional[int],
+                  sources: List[Network], destinations: List[Network]) -> str:
+        parts = []
+        if sources:
+            parts.append(f"{ADDRESS_KEYWORDS[family]} saddr {self.address_ref(spec, 's', family, sources)}")
+        parts += self._common_matches(spec, direction, family, destinations)
+        parts += ["counter", _verdict(spec), f'comment "{spec.comment}"']
+        return " ".join(parts)
+
+    def _map_line(self, run: List[Tuple[FirewallRuleSpec, int, List[Network], List[Network]]],
+                  direction: str, chain: Optional[str] = None) -> str:
+        spec, family, _, destinations = run[0]
+        elements, verdicts = [], []
+        for member, _, sources, _ in run:
+            for network in sources:
+                elements.append(str(network))
+                verdicts.append(_verdict(member))
+        parts = self._common_matches(spec, direction, family, destinations)
+        # Group chains add their name, so equal runs in two chains stay separate maps
+        content = repr((direction, family, parts, elements, verdicts) + ((chain,) if chain else ())).encode()
+        name = f"v_{HOOK_CHAINS[direction]}{family}_{hashlib.sha1(content).hexdigest()[:12]}"
+        self.sets[name] = NftSet(name, family, elements, verdicts)
+        self.merged[name] = [member.rule_id for member, _, _, _ in run]
+
+        parts += ["counter", f"{ADDRESS_KEYWORDS[family]} saddr vmap @{name}", f'comment "{COMMENT_TAG}@{name}"']
+        return " ".join(parts)
+
+    @staticmethod
+    def _shape(spec: FirewallRuleSpec, family: Optional[int], destinations: List[Network]) -> Tuple:
+        return (family, spec.interface, spec.protocol, spec.source_ports, spec.destination_ports,
+                tuple(destinations), spec.schedule, spec.days_of_week)
+
+    def add_direction(self, direction: str, specs: Iterable[Union[FirewallRuleSpec, FirewallGroupSpec]],
+                      chain: Optional[str] = None):
+        """
+        Emit the rules of one hook chain (or of a group chain when chain is
+        given), folding source-only runs into verdict maps; groups among
+        specs become jumps into their chains
+        """
+        lines = self.chains.setdefault(chain or direction, [])
+        run: List[Tuple[FirewallRuleSpec, int, List[Network], List[Network]]] = []
+        run_shape, run_intervals = None, _Intervals()
+
+        def flush_run():
+            if len(run) > 1:
+                lines.append(self._map_line(run, direction, chain))
+            elif run:
+                spec, family, sources, destinations = run[0]
+                lines.append(self.rule_line(spec, direction, family, sources, destinations))
+            run.clear()
+
+        for spec in specs:
+            if isinstance(spec, FirewallGroupSpec):
+                flush_run()
+                lines.append(group_jump_line(spec, direction))
+                continue
+            if direction not in spec.directions:
+                continue
+            for family, sources, destinations in address_families(spec):
+                mergeable = self.merge_verdict_maps and family is not None and bool(sources)
+                if mergeable:
+                    shape = self._shape(spec, family, destinations)
+                    spans = [_span(network) for network in sources]
+                    if run and shape == run_shape and not any(run_intervals.overlaps(*span) for span in spans):
+                        run.append((spec, family, sources, destinations))
+                        for span in spans:
+                            run_intervals.add(*span)
+                        continue
+                    flush_run()
+                    run.append((spec, family, sources, destinations))
+                    run_shape, run_intervals = shape, _Intervals()
+                    for span in spans:
+                        run_intervals.add(*span)
+                    continue
+                flush_run()
+                lines.append(self.rule_line(spec, direction, family, sources, destinations))
+        flush_run()
+
+    def add_layout(self, layout: ChainLayout):
+        """Hook chains plus every group chain; chains maps group chain names to their rules too"""
+        for direction in HOOK_CHAINS:
+            self.add_direction(direction, layout.base_entries(direction))
+            for group, rules in layout.group_chains(direction):
+                self.add_direction(direction, rules, group_chain(group, direction))
+
+    def group_chain_names(self) -> List[str]:
+        return [name for name in self.chains if name not in HOOK_CHAINS]
+
+
+def log_chain_rules() -> Dict[str, str]:
+    return {
+        LOG_CHAINS["DROP"]: f'log prefix "{LOG_PREFIX}" drop',
+        LOG_CHAINS["REJECT"]: f'log prefix "{LOG_PREFIX}" reject',
+    }
+
+
+def hook_definition(direction: str) -> str:
+    return f"type filter hook {HOOK_CHAINS[direction]} priority filter; policy accept;"
+
+
+def compile_nft_ruleset(specs: Sequence[FirewallRuleSpec], skipped: Optional[List[Tuple[str, str]]] = None,
+                        merge_verdict_maps: bool = True,
+                        groups: Optional[Dict[str, FirewallGroupSpec]] = None) -> CompiledRuleset:
+    """Render the `inet kobi` table as one `nft -f` transaction that replaces it atomically"""
+    builder = NftRulesetBuilder(merge_verdict_maps)
+    builder.add_layout(layout_rules(specs, groups))
+
+    lines = [f"table {NFT_FAMILY} {NFT_TABLE}", f"delete table {NFT_FAMILY} {NFT_TABLE}",
+             f"table {NFT_FAMILY} {NFT_TABLE} {{"]
+    for declared in builder.sets.values():
+        lines += ["\t" + line for line in declared.declaration()]
+    for chain, rule in log_chain_rules().items():
+        lines += [f"\tchain {chain} {{", f"\t\t{rule}", "\t}"]
+    # Group chains first, so the hook chains' jumps resolve
+    for chain in builder.group_chain_names():
+        lines += [f"\tchain {chain} {{"] + ["\t\t" + rule for rule in builder.chains[chain]] + ["\t}"]
+    for direction, chain in HOOK_CHAINS.items():
+        lines += [f"\tchain {chain} {{", f"\t\t{hook_definition(direction)}"]
+        lines += ["\t\t" + rule for rule in builder.chains[direction]]
+        lines.append("\t}")
+    lines.append("}")
+
+    return CompiledRuleset(
+        "\n".join(lines) + "\n",
+        rules=len(specs),
+        kernel_rules=sum(len(rules) for rules in builder.chains.values()),
+        skipped=list(skipped or []),
+        merged=builder.merged,
+    )
+
+
+def _incremental_commands(spec: FirewallRuleSpec) -> List[str]:
+    """Commands that add one rule to the live table without touching the rest"""
+    table = f"{NFT_FAMILY} {NFT_TABLE}"
+    commands = [f"add table {table}"]
+    for chain, rule in log_chain_rules().items():
+        commands += [f"add chain {table} {chain}", f"flush chain {table} {chain}", f"add rule {table} {chain} {rule}"]
+    for direction, chain in HOOK_CHAINS.items():
+        commands.append(f"add chain {table} {chain} {{ {hook_definition(direction)} }}")
+
+    builder = NftRulesetBuilder(merge_verdict_maps=False)
+    builder.add_direction("IN", [spec])
+    builder.add_direction("OUT", [spec])
+    for declared in builder.sets.values():
+        commands += declared.commands()
+    for direction, chain in HOOK_CHAINS.items():
+        commands += [f"add rule {table} {chain} {rule}" for rule in builder.chains[direction]]
+    return commands
+
+
+class NftablesFirewall(FirewallDriver):
+    """FirewallDriver backed by an nftables table, applied with `nft -f`"""
+
+    def __init__(self, nft_binary: str = "nft",
+                 runner: Callable[..., subprocess.CompletedProcess] = subprocess.run):
+        self.nft_binary = nft_binary
+        self.runner = runner
+
+    def run_script(self, payload: str, check_only: bool = False):
+        """Run an nft script as one transaction (`-c` only checks it)"""
+        args = [self.nft_binary] + (["-c"] if check_only else []) + ["-f", "-"]
+        result = self.runner(args, input=payload, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise FirewallApplyError(f"nft failed: {result.stderr.strip() or result.returncode}")
+
+    def compile(self, rules: Iterable[Dict[str, Any]],
+                group_documents: Optional[Iterable[Dict[str, Any]]] = None) -> CompiledRuleset:
+        groups = normalize_groups(group_documents)
+        specs, skipped, merged = prepare_ruleset(rules, groups)
+        compiled = compile_nft_ruleset(specs, skipped, groups=groups)
+        compiled.merged = expand_merged(compiled.merged, merged)
+        return compiled
+
+    def apply_ruleset(self, rules, groups=None):
+        compiled = self.compile(rules, groups)
+        self.run_script(compiled.payload)
+        for rule_id, reason in compiled.skipped:
+            logger.warning(f"⚠️ Firewall rule {rule_id} not applied: {reason}")
+        logger.info(f"✅ Applied {compiled.rules} firewall rules to nftables ({compiled.kernel_rules} rules, "
+                    f"{len(compiled.merged)} verdict maps)")
+        return compiled
+
+    def list_table(self) -> List[Dict[str, Any]]:
+        """`nft -j -a list table` objects ([] when the table does not exist)"""
+        result = self.runner([self.nft_binary, "-j", "-a", "list", "table", NFT_FAMILY, NFT_TABLE],
+                             capture_output=True, text=True)
+        if result.returncode != 0:
+            return []
+        return json.loads(result.stdout or "{}").get("nftables", [])
+
+    def _removal_commands(self, rule_name: str) -> List[str]:
+        prefix = rule_set_prefix(rule_name) + "_"
+        table = f"{NFT_FAMILY} {NFT_TABLE}"
+        rules, sets = [], []
+        for item in self.list_table():
+            rule = item.get("rule")
+            owner = parse_comment(rule.get("comment")) if rule else None
+            if owner and owner[0] == rule_name:
+                rules.append(f"delete rule {table} {rule['chain']} handle {rule['handle']}")
+            named = item.get("set")
+            if named and named.get("name", "").startswith(prefix):
+                sets.append(f"delete set {table} {named['name']}")
+        return rules + sets  # sets can only go once no rule references them
+
+    def add_rule(self, rule):
+        self.run_script("\n".join(_incremental_commands(normalize_rule(rule))) + "\n")
+
+    def remove_rule(self, rule_name):
+        commands = self._removal_commands(rule_name)
+        if commands:
+            self.run_script("\n".join(commands) + "\n")
+
+    def update_rule(self, old_rule, new_rule):
+        # Removal and re-insertion share one transaction, so the rule is never missing
+        commands = self._removal_commands(old_rule["rule_name"])
+        commands += _incremental_commands(normalize_rule(new_rule))
+        self.run_script("\n".join(commands) + "\n")
+
+
+__all__ = [
+    "NftablesFirewall", "NftRulesetBuilder", "NftSet", "compile_nft_ruleset", "address_families",
+    "rule_set_prefix", "log_chain_rules", "hook_definition", "group_chain", "group_jump_line",
+    "NFT_FAMILY", "NFT_TABLE", "HOOK_CHAINS", "GROUP_CHAIN_PREFIX",
+]
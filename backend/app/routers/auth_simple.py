@@ -16,6 +16,7 @@ import re
 # Import existing database connection
 from ..database import db
 from ..config import settings
+from ..tasks.blocklist import auto_ban
 
 # Logger
 logger = logging.getLogger(__name__)
@@ -170,6 +171,8 @@ class SecurityManager:
         if self.failed_attempts[ip]['count'] >= self.max_login_attempts:
             self.blocked_ips[ip] = datetime.utcnow()
             logger.warning(f"🚫 IP {ip} blocked for {self.lockout_duration_minutes} minutes")
+            # firewall_blocklist_auto_ban açıksa IP çekirdek seviyesinde de engellenir
+            auto_ban(ip, self.lockout_duration_minutes * 60, "login: too many failed attempts")
             return True
 
         return False
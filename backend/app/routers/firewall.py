@@ -1,6 +1,24 @@
-from fastapi import APIRouter, HTTPException
+import asyncio
+import logging
+from bson import ObjectId
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from typing import List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from ..blocklist import protected_networks
+from ..database import get_database
+from ..dependencies import get_current_user, require_admin
+from ..firewall_optimizer import optimize_rules, packet_from_log, replay, rule_hits
+from ..firewall_ruleset import normalize_rules
+from ..rule_matcher import NUMPY_AVAILABLE, matcher_for, normalize_packet, summarize
+from ..schemas import FirewallBlocklistRequest, FirewallRuleCreate, FirewallRuleUpdate, FirewallSimulateRequest
+from ..services import get_firewall_service
+from ..tasks.blocklist import (
+    ban_address, flush_blocklist, get_blocklist, get_blocklist_status, unban_address
+)
+from ..tasks.firewall_sync import get_last_drift_report, get_sync_metrics, reconcile_firewall, request_reconcile
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1/firewall", tags=["Firewall"])
 
@@ -21,4 +39,260 @@ async def get_firewall_rules():
         "success": True,
         "data": [],
         "total": 0
-    }
\ No newline at end of file
+    }
+
+
+@router.post("/rules")
+async def create_firewall_rule(rule: FirewallRuleCreate, current_user=Depends(require_admin)):
+    """Create a rule; overlaps with existing rules are returned as warnings"""
+    rule_data = rule.model_dump()
+    service = get_firewall_service()
+    if service:
+        await service.validate_rule_data(rule_data)
+    database = await get_database()
+    existing_rules = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+    # The service keeps its rule index between calls, so only changed rules are re-indexed
+    conflicts = service.check_rule_conflicts(rule_data, existing_rules) if service and rule.enabled else []
+
+    now = datetime.utcnow()
+    document = {**rule_data, "hit_count": 0, "last_hit": None, "created_at": now, "updated_at": now}
+    result = await database.firewall_rules.insert_one(document)
+    logger.info(f"🛡️ Firewall rule {rule.rule_name} created by {current_user.get('username')}")
+    request_reconcile()
+    return {
+        "success": True,
+        "data": {"id": str(result.inserted_id), **rule_data},
+        "conflicts": conflicts,
+        "timestamp": now.isoformat()
+    }
+
+
+@router.put("/rules/{rule_id}")
+async def update_firewall_rule(rule_id: str, update: FirewallRuleUpdate, current_user=Depends(require_admin)):
+    """Update a rule; the rule itself is left out of the conflict check"""
+    if not ObjectId.is_valid(rule_id):
+        raise HTTPException(status_code=400, detail="Invalid rule id")
+    changes = update.model_dump(exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No changes given")
+    database = await get_database()
+    current = await database.firewall_rules.find_one({"_id": ObjectId(rule_id)})
+    if current is None:
+        raise HTTPException(status_code=404, detail="Rule not found")
+
+    rule_data = {**current, **changes}
+    service = get_firewall_service()
+    if service:
+        await service.validate_rule_data(rule_data)
+    existing_rules = await database.firewall_rules.find(
+        {"enabled": True, "_id": {"$ne": current["_id"]}}
+    ).to_list(length=None)
+    conflicts = (service.check_rule_conflicts(rule_data, existing_rules)
+                 if service and rule_data.get("enabled", True) else [])
+
+    changes["updated_at"] = datetime.utcnow()
+    await database.firewall_rules.update_one({"_id": current["_id"]}, {"$set": changes})
+    logger.info(f"🛡️ Firewall rule {rule_data.get('rule_name')} updated by {current_user.get('username')}")
+    request_reconcile()
+    return {
+        "success": True,
+        "data": {"id": rule_id, **{key: value for key, value in changes.items() if key != "updated_at"}},
+        "conflicts": conflicts,
+        "timestamp": changes["updated_at"].isoformat()
+    }
+@router.get("/drift")
+async def get_firewall_drift(refresh: bool = False, current_user=Depends(require_admin)):
+    """Drift between firewall_rules and the kernel ruleset (refresh=true re-checks without applying)"""
+    report = await reconcile_firewall(dry_run=True) if refresh else get_last_drift_report()
+    return {
+        "success": True,
+        "data": report,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/sync/metrics")
+async def get_firewall_sync_metrics(current_user=Depends(get_current_user)):
+    """Sync worker queue depth, batching and apply latency"""
+    return {
+        "success": True,
+        "data": get_sync_metrics(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/optimizer")
+async def get_optimizer_report(sample: int = Query(2000, ge=0, le=20000), current_user=Depends(require_admin)):
+    """Optimizer report for the current rules, replayed against the most recent logged traffic"""
+    database = await get_database()
+    rule_docs = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+    log_docs = await database.system_logs.find(
+        {"event_type": "traffic_log", "source_ip": {"$ne": None}, "destination_ip": {"$ne": None}}
+    ).sort("timestamp", -1).limit(sample).to_list(length=sample) if sample else []
+
+    def build_report():
+        specs, skipped = normalize_rules(rule_docs)
+        optimized = optimize_rules(specs, rule_hits(rule_docs))
+        packets = [packet for packet in map(packet_from_log, log_docs) if packet]
+        optimized.report.replay = replay(specs, optimized.specs, packets)
+        return {**optimized.report.to_dict(), "skipped": skipped}
+
+    loop = asyncio.get_event_loop()
+    report = await loop.run_in_executor(None, build_report)
+    return {
+        "success": True,
+        "data": report,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.post("/simulate")
+async def simulate_packets(request: FirewallSimulateRequest, current_user=Depends(get_current_user)):
+    """Which enabled rule would handle a packet tuple (or a batch of up to 100k), without sending traffic"""
+    if (request.packet is None) == (request.packets is None):
+        raise HTTPException(status_code=400, detail="Provide either 'packet' or 'packets'")
+    database = await get_database()
+    rule_docs = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+    group_docs = await database.firewall_groups.find().to_list(length=None)
+
+    def evaluate():
+        matcher = matcher_for(rule_docs, request.optimized, group_docs)
+        if request.packet is not None:
+            return matcher.decide(normalize_packet(request.packet.model_dump())).to_dict()
+        decisions = matcher.decide_batch([normalize_packet(packet.model_dump()) for packet in request.packets])
+        return {
+            "verdicts": [decision.verdict for decision in decisions],
+            "rule_ids": [decision.spec.rule_id if decision.spec else None for decision in decisions],
+            "summary": summarize(decisions),
+            "engine": "numpy" if NUMPY_AVAILABLE else "scalar",
+        }
+
+    loop = asyncio.get_event_loop()
+    try:
+        result = await loop.run_in_executor(None, evaluate)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "data": result,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/hits")
+async def get_rule_hit_rates(
+    rule_id: Optional[str] = None,
+    hours: int = Query(24, ge=1, le=168),
+    bucket_minutes: int = Query(5, ge=1, le=1440),
+    current_user=Depends(get_current_user)
+):
+    """Hit-rate time series per rule (packets/s per bucket) from the kernel counter collector"""
+    database = await get_database()
+    match = {"timestamp": {"$gte": datetime.utcnow() - timedelta(hours=hours)}}
+    if rule_id:
+        match["rule_id"] = rule_id
+    rows = await database.firewall_rule_hits.aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"rule_id": "$rule_id", "bucket": {
+                "$dateTrunc": {"date": "$timestamp", "unit": "minute", "binSize": bucket_minutes}
+            }},
+            "packets": {"$sum": "$packets"},
+            "bytes": {"$sum": "$bytes"},
+        }},
+        {"$sort": {"_id.bucket": 1}},
+    ]).to_list(length=None)
+
+    series = {}
+    for row in rows:
+        series.setdefault(row["_id"]["rule_id"], []).append({
+            "timestamp": row["_id"]["bucket"].isoformat(),
+            "packets": row["packets"],
+            "bytes": row["bytes"],
+            "packets_per_second": round(row["packets"] / (bucket_minutes * 60), 3),
+        })
+    return {
+        "success": True,
+        "data": series,
+        "bucket_minutes": bucket_minutes,
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/blocklist")
+async def get_blocklist_entries(
+    limit: int = Query(100, ge=1, le=1000),
+    skip: int = Query(0, ge=0),
+    source: Optional[str] = None,
+    current_user=Depends(get_current_user)
+):
+    """Dynamic blocklist entries (from the firewall_blocklist mirror) and writer status"""
+    database = await get_database()
+    query = {"source": source} if source else {}
+    entries = await database.firewall_blocklist.find(query).sort("expires_at", 1).skip(skip).limit(limit).to_list(
+        length=limit
+    )
+    return {
+        "success": True,
+        "data": [{key: value for key, value in entry.items() if key != "_id"} for entry in entries],
+        "total": await database.firewall_blocklist.count_documents(query),
+        "status": get_blocklist_status(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.post("/blocklist")
+async def add_blocklist_entries(request: FirewallBlocklistRequest, http_request: Request,
+                                current_user=Depends(require_admin)):
+    """Block addresses/CIDRs in the kernel set until ttl_seconds pass (written in batches)"""
+    # Never the server itself, its management networks or the admin's own connection
+    protected = protected_networks([http_request.client.host] if http_request.client else [])
+    invalid = []
+    for address in request.addresses:
+        try:
+            ban_address(address, request.ttl_seconds, request.reason, source="api", protected=protected)
+        except ValueError as e:
+            invalid.append({"address": address, "error": str(e)})
+    if len(invalid) == len(request.addresses):
+        raise HTTPException(status_code=400, detail=invalid[:100])
+    result = await flush_blocklist(await get_database())
+    return {
+        "success": True,
+        "data": {**result, "invalid": invalid},
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.get("/blocklist/check")
+async def check_blocklist(ip: str, current_user=Depends(get_current_user)):
+    """Whether an address is covered by an active blocklist entry"""
+    try:
+        entry = get_blocklist().lookup(ip)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "success": True,
+        "data": {
+            "ip": ip,
+            "blocked": entry is not None,
+            "entry": entry.address if entry else None,
+            "expires_at": entry.expires_at.isoformat() if entry and entry.expires_at else None,
+        },
+        "timestamp": datetime.utcnow().isoformat()
+    }
+
+
+@router.delete("/blocklist/{address:path}")
+async def remove_blocklist_entry(address: str, current_user=Depends(require_admin)):
+    """Unblock an address or CIDR (e.g. /blocklist/10.0.0.0/24)"""
+    try:
+        removed = unban_address(address)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail="Address is not on the blocklist")
+    await flush_blocklist(await get_database())
+    return {
+        "success": True,
+        "timestamp": datetime.utcnow().isoformat()
+    }
@@ -1,4 +1,14 @@
-from fastapi import APIRouter
+import logging
+from fastapi import APIRouter, Depends, HTTPException
+from datetime import datetime
+from bson import ObjectId
+
+from ..database import get_database
+from ..dependencies import require_admin
+from ..schemas import FirewallGroupUpdate
+from ..tasks.firewall_sync import request_reconcile
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/v1/firewall-groups", tags=["Firewall Groups"])
 
@@ -8,4 +18,27 @@ async def get_firewall_groups():
     return {
         "success": True,
         "data": []
-    }
\ No newline at end of file
+    }
+
+@router.patch("/{group_id}")
+async def update_firewall_group(group_id: str, update: FirewallGroupUpdate, current_user=Depends(require_admin)):
+    """Update a group; enabling, disabling or reprioritising it only adds, removes or moves its chain jump"""
+    if not ObjectId.is_valid(group_id):
+        raise HTTPException(status_code=400, detail="Invalid group id")
+    changes = update.model_dump(exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No changes given")
+    changes["updated_at"] = datetime.utcnow()
+
+    database = await get_database()
+    result = await database.firewall_groups.update_one({"_id": ObjectId(group_id)}, {"$set": changes})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Group not found")
+    logger.info(f"🧱 Firewall group {group_id} updated by {current_user.get('username')}: "
+                f"{', '.join(key for key in changes if key != 'updated_at')}")
+    request_reconcile()
+    return {
+        "success": True,
+        "data": {"id": group_id, **{key: value for key, value in changes.items() if key != "updated_at"}},
+        "timestamp": datetime.utcnow().isoformat()
+    }
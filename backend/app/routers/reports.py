@@ -3,20 +3,21 @@ Reports Router - Comprehensive report generation and analytics endpoints
 Enhanced with PC-to-PC Internet Sharing analytics and real backend integration
 Compatible with existing frontend and optimized for KOBI Firewall
 """
-from fastapi import APIRouter, Depends, Query, HTTPException, status, BackgroundTasks
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, Query, HTTPException, status, Request
+from fastapi.responses import Response
 from typing import Optional, List, Dict, Any
-import json
-import csv
-import io
-import tempfile
 import os
-from datetime import datetime, timedelta
+from datetime import datetime
 import logging
+from bson import ObjectId
 
 # Import dependencies and services
 from ..dependencies import get_current_user, require_admin, rate_limit_check
 from ..services.reports_service import reports_service
+from ..services.report_jobs import ReportQueueFullError
+from ..services.report_renderers import MEDIA_TYPES
+from ..services.report_series import SERIES_RANGES, SERIES_GRANULARITIES
+from ..http_ranges import ranged_file_response
 from ..schemas.reports import (
     ReportGenerateRequest, ReportFilterRequest, ReportExportRequest,
     ReportScheduleRequest, ReportAnalyticsRequest, ReportsData,
@@ -34,6 +35,14 @@ logger = logging.getLogger(__name__)
 # Create router
 router = APIRouter(prefix="/api/v1/reports", tags=["Reports"])
 
+# /analytics time ranges mapped onto the standard report periods
+ANALYTICS_TIME_RANGES = {
+    "1h": "Son 1 saat",
+    "24h": "Bugün",
+    "7d": "Son 1 hafta",
+    "30d": "Son 30 gün"
+}
+
 
 # =============================================================================
 # DASHBOARD DATA ENDPOINTS
@@ -51,8 +60,8 @@ async def get_reports_data(
     try:
         logger.info(f"📊 Reports data requested by {current_user.get('username')} with filter: {filter}")
 
-        # Get dashboard statistics from service
-        dashboard_stats = await reports_service.get_dashboard_stats(filter)
+        # Get dashboard statistics from the materialized snapshot
+        dashboard_stats, refreshed_at = await reports_service.get_dashboard_snapshot(filter)
 
         # Format response to match frontend expectations
         response_data = {
@@ -106,6 +115,7 @@ async def get_reports_data(
                 # Metadata
                 "lastUpdate": dashboard_stats.last_updated.strftime("%d.%m.%Y %H:%M"),
                 "filterPeriod": filter,
+                "refreshedAt": (refreshed_at or dashboard_stats.last_updated).isoformat(),
                 "generatedAt": datetime.utcnow().isoformat()
             }
         }
@@ -223,194 +233,286 @@ async def get_quick_stats(
 # EXPORT ENDPOINTS
 # =============================================================================
 
+def _export_response(request: Request, artifact, cached: bool) -> Response:
+    """Serve a cached export artifact with a strong ETag (GET revalidation answers 304)"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"kobi_firewall_report_{timestamp}.{artifact.report_format}"
+    return ranged_file_response(
+        request, artifact.path, MEDIA_TYPES[artifact.report_format], filename,
+        headers={"Cache-Control": "private, no-cache", "X-Export-Cache": "hit" if cached else "miss"},
+        etag=artifact.etag
+    )
+
+
+async def _export(request: Request, export_request: Dict[str, Any], export_format: str, current_user) -> Response:
+    label = export_format.upper()
+    try:
+        artifact, cached = await reports_service.export_artifact({**export_request, "format": export_format})
+        logger.info(f"✅ {label} export {'served from cache' if cached else 'rendered'} "
+                    f"for {current_user.get('username')}")
+        return _export_response(request, artifact, cached)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ {label} export failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"{label} export failed: {str(e)}"
+        )
+
+
 @router.post("/export")
 async def export_report(
         data: dict,
+        request: Request,
         current_user=Depends(get_current_user)
 ):
     """
     Export report - Enhanced version compatible with existing frontend
     Supports multiple export formats and types
     """
-    try:
-        logger.info(f"📤 Report export requested by {current_user.get('username')}: {data}")
-
-        # Extract export parameters
-        export_format = data.get('format', 'JSON').upper()
-        report_type = data.get('reportType', 'all')
-        time_filter = data.get('timeFilter', 'Son 30 gün')
-
-        # Prepare export request
-        export_request = {
-            'report_type': report_type,
-            'filter_period': time_filter,
-            'include_charts': data.get('includeCharts', True),
-            'include_details': data.get('includeDetails', True)
-        }
-
-        if export_format == 'PDF':
-            return await export_pdf_report(export_request, current_user)
-        elif export_format == 'CSV':
-            return await export_csv_report(export_request, current_user)
-        elif export_format in ['JSON', 'EXCEL']:
-            return await export_json_report(export_request, current_user)
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Unsupported export format: {export_format}"
-            )
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        logger.error(f"❌ Export failed for {current_user.get('username')}: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Export failed: {str(e)}"
-        )
+    logger.info(f"📤 Report export requested by {current_user.get('username')}: {data}")
+
+    # Extract export parameters
+    export_format = str(data.get('format', 'JSON')).lower()
+    export_request = {
+        'report_type': data.get('reportType', 'all'),
+        'filter_period': data.get('timeFilter', 'Son 30 gün')
+    }
+    return await _export(request, export_request, export_format, current_user)
+
+
+@router.get("/export/{export_format}")
+async def get_export(
+        export_format: str,
+        request: Request,
+        report_type: str = Query("all", alias="reportType"),
+        time_filter: str = Query("Son 30 gün", alias="timeFilter"),
+        current_user=Depends(get_current_user)
+):
+    """
+    Export report (pdf, csv, json) by URL. Responses carry a strong ETag;
+    revalidating with If-None-Match returns 304 while the data is unchanged.
+    """
+    export_request = {'report_type': report_type, 'filter_period': time_filter}
+    return await _export(request, export_request, export_format.lower(), current_user)
 
 
 @router.post("/export/pdf")
 async def export_pdf_report(
         export_request: dict,
-        background_tasks: BackgroundTasks,
+        request: Request,
         current_user=Depends(get_current_user)
 ):
     """Export report as PDF"""
-    try:
-        logger.info(f"📑 PDF export requested by {current_user.get('username')}")
-
-        # Generate PDF using reports service
-        pdf_path = await reports_service.generate_pdf_report(export_request)
-
-        # Schedule cleanup
-        def cleanup():
-            try:
-                if os.path.exists(pdf_path):
-                    os.remove(pdf_path)
-                    logger.info(f"🗑️ Cleaned up PDF file: {pdf_path}")
-            except Exception as e:
-                logger.warning(f"⚠️ Cleanup warning: {e}")
-
-        background_tasks.add_task(cleanup)
-
-        # Generate filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"kobi_firewall_report_{timestamp}.pdf"
-
-        logger.info(f"✅ PDF export successful for {current_user.get('username')}: {filename}")
-
-        return FileResponse(
-            path=pdf_path,
-            filename=filename,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Cache-Control": "no-cache"
-            }
-        )
-
-    except Exception as e:
-        logger.error(f"❌ PDF export failed: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"PDF export failed: {str(e)}"
-        )
+    logger.info(f"📑 PDF export requested by {current_user.get('username')}")
+    return await _export(request, export_request, "pdf", current_user)
 
 
 @router.post("/export/csv")
 async def export_csv_report(
         export_request: dict,
+        request: Request,
         current_user=Depends(get_current_user)
 ):
     """Export report as CSV"""
-    try:
-        logger.info(f"📄 CSV export requested by {current_user.get('username')}")
-
-        # Generate CSV data using reports service
-        csv_data = await reports_service.generate_csv_report(export_request)
-
-        # Create CSV string
-        output = io.StringIO()
-        if csv_data:
-            fieldnames = csv_data[0].keys()
-            writer = csv.DictWriter(output, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(csv_data)
-
-        # Create response
-        csv_content = output.getvalue()
-        output.close()
-
-        # Generate filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"kobi_firewall_report_{timestamp}.csv"
-
-        logger.info(f"✅ CSV export successful for {current_user.get('username')}: {filename}")
-
-        response = StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8')),
-            media_type="text/csv",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Cache-Control": "no-cache"
-            }
-        )
-
-        return response
-
-    except Exception as e:
-        logger.error(f"❌ CSV export failed: {e}")
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"CSV export failed: {str(e)}"
-        )
+    logger.info(f"📄 CSV export requested by {current_user.get('username')}")
+    return await _export(request, export_request, "csv", current_user)
 
 
 @router.post("/export/json")
 async def export_json_report(
         export_request: dict,
+        request: Request,
         current_user=Depends(get_current_user)
 ):
     """Export report as JSON"""
-    try:
-        logger.info(f"📋 JSON export requested by {current_user.get('username')}")
+    logger.info(f"📋 JSON export requested by {current_user.get('username')}")
+    return await _export(request, export_request, "json", current_user)
 
-        # Generate JSON data using reports service
-        json_data = await reports_service.generate_json_report(export_request)
 
-        # Generate filename
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"kobi_firewall_report_{timestamp}.json"
+# =============================================================================
+# REPORT JOB ENDPOINTS
+# =============================================================================
 
-        # Create JSON string with proper formatting
-        json_content = json.dumps(json_data, indent=2, ensure_ascii=False, default=str)
+def _job_response(job: Dict[str, Any], reused: bool = False) -> Dict[str, Any]:
+    return {
+        "job_id": job["report_id"],
+        "status": job["status"],
+        "progress": job.get("progress", 0),
+        "stage": job.get("stage"),
+        "format": job.get("format"),
+        "size_bytes": job.get("size_bytes"),
+        "download_url": job.get("file_url"),
+        "error_message": job.get("error_message"),
+        "created_at": job.get("created_at"),
+        "generated_at": job.get("generated_at"),
+        "reused": reused
+    }
+
+
+@router.post("/jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_report_job(
+        data: dict,
+        current_user=Depends(get_current_user)
+):
+    """
+    Submit a report export job (format, reportType, timeFilter).
+    Returns immediately with a job id; poll /jobs/{job_id} and download when completed.
+    """
+    try:
+        job, reused = await reports_service.jobs.submit(data, str(current_user["_id"]))
+        logger.info(f"📥 Report job {job['report_id']} {'reused' if reused else 'queued'} "
+                    f"for {current_user.get('username')}")
+        return {"success": True, "data": _job_response(job, reused)}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except ReportQueueFullError as e:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": "30"}
+        )
+    except Exception as e:
+        logger.error(f"❌ Report job submission failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Report job submission failed: {str(e)}"
+        )
 
-        logger.info(f"✅ JSON export successful for {current_user.get('username')}: {filename}")
 
-        response = StreamingResponse(
-            io.BytesIO(json_content.encode('utf-8')),
-            media_type="application/json",
-            headers={
-                "Content-Disposition": f"attachment; filename={filename}",
-                "Cache-Control": "no-cache"
-            }
+@router.get("/jobs/{job_id}")
+async def get_report_job(
+        job_id: str,
+        current_user=Depends(get_current_user)
+):
+    """Get report job status and progress"""
+    job = await reports_service.jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Report job {job_id} not found")
+    return {"success": True, "data": _job_response(job)}
+
+
+@router.get("/jobs/{job_id}/download")
+async def download_report_job(
+        job_id: str,
+        request: Request,
+        current_user=Depends(get_current_user)
+):
+    """Download a finished report artifact (supports HTTP Range for resumable downloads)"""
+    job = await reports_service.jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Report job {job_id} not found")
+    if job["status"] != "completed" or not job.get("file_path") or not os.path.exists(job["file_path"]):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Report job {job_id} is {job['status']} ({job.get('progress', 0)}%)"
         )
 
-        return response
+    await reports_service.jobs.mark_downloaded(job_id)
+    filename = f"kobi_firewall_report_{job['generated_at'].strftime('%Y%m%d_%H%M%S')}.{job['format']}"
+    return ranged_file_response(
+        request, job["file_path"], MEDIA_TYPES[job["format"]], filename,
+        headers={"Cache-Control": "private, max-age=0"}, etag=job.get("checksum")
+    )
+
 
+@router.get("/schedules/{schedule_id}/latest")
+async def get_latest_scheduled_report(
+        schedule_id: str,
+        current_user=Depends(get_current_user)
+):
+    """Latest precomputed artifact of a report schedule (download via its download_url)"""
+    try:
+        key = ObjectId(schedule_id) if ObjectId.is_valid(schedule_id) else schedule_id
+        job = await reports_service.scheduler.latest_artifact(key)
     except Exception as e:
-        logger.error(f"❌ JSON export failed: {e}")
+        logger.error(f"❌ Scheduled report lookup failed: {e}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"JSON export failed: {str(e)}"
+            detail=f"Scheduled report lookup failed: {str(e)}"
         )
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No precomputed report for schedule {schedule_id}"
+        )
+    return {"success": True, "data": _job_response(job, reused=True)}
 
 
 # =============================================================================
 # ANALYTICS ENDPOINTS
 # =============================================================================
 
+@router.get("/top-talkers")
+async def get_top_talkers(
+        filter_period: str = Query(default="Son 1 hafta", description="Filtre dönemi"),
+        limit: int = Query(default=10, ge=1, le=64, description="Liste uzunluğu"),
+        current_user=Depends(get_current_user)
+):
+    """
+    Top source IPs, destinations and ports plus distinct blocked sources for a period.
+    Counts are lower bounds from merged top-K sketches (true value <= count + max_error);
+    the distinct count is a HyperLogLog estimate with the given relative standard error.
+    """
+    try:
+        return {"success": True, "data": await reports_service.get_top_talkers(filter_period, limit)}
+    except Exception as e:
+        logger.error(f"❌ Top talkers failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get top talkers: {str(e)}"
+        )
+
+
+@router.get("/latency")
+async def get_latency_percentiles(
+        filter_period: str = Query(default="Bugün", description="Filtre dönemi"),
+        kind: str = Query(default="http", pattern="^(http|db)$", description="http (rotalar) veya db (komutlar)"),
+        name: Optional[str] = Query(default=None, description="Tek rota / komut, örn. 'GET /api/v1/reports/data'"),
+        limit: int = Query(default=20, ge=1, le=200, description="Kırılım listesi uzunluğu"),
+        current_user=Depends(get_current_user)
+):
+    """Request or database latency percentiles (p50/p95/p99) merged from per-minute t-digests"""
+    try:
+        return {"success": True, "data": await reports_service.get_latency_percentiles(
+            filter_period, kind, name, limit
+        )}
+    except Exception as e:
+        logger.error(f"❌ Latency percentiles failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get latency percentiles: {str(e)}"
+        )
+
+
+@router.get("/series")
+async def get_chart_series(
+        metric: str = Query(default="traffic_bytes", description="Metrik (traffic_bytes, blocked_requests, ...)"),
+        range_name: str = Query(default="24h", alias="range", description="Zaman aralığı (1h, 6h, 24h, 7d, 30d, 90d)"),
+        granularity: str = Query(default="auto", description="Kova boyutu (1m ... 1w veya auto)"),
+        width: int = Query(default=800, ge=10, le=5000, description="Grafik genişliği (nokta bütçesi)"),
+        method: str = Query(default="lttb", description="Örnekleme yöntemi (lttb, minmax)"),
+        current_user=Depends(get_current_user)
+):
+    """
+    Time-bucketed series for charts as columnar arrays:
+    t = bucket start (epoch ms), v = value; downsampled to at most `width` points.
+    """
+    try:
+        return {"success": True, "data": await reports_service.get_chart_series(
+            metric, range_name, granularity, width, method
+        )}
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        logger.error(f"❌ Chart series failed: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to build chart series: {str(e)}"
+        )
+
+
 @router.get("/analytics")
 async def get_analytics_data(
         time_range: str = Query(default="24h", description="Zaman aralığı"),
@@ -422,23 +524,21 @@ async def get_analytics_data(
     try:
         logger.info(f"📈 Analytics data requested by {current_user.get('username')}")
 
-        # Parse time range
-        end_date = datetime.utcnow()
-        if time_range == "1h":
-            start_date = end_date - timedelta(hours=1)
-        elif time_range == "24h":
-            start_date = end_date - timedelta(hours=24)
-        elif time_range == "7d":
-            start_date = end_date - timedelta(days=7)
-        elif time_range == "30d":
-            start_date = end_date - timedelta(days=30)
-        else:
-            start_date = end_date - timedelta(hours=24)
-
-        # Get dashboard stats for the period
-        dashboard_stats = await reports_service.get_dashboard_stats(
-            f"Son {time_range.replace('h', ' saat').replace('d', ' gün')}"
-        )
+        # Same period strings as /data, so both read the same snapshot
+        filter_period = ANALYTICS_TIME_RANGES.get(time_range, "Bugün")
+        dashboard_stats, refreshed_at = await reports_service.get_dashboard_snapshot(filter_period)
+
+        traffic_series = None
+        if include_charts:
+            series_range = time_range if time_range in SERIES_RANGES else "24h"
+            series_granularity = granularity if granularity in SERIES_GRANULARITIES else "auto"
+            try:
+                traffic_series = await reports_service.get_chart_series(
+                    "traffic_bytes", series_range, series_granularity
+                )
+            except ValueError:
+                # Granularity too fine for the range; let the service pick one
+                traffic_series = await reports_service.get_chart_series("traffic_bytes", series_range)
 
         analytics_data = {
             "success": True,
@@ -484,13 +584,7 @@ async def get_analytics_data(
                     {
                         "chart_type": "line",
                         "title": "Trafik Trendi",
-                        "data": {
-                            "labels": [f"{i:02d}:00" for i in range(24)],
-                            "datasets": [{
-                                "label": "Trafik (GB)",
-                                "data": [40 + i * 2 for i in range(24)]
-                            }]
-                        }
+                        "data": traffic_series
                     },
                     {
                         "chart_type": "pie",
@@ -504,6 +598,7 @@ async def get_analytics_data(
                     }
                 ],
 
+                "refreshed_at": (refreshed_at or dashboard_stats.last_updated).isoformat(),
                 "generated_at": datetime.utcnow().isoformat(),
                 "data_points_count": len(dashboard_stats.port_statistics)
             }
@@ -670,20 +765,6 @@ async def get_port_statistics(
         )
 
 
-# =============================================================================
-# INITIALIZATION
-# =============================================================================
-
-@router.on_event("startup")
-async def startup_reports_router():
-    """Initialize reports service on router startup"""
-    try:
-        await reports_service.initialize()
-        logger.info("✅ Reports router initialized successfully")
-    except Exception as e:
-        logger.error(f"❌ Reports router initialization failed: {e}")
-
-
 # =============================================================================
 # ERROR HANDLERS
 # =============================================================================
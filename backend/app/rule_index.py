@@ -0,0 +1,366 @@
+"""
+Firewall rule index
+Answers "which rules intersect this rule" and "which rules match this
+address / packet" without scanning every rule:
+  - addresses live in path-compressed binary radix tries (one per address
+    family and role); two CIDRs intersect iff one contains the other, so an
+    intersecting query is the query's ancestors plus its subtree
+  - port ranges live in a PortIntervalIndex: a segment tree over the 16-bit
+    port space for stabbing queries plus sorted range starts, since two
+    ranges intersect iff one contains the other's start
+Both are bucketed by (direction, protocol). Candidates from each dimension
+are intersected and then checked exactly with RuleShape, which also covers
+interface and schedule.
+"""
+import ipaddress
+from bisect import bisect_left, bisect_right, insort
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from app.firewall_optimizer import ALL_PROTOCOLS, PORT_PROTOCOLS, RuleShape, prepare_packet
+from app.firewall_ruleset import FirewallRuleSpec, RulesetError, normalize_rule
+
+ANY_PROTOCOL = "*"
+ADDRESS_BITS = {4: 32, 6: 128}
+PORT_BITS = 16
+ANY_PORTS = ((0, 65535),)
+
+
+# =============================================================================
+# RADIX TRIE
+# =============================================================================
+
+class _TrieNode:
+    __slots__ = ("key", "length", "children", "values")
+
+    def __init__(self, key: int, length: int):
+        self.key = key
+        self.length = length
+        self.children: List[Optional["_TrieNode"]] = [None, None]
+        self.values: Set[str] = set()
+
+
+class PrefixTrie:
+    """Path-compressed binary radix trie of prefixes -> rule ids"""
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self.root = _TrieNode(0, 0)
+
+    def _mask(self, key: int, length: int) -> int:
+        return key >> (self.bits - length) << (self.bits - length) if length else 0
+
+    def _bit(self, key: int, position: int) -> int:
+        return (key >> (self.bits - 1 - position)) & 1
+
+    def insert(self, key: int, length: int, value: str):
+        key = self._mask(key, length)
+        node = self.root
+        while True:
+            if node.length == length:
+                node.values.add(value)
+                return
+            bit = self._bit(key, node.length)
+            child = node.children[bit]
+            if child is None:
+                leaf = node.children[bit] = _TrieNode(key, length)
+                leaf.values.add(value)
+                return
+
+            limit = min(length, child.length)
+            difference = key ^ child.key
+            common = limit if not difference else min(limit, self.bits - difference.bit_length())
+            if common == child.length:
+                node = child
+                continue
+
+            # Split the edge at the first differing bit (or where the new prefix ends)
+            middle = node.children[bit] = _TrieNode(self._mask(key, common), common)
+            middle.children[self._bit(child.key, common)] = child
+            if common == length:
+                middle.values.add(value)
+            else:
+                leaf = middle.children[self._bit(key, common)] = _TrieNode(key, length)
+                leaf.values.add(value)
+            return
+
+    def discard(self, key: int, length: int, value: str):
+        key = self._mask(key, length)
+        node = self.root
+        while node is not None and node.length <= length:
+            if self._mask(key, node.length) != node.key:
+                return
+            if node.length == length:
+                node.values.discard(value)
+                return
+            node = node.children[self._bit(key, node.length)]
+
+    @staticmethod
+    def _collect(node: Optional[_TrieNode], out: Set[str]):
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current is not None:
+                out.update(current.values)
+                stack.extend(current.children)
+
+    def query(self, key: int, length: int, out: Set[str], subtree: bool = True):
+        """Add values of prefixes containing key/length (and, with subtree, contained in it)"""
+        key = self._mask(key, length)
+        node = self.root
+        while node is not None:
+            if node.length > length:
+                if subtree and self._mask(node.key, length) == key:
+                    self._collect(node, out)
+                return
+            if self._mask(key, node.length) != node.key:
+                return
+            out.update(node.values)
+            if node.length == length:
+                if subtree:
+                    for child in node.children:
+                        self._collect(child, out)
+                return
+            node = node.children[self._bit(key, node.length)]
+
+
+# =============================================================================
+# PORT INTERVALS
+# =============================================================================
+
+class PortIntervalIndex:
+    """Inclusive port ranges -> rule ids, with O(log U + k) stabbing and overlap queries"""
+
+    def __init__(self):
+        self._segments: Dict[int, Set[str]] = {}        # heap-numbered segment tree nodes
+        self._starts: List[Tuple[int, int, str]] = []   # (low, high, rule id), sorted
+
+    def _canonical(self, low: int, high: int, node: int = 1, node_low: int = 0,
+                   node_high: int = (1 << PORT_BITS) - 1) -> Iterable[int]:
+        if high < node_low or node_high < low:
+            return
+        if low <= node_low and node_high <= high:
+            yield node
+            return
+        middle = (node_low + node_high) // 2
+        yield from self._canonical(low, high, node * 2, node_low, middle)
+        yield from self._canonical(low, high, node * 2 + 1, middle + 1, node_high)
+
+    def insert(self, low: int, high: int, value: str):
+        for node in self._canonical(low, high):
+            self._segments.setdefault(node, set()).add(value)
+        insort(self._starts, (low, high, value))
+
+    def discard(self, low: int, high: int, value: str):
+        for node in self._canonical(low, high):
+            members = self._segments.get(node)
+            if members is not None:
+                members.discard(value)
+                if not members:
+                    del self._segments[node]
+        index = bisect_left(self._starts, (low, high, value))
+        if index < len(self._starts) and self._starts[index] == (low, high, value):
+            del self._starts[index]
+
+    def stab(self, port: int, out: Set[str]):
+        """Ranges containing port"""
+        node, node_low, node_high = 1, 0, (1 << PORT_BITS) - 1
+        while True:
+            out.update(self._segments.get(node, ()))
+            if node_low == node_high:
+                return
+            middle = (node_low + node_high) // 2
+            if port <= middle:
+                node, node_high = node * 2, middle
+            else:
+                node, node_low = node * 2 + 1, middle + 1
+
+    def overlapping(self, low: int, high: int, out: Set[str]):
+        """Ranges intersecting [low, high]: those containing low, plus those starting inside"""
+        self.stab(low, out)
+        begin = bisect_right(self._starts, (low, 1 << PORT_BITS, ""))
+        end = bisect_right(self._starts, (high, 1 << PORT_BITS, ""))
+        out.update(value for _, _, value in self._starts[begin:end])
+
+
+# =============================================================================
+# RULE INDEX
+# =============================================================================
+
+def _prefixes(networks: Iterable[str]) -> List[Tuple[int, int, int]]:
+    """(family, key, length) per CIDR; the empty list ("any") is both family roots"""
+    parsed = [ipaddress.ip_network(network) for network in networks]
+    if not parsed:
+        return [(4, 0, 0), (6, 0, 0)]
+    return [(network.version, int(network.network_address), network.prefixlen) for network in parsed]
+
+
+class _Bucket:
+    """Indexes of the rules sharing one (direction, protocol)"""
+    __slots__ = ("addresses", "ports")
+
+    def __init__(self):
+        self.addresses = {(role, family): PrefixTrie(bits)
+                          for role in ("source", "destination") for family, bits in ADDRESS_BITS.items()}
+        self.ports = {"source": PortIntervalIndex(), "destination": PortIntervalIndex()}
+
+
+class RuleIndex:
+    """Incrementally maintained index of normalized firewall rules"""
+
+    def __init__(self):
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._rules: Dict[str, RuleShape] = {}
+        self._versions: Dict[str, Any] = {}
+
+    def __len__(self) -> int:
+        return len(self._rules)
+
+    def __contains__(self, rule_id: str) -> bool:
+        return rule_id in self._rules
+
+    def get(self, rule_id: str) -> Optional[FirewallRuleSpec]:
+        shape = self._rules.get(rule_id)
+        return shape.spec if shape else None
+
+    @staticmethod
+    def _protocol_keys(shape: RuleShape) -> Tuple[str, ...]:
+        return (ANY_PROTOCOL,) if shape.protocols == ALL_PROTOCOLS else tuple(sorted(shape.protocols))
+
+    def _entries(self, shape: RuleShape):
+        """Every (bucket key, dimension, value) the rule is stored under"""
+        spec = shape.spec
+        for direction in spec.directions:
+            for protocol in self._protocol_keys(shape):
+                yield (direction, protocol), _prefixes(spec.sources), _prefixes(spec.destinations), \
+                    spec.source_ports or ANY_PORTS, spec.destination_ports or ANY_PORTS
+
+    def add(self, spec: FirewallRuleSpec, version: Any = None):
+        if spec.rule_id in self._rules:
+            self.remove(spec.rule_id)
+        shape = RuleShape(spec)
+        for key, sources, destinations, source_ports, destination_ports in self._entries(shape):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket()
+            for role, prefixes in (("source", sources), ("destination", destinations)):
+                for family, prefix, length in prefixes:
+                    bucket.addresses[(role, family)].insert(prefix, length, spec.rule_id)
+            for role, ranges in (("source", source_ports), ("destination", destination_ports)):
+                for low, high in ranges:
+                    bucket.ports[role].insert(low, high, spec.rule_id)
+        self._rules[spec.rule_id] = shape
+        self._versions[spec.rule_id] = version
+
+    def remove(self, rule_id: str):
+        shape = self._rules.pop(rule_id, None)
+        self._versions.pop(rule_id, None)
+        if shape is None:
+            return
+        for key, sources, destinations, source_ports, destination_ports in self._entries(shape):
+            bucket = self._buckets[key]
+            for role, prefixes in (("source", sources), ("destination", destinations)):
+                for family, prefix, length in prefixes:
+                    bucket.addresses[(role, family)].discard(prefix, length, rule_id)
+            for role, ranges in (("source", source_ports), ("destination", destination_ports)):
+                for low, high in ranges:
+                    bucket.ports[role].discard(low, high, rule_id)
+
+    def sync(self, documents: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Bring the index in line with a full list of rule documents, touching
+        only rules that were added, removed or changed (by updated_at);
+        returns (indexed, removed)
+        """
+        seen, indexed = set(), 0
+        for document in documents:
+            rule_id = document.get("_id") or document.get("id") or document.get("rule_name")
+            updated_at = document.get("updated_at")
+            if rule_id and updated_at is not None and self._versions.get(str(rule_id)) == updated_at:
+                seen.add(str(rule_id))  # unchanged: skip normalization entirely
+                continue
+            try:
+                spec = normalize_rule(document)
+            except RulesetError:
+                continue
+            seen.add(spec.rule_id)
+            version = updated_at if updated_at is not None else spec
+            if spec.rule_id not in self._rules or self._versions.get(spec.rule_id) != version:
+                self.add(spec, version)
+                indexed += 1
+        stale = [rule_id for rule_id in self._rules if rule_id not in seen]
+        for rule_id in stale:
+            self.remove(rule_id)
+        return indexed, len(stale)
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Dict[str, Any]]) -> "RuleIndex":
+        index = cls()
+        index.sync(documents)
+        return index
+
+    # -- queries -------------------------------------------------------------
+
+    def _bucket_keys(self, directions: Iterable[str], protocols: frozenset) -> List[Tuple[str, str]]:
+        wanted = set(protocols) | {ANY_PROTOCOL}
+        return [key for key in self._buckets
+                if key[0] in directions and (protocols == ALL_PROTOCOLS or key[1] in wanted)]
+
+    def _candidates(self, bucket: _Bucket, sources, destinations, source_ports, destination_ports,
+                    subtree: bool) -> Set[str]:
+        dimensions = []
+        for role, prefixes in (("source", sources), ("destination", destinations)):
+            found: Set[str] = set()
+            for family, prefix, length in prefixes:
+                bucket.addresses[(role, family)].query(prefix, length, found, subtree)
+            dimensions.append(found)
+        for role, ranges in (("source", source_ports), ("destination", destination_ports)):
+            found = set()
+            for low, high in ranges:
+                bucket.ports[role].overlapping(low, high, found)
+            dimensions.append(found)
+        dimensions.sort(key=len)
+        return set.intersection(*dimensions) if dimensions else set()
+
+    def intersecting(self, spec: FirewallRuleSpec) -> List[FirewallRuleSpec]:
+        """Indexed rules some packet could match together with spec, in priority order"""
+        shape = RuleShape(spec)
+        found: Set[str] = set()
+        for key in self._bucket_keys(spec.directions, shape.protocols):
+            found |= self._candidates(self._buckets[key], _prefixes(spec.sources), _prefixes(spec.destinations),
+                                      spec.source_ports or ANY_PORTS, spec.destination_ports or ANY_PORTS, True)
+        found.discard(spec.rule_id)
+        matches = [self._rules[rule_id] for rule_id in found if self._rules[rule_id].overlaps(shape)]
+        return [match.spec for match in sorted(matches, key=lambda item: item.spec.priority)]
+
+    def matching_address(self, address: str, role: str = "source",
+                         directions: Iterable[str] = ("IN", "OUT")) -> List[FirewallRuleSpec]:
+        """Rules whose source (or destination) list contains address, in priority order"""
+        parsed = ipaddress.ip_address(address)
+        found: Set[str] = set()
+        for key in self._bucket_keys(tuple(directions), ALL_PROTOCOLS):
+            self._buckets[key].addresses[(role, parsed.version)].query(
+                int(parsed), ADDRESS_BITS[parsed.version], found, subtree=False
+            )
+        return sorted((self._rules[rule_id].spec for rule_id in found), key=lambda spec: spec.priority)
+
+    def matching_packet(self, packet: Dict[str, Any]) -> List[FirewallRuleSpec]:
+        """Rules matching a packet (packet_from_log format), in priority order"""
+        packet = prepare_packet(packet)
+        protocol = packet["protocol"]
+        protocols = frozenset({protocol})
+        found: Set[str] = set()
+        ports = []
+        for role in ("source", "destination"):
+            port = packet.get(f"{role}_port") if protocol in PORT_PROTOCOLS else None
+            ports.append(((int(port), int(port)),) if port is not None else ANY_PORTS)
+        addresses = []
+        for role in ("source", "destination"):
+            parsed = ipaddress.ip_address(packet[f"{role}_ip"])
+            addresses.append([(parsed.version, int(parsed), ADDRESS_BITS[parsed.version])])
+        for key in self._bucket_keys((packet["direction"],), protocols):
+            found |= self._candidates(self._buckets[key], addresses[0], addresses[1], ports[0], ports[1], False)
+        matches = [self._rules[rule_id] for rule_id in found]
+        return [match.spec for match in sorted(matches, key=lambda item: item.spec.priority) if match.matches(packet)]
+
+
+__all__ = ["RuleIndex", "PrefixTrie", "PortIntervalIndex"]
@@ -0,0 +1,272 @@
+"""
+Firewall rule matcher (what-if evaluation)
+Decides which rule would handle a packet tuple without sending traffic.
+Enabled rules are compiled in kernel evaluation order (priority, then
+document order - optionally after the optimizer):
+  - single packets go through the RuleIndex tries bucketed by protocol and
+    direction, and the matching rule with the lowest evaluation rank wins
+  - batches are vectorized with NumPy when it is installed: rules are
+    walked in evaluation order over the still-undecided packets, with
+    address and port lists matched by binary search over merged ranges
+Schedules and days_of_week are honoured for packets that carry a timestamp;
+packets without one match scheduled rules, like RuleShape.matches.
+Since the decision does not depend on how a ruleset is rendered, the matcher
+doubles as a correctness oracle for the compiler and the optimizer.
+"""
+import ipaddress
+import logging
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.firewall_optimizer import DEFAULT_VERDICT, RuleShape, prepare_ruleset
+from app.firewall_ruleset import FirewallRuleSpec, layout_rules, normalize_groups, normalize_rules
+from app.rule_index import RuleIndex
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH = 100_000
+PROTOCOL_CODES = {"tcp": 0, "udp": 1, "icmp": 2, "other": 3}
+DIRECTION_BITS = {"IN": 1, "OUT": 2}
+NO_RULE = -1
+
+
+def normalize_packet(packet: Dict[str, Any]) -> Dict[str, Any]:
+    """Canonical packet dict (direction IN/OUT, lower-case protocol, int ports); raises ValueError"""
+    protocol = str(packet.get("protocol") or "other").lower()
+    direction = str(packet.get("direction") or "IN").upper()
+    if direction not in DIRECTION_BITS:
+        raise ValueError(f"Unsupported direction: {direction}")
+    normalized = {
+        "direction": direction,
+        "protocol": protocol if protocol in PROTOCOL_CODES else "other",
+        "source_ip": str(ipaddress.ip_address(str(packet.get("source_ip")).strip())),
+        "destination_ip": str(ipaddress.ip_address(str(packet.get("destination_ip")).strip())),
+        "source_port": None,
+        "destination_port": None,
+        "interface": packet.get("interface") or None,
+        "timestamp": packet.get("timestamp"),
+    }
+    for role in ("source_port", "destination_port"):
+        if packet.get(role) is not None:
+            normalized[role] = int(packet[role])
+    return normalized
+
+
+@dataclass
+class Decision:
+    """Outcome for one packet: the first matching rule (None = chain policy)"""
+    position: int
+    spec: Optional[FirewallRuleSpec]
+
+    @property
+    def verdict(self) -> str:
+        return self.spec.target if self.spec else DEFAULT_VERDICT
+
+    def to_dict(self) -> Dict[str, Any]:
+        spec = self.spec
+        return {
+            "verdict": self.verdict,
+            "rule_id": spec.rule_id if spec else None,
+            "rule_name": spec.name if spec else None,
+            "action": spec.action if spec else None,
+            "priority": spec.priority if spec else None,
+            "position": self.position if spec else None,
+        }
+
+
+class _VectorRule:
+    """One rule flattened into NumPy-friendly ranges"""
+    __slots__ = ("protocols", "directions", "interface", "sources", "destinations", "source_ports",
+                 "destination_ports", "schedule", "days")
+
+    def __init__(self, spec: FirewallRuleSpec, interfaces: Dict[str, int]):
+        shape = RuleShape(spec)
+        self.protocols = np.array(sorted(PROTOCOL_CODES[item] for item in shape.protocols), dtype=np.int8)
+        self.directions = sum(DIRECTION_BITS[item] for item in spec.directions)
+        self.interface = interfaces.setdefault(spec.interface, len(interfaces)) if spec.interface else None
+        self.sources = self._spans(shape.source_spans) if spec.sources else None
+        self.destinations = self._spans(shape.destination_spans) if spec.destinations else None
+        self.source_ports = self._ranges(spec.source_ports) if spec.source_ports else None
+        self.destination_ports = self._ranges(spec.destination_ports) if spec.destination_ports else None
+        self.schedule = None
+        if spec.schedule:
+            start, end = (int(clock[:2]) * 60 + int(clock[3:5]) for clock in spec.schedule)
+            self.schedule = (start, end)
+        self.days = np.array(spec.days_of_week, dtype=np.int8) if spec.days_of_week else None
+
+    @staticmethod
+    def _ranges(ranges: Iterable[Tuple[int, int]]) -> Tuple[Any, Any]:
+        merged: List[List[int]] = []
+        for low, high in sorted(ranges):
+            if merged and low <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], high)
+            else:
+                merged.append([low, high])
+        return (np.array([low for low, _ in merged], dtype=np.int64),
+                np.array([high for _, high in merged], dtype=np.int64))
+
+    @classmethod
+    def _spans(cls, spans: Iterable[Tuple[int, int, int]]) -> Tuple[Any, Any]:
+        # Vector path is IPv4 only; IPv6 packets are routed to the index path
+        return cls._ranges((low, high) for version, low, high in spans if version == 4)
+
+    @staticmethod
+    def _inside(values, ranges) -> Any:
+        lows, highs = ranges
+        if not len(lows):
+            return np.zeros(len(values), dtype=bool)
+        position = np.searchsorted(lows, values, side="right") - 1
+        inside = position >= 0
+        inside[inside] = values[inside] <= highs[position[inside]]
+        return inside
+
+    def match(self, columns: Dict[str, Any], rows) -> Any:
+        mask = np.isin(columns["protocol"][rows], self.protocols)
+        mask &= (columns["direction"][rows] & self.directions) != 0
+        if self.interface is not None:
+            mask &= columns["interface"][rows] == self.interface
+        for name, ranges in (("source_ip", self.sources), ("destination_ip", self.destinations),
+                             ("source_port", self.source_ports), ("destination_port", self.destination_ports)):
+            if ranges is not None:
+                candidates = rows[mask]
+                mask[mask] = self._inside(columns[name][candidates], ranges)
+        if self.schedule is not None:
+            minutes = columns["minute"][rows]
+            start, end = self.schedule
+            window = (minutes >= start) & (minutes <= end) if start <= end else (minutes >= start) | (minutes <= end)
+            if self.days is not None:
+                window &= np.isin(columns["weekday"][rows], self.days)
+            mask &= window | (minutes < 0)
+        return mask
+
+
+class RuleMatcher:
+    """First-match decision structure over rules in evaluation order"""
+
+    def __init__(self, specs: Sequence[FirewallRuleSpec]):
+        self.specs = list(specs)
+        self.rank = {spec.rule_id: position for position, spec in enumerate(self.specs)}
+        self.index = RuleIndex()
+        for spec in self.specs:
+            self.index.add(spec)
+        self._interfaces: Dict[str, int] = {}
+        self._vector_rules: Optional[List[_VectorRule]] = None
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Dict[str, Any]], optimized: bool = False,
+                       group_documents: Optional[Iterable[Dict[str, Any]]] = None) -> "RuleMatcher":
+        """Enabled rules as the kernel sees them (optimized=True: after the optimizer; disabled groups skipped)"""
+        groups = normalize_groups(group_documents)
+        specs = prepare_ruleset(documents, groups)[0] if optimized else normalize_rules(documents)[0]
+        return cls(layout_rules(specs, groups).evaluation_order())
+
+    def decide(self, packet: Dict[str, Any]) -> Decision:
+        """packet must be normalized (normalize_packet)"""
+        matches = self.index.matching_packet(packet)
+        if not matches:
+            return Decision(NO_RULE, None)
+        winner = min(matches, key=lambda spec: self.rank[spec.rule_id])
+        return Decision(self.rank[winner.rule_id], winner)
+
+    def _columns(self, packets: Sequence[Dict[str, Any]]) -> Tuple[Dict[str, Any], Any]:
+        count = len(packets)
+        columns = {
+            "protocol": np.empty(count, dtype=np.int8),
+            "direction": np.empty(count, dtype=np.int8),
+            "interface": np.full(count, -1, dtype=np.int32),
+            "source_ip": np.zeros(count, dtype=np.int64),
+            "destination_ip": np.zeros(count, dtype=np.int64),
+            "source_port": np.full(count, -1, dtype=np.int64),
+            "destination_port": np.full(count, -1, dtype=np.int64),
+            "minute": np.full(count, -1, dtype=np.int16),
+            "weekday": np.full(count, -1, dtype=np.int8),
+        }
+        ipv6 = np.zeros(count, dtype=bool)
+        for row, packet in enumerate(packets):
+            columns["protocol"][row] = PROTOCOL_CODES[packet["protocol"]]
+            columns["direction"][row] = DIRECTION_BITS[packet["direction"]]
+            if packet["interface"]:
+                columns["interface"][row] = self._interfaces.get(packet["interface"], -2)
+            for role in ("source_ip", "destination_ip"):
+                address = ipaddress.ip_address(packet[role])
+                if address.version == 6:
+                    ipv6[row] = True
+                else:
+                    columns[role][row] = int(address)
+            if packet["protocol"] in ("tcp", "udp"):
+                for role in ("source_port", "destination_port"):
+                    if packet[role] is not None:
+                        columns[role][row] = packet[role]
+            timestamp = packet["timestamp"]
+            if timestamp is not None:
+                columns["minute"][row] = timestamp.hour * 60 + timestamp.minute
+                columns["weekday"][row] = timestamp.weekday()
+        return columns, ipv6
+
+    def decide_positions(self, packets: Sequence[Dict[str, Any]]) -> List[int]:
+        """Rule position per normalized packet (NO_RULE = chain policy)"""
+        if not NUMPY_AVAILABLE:
+            return [self.decide(packet).position for packet in packets]
+
+        if self._vector_rules is None:
+            self._vector_rules = [_VectorRule(spec, self._interfaces) for spec in self.specs]
+        columns, ipv6 = self._columns(packets)
+        positions = np.full(len(packets), NO_RULE, dtype=np.int64)
+        rows = np.flatnonzero(~ipv6)
+        for position, rule in enumerate(self._vector_rules):
+            if not rows.size:
+                break
+            mask = rule.match(columns, rows)
+            positions[rows[mask]] = position
+            rows = rows[~mask]
+
+        result = positions.tolist()
+        for row in np.flatnonzero(ipv6).tolist():
+            result[row] = self.decide(packets[row]).position
+        return result
+
+    def decide_batch(self, packets: Sequence[Dict[str, Any]]) -> List[Decision]:
+        return [Decision(position, self.specs[position] if position != NO_RULE else None)
+                for position in self.decide_positions(packets)]
+
+
+def summarize(decisions: Sequence[Decision]) -> Dict[str, Any]:
+    """Verdict and per-rule counts for a batch"""
+    verdicts: Dict[str, int] = {}
+    rules: Dict[str, int] = {}
+    for decision in decisions:
+        verdicts[decision.verdict] = verdicts.get(decision.verdict, 0) + 1
+        if decision.spec:
+            rules[decision.spec.rule_id] = rules.get(decision.spec.rule_id, 0) + 1
+    return {"packets": len(decisions), "verdicts": verdicts, "rules": rules}
+
+
+_cached_matchers: Dict[bool, Tuple[Any, RuleMatcher]] = {}
+
+
+def matcher_for(documents: List[Dict[str, Any]], optimized: bool = False,
+                group_documents: Optional[List[Dict[str, Any]]] = None) -> RuleMatcher:
+    """Matcher for the given rule (and group) documents, reused while none was added, removed or updated"""
+    signature = tuple((str(document.get("_id") or document.get("rule_name")), document.get("updated_at"),
+                       document.get("enabled", True)) for document in documents)
+    signature += tuple((str(document.get("_id")), document.get("enabled", True), document.get("priority"))
+                       for document in group_documents or ())
+    cached = _cached_matchers.get(optimized)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    matcher = RuleMatcher.from_documents(documents, optimized, group_documents)
+    logger.info(f"🎯 Rule matcher compiled: {len(matcher.specs)} rules (optimized={optimized})")
+    _cached_matchers[optimized] = (signature, matcher)
+    return matcher
+
+
+__all__ = [
+    "RuleMatcher", "Decision", "normalize_packet", "summarize", "matcher_for", "MAX_BATCH", "NUMPY_AVAILABLE",
+]
@@ -746,19 +746,73 @@ class FirewallRuleResponse(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
+class PacketTuple(BaseModel):
+    """Packet tuple for rule simulation"""
+    source_ip: str = Field(..., description="Kaynak IP")
+    destination_ip: str = Field(..., description="Hedef IP")
+    protocol: str = Field(default="TCP", description="TCP / UDP / ICMP / OTHER")
+    source_port: Optional[int] = Field(None, ge=0, le=65535)
+    destination_port: Optional[int] = Field(None, ge=0, le=65535)
+    direction: str = Field(default="IN", description="IN / OUT")
+    interface: Optional[str] = None
+    timestamp: Optional[datetime] = Field(None, description="Zamanlanmış kurallar için paket zamanı")
+
+    @validator('protocol')
+    def validate_protocol(cls, v):
+        if v.upper() not in ('TCP', 'UDP', 'ICMP', 'OTHER'):
+            raise ValueError('Protocol must be one of: TCP, UDP, ICMP, OTHER')
+        return v.upper()
+
+    @validator('direction')
+    def validate_direction(cls, v):
+        if v.upper() not in ('IN', 'OUT'):
+            raise ValueError('Direction must be IN or OUT')
+        return v.upper()
+
+    @validator('source_ip', 'destination_ip')
+    def validate_ip_address(cls, v):
+        import ipaddress
+        try:
+            ipaddress.ip_address(v.strip())
+        except ValueError:
+            raise ValueError(f'Invalid IP address: {v}')
+        return v.strip()
+
+class FirewallSimulateRequest(BaseModel):
+    """Firewall simulation request: one packet or a batch"""
+    packet: Optional[PacketTuple] = None
+    packets: Optional[List[PacketTuple]] = Field(None, max_length=100000)
+    optimized: bool = Field(default=False, description="Optimize edilmiş kural setini değerlendir")
+
+class FirewallBlocklistRequest(BaseModel):
+    """Dynamic blocklist addition: addresses or CIDRs sharing one expiry"""
+    addresses: List[str] = Field(..., min_length=1, max_length=100000)
+    ttl_seconds: Optional[int] = Field(None, ge=0, description="Süre (saniye); boş: varsayılan, 0: kalıcı")
+    reason: Optional[str] = Field(None, max_length=200)
+
 class FirewallGroupCreate(BaseModel):
     """Firewall group creation schema"""
     group_name: str = Field(..., min_length=1, max_length=100)
     description: Optional[str] = Field(None, max_length=500)
     enabled: bool = True
+    priority: int = Field(default=100, ge=1, le=1000)
     tags: List[str] = Field(default_factory=list)
 
+class FirewallGroupUpdate(BaseModel):
+    """Firewall group update schema (enabled/priority only move the group's jump)"""
+    group_name: Optional[str] = Field(None, min_length=1, max_length=100)
+    description: Optional[str] = Field(None, max_length=500)
+    enabled: Optional[bool] = None
+    priority: Optional[int] = Field(None, ge=1, le=1000)
+    tags: Optional[List[str]] = None
+
 class FirewallGroupResponse(BaseModel):
     """Firewall group response schema"""
     id: str
     group_name: str
     description: Optional[str] = None
     enabled: bool
+    priority: int = 100
     rule_count: int
     tags: List[str]
     created_at: datetime
@@ -0,0 +1,92 @@
+"""
+Chart series downsampling
+Reduces a (timestamps, values) series to a pixel budget before it is sent to
+the frontend. LTTB (Largest-Triangle-Three-Buckets) keeps the visual shape of
+line charts; min/max keeps every spike and dip, which suits counters such as
+blocked requests where an outlier must not disappear.
+"""
+from typing import List, Sequence, Tuple
+
+Series = Tuple[List[float], List[float]]
+
+
+def lttb(timestamps: Sequence[float], values: Sequence[float], threshold: int) -> Series:
+    """Largest-Triangle-Three-Buckets downsampling to at most `threshold` points"""
+    length = len(timestamps)
+    if threshold >= length or threshold < 3:
+        return list(timestamps), list(values)
+
+    sampled_t = [timestamps[0]]
+    sampled_v = [values[0]]
+    every = (length - 2) / (threshold - 2)
+    anchor = 0
+
+    for bucket in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        next_start = int((bucket + 1) * every) + 1
+        next_end = min(int((bucket + 2) * every) + 1, length)
+        span = next_end - next_start
+        avg_t = sum(timestamps[next_start:next_end]) / span
+        avg_v = sum(values[next_start:next_end]) / span
+
+        start = int(bucket * every) + 1
+        end = int((bucket + 1) * every) + 1
+        anchor_t, anchor_v = timestamps[anchor], values[anchor]
+        best_area, best = -1.0, start
+        for index in range(start, end):
+            area = abs(
+                (anchor_t - avg_t) * (values[index] - anchor_v)
+                - (anchor_t - timestamps[index]) * (avg_v - anchor_v)
+            )
+            if area > best_area:
+                best_area, best = area, index
+
+        sampled_t.append(timestamps[best])
+        sampled_v.append(values[best])
+        anchor = best
+
+    sampled_t.append(timestamps[-1])
+    sampled_v.append(values[-1])
+    return sampled_t, sampled_v
+
+
+def min_max(timestamps: Sequence[float], values: Sequence[float], threshold: int) -> Series:
+    """Keep the minimum and maximum of each of threshold/2 buckets, in time order"""
+    length = len(timestamps)
+    if threshold >= length or threshold < 2:
+        return list(timestamps), list(values)
+
+    buckets = threshold // 2
+    every = length / buckets
+    sampled_t: List[float] = []
+    sampled_v: List[float] = []
+    for bucket in range(buckets):
+        start = int(bucket * every)
+        end = min(int((bucket + 1) * every), length)
+        if start >= end:
+            continue
+        low = min(range(start, end), key=values.__getitem__)
+        high = max(range(start, end), key=values.__getitem__)
+        for index in sorted({low, high}):
+            sampled_t.append(timestamps[index])
+            sampled_v.append(values[index])
+    return sampled_t, sampled_v
+
+
+DOWNSAMPLERS = {
+    "lttb": lttb,
+    "minmax": min_max,
+}
+
+
+def downsample(timestamps: Sequence[float], values: Sequence[float], width: int,
+               method: str = "lttb") -> Series:
+    """Downsample to the chart's pixel width with the named method"""
+    try:
+        sampler = DOWNSAMPLERS[method]
+    except KeyError:
+        raise ValueError(f"Unknown downsampling method: {method}")
+    return sampler(timestamps, values, width)
+
+
+__all__ = ["lttb", "min_max", "downsample", "DOWNSAMPLERS"]
@@ -7,6 +7,10 @@ import re
 from typing import Dict, Any, List
 from fastapi import HTTPException, status
 
+from ..firewall_optimizer import RuleShape
+from ..firewall_ruleset import RulesetError, normalize_rule
+from ..rule_index import RuleIndex
+
 
 class FirewallService:
     """Service class for firewall rule management"""
@@ -16,6 +20,7 @@ class FirewallService:
         self.valid_actions = ["ALLOW", "DENY", "DROP", "REJECT"]
         self.valid_directions = ["IN", "OUT", "BOTH"]
         self.valid_profiles = ["Any", "Domain", "Private", "Public"]
+        self.rule_index = RuleIndex()
 
     async def validate_rule_data(self, rule_data: Dict[str, Any]) -> None:
         """Validate firewall rule data"""
@@ -240,46 +245,27 @@ class FirewallService:
         return formatted_rule
 
     def check_rule_conflicts(self, rule_data: Dict[str, Any], existing_rules: List[Dict[str, Any]]) -> List[str]:
-        """Check for potential conflicts with existing rules"""
+        """
+        Check for potential conflicts with existing rules. The rule index is
+        synced incrementally with existing_rules, so only rules that changed
+        since the last check are re-indexed
+        """
+        try:
+            new_rule = normalize_rule(rule_data)
+        except RulesetError:
+            return []  # validate_rule_data reports malformed rules
+
+        self.rule_index.sync(existing_rules)
+        new_shape = RuleShape(new_rule)
         conflicts = []
-
-        # Check for exact duplicates
-        for existing_rule in existing_rules:
-            if self._rules_overlap(rule_data, existing_rule):
-                conflicts.append(f"Rule overlaps with existing rule: {existing_rule.get('rule_name', 'Unknown')}")
+        for existing in self.rule_index.intersecting(new_rule):
+            existing_shape = RuleShape(existing)
+            if existing.priority <= new_rule.priority and existing_shape.covers(new_shape):
+                conflicts.append(f"Rule is fully shadowed by existing rule: {existing.name}")
+            elif existing.target != new_rule.target:
+                conflicts.append(f"Rule conflicts with existing rule: {existing.name} "
+                                 f"(overlapping traffic, {existing.action} vs {new_rule.action})")
+            else:
+                conflicts.append(f"Rule overlaps with existing rule: {existing.name}")
 
         return conflicts
-
-    def _rules_overlap(self, rule1: Dict[str, Any], rule2: Dict[str, Any]) -> bool:
-        """Check if two rules overlap in their network scope"""
-        # This is a simplified check - in production, you'd want more sophisticated overlap detection
-
-        # Check if protocols overlap
-        proto1 = rule1.get("protocol", "ANY")
-        proto2 = rule2.get("protocol", "ANY")
-
-        if proto1 != "ANY" and proto2 != "ANY" and proto1 != proto2:
-            return False
-
-        # Check if directions overlap
-        dir1 = rule1.get("direction", "IN")
-        dir2 = rule2.get("direction", "IN")
-
-        if dir1 != dir2 and "BOTH" not in [dir1, dir2]:
-            return False
-
-        # Check IP address overlap (simplified)
-        src_ips1 = rule1.get("source_ips", ["0.0.0.0/0"])
-        src_ips2 = rule2.get("source_ips", ["0.0.0.0/0"])
-
-        # If both rules have any-source or overlap in source IPs
-        if "0.0.0.0/0" in src_ips1 or "0.0.0.0/0" in src_ips2:
-            return True
-
-        # Check for actual IP overlap (simplified - check if any IPs are the same)
-        for ip1 in src_ips1:
-            for ip2 in src_ips2:
-                if ip1 == ip2:
-                    return True
-
-        return False
\ No newline at end of file
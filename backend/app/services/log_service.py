@@ -16,11 +16,21 @@ import os
 from collections import defaultdict, Counter
 
 from ..database import get_database
+from ..index_planner import register_query_shape
 from .network_service import network_service
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Query shapes issued by get_logs/export_logs (see app.index_planner)
+register_query_shape("system_logs", "logs.latest", sort=[("timestamp", DESCENDING)], owner="log_service")
+register_query_shape("system_logs", "logs.by_level", equality=["level"],
+                     sort=[("timestamp", DESCENDING)], range=["timestamp"], owner="log_service")
+register_query_shape("system_logs", "logs.by_source_ip", equality=["source_ip"],
+                     sort=[("timestamp", DESCENDING)], range=["timestamp"], owner="log_service")
+register_query_shape("system_logs", "logs.by_event_type", equality=["event_type"],
+                     sort=[("timestamp", DESCENDING)], range=["timestamp"], owner="log_service")
+
 class LogService:
     """Comprehensive log service for firewall and network traffic analysis"""
 
@@ -61,21 +71,8 @@ class LogService:
     async def _ensure_indexes(self):
         """Ensure required database indexes exist for optimal performance"""
         try:
-            # System logs indexes
-            await self.db.system_logs.create_index([
-                ("timestamp", DESCENDING),
-                ("level", ASCENDING)
-            ], name="timestamp_level_idx")
-
-            await self.db.system_logs.create_index([
-                ("source_ip", ASCENDING),
-                ("timestamp", DESCENDING)
-            ], name="source_ip_time_idx")
-
-            await self.db.system_logs.create_index([
-                ("event_type", ASCENDING),
-                ("timestamp", DESCENDING)
-            ], name="event_type_time_idx")
+            # system_logs indexes are derived from the query shapes registered
+            # at module level and created by the index planner at startup
 
             # Network activity indexes
             await self.db.network_activity.create_index([
@@ -0,0 +1,178 @@
+"""
+Content-addressed export artifact cache
+Exports are keyed by a hash of (report type, period, format, filters, data
+watermark), where the watermark is a digest of the dashboard data the export
+is rendered from. Unchanged data maps to the same key, so a repeated export is
+served from disk without rendering. Files are named <key>.<etag>.<format>; the
+ETag is the SHA-256 of the artifact bytes, so it is a valid strong validator.
+The directory is bounded by size with least-recently-used eviction.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+KEY_LENGTH = 40
+ETAG_LENGTH = 32
+STAGING = "rendering"
+
+
+@dataclass(frozen=True)
+class CachedArtifact:
+    key: str
+    path: str
+    etag: str
+    size: int
+    report_format: str
+
+    @property
+    def etag_header(self) -> str:
+        return f'"{self.etag}"'
+
+
+def artifact_key(report_type: str, filter_period: str, report_format: str,
+                 watermark: str, filters: Optional[Dict[str, Any]] = None) -> str:
+    material = json.dumps(
+        {"type": report_type, "period": filter_period, "format": report_format,
+         "filters": filters or {}, "watermark": watermark},
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(material.encode()).hexdigest()[:KEY_LENGTH]
+
+
+def data_watermark(data: Any) -> str:
+    """Digest of the JSON-compatible data an artifact is rendered from"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _file_etag(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:ETAG_LENGTH]
+
+
+class ArtifactCache:
+    """Size-bounded LRU cache of rendered export files"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CachedArtifact]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._loaded = False
+        self.total_bytes = 0
+        self.metrics = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0}
+
+    def _load(self):
+        """Index artifacts left by a previous run, oldest access first"""
+        self._loaded = True
+        if not self.directory.exists():
+            return
+        files = []
+        for path in self.directory.iterdir():
+            parts = path.name.split(".")
+            if not path.is_file() or len(parts[0]) != KEY_LENGTH:
+                continue
+            if parts[1] == STAGING:
+                path.unlink(missing_ok=True)  # render interrupted by a restart
+            elif len(parts) == 3 and len(parts[1]) == ETAG_LENGTH:
+                files.append((path.stat().st_mtime, path, parts))
+        for _, path, (key, etag, report_format) in sorted(files):
+            self._add(CachedArtifact(key, str(path), etag, path.stat().st_size, report_format))
+        self._evict()
+
+    def _add(self, artifact: CachedArtifact):
+        previous = self._entries.pop(artifact.key, None)
+        if previous is not None:
+            self.total_bytes -= previous.size
+        self._entries[artifact.key] = artifact
+        self.total_bytes += artifact.size
+
+    def _evict(self):
+        # The newest entry always survives, even if it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, artifact = self._entries.popitem(last=False)
+            self.total_bytes -= artifact.size
+            self.metrics["evictions"] += 1
+            try:
+                os.remove(artifact.path)
+            except OSError as e:
+                logger.warning(f"⚠️ Could not remove evicted artifact {artifact.path}: {e}")
+
+    def get(self, key: str) -> Optional[CachedArtifact]:
+        if not self._loaded:
+            self._load()
+        artifact = self._entries.get(key)
+        if artifact is None:
+            return None
+        if not os.path.exists(artifact.path):
+            self._entries.pop(key)
+            self.total_bytes -= artifact.size
+            return None
+        self._entries.move_to_end(key)
+        try:
+            os.utime(artifact.path)  # access order survives restarts
+        except OSError:
+            pass
+        return artifact
+
+    async def get_or_render(self, key: str, report_format: str,
+                            render: Callable[[str], Awaitable[Any]]) -> Tuple[CachedArtifact, bool]:
+        """(artifact, served_from_cache); concurrent misses for one key render once"""
+        artifact = self.get(key)
+        if artifact is not None:
+            self.metrics["hits"] += 1
+            return artifact, True
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.metrics["coalesced"] += 1
+            return await asyncio.shield(pending), True
+
+        self.metrics["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            artifact = await self._render(key, report_format, render)
+            future.set_result(artifact)
+            return artifact, False
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; keep asyncio from logging it as unretrieved
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _render(self, key: str, report_format: str,
+                      render: Callable[[str], Awaitable[Any]]) -> CachedArtifact:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        staging = str(self.directory / f"{key}.{STAGING}.{report_format}")
+        await render(staging)
+        etag = await asyncio.to_thread(_file_etag, staging)
+        final = str(self.directory / f"{key}.{etag}.{report_format}")
+        os.replace(staging, final)
+
+        artifact = CachedArtifact(key, final, etag, os.path.getsize(final), report_format)
+        self._add(artifact)
+        self._evict()
+        return artifact
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "entries": len(self._entries),
+            "total_bytes": self.total_bytes,
+            "max_bytes": self.max_bytes
+        }
+
+
+__all__ = ["ArtifactCache", "CachedArtifact", "artifact_key", "data_watermark"]
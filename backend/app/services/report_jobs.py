@@ -0,0 +1,260 @@
+"""
+Report job subsystem
+Exports are submitted as jobs tracked in generated_reports (status, progress,
+stage). Data is collected on the event loop, rendering runs in a process pool
+capped at report_max_concurrent_jobs, and submissions beyond the bounded queue
+are rejected. Identical requests join a running job or reuse a recent artifact.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from ..models.reports import ReportStatus
+from ..settings import get_settings
+from .report_renderers import render_artifact
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_FORMATS = ("pdf", "csv", "json")
+ACTIVE_STATUSES = [ReportStatus.PENDING.value, ReportStatus.GENERATING.value]
+
+
+class ReportQueueFullError(Exception):
+    """Raised when the bounded report job queue is full"""
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReportJobManager:
+    """Submits, runs and tracks report rendering jobs"""
+
+    def __init__(self, service):
+        settings = get_settings()
+        self.service = service
+        self.queue_size = settings.report_job_queue_size
+        self.reuse_seconds = settings.report_artifact_reuse_seconds
+        self.artifact_dir = Path(settings.report_artifact_dir)
+        self._slots = asyncio.Semaphore(service.max_concurrent_reports)
+        self._executor: Optional[Executor] = None
+        self.metrics = {
+            "submitted": 0,
+            "reused": 0,
+            "rejected": 0,
+            "completed": 0,
+            "failed": 0
+        }
+
+    @property
+    def db(self):
+        return self.service.db
+
+    @property
+    def active(self) -> Dict[str, asyncio.Task]:
+        """Queued and running jobs (report_id -> task)"""
+        return self.service.active_report_generations
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            try:
+                self._executor = ProcessPoolExecutor(max_workers=self.service.max_concurrent_reports)
+            except (OSError, NotImplementedError) as e:
+                # Some sandboxes cannot fork/spawn; threads still keep rendering off the loop
+                logger.warning(f"⚠️ Process pool unavailable, rendering reports in threads: {e}")
+                self._executor = ThreadPoolExecutor(max_workers=self.service.max_concurrent_reports)
+        return self._executor
+
+    async def render(self, report_format: str, payload: Dict[str, Any], path: str) -> int:
+        """Render one artifact in the worker pool under the concurrency cap"""
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool(), render_artifact, report_format, payload, path)
+
+    @staticmethod
+    def normalize_request(request: Dict[str, Any]) -> Dict[str, Any]:
+        """Accept both the frontend (format/reportType/timeFilter) and service key styles"""
+        report_format = str(request.get("format", "pdf")).lower()
+        if report_format == "excel":
+            report_format = "json"
+        if report_format not in SUPPORTED_FORMATS:
+            raise ValueError(f"Unsupported export format: {report_format}")
+        return {
+            "format": report_format,
+            "report_type": request.get("report_type") or request.get("reportType") or "full",
+            "filter_period": request.get("filter_period") or request.get("timeFilter") or "Son 30 gün",
+            "filters": request.get("filters") or {},
+        }
+
+    @staticmethod
+    def fingerprint(normalized: Dict[str, Any]) -> str:
+        return hashlib.sha256(json.dumps(normalized, sort_keys=True, default=str).encode()).hexdigest()
+
+    async def submit(self, request: Dict[str, Any], user_id: str) -> Tuple[Dict[str, Any], bool]:
+        """Queue a report job; returns (job document, reused)"""
+        normalized = self.normalize_request(request)
+        fingerprint = self.fingerprint(normalized)
+        jobs = self.db.generated_reports
+
+        running = await jobs.find_one({"fingerprint": fingerprint, "status": {"$in": ACTIVE_STATUSES}})
+        if running and running["report_id"] in self.active:
+            self.metrics["reused"] += 1
+            return running, True
+
+        recent = await jobs.find_one(
+            {
+                "fingerprint": fingerprint,
+                "status": ReportStatus.COMPLETED.value,
+                "generated_at": {"$gte": datetime.utcnow() - timedelta(seconds=self.reuse_seconds)}
+            },
+            sort=[("generated_at", -1)]
+        )
+        if recent and recent.get("file_path") and Path(recent["file_path"]).exists():
+            self.metrics["reused"] += 1
+            return recent, True
+
+        if len(self.active) >= self.service.max_concurrent_reports + self.queue_size:
+            self.metrics["rejected"] += 1
+            raise ReportQueueFullError(f"Report queue is full ({len(self.active)} jobs)")
+
+        now = datetime.utcnow()
+        report_id = uuid.uuid4().hex
+        job = {
+            "report_id": report_id,
+            "report_name": f"{normalized['report_type'].title()} - {normalized['filter_period']}",
+            "report_type": normalized["report_type"],
+            "format": normalized["format"],
+            "status": ReportStatus.PENDING.value,
+            "progress": 0,
+            "stage": "queued",
+            "fingerprint": fingerprint,
+            "filters_applied": normalized,
+            "generated_by": user_id,
+            "timestamp": now,
+            "created_at": now,
+            "download_count": 0
+        }
+        await jobs.insert_one(job)
+        job.pop("_id", None)
+
+        task = asyncio.create_task(self._run(report_id, normalized))
+        self.active[report_id] = task
+        task.add_done_callback(lambda _: self.active.pop(report_id, None))
+        self.metrics["submitted"] += 1
+        return job, False
+
+    async def _update(self, report_id: str, **fields):
+        await self.db.generated_reports.update_one({"report_id": report_id}, {"$set": fields})
+
+    async def _collect(self, normalized: Dict[str, Any]) -> Dict[str, Any]:
+        """Gather report data on the event loop (database access stays in-process)"""
+        report_format = normalized["format"]
+        if report_format == "pdf":
+            dashboard, _ = await self.service.get_dashboard_snapshot(normalized["filter_period"])
+            return {
+                "dashboard": dashboard.model_dump(mode="json"),
+                "report_type": normalized["report_type"],
+                "filter_period": normalized["filter_period"]
+            }
+        if report_format == "csv":
+            return {"rows": await self.service.generate_csv_report(normalized)}
+        return {"data": await self.service.generate_json_report(normalized)}
+
+    async def _run(self, report_id: str, normalized: Dict[str, Any]):
+        started = datetime.utcnow()
+        try:
+            async with self._slots:
+                await self._update(report_id, status=ReportStatus.GENERATING.value, progress=10, stage="collecting")
+                payload = await self._collect(normalized)
+
+                await self._update(report_id, progress=40, stage="rendering")
+                self.artifact_dir.mkdir(parents=True, exist_ok=True)
+                path = self.artifact_dir / f"{report_id}.{normalized['format']}"
+                loop = asyncio.get_running_loop()
+                size = await loop.run_in_executor(
+                    self._pool(), render_artifact, normalized["format"], payload, str(path)
+                )
+
+            await self._update(report_id, progress=90, stage="finalizing")
+            checksum = await asyncio.to_thread(_sha256, path)
+            finished = datetime.utcnow()
+            await self._update(
+                report_id,
+                status=ReportStatus.COMPLETED.value,
+                progress=100,
+                stage="done",
+                file_path=str(path),
+                file_url=f"/api/v1/reports/jobs/{report_id}/download",
+                size_bytes=size,
+                checksum=checksum,
+                generated_at=finished,
+                generation_time_seconds=(finished - started).total_seconds()
+            )
+            self.metrics["completed"] += 1
+            self.service.performance_metrics["reports_generated"] += 1
+            self.service.performance_metrics["total_generation_time"] += (finished - started).total_seconds()
+            logger.info(f"✅ Report job {report_id} completed ({size} bytes)")
+
+        except Exception as e:
+            self.metrics["failed"] += 1
+            self.service.performance_metrics["failed_generations"] += 1
+            logger.error(f"❌ Report job {report_id} failed: {e}")
+            try:
+                await self._update(report_id, status=ReportStatus.FAILED.value, stage="failed", error_message=str(e))
+            except Exception as update_error:
+                logger.warning(f"⚠️ Could not record report job failure: {update_error}")
+
+    async def get_job(self, report_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.generated_reports.find_one({"report_id": report_id}, {"_id": 0})
+
+    async def mark_downloaded(self, report_id: str):
+        await self.db.generated_reports.update_one(
+            {"report_id": report_id},
+            {"$inc": {"download_count": 1}, "$set": {"last_accessed": datetime.utcnow()}}
+        )
+
+    async def recover(self):
+        """Fail jobs interrupted by a restart and remove artifacts whose job record expired"""
+        try:
+            result = await self.db.generated_reports.update_many(
+                {"status": {"$in": ACTIVE_STATUSES}, "report_id": {"$nin": list(self.active)}},
+                {"$set": {"status": ReportStatus.FAILED.value, "stage": "failed",
+                          "error_message": "Interrupted by service restart"}}
+            )
+            if result.modified_count:
+                logger.warning(f"⚠️ Marked {result.modified_count} interrupted report jobs as failed")
+
+            if self.artifact_dir.exists():
+                files = {path.stem: path for path in self.artifact_dir.iterdir() if path.is_file()}
+                if files:
+                    known = await self.db.generated_reports.distinct("report_id", {"report_id": {"$in": list(files)}})
+                    for stem in set(files) - set(known):
+                        files[stem].unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"⚠️ Report job recovery warning: {e}")
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "active": len(self.active),
+            "max_concurrent": self.service.max_concurrent_reports,
+            "queue_size": self.queue_size
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+__all__ = ["ReportJobManager", "ReportQueueFullError", "SUPPORTED_FORMATS"]
@@ -0,0 +1,116 @@
+"""
+Latency percentiles from merged t-digests
+Whole hours come from the per-hour digests folded into report_rollups_hourly;
+the partial hours at either end of the window come from the per-minute
+digests in performance_metrics. Nothing is stored per request.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ..latency import METRIC_TYPE as LATENCY_METRIC, KIND_HTTP
+from ..sketches import TDigest
+from .report_snapshots import ROLLUP_COLLECTION, truncate_hour
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Accumulator:
+    __slots__ = ("digest", "count", "errors", "sum_ms")
+
+    def __init__(self):
+        self.digest = TDigest()
+        self.count = 0
+        self.errors = 0
+        self.sum_ms = 0.0
+
+    def add(self, entry: Dict[str, Any]):
+        self.digest.merge(TDigest.from_bytes(bytes(entry["digest"])))
+        self.count += entry.get("count", 0)
+        self.errors += entry.get("errors", 0)
+        self.sum_ms += entry.get("sum_ms", 0.0)
+
+    def summary(self) -> Dict[str, Any]:
+        result = {
+            "count": self.count,
+            "errors": self.errors,
+            "success_rate": round((1 - self.errors / self.count) * 100, 2) if self.count else None,
+            "mean_ms": round(self.sum_ms / self.count, 2) if self.count else None,
+            "max_ms": round(self.digest.max, 2) if self.count else None,
+        }
+        for quantile in QUANTILES:
+            value = self.digest.quantile(quantile) if self.count else None
+            result[f"p{int(quantile * 100)}_ms"] = round(value, 2) if value is not None else None
+        return result
+
+
+def _ceil_hour(value: datetime) -> datetime:
+    hour = truncate_hour(value)
+    return hour if hour == value else hour + timedelta(hours=1)
+
+
+async def _minute_entries(db, start: datetime, end: datetime, kind: str,
+                          name: Optional[str]) -> Iterable[Dict[str, Any]]:
+    query = {"timestamp": {"$gte": start, "$lt": end}, "metric_type": LATENCY_METRIC, "kind": kind}
+    if name:
+        query["name"] = name
+    return await db.performance_metrics.find(
+        query, {"name": 1, "count": 1, "errors": 1, "sum_ms": 1, "digest": 1}
+    ).to_list(length=None)
+
+
+async def _hour_entries(db, start: datetime, end: datetime, kind: str,
+                        name: Optional[str]) -> Tuple[List[Dict[str, Any]], int]:
+    """(latency entries, rollup hours that had any) for whole hours in [start, end)"""
+    entries: List[Dict[str, Any]] = []
+    hours = 0
+    cursor = db[ROLLUP_COLLECTION].find(
+        {"timestamp": {"$gte": start, "$lt": end}, "latency": {"$exists": True}}, {"latency": 1}
+    )
+    async for document in cursor:
+        hours += 1
+        entries.extend(
+            entry for entry in document["latency"]
+            if entry["kind"] == kind and (name is None or entry["name"] == name)
+        )
+    return entries, hours
+
+
+async def latency_percentiles(db, start_date: datetime, end_date: datetime, kind: str = KIND_HTTP,
+                              name: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+    """Overall and per-name p50/p95/p99 for [start_date, end_date)"""
+    first_hour, last_hour = _ceil_hour(start_date), truncate_hour(end_date)
+    entries: List[Dict[str, Any]] = []
+
+    hour_entries, hours = ([], 0)
+    if first_hour < last_hour:
+        hour_entries, hours = await _hour_entries(db, first_hour, last_hour, kind, name)
+
+    if hours:
+        entries.extend(hour_entries)
+        entries.extend(await _minute_entries(db, start_date, first_hour, kind, name))
+        entries.extend(await _minute_entries(db, last_hour, end_date, kind, name))
+    else:
+        # Rollups not materialized yet: merge the minute digests for the whole window
+        entries.extend(await _minute_entries(db, start_date, end_date, kind, name))
+
+    overall = _Accumulator()
+    by_name: Dict[str, _Accumulator] = {}
+    for entry in entries:
+        overall.add(entry)
+        by_name.setdefault(entry["name"], _Accumulator()).add(entry)
+
+    ranked = sorted(by_name.items(), key=lambda item: item[1].count, reverse=True)[:limit]
+    return {
+        "kind": kind,
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "digests_merged": len(entries),
+        **overall.summary(),
+        "breakdown": [{"name": entry_name, **accumulator.summary()} for entry_name, accumulator in ranked]
+    }
+
+
+__all__ = ["latency_percentiles", "QUANTILES"]
@@ -0,0 +1,109 @@
+"""
+Report query planner
+One planner is created per report build. Sub-statistics request their
+aggregations through it; identical queries (same collection and pipeline)
+are issued once and shared, and all distinct queries run concurrently
+under the report's concurrency limit.
+"""
+import asyncio
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_EVENT_LEVELS = ["ERROR", "WARNING", "CRITICAL"]
+BLOCKED_LEVELS = ["BLOCK", "DENY"]
+ATTACK_THREAT_LEVELS = ["HIGH", "CRITICAL"]
+
+# Standard report periods (UI strings) and their length in days
+PERIOD_DAYS = {
+    "Bugün": 1,
+    "Dün": 1,
+    "Son 3 gün": 3,
+    "Son 1 hafta": 7,
+    "Son 2 hafta": 14,
+    "Son 3 hafta": 21,
+    "Son 30 gün": 30,
+    "Son 60 gün": 60
+}
+# Sub-day periods (hours)
+PERIOD_HOURS = {
+    "Son 1 saat": 1
+}
+
+# performance_metrics rows carrying request latency: legacy per-request
+# response_time samples and per-minute HTTP latency digests (app.latency)
+RESPONSE_TIME_MATCH = {"$or": [
+    {"metric_type": "response_time"},
+    {"metric_type": "latency_digest", "kind": "http"}
+]}
+RESPONSE_TIME_SUM = {"$cond": [{"$eq": ["$metric_type", "latency_digest"]}, "$sum_ms", "$value"]}
+RESPONSE_TIME_COUNT = {"$cond": [{"$eq": ["$metric_type", "latency_digest"]}, "$count", 1]}
+REQUEST_ERRORS = {"$ifNull": ["$errors", 0]}
+
+# Port numbers to service names
+PORT_SERVICES = {
+    22: "SSH", 80: "HTTP", 443: "HTTPS", 21: "FTP", 25: "SMTP",
+    53: "DNS", 110: "POP3", 143: "IMAP", 993: "IMAPS", 995: "POP3S"
+}
+
+
+def period_flag(start_date: datetime) -> Dict[str, Any]:
+    """$cond expression labelling a document 'current' or 'previous' relative to start_date"""
+    return {"$cond": [{"$gte": ["$timestamp", start_date]}, "current", "previous"]}
+
+
+class ReportQueryPlanner:
+    """Deduplicating, concurrency-limited query runner for a single report"""
+
+    def __init__(self, db, max_concurrency: int = 4):
+        self.db = db
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queries: Dict[str, asyncio.Task] = {}
+        self.issued = 0
+        self.deduplicated = 0
+
+    def _submit(self, key: str, factory) -> asyncio.Task:
+        task = self._queries.get(key)
+        if task is not None:
+            self.deduplicated += 1
+            return task
+
+        async def _run():
+            async with self._semaphore:
+                return await factory()
+
+        self.issued += 1
+        task = asyncio.get_running_loop().create_task(_run())
+        self._queries[key] = task
+        return task
+
+    @staticmethod
+    def _key(kind: str, collection: str, spec: Any) -> str:
+        return f"{kind}:{collection}:{json.dumps(spec, sort_keys=True, default=str)}"
+
+    async def aggregate(self, collection: str, pipeline: List[Dict[str, Any]], length: int = None) -> List[Dict[str, Any]]:
+        """Run (or join) an aggregation; results are shared between identical requests"""
+        key = self._key("aggregate", collection, [pipeline, length])
+        return await self._submit(
+            key, lambda: self.db[collection].aggregate(pipeline).to_list(length=length)
+        )
+
+    async def shared(self, key: str, factory) -> Any:
+        """Run (or join) any other awaitable under the same limit, keyed by name"""
+        return await self._submit(f"shared:{key}", factory)
+
+    async def count(self, collection: str, query: Dict[str, Any]) -> int:
+        """Run (or join) a count_documents call"""
+        key = self._key("count", collection, query)
+        return await self._submit(key, lambda: self.db[collection].count_documents(query))
+
+
+__all__ = [
+    "ReportQueryPlanner", "period_flag",
+    "SYSTEM_EVENT_LEVELS", "BLOCKED_LEVELS", "ATTACK_THREAT_LEVELS", "PORT_SERVICES",
+    "PERIOD_DAYS", "PERIOD_HOURS",
+    "RESPONSE_TIME_MATCH", "RESPONSE_TIME_SUM", "RESPONSE_TIME_COUNT", "REQUEST_ERRORS",
+]
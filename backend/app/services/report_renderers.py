@@ -0,0 +1,110 @@
+"""
+Report artifact renderers
+Plain functions over JSON-compatible dicts so they can run in a worker
+process (ProcessPoolExecutor) instead of on the API event loop.
+"""
+import csv
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+try:
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    PDF_AVAILABLE = True
+except ImportError:
+    PDF_AVAILABLE = False
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "csv": "text/csv",
+    "json": "application/json",
+}
+
+
+def _table_style(header_font_size: int):
+    return TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), header_font_size),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+        ('GRID', (0, 0), (-1, -1), 1, colors.black)
+    ])
+
+
+def render_pdf(dashboard: Dict[str, Any], report_type: str, filter_period: str, path: str) -> None:
+    """Render the dashboard statistics PDF (dashboard is ReportsData.model_dump(mode='json'))"""
+    if not PDF_AVAILABLE:
+        raise RuntimeError("PDF generation not available. ReportLab not installed.")
+
+    doc = SimpleDocTemplate(path, pagesize=A4)
+    styles = getSampleStyleSheet()
+    story = [
+        Paragraph("KOBI Firewall - Sistem Raporu", styles['Title']),
+        Spacer(1, 12),
+        Paragraph(f"<b>Oluşturulma:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}<br/>"
+                  f"<b>Filtre:</b> {filter_period}<br/>"
+                  f"<b>Rapor Türü:</b> {report_type.title()}", styles['Normal']),
+        Spacer(1, 20),
+    ]
+
+    traffic, system = dashboard["traffic_stats"], dashboard["system_stats"]
+    security, uptime = dashboard["security_stats"], dashboard["uptime_stats"]
+    table = Table([
+        ['Metrik', 'Değer', 'Değişim'],
+        ['Toplam Trafik', traffic["total_traffic"], traffic["change_percentage"]],
+        ['Sistem Denemeleri', str(system["total_attempts"]), system["change_percentage"]],
+        ['Engellenen İstekler', str(security["blocked_requests"]), security["change_percentage"]],
+        ['Sistem Çalışma Süresi', uptime["uptime_text"], uptime["uptime_percentage"]]
+    ])
+    table.setStyle(_table_style(14))
+    story.extend([table, Spacer(1, 20)])
+
+    ports = dashboard.get("port_statistics") or []
+    if ports:
+        story.extend([Paragraph("En Çok Saldırı Alan Portlar", styles['Heading2']), Spacer(1, 12)])
+        port_table = Table([['Port', 'Servis', 'Deneme Sayısı']] + [
+            [str(port["port"]), port["service_name"], str(port["attempts"])] for port in ports[:5]
+        ])
+        port_table.setStyle(_table_style(12))
+        story.append(port_table)
+
+    doc.build(story)
+
+
+def render_csv(rows: List[Dict[str, Any]], path: str) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as handle:
+        if rows:
+            writer = csv.DictWriter(handle, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+def render_json(data: Dict[str, Any], path: str) -> None:
+    with open(path, "w", encoding="utf-8") as handle:
+        json.dump(data, handle, indent=2, ensure_ascii=False, default=str)
+
+
+def render_artifact(report_format: str, payload: Dict[str, Any], path: str) -> int:
+    """Worker entry point: render one artifact atomically and return its size"""
+    temp_path = f"{path}.part"
+    if report_format == "pdf":
+        render_pdf(payload["dashboard"], payload["report_type"], payload["filter_period"], temp_path)
+    elif report_format == "csv":
+        render_csv(payload["rows"], temp_path)
+    elif report_format == "json":
+        render_json(payload["data"], temp_path)
+    else:
+        raise ValueError(f"Unsupported report format: {report_format}")
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+
+__all__ = ["PDF_AVAILABLE", "MEDIA_TYPES", "render_pdf", "render_csv", "render_json", "render_artifact"]
@@ -0,0 +1,377 @@
+"""
+Scheduled report precomputation
+Reads report_schedules, works out each schedule's next run (frequency +
+time_of_day / days_of_week / day_of_month, or a cron expression for custom
+schedules) and renders the report ahead of time inside the off-peak window
+preceding it. Runs are spread across the window per schedule, jittered, and
+only started while the CPU / report-worker budget allows, so precomputed
+artifacts are ready to download when users ask for them.
+"""
+import hashlib
+import logging
+import random
+from calendar import monthrange
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, Optional, Set, Tuple
+
+import psutil
+
+from ..index_planner import register_query_shape
+from ..models.reports import ReportFrequency, ReportStatus
+from ..settings import get_settings
+from .report_jobs import ReportQueueFullError
+from .report_queries import PERIOD_DAYS
+
+logger = logging.getLogger(__name__)
+
+register_query_shape("report_schedules", "scheduler.due", equality=["enabled"], range=["run_at"],
+                     owner="report_scheduler")
+register_query_shape("report_schedules", "scheduler.pending", equality=["pending_report_id"],
+                     owner="report_scheduler")
+
+# Longest span searched for the next cron match (covers Feb 29 expressions)
+CRON_SEARCH_DAYS = 366 * 4 + 1
+
+
+# =============================================================================
+# NEXT RUN COMPUTATION (schedule times are server-local wall clock)
+# =============================================================================
+
+def _parse_clock(value: str) -> time:
+    hours, minutes = (value or "00:00").split(":")
+    return time(int(hours), int(minutes))
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> Set[int]:
+    values: Set[int] = set()
+    for part in field.split(","):
+        spec, _, step_text = part.partition("/")
+        step = int(step_text) if step_text else 1
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start_text, end_text = spec.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(spec)
+            end = high if step_text else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field out of range: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_cron(expression: str) -> Dict[str, Any]:
+    """Parse a 5-field cron expression (minute hour day-of-month month day-of-week, 0=Sunday)"""
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+    dow = {day % 7 for day in _parse_cron_field(fields[4], 0, 7)}  # 7 is Sunday too
+    return {
+        "minutes": sorted(_parse_cron_field(fields[0], 0, 59)),
+        "hours": sorted(_parse_cron_field(fields[1], 0, 23)),
+        "days": _parse_cron_field(fields[2], 1, 31),
+        "months": _parse_cron_field(fields[3], 1, 12),
+        # cron counts from Sunday, datetime.weekday() from Monday
+        "weekdays": {(day - 1) % 7 for day in dow},
+        "days_restricted": fields[2] != "*",
+        "weekdays_restricted": fields[4] != "*",
+    }
+
+
+def _cron_day_matches(cron: Dict[str, Any], day: datetime) -> bool:
+    if day.month not in cron["months"]:
+        return False
+    day_ok = day.day in cron["days"]
+    weekday_ok = day.weekday() in cron["weekdays"]
+    # Standard cron: when both day fields are restricted either may match
+    if cron["days_restricted"] and cron["weekdays_restricted"]:
+        return day_ok or weekday_ok
+    return day_ok and weekday_ok
+
+
+def next_cron_run(expression: str, after: datetime) -> Optional[datetime]:
+    """First time strictly after `after` matching the cron expression"""
+    cron = parse_cron(expression)
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.replace(hour=0, minute=0)
+    for _ in range(CRON_SEARCH_DAYS):
+        if _cron_day_matches(cron, day):
+            for hour in cron["hours"]:
+                for minute in cron["minutes"]:
+                    candidate = day.replace(hour=hour, minute=minute)
+                    if candidate >= start:
+                        return candidate
+        day += timedelta(days=1)
+    return None
+
+
+def _anchored_months(frequency: str, anchor_month: int) -> Set[int]:
+    if frequency == ReportFrequency.QUARTERLY.value:
+        return {(anchor_month - 1 + 3 * step) % 12 + 1 for step in range(4)}
+    if frequency == ReportFrequency.YEARLY.value:
+        return {anchor_month}
+    return set(range(1, 13))
+
+
+def compute_next_run(schedule: Dict[str, Any], after: datetime) -> Optional[datetime]:
+    """Next local run time strictly after `after`; None when the schedule cannot fire"""
+    frequency = schedule.get("frequency")
+    frequency = getattr(frequency, "value", frequency)
+    clock = _parse_clock(schedule.get("time_of_day", "00:00"))
+    weekdays = set(schedule.get("days_of_week") or [])
+
+    if frequency == ReportFrequency.CUSTOM.value:
+        expression = schedule.get("cron") or (schedule.get("filters") or {}).get("cron")
+        return next_cron_run(expression, after) if expression else None
+
+    if frequency == ReportFrequency.HOURLY.value:
+        candidate = after.replace(minute=clock.minute, second=0, microsecond=0)
+        while candidate <= after or (weekdays and candidate.weekday() not in weekdays):
+            candidate += timedelta(hours=1)
+        return candidate
+
+    if frequency in (ReportFrequency.DAILY.value, ReportFrequency.WEEKLY.value):
+        if frequency == ReportFrequency.WEEKLY.value and not weekdays:
+            weekdays = {0}
+        candidate = datetime.combine(after.date(), clock)
+        for _ in range(8):
+            if candidate > after and (not weekdays or candidate.weekday() in weekdays):
+                return candidate
+            candidate += timedelta(days=1)
+        return None
+
+    if frequency in (ReportFrequency.MONTHLY.value, ReportFrequency.QUARTERLY.value,
+                     ReportFrequency.YEARLY.value):
+        anchor = schedule.get("created_at")
+        months = _anchored_months(frequency, anchor.month if isinstance(anchor, datetime) else 1)
+        wanted_day = schedule.get("day_of_month") or 1
+        year, month = after.year, after.month
+        for _ in range(25):
+            if month in months:
+                day = min(wanted_day, monthrange(year, month)[1])
+                candidate = datetime.combine(datetime(year, month, day).date(), clock)
+                if candidate > after:
+                    return candidate
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return None
+
+    return None
+
+
+def parse_window(value: str) -> Tuple[time, time]:
+    """Parse an 'HH:MM-HH:MM' off-peak window (may wrap past midnight)"""
+    start_text, end_text = value.split("-", 1)
+    return _parse_clock(start_text.strip()), _parse_clock(end_text.strip())
+
+
+def _spread_fraction(schedule_id: str) -> float:
+    """Stable position in [0, 1) so schedules spread evenly over the window"""
+    return int(hashlib.sha1(schedule_id.encode()).hexdigest()[:8], 16) / 0x100000000
+
+
+def plan_precompute(due: datetime, schedule_id: str, window: Tuple[time, time],
+                    now: datetime, jitter_seconds: int = 0) -> datetime:
+    """
+    Pick when to render a run due at `due`: inside the latest off-peak window
+    that opens before it (clipped at `due`), otherwise at `due` itself
+    """
+    window_start, window_end = window
+    fraction = _spread_fraction(schedule_id)
+    jitter = timedelta(seconds=random.uniform(0, jitter_seconds)) if jitter_seconds else timedelta(0)
+
+    for days_back in range(2):
+        opens = datetime.combine(due.date() - timedelta(days=days_back), window_start)
+        closes = datetime.combine(opens.date(), window_end)
+        if closes <= opens:
+            closes += timedelta(days=1)
+        if opens >= due:
+            continue
+        if due <= closes:
+            # Due inside the window: spread between the window opening and the due time
+            return max(now, opens + (due - opens) * fraction)
+        run_at = opens + (closes - opens) * fraction + jitter
+        if run_at >= now:
+            return min(run_at, closes)
+        break
+    return max(now, due + jitter)
+
+
+def _local_to_utc(value: datetime) -> datetime:
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _utc_to_local(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+
+
+def filter_period_for(data_range_days: int) -> str:
+    """Smallest dashboard period covering data_range_days"""
+    ranges = sorted((days, period) for period, days in PERIOD_DAYS.items() if period != "Dün")
+    for days, period in ranges:
+        if days >= data_range_days:
+            return period
+    return ranges[-1][1]
+
+
+# =============================================================================
+# SCHEDULER
+# =============================================================================
+
+class ReportScheduler:
+    """Precomputes due report schedules through the report job manager"""
+
+    def __init__(self, service):
+        settings = get_settings()
+        self.service = service
+        self.window = parse_window(settings.report_offpeak_window)
+        self.jitter_seconds = settings.report_scheduler_jitter_seconds
+        self.max_parallel = settings.report_scheduler_max_parallel
+        self.max_cpu_percent = settings.report_scheduler_max_cpu_percent
+        self.batch_size = 20
+        self.metrics = {
+            "ticks": 0,
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "deferred": 0,
+            "last_tick": None
+        }
+
+    @property
+    def collection(self):
+        return self.service.db.report_schedules
+
+    def _plan(self, schedule: Dict[str, Any], after_utc: datetime, now_utc: datetime) -> Dict[str, Any]:
+        """next_run / run_at (UTC) for the run following after_utc"""
+        try:
+            due_local = compute_next_run(schedule, _utc_to_local(after_utc))
+        except ValueError as e:
+            logger.warning(f"⚠️ Schedule {schedule.get('schedule_name')} has an invalid cron expression: {e}")
+            due_local = None
+        if due_local is None:
+            return {"next_run": None, "run_at": None}
+
+        frequency = getattr(schedule.get("frequency"), "value", schedule.get("frequency"))
+        if frequency == ReportFrequency.HOURLY.value:
+            # Hourly runs are too frequent to move; only jitter them
+            run_local = due_local + timedelta(seconds=random.uniform(0, self.jitter_seconds))
+        else:
+            run_local = plan_precompute(due_local, str(schedule["_id"]), self.window,
+                                        _utc_to_local(now_utc), self.jitter_seconds)
+        return {"next_run": _local_to_utc(due_local), "run_at": _local_to_utc(run_local)}
+
+    def _budget_available(self, in_flight: int) -> bool:
+        """Global budget: scheduled-run cap, a free report worker and CPU headroom"""
+        if in_flight >= self.max_parallel:
+            return False
+        if len(self.service.jobs.active) >= self.service.max_concurrent_reports:
+            return False
+        try:
+            return psutil.cpu_percent(interval=None) < self.max_cpu_percent
+        except Exception:
+            return True
+
+    async def tick(self):
+        """One scheduler pass: settle finished runs, plan new schedules, start due ones"""
+        now = datetime.utcnow()
+        self.metrics["ticks"] += 1
+        self.metrics["last_tick"] = now
+        in_flight = await self._settle()
+        await self._plan_unscheduled(now)
+
+        due = self.collection.find(
+            {"enabled": True, "run_at": {"$lte": now}, "pending_report_id": None}
+        ).sort("run_at", 1).limit(self.batch_size)
+        async for schedule in due:
+            if not self._budget_available(in_flight):
+                self.metrics["deferred"] += 1
+                break
+            if await self._start(schedule, now):
+                in_flight += 1
+
+    async def _plan_unscheduled(self, now: datetime):
+        """Give enabled schedules without a run_at their first run"""
+        unscheduled = self.collection.find(
+            {"enabled": True, "run_at": None, "schedule_error": {"$exists": False}}
+        ).limit(self.batch_size)
+        async for schedule in unscheduled:
+            plan = self._plan(schedule, now, now)
+            update = {"$set": {**plan, "updated_at": now}}
+            if plan["next_run"] is None:
+                # Parked until the schedule is edited (editing clears schedule_error/run_at)
+                update["$set"]["schedule_error"] = "No upcoming run for this frequency/cron"
+                logger.warning(f"⚠️ Schedule {schedule.get('schedule_name')} has no upcoming run")
+            await self.collection.update_one({"_id": schedule["_id"]}, update)
+
+    async def _start(self, schedule: Dict[str, Any], now: datetime) -> bool:
+        request = {
+            "format": getattr(schedule.get("format"), "value", schedule.get("format") or "pdf"),
+            "report_type": getattr(schedule.get("report_type"), "value", schedule.get("report_type") or "full"),
+            "filter_period": filter_period_for(schedule.get("data_range_days") or 7),
+            "filters": schedule.get("filters") or {},
+        }
+        # Missed runs (downtime) are caught up once, then planning resumes from now
+        plan = self._plan(schedule, max(schedule.get("next_run") or now, now), now)
+        try:
+            job, reused = await self.service.jobs.submit(request, str(schedule.get("created_by", "scheduler")))
+        except ReportQueueFullError:
+            self.metrics["deferred"] += 1
+            return False
+        except Exception as e:
+            logger.error(f"❌ Scheduled report {schedule.get('schedule_name')} could not start: {e}")
+            await self.collection.update_one(
+                {"_id": schedule["_id"]},
+                {"$set": {**plan, "last_run": now, "last_status": ReportStatus.FAILED.value, "updated_at": now},
+                 "$inc": {"failure_count": 1}}
+            )
+            self.metrics["failed"] += 1
+            return False
+
+        await self.collection.update_one(
+            {"_id": schedule["_id"]},
+            {"$set": {**plan, "last_run": now, "last_status": ReportStatus.PENDING.value,
+                      "pending_report_id": job["report_id"], "updated_at": now}}
+        )
+        self.metrics["started"] += 1
+        logger.info(f"🗓️ Scheduled report {schedule.get('schedule_name')} "
+                    f"{'reused' if reused else 'queued'} as {job['report_id']}")
+        return not reused
+
+    async def _settle(self) -> int:
+        """Record finished scheduled runs; returns how many are still in flight"""
+        in_flight = 0
+        async for schedule in self.collection.find({"pending_report_id": {"$ne": None}}):
+            job = await self.service.jobs.get_job(schedule["pending_report_id"])
+            status = job.get("status") if job else ReportStatus.FAILED.value
+            if status == ReportStatus.COMPLETED.value:
+                update = {"$set": {"last_status": status, "last_report_id": job["report_id"]},
+                          "$inc": {"run_count": 1}}
+                self.metrics["completed"] += 1
+            elif status == ReportStatus.FAILED.value:
+                update = {"$set": {"last_status": status}, "$inc": {"failure_count": 1}}
+                self.metrics["failed"] += 1
+            else:
+                in_flight += 1
+                continue
+            update["$set"]["pending_report_id"] = None
+            await self.collection.update_one({"_id": schedule["_id"]}, update)
+        return in_flight
+
+    async def latest_artifact(self, schedule_id) -> Optional[Dict[str, Any]]:
+        """Most recent precomputed job for a schedule"""
+        schedule = await self.collection.find_one({"_id": schedule_id}, {"last_report_id": 1})
+        if not schedule or not schedule.get("last_report_id"):
+            return None
+        return await self.service.jobs.get_job(schedule["last_report_id"])
+
+    def get_status(self) -> Dict[str, Any]:
+        return {
+            **self.metrics,
+            "offpeak_window": f"{self.window[0].strftime('%H:%M')}-{self.window[1].strftime('%H:%M')}",
+            "max_parallel": self.max_parallel,
+            "max_cpu_percent": self.max_cpu_percent
+        }
+
+
+__all__ = ["ReportScheduler", "compute_next_run", "next_cron_run", "plan_precompute", "filter_period_for"]
@@ -0,0 +1,218 @@
+"""
+Time-bucketed chart series
+Buckets a metric with $dateTrunc - from the hourly rollups for hour and
+coarser granularities, from the raw time-series collections for sub-hour
+ones - fills empty buckets, and downsamples to the chart's pixel budget.
+Series are returned as columnar arrays (epoch-ms timestamps, values).
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .downsampling import DOWNSAMPLERS, downsample
+from .report_queries import (
+    SYSTEM_EVENT_LEVELS, BLOCKED_LEVELS, ATTACK_THREAT_LEVELS,
+    RESPONSE_TIME_MATCH, RESPONSE_TIME_SUM, RESPONSE_TIME_COUNT
+)
+from .report_snapshots import ROLLUP_COLLECTION, BACKFILL_DAYS
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1)
+# $dateTrunc bins are aligned to this reference; week bins start on Monday
+BIN_REFERENCE = datetime(2000, 1, 1)
+WEEK_REFERENCE = datetime(2000, 1, 3)
+
+SERIES_RANGES = {
+    "1h": timedelta(hours=1),
+    "6h": timedelta(hours=6),
+    "24h": timedelta(hours=24),
+    "7d": timedelta(days=7),
+    "30d": timedelta(days=30),
+    "90d": timedelta(days=90),
+}
+
+# granularity -> ($dateTrunc unit, binSize, bucket length)
+SERIES_GRANULARITIES = {
+    "1m": ("minute", 1, timedelta(minutes=1)),
+    "5m": ("minute", 5, timedelta(minutes=5)),
+    "15m": ("minute", 15, timedelta(minutes=15)),
+    "1h": ("hour", 1, timedelta(hours=1)),
+    "6h": ("hour", 6, timedelta(hours=6)),
+    "1d": ("day", 1, timedelta(days=1)),
+    "1w": ("week", 1, timedelta(weeks=1)),
+}
+
+MAX_BUCKETS = 20000
+DEFAULT_WIDTH = 800
+
+
+@dataclass(frozen=True)
+class SeriesMetric:
+    """Where a chart metric comes from at rollup and raw granularity"""
+    unit: str
+    rollup_field: str
+    raw_collection: str
+    raw_match: Dict[str, Any]
+    raw_value: Any
+    average: bool = False               # mean per bucket instead of a sum
+    rollup_count_field: Optional[str] = None
+    raw_count: Any = 1                  # per-document weight of an averaged raw metric
+
+
+SERIES_METRICS = {
+    "traffic_bytes": SeriesMetric(
+        unit="bytes", rollup_field="traffic_bytes", raw_collection="traffic_analytics",
+        raw_match={}, raw_value={"$add": ["$bytes_in", "$bytes_out"]}
+    ),
+    "traffic_packets": SeriesMetric(
+        unit="packets", rollup_field="traffic_packets", raw_collection="traffic_analytics",
+        raw_match={}, raw_value={"$add": ["$packets_in", "$packets_out"]}
+    ),
+    "system_events": SeriesMetric(
+        unit="events", rollup_field="system_events", raw_collection="system_logs",
+        raw_match={"level": {"$in": SYSTEM_EVENT_LEVELS}}, raw_value=1
+    ),
+    "blocked_requests": SeriesMetric(
+        unit="requests", rollup_field="blocked_requests", raw_collection="system_logs",
+        raw_match={"level": {"$in": BLOCKED_LEVELS}}, raw_value=1
+    ),
+    "attack_attempts": SeriesMetric(
+        unit="events", rollup_field="attack_attempts", raw_collection="security_events",
+        raw_match={"threat_level": {"$in": ATTACK_THREAT_LEVELS}}, raw_value=1
+    ),
+    "response_time": SeriesMetric(
+        unit="ms", rollup_field="response_time_sum", raw_collection="performance_metrics",
+        raw_match=RESPONSE_TIME_MATCH, raw_value=RESPONSE_TIME_SUM, raw_count=RESPONSE_TIME_COUNT,
+        average=True, rollup_count_field="response_time_count"
+    ),
+}
+
+
+def auto_granularity(span: timedelta, width: int) -> str:
+    """Finest granularity that still fits within the pixel budget"""
+    for name, (_, _, step) in SERIES_GRANULARITIES.items():
+        if span / step <= width:
+            return name
+    return "1w"
+
+
+def align(value: datetime, granularity: str) -> datetime:
+    """Floor a timestamp the way $dateTrunc bins it"""
+    unit, _, step = SERIES_GRANULARITIES[granularity]
+    reference = WEEK_REFERENCE if unit == "week" else BIN_REFERENCE
+    return reference + step * ((value - reference) // step)
+
+
+def _epoch_ms(value: datetime) -> int:
+    return int((value - EPOCH).total_seconds() * 1000)
+
+
+def bucket_pipeline(match: Dict[str, Any], granularity: str, value: Any,
+                    count: Any = None) -> List[Dict[str, Any]]:
+    unit, bin_size, _ = SERIES_GRANULARITIES[granularity]
+    trunc = {"date": "$timestamp", "unit": unit, "binSize": bin_size}
+    if unit == "week":
+        trunc["startOfWeek"] = "monday"
+    group = {"_id": {"$dateTrunc": trunc}, "v": {"$sum": value}}
+    if count is not None:
+        group["n"] = {"$sum": count}
+    return [{"$match": match}, {"$group": group}, {"$sort": {"_id": 1}}]
+
+
+class SeriesService:
+    """Builds downsampled, columnar chart series for the reports API"""
+
+    def __init__(self, service):
+        self.service = service
+
+    @property
+    def db(self):
+        return self.service.db
+
+    @staticmethod
+    def resolve(metric: str, range_name: str, granularity: str, width: int,
+                method: str = "lttb") -> Tuple[SeriesMetric, timedelta, str]:
+        """Validate request parameters; raises ValueError for unknown or oversized requests"""
+        if method not in DOWNSAMPLERS:
+            raise ValueError(f"Unknown downsampling method '{method}' (expected one of {', '.join(DOWNSAMPLERS)})")
+        if metric not in SERIES_METRICS:
+            raise ValueError(f"Unknown metric '{metric}' (expected one of {', '.join(SERIES_METRICS)})")
+        if range_name not in SERIES_RANGES:
+            raise ValueError(f"Unknown range '{range_name}' (expected one of {', '.join(SERIES_RANGES)})")
+        span = SERIES_RANGES[range_name]
+        if granularity == "auto":
+            granularity = auto_granularity(span, width)
+        if granularity not in SERIES_GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}'")
+        if span / SERIES_GRANULARITIES[granularity][2] > MAX_BUCKETS:
+            raise ValueError(f"Range {range_name} at {granularity} exceeds {MAX_BUCKETS} buckets")
+        if span > timedelta(days=BACKFILL_DAYS):
+            raise ValueError(f"Range {range_name} exceeds rollup retention ({BACKFILL_DAYS} days)")
+        return SERIES_METRICS[metric], span, granularity
+
+    async def _fetch(self, spec: SeriesMetric, start: datetime, end: datetime,
+                     granularity: str) -> List[Dict[str, Any]]:
+        window = {"timestamp": {"$gte": start, "$lt": end}}
+        if SERIES_GRANULARITIES[granularity][2] >= timedelta(hours=1):
+            pipeline = bucket_pipeline(
+                window, granularity, f"${spec.rollup_field}",
+                f"${spec.rollup_count_field}" if spec.rollup_count_field else None
+            )
+            collection = self.db[ROLLUP_COLLECTION]
+        else:
+            pipeline = bucket_pipeline(
+                {**window, **spec.raw_match}, granularity, spec.raw_value, spec.raw_count if spec.average else None
+            )
+            collection = self.db[spec.raw_collection]
+        return await collection.aggregate(pipeline).to_list(length=None)
+
+    async def get_series(self, metric: str, range_name: str = "24h", granularity: str = "auto",
+                         width: int = DEFAULT_WIDTH, method: str = "lttb",
+                         now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Columnar series {t: [epoch ms], v: [values]} for one metric"""
+        spec, span, granularity = self.resolve(metric, range_name, granularity, width, method)
+        step = SERIES_GRANULARITIES[granularity][2]
+        end = now or datetime.utcnow()
+        start = align(end - span, granularity)
+
+        rows = await self._fetch(spec, start, end, granularity)
+        by_bucket = {row["_id"]: row for row in rows}
+
+        timestamps: List[int] = []
+        values: List[float] = []
+        bucket = start
+        while bucket < end:
+            row = by_bucket.get(bucket)
+            if spec.average:
+                # Empty buckets have no mean; leave a gap instead of a fake zero
+                if row and row.get("n"):
+                    timestamps.append(_epoch_ms(bucket))
+                    values.append(round(row["v"] / row["n"], 3))
+            else:
+                timestamps.append(_epoch_ms(bucket))
+                values.append(row["v"] if row else 0)
+            bucket += step
+
+        raw_points = len(timestamps)
+        downsampled = raw_points > width
+        if downsampled:
+            timestamps, values = downsample(timestamps, values, width, method)
+
+        return {
+            "metric": metric,
+            "unit": spec.unit,
+            "range": range_name,
+            "granularity": granularity,
+            "bucket_ms": int(step.total_seconds() * 1000),
+            "t": timestamps,
+            "v": values,
+            "raw_points": raw_points,
+            "downsampled": downsampled,
+            "method": method if downsampled else None,
+            "generated_at": end.isoformat()
+        }
+
+
+__all__ = ["SeriesService", "SERIES_METRICS", "SERIES_RANGES", "SERIES_GRANULARITIES", "auto_granularity", "align"]
@@ -0,0 +1,464 @@
+"""
+Materialized dashboard snapshots
+Raw telemetry is folded into hourly rollups (report_rollups_hourly). Each
+refresh re-rolls only the hours since the previous run (plus a short
+late-arrival lookback), then rebuilds one snapshot document per standard
+period in dashboard_snapshots from the rollups. The reports endpoints read a
+snapshot by _id instead of aggregating raw collections per request.
+Distinct blocked sources and top ports / talkers are kept per hour as
+mergeable sketches (see app.sketches) rather than raw value lists.
+"""
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReplaceOne
+
+from ..schemas.reports import (
+    ReportsData, TrafficStatsData, SystemStatsData, SecurityStatsData,
+    QuickStatsData, PortStatisticData
+)
+from ..latency import METRIC_TYPE as LATENCY_METRIC
+from ..sketches import HyperLogLog, TopK, TDigest
+from .report_queries import (
+    period_flag, SYSTEM_EVENT_LEVELS, BLOCKED_LEVELS, ATTACK_THREAT_LEVELS, PORT_SERVICES, PERIOD_DAYS,
+    RESPONSE_TIME_MATCH, RESPONSE_TIME_SUM, RESPONSE_TIME_COUNT, REQUEST_ERRORS
+)
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "report_rollups_hourly"
+SNAPSHOT_COLLECTION = "dashboard_snapshots"
+STATE_ID = "_materializer_state"
+# Bump when the rollup document layout changes; a mismatch triggers a full backfill
+ROLLUP_VERSION = 3
+SKETCH_FIELDS = ("blocked_sources_hll", "top_ports", "top_blocked_ports", "top_sources", "top_destinations")
+
+# Periods kept materialized (sub-day periods stay on the live path)
+SNAPSHOT_PERIODS = list(PERIOD_DAYS)
+
+# Closed hours are re-rolled this far back so late (spooled/replayed) writes are picked up
+LATE_ARRIVAL_HOURS = 2
+# First run backfills current + previous window of the longest period
+BACKFILL_DAYS = 120
+# Rollups are computed one window at a time so a backfill never holds more than a day in memory
+ROLLUP_CHUNK = timedelta(days=1)
+
+
+def truncate_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def _hour_bucket() -> Dict[str, Any]:
+    return {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}}
+
+
+class DashboardSnapshots:
+    """Hourly rollups + per-period snapshot documents for the reports dashboard"""
+
+    def __init__(self, service):
+        self.service = service
+        self.metrics = {
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "hours_rolled": 0,
+            "last_refresh": None,
+            "last_refresh_ms": 0.0
+        }
+
+    @property
+    def db(self):
+        return self.service.db
+
+    async def ensure_indexes(self):
+        """Rollups expire once no period (current + previous window) can reach them"""
+        try:
+            await self.db[ROLLUP_COLLECTION].create_index(
+                [("timestamp", 1)], expireAfterSeconds=BACKFILL_DAYS * 86400, name="rollup_ttl"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Rollup index warning: {e}")
+
+    # -------------------------------------------------------------------------
+    # Rollups
+    # -------------------------------------------------------------------------
+
+    async def _rollup_since(self, since: datetime) -> int:
+        """Recompute the hourly rollup documents for every hour >= since, one ROLLUP_CHUNK at a time"""
+        rolled = 0
+        start = since
+        last_chunk = truncate_hour(datetime.utcnow()) - ROLLUP_CHUNK
+        while start < last_chunk:
+            rolled += await self._rollup_window(start, start + ROLLUP_CHUNK)
+            start += ROLLUP_CHUNK
+        # The newest chunk stays open-ended so the current hour and late writes are included
+        return rolled + await self._rollup_window(start, None)
+
+    async def _rollup_window(self, start: datetime, end: Optional[datetime]) -> int:
+        """Recompute the hourly rollup documents for every hour in [start, end)"""
+        window = {"timestamp": {"$gte": start, **({"$lt": end} if end is not None else {})}}
+        hours: Dict[datetime, Dict[str, Any]] = {}
+
+        def bucket(hour: datetime) -> Dict[str, Any]:
+            return hours.setdefault(hour, {
+                "timestamp": hour,
+                "traffic_bytes": 0, "traffic_packets": 0, "traffic_samples": 0,
+                "system_events": 0, "blocked_requests": 0, "attack_attempts": 0,
+                "response_time_sum": 0.0, "response_time_count": 0, "request_errors": 0
+            })
+
+        traffic = await self.db.traffic_analytics.aggregate([
+            {"$match": window},
+            {"$group": {
+                "_id": _hour_bucket(),
+                "bytes": {"$sum": {"$add": ["$bytes_in", "$bytes_out"]}},
+                "packets": {"$sum": {"$add": ["$packets_in", "$packets_out"]}},
+                "samples": {"$sum": 1}
+            }}
+        ]).to_list(length=None)
+        for row in traffic:
+            doc = bucket(row["_id"])
+            doc.update(traffic_bytes=row["bytes"], traffic_packets=row["packets"], traffic_samples=row["samples"])
+
+        logs = await self.db.system_logs.aggregate([
+            {"$match": {**window, "level": {"$in": SYSTEM_EVENT_LEVELS + BLOCKED_LEVELS}}},
+            {"$group": {
+                "_id": _hour_bucket(),
+                "system_events": {"$sum": {"$cond": [{"$in": ["$level", SYSTEM_EVENT_LEVELS]}, 1, 0]}},
+                "blocked_requests": {"$sum": {"$cond": [{"$in": ["$level", BLOCKED_LEVELS]}, 1, 0]}}
+            }}
+        ]).to_list(length=None)
+        for row in logs:
+            bucket(row["_id"]).update(system_events=row["system_events"], blocked_requests=row["blocked_requests"])
+
+        # Per-hour exact counts feed the hour's sketches
+        port_attempts: Dict[datetime, Dict[int, int]] = {}
+        port_blocked: Dict[datetime, Dict[int, int]] = {}
+        source_events: Dict[datetime, Dict[str, int]] = {}
+        blocked_sources: Dict[datetime, List[str]] = {}
+        destination_events: Dict[datetime, Dict[str, int]] = {}
+
+        ports = await self.db.system_logs.aggregate([
+            {"$match": {**window, "destination_port": {"$exists": True, "$ne": None}}},
+            {"$group": {
+                "_id": {"hour": _hour_bucket(), "port": "$destination_port"},
+                "attempts": {"$sum": 1},
+                "blocked": {"$sum": {"$cond": [{"$in": ["$level", BLOCKED_LEVELS]}, 1, 0]}}
+            }}
+        ], allowDiskUse=True).to_list(length=None)
+        for row in ports:
+            hour, port = row["_id"]["hour"], row["_id"]["port"]
+            port_attempts.setdefault(hour, {})[port] = row["attempts"]
+            if row["blocked"]:
+                port_blocked.setdefault(hour, {})[port] = row["blocked"]
+
+        sources = await self.db.system_logs.aggregate([
+            {"$match": {**window, "source_ip": {"$exists": True, "$ne": None}}},
+            {"$group": {
+                "_id": {"hour": _hour_bucket(), "ip": "$source_ip"},
+                "events": {"$sum": 1},
+                "blocked": {"$sum": {"$cond": [{"$in": ["$level", BLOCKED_LEVELS]}, 1, 0]}}
+            }}
+        ], allowDiskUse=True).to_list(length=None)
+        for row in sources:
+            hour, ip = row["_id"]["hour"], row["_id"]["ip"]
+            source_events.setdefault(hour, {})[ip] = row["events"]
+            if row["blocked"]:
+                blocked_sources.setdefault(hour, []).append(ip)
+
+        destinations = await self.db.system_logs.aggregate([
+            {"$match": {**window, "destination_ip": {"$exists": True, "$ne": None}}},
+            {"$group": {"_id": {"hour": _hour_bucket(), "ip": "$destination_ip"}, "events": {"$sum": 1}}}
+        ], allowDiskUse=True).to_list(length=None)
+        for row in destinations:
+            destination_events.setdefault(row["_id"]["hour"], {})[row["_id"]["ip"]] = row["events"]
+
+        for hour in set(port_attempts) | set(source_events) | set(destination_events):
+            bucket(hour).update(
+                blocked_sources_hll=HyperLogLog().update(blocked_sources.get(hour, [])).to_bytes(),
+                top_ports=TopK.from_counts(port_attempts.get(hour, {})).to_document(),
+                top_blocked_ports=TopK.from_counts(port_blocked.get(hour, {})).to_document(),
+                top_sources=TopK.from_counts(source_events.get(hour, {})).to_document(),
+                top_destinations=TopK.from_counts(destination_events.get(hour, {})).to_document()
+            )
+
+        attacks = await self.db.security_events.aggregate([
+            {"$match": {**window, "threat_level": {"$in": ATTACK_THREAT_LEVELS}}},
+            {"$group": {"_id": _hour_bucket(), "count": {"$sum": 1}}}
+        ]).to_list(length=None)
+        for row in attacks:
+            bucket(row["_id"])["attack_attempts"] = row["count"]
+
+        response_times = await self.db.performance_metrics.aggregate([
+            {"$match": {**window, **RESPONSE_TIME_MATCH}},
+            {"$group": {
+                "_id": _hour_bucket(),
+                "sum": {"$sum": RESPONSE_TIME_SUM},
+                "count": {"$sum": RESPONSE_TIME_COUNT},
+                "errors": {"$sum": REQUEST_ERRORS}
+            }}
+        ]).to_list(length=None)
+        for row in response_times:
+            bucket(row["_id"]).update(response_time_sum=row["sum"], response_time_count=row["count"],
+                                      request_errors=row["errors"])
+
+        # Per-minute latency digests fold into one digest per (hour, kind, name)
+        latency: Dict[datetime, Dict[Tuple[str, str], Dict[str, Any]]] = {}
+        digests = self.db.performance_metrics.find(
+            {**window, "metric_type": LATENCY_METRIC},
+            {"timestamp": 1, "kind": 1, "name": 1, "count": 1, "errors": 1, "sum_ms": 1, "digest": 1}
+        )
+        async for row in digests:
+            entry = latency.setdefault(truncate_hour(row["timestamp"]), {}).setdefault(
+                (row["kind"], row["name"]), {"digest": TDigest(), "count": 0, "errors": 0, "sum_ms": 0.0}
+            )
+            entry["digest"].merge(TDigest.from_bytes(bytes(row["digest"])))
+            entry["count"] += row.get("count", 0)
+            entry["errors"] += row.get("errors", 0)
+            entry["sum_ms"] += row.get("sum_ms", 0.0)
+        for hour, entries in latency.items():
+            bucket(hour)["latency"] = [
+                {"kind": kind, "name": name, "count": entry["count"], "errors": entry["errors"],
+                 "sum_ms": round(entry["sum_ms"], 3), "digest": entry["digest"].to_bytes()}
+                for (kind, name), entry in entries.items()
+            ]
+
+        rollups = self.db[ROLLUP_COLLECTION]
+        # Hours that lost all their data (expired/cleaned) must not keep stale rollups
+        await rollups.delete_many({**window, "_id": {"$nin": list(hours)}})
+        now = datetime.utcnow()
+        if hours:
+            await rollups.bulk_write(
+                [ReplaceOne({"_id": hour}, {**doc, "updated_at": now}, upsert=True) for hour, doc in hours.items()],
+                ordered=False
+            )
+        return len(hours)
+
+    # -------------------------------------------------------------------------
+    # Snapshots
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def period_window(period: str, now: Optional[datetime] = None) -> Tuple[datetime, datetime]:
+        """Hour-aligned [start, end) window of a standard period"""
+        end = truncate_hour(now or datetime.utcnow()) + timedelta(hours=1)
+        days = PERIOD_DAYS.get(period, 30)
+        if period == "Dün":
+            end -= timedelta(days=1)
+        return end - timedelta(days=days), end
+
+    async def _build_snapshot(self, period: str, sketches: Optional[Dict[str, Any]]) -> ReportsData:
+        start_date, end_date = self.period_window(period)
+        prev_start = start_date - (end_date - start_date)
+        current = {"$match": {"timestamp": {"$gte": start_date}}}
+
+        result = await self.db[ROLLUP_COLLECTION].aggregate([
+            {"$match": {"timestamp": {"$gte": prev_start, "$lt": end_date}}},
+            {"$facet": {
+                "periods": [{"$group": {
+                    "_id": period_flag(start_date),
+                    "traffic_bytes": {"$sum": "$traffic_bytes"},
+                    "system_events": {"$sum": "$system_events"},
+                    "blocked_requests": {"$sum": "$blocked_requests"},
+                    "attack_attempts": {"$sum": "$attack_attempts"},
+                    "response_time_sum": {"$sum": "$response_time_sum"},
+                    "response_time_count": {"$sum": "$response_time_count"},
+                    "request_errors": {"$sum": "$request_errors"}
+                }}],
+                "peak_hour": [
+                    current,
+                    {"$group": {"_id": {"$hour": "$timestamp"}, "bytes": {"$sum": "$traffic_bytes"}}},
+                    {"$sort": {"bytes": -1}},
+                    {"$limit": 1}
+                ]
+            }}
+        ]).to_list(length=1)
+        facets = result[0] if result else {}
+        periods = {row["_id"]: row for row in facets.get("periods", [])}
+        return self._assemble(periods.get("current", {}), periods.get("previous", {}), facets, sketches,
+                              days=(end_date - start_date).days or 1)
+
+    async def load_sketches(self, windows: Dict[str, Tuple[datetime, datetime]]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Merge the hourly sketches of each [start, end) window; None for windows
+        without sketched hours. Windows sharing an end are nested, so they are
+        served by one newest-to-oldest pass that snapshots the running merge at
+        each window start instead of re-merging the same hours per window.
+        """
+        merged: Dict[str, Optional[Dict[str, Any]]] = {}
+        by_end: Dict[datetime, List[Tuple[datetime, str]]] = {}
+        for key, (start, end) in windows.items():
+            by_end.setdefault(end, []).append((truncate_hour(start), key))
+
+        for end, starts in by_end.items():
+            starts.sort(reverse=True)
+            cursor = self.db[ROLLUP_COLLECTION].find(
+                {"timestamp": {"$gte": starts[-1][0], "$lt": end}, "top_ports": {"$exists": True}},
+                {"timestamp": 1, **{field: 1 for field in SKETCH_FIELDS}}
+            ).sort("timestamp", -1)
+
+            running = {"blocked_sources": HyperLogLog(), **{field: TopK() for field in SKETCH_FIELDS[1:]}, "hours": 0}
+            async for document in cursor:
+                while starts and document["timestamp"] < starts[0][0]:
+                    merged[starts.pop(0)[1]] = self._copy_sketches(running)
+                if document.get("blocked_sources_hll"):
+                    running["blocked_sources"].merge(HyperLogLog.from_bytes(bytes(document["blocked_sources_hll"])))
+                for field in SKETCH_FIELDS[1:]:
+                    if document.get(field):
+                        running[field].merge(TopK.from_document(document[field]))
+                running["hours"] += 1
+            for _, key in starts:
+                merged[key] = self._copy_sketches(running)
+        return merged
+
+    @staticmethod
+    def _copy_sketches(running: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if not running["hours"]:
+            return None
+        return {key: value if key == "hours" else value.copy() for key, value in running.items()}
+
+    @staticmethod
+    def port_statistics(sketches: Dict[str, Any], limit: int = 10) -> List[PortStatisticData]:
+        """Top ports by blocked attempts from merged sketches (counts are lower bounds)"""
+        attempts: TopK = sketches["top_ports"]
+        ranked = sketches["top_blocked_ports"].top(limit) or attempts.top(limit)
+        stats = []
+        for port, blocked, _ in ranked:
+            if isinstance(port, int) and 1 <= port <= 65535:
+                stats.append(PortStatisticData(
+                    port=port, service_name=PORT_SERVICES.get(port, f"PORT-{port}"),
+                    attempts=max(attempts.estimate(port)[0], blocked),
+                    blocked_attempts=blocked if sketches["top_blocked_ports"].counts else 0
+                ))
+        return stats
+
+    @staticmethod
+    def _change(current: int, previous: int, default: str) -> str:
+        if previous > 0:
+            return f"{((current - previous) / previous) * 100:+.0f}% bu ay"
+        return default
+
+    def _assemble(self, current: Dict[str, Any], previous: Dict[str, Any],
+                  facets: Dict[str, Any], sketches: Optional[Dict[str, Any]], days: int) -> ReportsData:
+        """Shape rollup sums like the live dashboard (same fallbacks and formatting)"""
+        service = self.service
+        total_bytes = current.get("traffic_bytes", 0)
+
+        if total_bytes:
+            traffic_stats = TrafficStatsData(
+                total_traffic=service._format_bytes(total_bytes),
+                total_traffic_bytes=total_bytes,
+                change_percentage=self._change(total_bytes, previous.get("traffic_bytes", 0), "+12% bu ay")
+            )
+            daily_average_bytes = total_bytes // days
+            daily_average_traffic = service._format_bytes(daily_average_bytes)
+        else:
+            traffic_stats = TrafficStatsData(total_traffic="2.4 TB", total_traffic_bytes=2400000000000,
+                                             change_percentage="+12% bu ay")
+            daily_average_traffic, daily_average_bytes = "80 GB", 80000000000
+
+        system_events = current.get("system_events", 0)
+        blocked_requests = current.get("blocked_requests", 0)
+        blocked_ips = sketches["blocked_sources"].count() if sketches else None
+
+        peak = facets.get("peak_hour", [])
+        peak_hour = f"{peak[0]['_id']:02d}:00-{(peak[0]['_id'] + 1):02d}:00" if peak else "14:00-15:00"
+        rt_count = current.get("response_time_count", 0)
+        response_time = f"{current['response_time_sum'] / rt_count:.0f}ms" if rt_count else "12ms"
+        success_rate = (f"{(1 - current.get('request_errors', 0) / rt_count) * 100:.1f}%"
+                        if rt_count else "99.2%")
+
+        port_stats = (self.port_statistics(sketches) if sketches else []) or [
+            PortStatisticData(port=22, service_name="SSH", attempts=156, blocked_attempts=156),
+            PortStatisticData(port=80, service_name="HTTP", attempts=89, blocked_attempts=89),
+            PortStatisticData(port=443, service_name="HTTPS", attempts=34, blocked_attempts=34)
+        ]
+
+        uptime_seconds = service._get_system_uptime()
+        return ReportsData(
+            traffic_stats=traffic_stats,
+            system_stats=SystemStatsData(
+                total_attempts=system_events or 34,
+                change_percentage=self._change(system_events, previous.get("system_events", 0), "-8% bu ay")
+            ),
+            security_stats=SecurityStatsData(
+                blocked_requests=blocked_requests or 1247,
+                change_percentage=self._change(blocked_requests, previous.get("blocked_requests", 0), "+3% bu ay"),
+                attack_attempts=current.get("attack_attempts", 0) or 34,
+                blocked_ips=blocked_ips if blocked_ips is not None else 12
+            ),
+            uptime_stats=service._build_uptime_stats(uptime_seconds),
+            quick_stats=QuickStatsData(
+                daily_average_traffic=daily_average_traffic,
+                daily_average_traffic_bytes=daily_average_bytes,
+                peak_hour=peak_hour,
+                average_response_time=response_time,
+                success_rate=success_rate,
+                security_score="8.7/10"
+            ),
+            port_statistics=port_stats,
+            last_updated=datetime.utcnow()
+        )
+
+    # -------------------------------------------------------------------------
+    # Refresh / read
+    # -------------------------------------------------------------------------
+
+    async def refresh(self) -> Dict[str, Any]:
+        """Roll up the delta since the last run and rebuild every period snapshot"""
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        snapshots = self.db[SNAPSHOT_COLLECTION]
+
+        try:
+            state = await snapshots.find_one({"_id": STATE_ID})
+            rolled_until = state.get("rolled_until") if state else None
+            if rolled_until is None or state.get("rollup_version") != ROLLUP_VERSION:
+                since = truncate_hour(now) - timedelta(days=BACKFILL_DAYS)
+            else:
+                since = min(rolled_until, truncate_hour(now)) - timedelta(hours=LATE_ARRIVAL_HOURS)
+
+            hours = await self._rollup_since(since)
+            await snapshots.replace_one(
+                {"_id": STATE_ID}, {"_id": STATE_ID, "rolled_until": truncate_hour(now), "rollup_version": ROLLUP_VERSION,
+                 "updated_at": now},
+                upsert=True
+            )
+
+            sketches = await self.load_sketches({period: self.period_window(period) for period in SNAPSHOT_PERIODS})
+            for period in SNAPSHOT_PERIODS:
+                data = await self._build_snapshot(period, sketches.get(period))
+                refreshed_at = datetime.utcnow()
+                await snapshots.replace_one(
+                    {"_id": period},
+                    {"_id": period, "period": period, "data": data.model_dump(), "refreshed_at": refreshed_at},
+                    upsert=True
+                )
+            # Keep the in-process cache in line with the snapshots
+            self.service.report_cache.invalidate("dashboard_stats")
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.metrics["refreshes"] += 1
+            self.metrics["hours_rolled"] += hours
+            self.metrics["last_refresh"] = datetime.utcnow()
+            self.metrics["last_refresh_ms"] = round(elapsed_ms, 1)
+            logger.debug(f"📸 Dashboard snapshots refreshed: {hours} hours rolled in {elapsed_ms:.0f}ms")
+            return {"hours_rolled": hours, "since": since, "elapsed_ms": elapsed_ms}
+
+        except Exception as e:
+            self.metrics["refresh_errors"] += 1
+            logger.error(f"❌ Dashboard snapshot refresh failed: {e}")
+            raise
+
+    async def get(self, period: str) -> Optional[Tuple[ReportsData, datetime]]:
+        """Read a materialized snapshot; None when the period is not materialized yet"""
+        if period not in SNAPSHOT_PERIODS or self.db is None:
+            return None
+        document = await self.db[SNAPSHOT_COLLECTION].find_one({"_id": period})
+        if not document:
+            return None
+        return ReportsData.model_validate(document["data"]), document["refreshed_at"]
+
+
+__all__ = ["DashboardSnapshots", "SNAPSHOT_PERIODS", "truncate_hour"]
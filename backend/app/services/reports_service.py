@@ -7,7 +7,6 @@ import asyncio
 import logging
 import json
 import csv
-import tempfile
 import os
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any, Tuple
@@ -18,21 +17,30 @@ import subprocess
 from collections import defaultdict, Counter
 from pathlib import Path
 
-# PDF generation
-try:
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter, A4
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-
-    PDF_AVAILABLE = True
-except ImportError:
-    PDF_AVAILABLE = False
+# PDF generation (rendering itself runs in report worker processes)
+from .report_renderers import PDF_AVAILABLE
+
+if not PDF_AVAILABLE:
     logging.warning("ReportLab not available. PDF generation disabled.")
 
 # Database and services imports
+from ..cache import AsyncTTLCache
 from ..database import get_database
+from ..index_planner import register_query_shape
+from ..settings import get_settings
+from .report_queries import (
+    ReportQueryPlanner, period_flag,
+    SYSTEM_EVENT_LEVELS, BLOCKED_LEVELS, ATTACK_THREAT_LEVELS, PORT_SERVICES, PERIOD_DAYS, PERIOD_HOURS,
+    RESPONSE_TIME_MATCH, RESPONSE_TIME_SUM, RESPONSE_TIME_COUNT, REQUEST_ERRORS
+)
+from .report_snapshots import DashboardSnapshots
+from .report_jobs import ReportJobManager
+from .report_scheduler import ReportScheduler
+from .report_series import SeriesService
+from .report_latency import latency_percentiles
+from .report_artifacts import ArtifactCache, CachedArtifact, artifact_key, data_watermark
+from ..latency import latency_recorder
+from ..traffic_analytics import ALL_PROTOCOLS, traffic_producer
 from ..models.reports import (
     ReportType, ReportStatus, ReportFormat, ReportFrequency,
     TrafficDirection, SecurityThreatLevel, MetricType
@@ -47,6 +55,14 @@ from ..schemas.reports import (
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Query shapes issued by the dashboard statistics (see app.index_planner)
+register_query_shape("system_logs", "reports.level_window", equality=["level"], range=["timestamp"],
+                     owner="reports_service")
+register_query_shape("system_logs", "reports.blocked_ips", equality=["level"], range=["timestamp"],
+                     covering=["source_ip"], owner="reports_service")
+register_query_shape("system_logs", "reports.ports", range=["timestamp", "destination_port"],
+                     covering=["level"], owner="reports_service")
+
 
 class ReportsService:
     """Comprehensive reports service for firewall and network analytics"""
@@ -54,19 +70,20 @@ class ReportsService:
     def __init__(self):
         self.db = None
         self.cache = {
-            "dashboard_stats": None,
-            "last_cache_update": None,
             "analytics_cache": {},
             "template_cache": {}
         }
         self.cache_ttl_seconds = 300  # 5 minutes cache
+        self.cache_stale_seconds = 600  # serve stale for 10 more minutes while refreshing
+        self.cache_max_entries = 128
 
         # PC-to-PC monitoring state
         self.pc_to_pc_active = False
         self.monitored_interfaces = {"wan": None, "lan": None}
 
         # Report generation settings
-        self.max_concurrent_reports = 5
+        self.max_concurrent_reports = get_settings().report_max_concurrent_jobs
+        self.report_query_concurrency = 4  # concurrent database queries per report build
         self.active_report_generations = {}
 
         # Performance metrics
@@ -78,11 +95,44 @@ class ReportsService:
             "cache_misses": 0
         }
 
+        # Dashboard results keyed by (report, period, filters)
+        self.report_cache = AsyncTTLCache(
+            "reports",
+            max_entries=self.cache_max_entries,
+            ttl_seconds=self.cache_ttl_seconds,
+            stale_seconds=self.cache_stale_seconds,
+            metrics=self.performance_metrics
+        )
+
+        # Materialized per-period dashboard snapshots (refreshed by tasks.report_materializer)
+        self.snapshots = DashboardSnapshots(self)
+
+        # Off-loop report rendering jobs (tracked in generated_reports)
+        self.jobs = ReportJobManager(self)
+
+        # Live dashboards over at least this many hours use the rollup sketches
+        self.sketch_min_window_hours = 24
+
+        # Time-bucketed chart series (rollups + raw time-series collections)
+        self.series = SeriesService(self)
+        self.series_cache_seconds = 30
+
+        # Off-peak precomputation of report_schedules (driven by tasks.report_scheduler)
+        self.scheduler = ReportScheduler(self)
+
+        # Rendered exports keyed by request + data watermark (size-bounded, LRU)
+        settings = get_settings()
+        self.export_cache = ArtifactCache(
+            str(Path(settings.report_artifact_dir) / "exports"),
+            settings.report_export_cache_mb * 1024 * 1024
+        )
+
     async def initialize(self):
         """Initialize reports service and database connection"""
         try:
             self.db = await get_database()
             await self._ensure_collections()
+            await self.snapshots.ensure_indexes()
             await self._setup_pc_to_pc_monitoring()
             await self._initialize_default_templates()
             logger.info("✅ Reports service initialized successfully")
@@ -96,7 +146,7 @@ class ReportsService:
             collections = [
                 'reports_config', 'report_templates', 'generated_reports',
                 'report_schedules', 'traffic_analytics', 'performance_metrics',
-                'security_events', 'report_history'
+                'security_events', 'report_history', 'report_rollups_hourly', 'dashboard_snapshots'
             ]
 
             existing_collections = await self.db.list_collection_names()
@@ -183,72 +233,169 @@ class ReportsService:
     async def get_dashboard_stats(self, filter_period: str = "Son 30 gün") -> ReportsData:
         """Get comprehensive dashboard statistics for reports page"""
         try:
-            # Check cache first
-            cache_key = f"dashboard_stats_{filter_period}"
-            if await self._is_cache_valid(cache_key):
-                self.performance_metrics["cache_hits"] += 1
-                return self.cache["dashboard_stats"]
-
-            self.performance_metrics["cache_misses"] += 1
-
-            # Calculate date range
-            start_date, end_date = self._parse_filter_period(filter_period)
-
-            # Collect all statistics
-            traffic_stats = await self._get_traffic_statistics(start_date, end_date)
-            system_stats = await self._get_system_statistics(start_date, end_date)
-            security_stats = await self._get_security_statistics(start_date, end_date)
-            uptime_stats = await self._get_uptime_statistics()
-            quick_stats = await self._get_quick_statistics(start_date, end_date)
-            port_stats = await self._get_port_statistics(start_date, end_date)
-
-            # Create response
-            dashboard_data = ReportsData(
-                traffic_stats=traffic_stats,
-                system_stats=system_stats,
-                security_stats=security_stats,
-                uptime_stats=uptime_stats,
-                quick_stats=quick_stats,
-                port_statistics=port_stats,
-                last_updated=datetime.utcnow()
+            cache_key = AsyncTTLCache.make_key("dashboard_stats", filter_period)
+            return await self.report_cache.get_or_compute(
+                cache_key, lambda: self._build_dashboard_stats(filter_period)
             )
-
-            # Cache the result
-            self.cache["dashboard_stats"] = dashboard_data
-            self.cache["last_cache_update"] = datetime.utcnow()
-
-            return dashboard_data
-
         except Exception as e:
             logger.error(f"❌ Failed to get dashboard stats: {e}")
             return await self._get_fallback_dashboard_stats()
 
-    async def _get_traffic_statistics(self, start_date: datetime, end_date: datetime) -> TrafficStatsData:
-        """Get traffic statistics for the dashboard"""
+    async def get_dashboard_snapshot(self, filter_period: str = "Son 30 gün") -> Tuple[ReportsData, Optional[datetime]]:
+        """
+        Get dashboard statistics from the materialized snapshot (single document read).
+        Falls back to live computation for non-standard periods or before the first
+        refresh; the second value is the snapshot's refresh time (None when live).
+        """
         try:
-            # Get traffic data from logs and analytics collections
-            traffic_pipeline = [
-                {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
+            snapshot = await self.snapshots.get(filter_period)
+            if snapshot is not None:
+                self.performance_metrics["snapshot_hits"] = self.performance_metrics.get("snapshot_hits", 0) + 1
+                return snapshot
+        except Exception as e:
+            logger.warning(f"⚠️ Dashboard snapshot read failed, computing live: {e}")
+
+        return await self.get_dashboard_stats(filter_period), None
+
+    async def _build_dashboard_stats(self, filter_period: str) -> ReportsData:
+        """Compute dashboard statistics (errors propagate so fallbacks are never cached)"""
+        # Calculate date range
+        start_date, end_date = self._parse_filter_period(filter_period)
+
+        # Sub-statistics share one planner: identical queries run once and all
+        # distinct queries run concurrently under the per-report limit
+        queries = ReportQueryPlanner(self.db, self.report_query_concurrency)
+        (traffic_stats, system_stats, security_stats,
+         uptime_stats, quick_stats, port_stats) = await asyncio.gather(
+            self._get_traffic_statistics(queries, start_date, end_date),
+            self._get_system_statistics(queries, start_date, end_date),
+            self._get_security_statistics(queries, start_date, end_date),
+            self._get_uptime_statistics(),
+            self._get_quick_statistics(queries, start_date, end_date),
+            self._get_port_statistics(queries, start_date, end_date),
+        )
+        logger.debug(f"📊 Dashboard {filter_period}: {queries.issued} queries, {queries.deduplicated} shared")
+
+        return ReportsData(
+            traffic_stats=traffic_stats,
+            system_stats=system_stats,
+            security_stats=security_stats,
+            uptime_stats=uptime_stats,
+            quick_stats=quick_stats,
+            port_statistics=port_stats,
+            last_updated=datetime.utcnow()
+        )
+
+    @staticmethod
+    def _previous_period_start(start_date: datetime, end_date: datetime) -> datetime:
+        return start_date - (end_date - start_date)
+
+    def _traffic_periods_pipeline(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+        """
+        One pass over traffic_analytics for the current and previous period:
+        totals grouped by period flag plus the current period's peak hour
+        """
+        traffic_bytes = {"$add": ["$bytes_in", "$bytes_out"]}
+        return [
+            {"$match": {"timestamp": {"$gte": self._previous_period_start(start_date, end_date), "$lte": end_date}}},
+            {"$facet": {
+                "periods": [
+                    {"$group": {
+                        "_id": period_flag(start_date),
+                        "total_bytes": {"$sum": traffic_bytes},
+                        "total_packets": {"$sum": {"$add": ["$packets_in", "$packets_out"]}},
+                        "count": {"$sum": 1}
+                    }}
+                ],
+                "peak_hour": [
+                    {"$match": {"timestamp": {"$gte": start_date}}},
+                    {"$group": {"_id": {"$hour": "$timestamp"}, "total_bytes": {"$sum": traffic_bytes}}},
+                    {"$sort": {"total_bytes": -1}},
+                    {"$limit": 1}
+                ]
+            }}
+        ]
+
+    def _log_periods_pipeline(self, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+        """
+        One pass over system_logs for system events and blocked requests in the
+        current and previous period. Short windows also count the unique blocked
+        IPs here; longer ones take them from the rollup sketches instead.
+        """
+        facets = {
+            "periods": [
                 {"$group": {
-                    "_id": None,
-                    "total_bytes": {"$sum": {"$add": ["$bytes_in", "$bytes_out"]}},
-                    "total_packets": {"$sum": {"$add": ["$packets_in", "$packets_out"]}},
+                    "_id": {
+                        "period": period_flag(start_date),
+                        "kind": {"$cond": [{"$in": ["$level", BLOCKED_LEVELS]}, "blocked", "system"]}
+                    },
                     "count": {"$sum": 1}
                 }}
             ]
+        }
+        if not self._uses_sketches(start_date, end_date):
+            facets["blocked_ips"] = [
+                {"$match": {
+                    "timestamp": {"$gte": start_date},
+                    "level": {"$in": BLOCKED_LEVELS},
+                    "source_ip": {"$exists": True, "$ne": None}
+                }},
+                {"$group": {"_id": "$source_ip"}},
+                {"$count": "unique_ips"}
+            ]
+        return [
+            {"$match": {
+                "timestamp": {"$gte": self._previous_period_start(start_date, end_date), "$lte": end_date},
+                "level": {"$in": SYSTEM_EVENT_LEVELS + BLOCKED_LEVELS}
+            }},
+            {"$facet": facets}
+        ]
+
+    def _uses_sketches(self, start_date: datetime, end_date: datetime) -> bool:
+        """Windows this long read distinct IPs / top ports from hourly sketches, not raw logs"""
+        return end_date - start_date >= timedelta(hours=self.sketch_min_window_hours)
+
+    async def _get_window_sketches(self, queries: ReportQueryPlanner, start_date: datetime,
+                                   end_date: datetime) -> Optional[Dict[str, Any]]:
+        """Merged rollup sketches for the window (shared by the sub-statistics); None if unavailable"""
+        if not self._uses_sketches(start_date, end_date):
+            return None
+        merged = await queries.shared(
+            f"sketches:{start_date.isoformat()}:{end_date.isoformat()}",
+            lambda: self.snapshots.load_sketches({"window": (start_date, end_date)})
+        )
+        return merged["window"]
+
+    async def _get_traffic_periods(self, queries: ReportQueryPlanner, start_date: datetime,
+                                   end_date: datetime) -> Dict[str, Any]:
+        result = await queries.aggregate("traffic_analytics", self._traffic_periods_pipeline(start_date, end_date))
+        facets = result[0] if result else {}
+        return {
+            "periods": {row["_id"]: row for row in facets.get("periods", [])},
+            "peak_hour": facets.get("peak_hour", [])
+        }
 
-            traffic_result = await self.db.traffic_analytics.aggregate(traffic_pipeline).to_list(length=1)
+    async def _get_log_periods(self, queries: ReportQueryPlanner, start_date: datetime,
+                               end_date: datetime) -> Dict[str, Any]:
+        result = await queries.aggregate("system_logs", self._log_periods_pipeline(start_date, end_date))
+        facets = result[0] if result else {}
+        counts = {(row["_id"]["period"], row["_id"]["kind"]): row["count"] for row in facets.get("periods", [])}
+        blocked_ips = facets.get("blocked_ips", [])
+        return {"counts": counts, "blocked_ips": blocked_ips[0]["unique_ips"] if blocked_ips else None}
+
+    async def _get_traffic_statistics(self, queries: ReportQueryPlanner, start_date: datetime,
+                                      end_date: datetime) -> TrafficStatsData:
+        """Get traffic statistics for the dashboard"""
+        try:
+            periods = (await self._get_traffic_periods(queries, start_date, end_date))["periods"]
+            traffic_result = [periods["current"]] if "current" in periods else []
 
             if traffic_result:
                 total_bytes = traffic_result[0].get("total_bytes", 0)
                 total_traffic = self._format_bytes(total_bytes)
 
                 # Calculate growth percentage (compare with previous period)
-                prev_start = start_date - (end_date - start_date)
-                prev_result = await self.db.traffic_analytics.aggregate([
-                    {"$match": {"timestamp": {"$gte": prev_start, "$lt": start_date}}},
-                    {"$group": {"_id": None, "total_bytes": {"$sum": {"$add": ["$bytes_in", "$bytes_out"]}}}}
-                ]).to_list(length=1)
+                prev_result = [periods["previous"]] if "previous" in periods else []
 
                 change_percentage = "+12% bu ay"  # Default
                 if prev_result and prev_result[0].get("total_bytes", 0) > 0:
@@ -274,21 +421,14 @@ class ReportsService:
                 change_percentage="+12% bu ay"
             )
 
-    async def _get_system_statistics(self, start_date: datetime, end_date: datetime) -> SystemStatsData:
+    async def _get_system_statistics(self, queries: ReportQueryPlanner, start_date: datetime,
+                                     end_date: datetime) -> SystemStatsData:
         """Get system statistics for the dashboard"""
         try:
-            # Count system attempts/events from logs
-            system_attempts = await self.db.system_logs.count_documents({
-                "timestamp": {"$gte": start_date, "$lte": end_date},
-                "level": {"$in": ["ERROR", "WARNING", "CRITICAL"]}
-            })
-
-            # Calculate change from previous period
-            prev_start = start_date - (end_date - start_date)
-            prev_attempts = await self.db.system_logs.count_documents({
-                "timestamp": {"$gte": prev_start, "$lt": start_date},
-                "level": {"$in": ["ERROR", "WARNING", "CRITICAL"]}
-            })
+            # System events in the current and previous period (shared system_logs pass)
+            counts = (await self._get_log_periods(queries, start_date, end_date))["counts"]
+            system_attempts = counts.get(("current", "system"), 0)
+            prev_attempts = counts.get(("previous", "system"), 0)
 
             if prev_attempts > 0:
                 growth = ((system_attempts - prev_attempts) / prev_attempts) * 100
@@ -308,41 +448,28 @@ class ReportsService:
                 change_percentage="-8% bu ay"
             )
 
-    async def _get_security_statistics(self, start_date: datetime, end_date: datetime) -> SecurityStatsData:
+    async def _get_security_statistics(self, queries: ReportQueryPlanner, start_date: datetime,
+                                       end_date: datetime) -> SecurityStatsData:
         """Get security statistics for the dashboard"""
         try:
-            # Count blocked requests
-            blocked_requests = await self.db.system_logs.count_documents({
-                "timestamp": {"$gte": start_date, "$lte": end_date},
-                "level": {"$in": ["BLOCK", "DENY"]}
-            })
-
             # Count attack attempts
-            attack_attempts = await self.db.security_events.count_documents({
+            attack_attempts_query = queries.count("security_events", {
                 "timestamp": {"$gte": start_date, "$lte": end_date},
-                "threat_level": {"$in": ["HIGH", "CRITICAL"]}
+                "threat_level": {"$in": ATTACK_THREAT_LEVELS}
             })
 
-            # Count blocked IPs (unique)
-            blocked_ips_pipeline = [
-                {"$match": {
-                    "timestamp": {"$gte": start_date, "$lte": end_date},
-                    "level": {"$in": ["BLOCK", "DENY"]},
-                    "source_ip": {"$exists": True, "$ne": None}
-                }},
-                {"$group": {"_id": "$source_ip"}},
-                {"$count": "unique_ips"}
-            ]
-
-            blocked_ips_result = await self.db.system_logs.aggregate(blocked_ips_pipeline).to_list(length=1)
-            blocked_ips = blocked_ips_result[0]["unique_ips"] if blocked_ips_result else 12
-
-            # Calculate change percentage
-            prev_start = start_date - (end_date - start_date)
-            prev_blocked = await self.db.system_logs.count_documents({
-                "timestamp": {"$gte": prev_start, "$lt": start_date},
-                "level": {"$in": ["BLOCK", "DENY"]}
-            })
+            # Blocked requests (current/previous) come from the shared system_logs pass;
+            # unique blocked IPs from it too, or from the merged HyperLogLogs on long windows
+            log_periods, attack_attempts, sketches = await asyncio.gather(
+                self._get_log_periods(queries, start_date, end_date), attack_attempts_query,
+                self._get_window_sketches(queries, start_date, end_date)
+            )
+            blocked_requests = log_periods["counts"].get(("current", "blocked"), 0)
+            prev_blocked = log_periods["counts"].get(("previous", "blocked"), 0)
+            if sketches:
+                blocked_ips = sketches["blocked_sources"].count()
+            else:
+                blocked_ips = log_periods["blocked_ips"] if log_periods["blocked_ips"] is not None else 12
 
             if prev_blocked > 0:
                 growth = ((blocked_requests - prev_blocked) / prev_blocked) * 100
@@ -369,19 +496,7 @@ class ReportsService:
     async def _get_uptime_statistics(self) -> UptimeStatsData:
         """Get system uptime statistics"""
         try:
-            # Get system uptime
-            uptime_seconds = self._get_system_uptime()
-            uptime_text = self._format_uptime(uptime_seconds)
-
-            # Calculate uptime percentage (assume target is 99.8%)
-            # You can implement actual uptime calculation based on your needs
-            uptime_percentage = "99.8"
-
-            return UptimeStatsData(
-                uptime_text=uptime_text,
-                uptime_percentage=f"%{uptime_percentage} uptime",
-                uptime_seconds=uptime_seconds
-            )
+            return self._build_uptime_stats(self._get_system_uptime())
 
         except Exception as e:
             logger.error(f"Failed to get uptime statistics: {e}")
@@ -391,21 +506,29 @@ class ReportsService:
                 uptime_seconds=1317600
             )
 
-    async def _get_quick_statistics(self, start_date: datetime, end_date: datetime) -> QuickStatsData:
+    def _build_uptime_stats(self, uptime_seconds: int) -> UptimeStatsData:
+        """Format uptime seconds as dashboard uptime statistics"""
+        # Calculate uptime percentage (assume target is 99.8%)
+        # You can implement actual uptime calculation based on your needs
+        uptime_percentage = "99.8"
+
+        return UptimeStatsData(
+            uptime_text=self._format_uptime(uptime_seconds),
+            uptime_percentage=f"%{uptime_percentage} uptime",
+            uptime_seconds=uptime_seconds
+        )
+
+    async def _get_quick_statistics(self, queries: ReportQueryPlanner, start_date: datetime,
+                                    end_date: datetime) -> QuickStatsData:
         """Get quick statistics for the dashboard"""
         try:
-            # Calculate daily average traffic
+            # Daily average and peak hour come from the shared traffic_analytics pass
             days_diff = (end_date - start_date).days or 1
-            traffic_result = await self.db.traffic_analytics.aggregate([
-                {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
-                {"$group": {
-                    "_id": None,
-                    "total_bytes": {"$sum": {"$add": ["$bytes_in", "$bytes_out"]}}
-                }}
-            ]).to_list(length=1)
+            traffic = await self._get_traffic_periods(queries, start_date, end_date)
+            current = traffic["periods"].get("current")
 
-            if traffic_result:
-                total_bytes = traffic_result[0].get("total_bytes", 0)
+            if current:
+                total_bytes = current.get("total_bytes", 0)
                 daily_average_bytes = total_bytes // days_diff
                 daily_average_traffic = self._format_bytes(daily_average_bytes)
             else:
@@ -413,46 +536,40 @@ class ReportsService:
                 daily_average_bytes = 80000000000
 
             # Find peak hour (most active hour)
-            peak_hour_pipeline = [
-                {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
-                {"$group": {
-                    "_id": {"$hour": "$timestamp"},
-                    "total_bytes": {"$sum": {"$add": ["$bytes_in", "$bytes_out"]}}
-                }},
-                {"$sort": {"total_bytes": -1}},
-                {"$limit": 1}
-            ]
-
-            peak_result = await self.db.traffic_analytics.aggregate(peak_hour_pipeline).to_list(length=1)
+            peak_result = traffic["peak_hour"]
             if peak_result:
                 peak_hour_num = peak_result[0]["_id"]
                 peak_hour = f"{peak_hour_num:02d}:00-{(peak_hour_num + 1):02d}:00"
             else:
                 peak_hour = "14:00-15:00"
 
-            # Calculate average response time (simulated or from performance metrics)
+            # Average response time and success rate from the request latency digests
             response_time = "12ms"  # Default
+            success_rate = "99.2%"  # Default
             try:
-                perf_result = await self.db.performance_metrics.aggregate([
-                    {"$match": {
-                        "timestamp": {"$gte": start_date, "$lte": end_date},
-                        "metric_type": "response_time"
-                    }},
-                    {"$group": {"_id": None, "avg_response": {"$avg": "$value"}}}
-                ]).to_list(length=1)
-
-                if perf_result:
-                    avg_response = perf_result[0].get("avg_response", 12)
-                    response_time = f"{avg_response:.0f}ms"
-            except:
-                pass
+                perf_result = await queries.aggregate("performance_metrics", [
+                    {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}, **RESPONSE_TIME_MATCH}},
+                    {"$group": {
+                        "_id": None,
+                        "sum": {"$sum": RESPONSE_TIME_SUM},
+                        "count": {"$sum": RESPONSE_TIME_COUNT},
+                        "errors": {"$sum": REQUEST_ERRORS}
+                    }}
+                ], length=1)
+
+                if perf_result and perf_result[0].get("count"):
+                    requests = perf_result[0]["count"]
+                    response_time = f"{perf_result[0]['sum'] / requests:.0f}ms"
+                    success_rate = f"{(1 - perf_result[0]['errors'] / requests) * 100:.1f}%"
+            except Exception as e:
+                logger.debug(f"Response time statistics unavailable: {e}")
 
             return QuickStatsData(
                 daily_average_traffic=daily_average_traffic,
                 daily_average_traffic_bytes=daily_average_bytes,
                 peak_hour=peak_hour,
                 average_response_time=response_time,
-                success_rate="99.2%",
+                success_rate=success_rate,
                 security_score="8.7/10"
             )
 
@@ -467,9 +584,17 @@ class ReportsService:
                 security_score="8.7/10"
             )
 
-    async def _get_port_statistics(self, start_date: datetime, end_date: datetime) -> List[PortStatisticData]:
+    async def _get_port_statistics(self, queries: ReportQueryPlanner, start_date: datetime,
+                                   end_date: datetime) -> List[PortStatisticData]:
         """Get port statistics for the dashboard"""
         try:
+            # Long windows merge the hourly top-K port sketches
+            sketches = await self._get_window_sketches(queries, start_date, end_date)
+            if sketches:
+                port_stats = self.snapshots.port_statistics(sketches)
+                if port_stats:
+                    return port_stats
+
             # Get port statistics from logs
             port_pipeline = [
                 {"$match": {
@@ -487,19 +612,13 @@ class ReportsService:
                 {"$limit": 10}
             ]
 
-            port_results = await self.db.system_logs.aggregate(port_pipeline).to_list(length=10)
-
-            # Map port numbers to service names
-            port_services = {
-                22: "SSH", 80: "HTTP", 443: "HTTPS", 21: "FTP", 25: "SMTP",
-                53: "DNS", 110: "POP3", 143: "IMAP", 993: "IMAPS", 995: "POP3S"
-            }
+            port_results = await queries.aggregate("system_logs", port_pipeline, length=10)
 
             port_stats = []
             for result in port_results:
                 port_num = result["_id"]
                 if isinstance(port_num, int) and 1 <= port_num <= 65535:
-                    service_name = port_services.get(port_num, f"PORT-{port_num}")
+                    service_name = PORT_SERVICES.get(port_num, f"PORT-{port_num}")
                     port_stats.append(PortStatisticData(
                         port=port_num,
                         service_name=service_name,
@@ -688,11 +807,14 @@ class ReportsService:
                 peak_usage = "120 Mbps"
                 average_usage = "45 Mbps"
 
-            # Get protocol distribution
+            # Get protocol distribution (protocol lives in the time-series metaField,
+            # so grouping works per bucket and the time-range $match prunes buckets;
+            # interface-counter documents carry totals only and are skipped)
             protocol_pipeline = [
-                {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date}}},
+                {"$match": {"timestamp": {"$gte": start_date, "$lte": end_date},
+                            "meta.protocol": {"$ne": ALL_PROTOCOLS}}},
                 {"$group": {
-                    "_id": "$protocol",
+                    "_id": "$meta.protocol",
                     "bytes": {"$sum": {"$add": ["$tcp_bytes", "$udp_bytes", "$icmp_bytes", "$other_bytes"]}}
                 }},
                 {"$sort": {"bytes": -1}}
@@ -717,13 +839,12 @@ class ReportsService:
                     {"protocol": "SSH", "percentage": 6.3}
                 ]
 
-            # Get hourly traffic
-            traffic_by_hour = []
-            for i in range(24):
-                traffic_by_hour.append({
-                    "hour": f"{i:02d}:00",
-                    "traffic": f"{40 + i * 2} GB"  # Simulated data
-                })
+            # Hourly traffic for the last 24 hours, from the rollups
+            hourly = await self.get_chart_series("traffic_bytes", "24h", "1h")
+            traffic_by_hour = [
+                {"hour": datetime.utcfromtimestamp(ts / 1000).strftime("%H:00"), "traffic": self._format_bytes(value)}
+                for ts, value in zip(hourly["t"], hourly["v"])
+            ]
 
             return TrafficReportData(
                 total_bandwidth=total_bandwidth,
@@ -744,118 +865,127 @@ class ReportsService:
                     {"protocol": "HTTP", "percentage": 28.5},
                     {"protocol": "SSH", "percentage": 6.3}
                 ],
-                traffic_by_hour=[{"hour": f"{i:02d}:00", "traffic": f"{40 + i * 2} GB"} for i in range(24)]
+                traffic_by_hour=[]
             )
 
+    async def get_top_talkers(self, filter_period: str = "Son 1 hafta", limit: int = 10) -> Dict[str, Any]:
+        """Top sources / destinations / ports and distinct blocked sources, merged from hourly sketches"""
+        start_date, end_date = self._parse_filter_period(filter_period)
+        sketches = (await self.snapshots.load_sketches({"window": (start_date, end_date)}))["window"]
+        if not sketches:
+            return {"filter_period": filter_period, "hours": 0, "distinct_blocked_sources": None,
+                    "sources": [], "destinations": [], "ports": [], "blocked_ports": []}
+
+        def ranked(name: str) -> List[Dict[str, Any]]:
+            return [{"key": item, "count": count, "max_error": error}
+                    for item, count, error in sketches[name].top(limit)]
+
+        hll = sketches["blocked_sources"]
+        return {
+            "filter_period": filter_period,
+            "hours": sketches["hours"],
+            "distinct_blocked_sources": {"estimate": hll.count(), "relative_error": round(hll.relative_error, 4)},
+            "sources": ranked("top_sources"),
+            "destinations": ranked("top_destinations"),
+            "ports": ranked("top_ports"),
+            "blocked_ports": ranked("top_blocked_ports")
+        }
+
+    async def get_latency_percentiles(self, filter_period: str = "Bugün", kind: str = "http",
+                                      name: Optional[str] = None, limit: int = 20) -> Dict[str, Any]:
+        """p50/p95/p99 request (kind=http) or database (kind=db) latency merged from t-digests"""
+        start_date, end_date = self._parse_filter_period(filter_period)
+        key = self.report_cache.make_key("latency", filter_period, kind=kind, name=name, limit=limit)
+        return await self.report_cache.get_or_compute(
+            key,
+            lambda: latency_percentiles(self.db, start_date, end_date, kind, name, limit),
+            ttl_seconds=self.series_cache_seconds
+        )
+
+    async def get_chart_series(self, metric: str, range_name: str = "24h", granularity: str = "auto",
+                               width: int = 800, method: str = "lttb") -> Dict[str, Any]:
+        """Columnar chart series, cached briefly per parameter set"""
+        self.series.resolve(metric, range_name, granularity, width, method)
+        key = self.report_cache.make_key(
+            "series", range_name, metric=metric, granularity=granularity, width=width, method=method
+        )
+        return await self.report_cache.get_or_compute(
+            key,
+            lambda: self.series.get_series(metric, range_name, granularity, width, method),
+            ttl_seconds=self.series_cache_seconds
+        )
+
     # =============================================================================
     # EXPORT METHODS
     # =============================================================================
 
-    async def generate_pdf_report(self, export_request: Dict[str, Any]) -> str:
-        """Generate PDF report"""
-        if not PDF_AVAILABLE:
-            raise Exception("PDF generation not available. ReportLab not installed.")
-
-        try:
-            # Create temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-            temp_file.close()
+    @staticmethod
+    def _dashboard_watermark(dashboard_stats: ReportsData) -> str:
+        """Data version of a dashboard; refresh time and the uptime clock are not data changes"""
+        return data_watermark(
+            dashboard_stats.model_dump(mode="json", exclude={"last_updated": True, "uptime_stats": True})
+        )
 
-            # Get report data
-            report_type = export_request.get('report_type', 'full')
-            filter_period = export_request.get('filter_period', 'Son 30 gün')
+    async def export_artifact(self, export_request: Dict[str, Any]) -> Tuple[CachedArtifact, bool]:
+        """
+        Rendered export for a request, from the artifact cache when the underlying
+        data has not changed since it was last rendered. Returns (artifact, cached).
+        """
+        normalized = ReportJobManager.normalize_request(export_request)
+        report_format = normalized["format"]
+        if report_format == "pdf" and not PDF_AVAILABLE:
+            raise Exception("PDF generation not available. ReportLab not installed.")
 
-            # Create PDF document
-            doc = SimpleDocTemplate(temp_file.name, pagesize=A4)
-            styles = getSampleStyleSheet()
-            story = []
-
-            # Title
-            title = Paragraph("KOBI Firewall - Sistem Raporu", styles['Title'])
-            story.append(title)
-            story.append(Spacer(1, 12))
-
-            # Report info
-            info = Paragraph(f"<b>Oluşturulma:</b> {datetime.now().strftime('%d.%m.%Y %H:%M')}<br/>"
-                             f"<b>Filtre:</b> {filter_period}<br/>"
-                             f"<b>Rapor Türü:</b> {report_type.title()}", styles['Normal'])
-            story.append(info)
-            story.append(Spacer(1, 20))
-
-            # Get and add statistics
-            dashboard_stats = await self.get_dashboard_stats(filter_period)
-
-            # Create statistics table
-            data = [
-                ['Metrik', 'Değer', 'Değişim'],
-                ['Toplam Trafik', dashboard_stats.traffic_stats.total_traffic,
-                 dashboard_stats.traffic_stats.change_percentage],
-                ['Sistem Denemeleri', str(dashboard_stats.system_stats.total_attempts),
-                 dashboard_stats.system_stats.change_percentage],
-                ['Engellenen İstekler', str(dashboard_stats.security_stats.blocked_requests),
-                 dashboard_stats.security_stats.change_percentage],
-                ['Sistem Çalışma Süresi', dashboard_stats.uptime_stats.uptime_text,
-                 dashboard_stats.uptime_stats.uptime_percentage]
-            ]
+        dashboard_stats, _ = await self.get_dashboard_snapshot(normalized["filter_period"])
+        watermark = self._dashboard_watermark(dashboard_stats)
+        if report_format == "json":
+            # The JSON export also describes the PC-to-PC monitoring state
+            watermark = data_watermark([watermark, self.pc_to_pc_active, self.monitored_interfaces])
+        key = artifact_key(normalized["report_type"], normalized["filter_period"], report_format,
+                           watermark, normalized["filters"])
+
+        async def render(path: str):
+            started = datetime.utcnow()
+            if report_format == "pdf":
+                payload = {
+                    "dashboard": dashboard_stats.model_dump(mode="json"),
+                    "report_type": normalized["report_type"],
+                    "filter_period": normalized["filter_period"]
+                }
+            elif report_format == "csv":
+                payload = {"rows": await self.generate_csv_report(normalized, dashboard_stats)}
+            else:
+                payload = {"data": await self.generate_json_report(normalized, dashboard_stats)}
+            await self.jobs.render(report_format, payload, path)
+            self.performance_metrics["reports_generated"] += 1
+            self.performance_metrics["total_generation_time"] += (datetime.utcnow() - started).total_seconds()
 
-            table = Table(data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 14),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-
-            story.append(table)
-            story.append(Spacer(1, 20))
+        try:
+            artifact, cached = await self.export_cache.get_or_render(key, report_format, render)
+        except Exception:
+            self.performance_metrics["failed_generations"] += 1
+            raise
+        if not cached:
+            logger.info(f"✅ {report_format.upper()} export rendered ({artifact.size} bytes, etag {artifact.etag[:12]})")
+        return artifact, cached
 
-            # Port statistics
-            if dashboard_stats.port_statistics:
-                port_title = Paragraph("En Çok Saldırı Alan Portlar", styles['Heading2'])
-                story.append(port_title)
-                story.append(Spacer(1, 12))
-
-                port_data = [['Port', 'Servis', 'Deneme Sayısı']]
-                for port_stat in dashboard_stats.port_statistics[:5]:
-                    port_data.append([
-                        str(port_stat.port),
-                        port_stat.service_name,
-                        str(port_stat.attempts)
-                    ])
-
-                port_table = Table(port_data)
-                port_table.setStyle(TableStyle([
-                    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                    ('FONTSIZE', (0, 0), (-1, 0), 12),
-                    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                    ('GRID', (0, 0), (-1, -1), 1, colors.black)
-                ]))
-
-                story.append(port_table)
-
-            # Build PDF
-            doc.build(story)
-
-            logger.info(f"✅ PDF report generated: {temp_file.name}")
-            return temp_file.name
+    async def generate_pdf_report(self, export_request: Dict[str, Any]) -> str:
+        """Path of the PDF export (rendered in a worker process, cached by data version)"""
+        try:
+            artifact, _ = await self.export_artifact({**export_request, "format": "pdf"})
+            return artifact.path
 
         except Exception as e:
             logger.error(f"❌ PDF generation failed: {e}")
             raise
 
-    async def generate_csv_report(self, export_request: Dict[str, Any]) -> List[Dict[str, Any]]:
+    async def generate_csv_report(self, export_request: Dict[str, Any],
+                                  dashboard_stats: Optional[ReportsData] = None) -> List[Dict[str, Any]]:
         """Generate CSV report data"""
         try:
             filter_period = export_request.get('filter_period', 'Son 30 gün')
-            dashboard_stats = await self.get_dashboard_stats(filter_period)
+            if dashboard_stats is None:
+                dashboard_stats = await self.get_dashboard_stats(filter_period)
 
             csv_data = []
 
@@ -903,13 +1033,15 @@ class ReportsService:
             logger.error(f"❌ CSV generation failed: {e}")
             raise
 
-    async def generate_json_report(self, export_request: Dict[str, Any]) -> Dict[str, Any]:
+    async def generate_json_report(self, export_request: Dict[str, Any],
+                                   dashboard_stats: Optional[ReportsData] = None) -> Dict[str, Any]:
         """Generate JSON report data"""
         try:
             filter_period = export_request.get('filter_period', 'Son 30 gün')
             report_type = export_request.get('report_type', 'full')
 
-            dashboard_stats = await self.get_dashboard_stats(filter_period)
+            if dashboard_stats is None:
+                dashboard_stats = await self.get_dashboard_stats(filter_period)
 
             json_data = {
                 "report_info": {
@@ -982,24 +1114,16 @@ class ReportsService:
         """Parse filter period string to datetime range"""
         end_date = datetime.utcnow()
 
-        period_map = {
-            "Bugün": 1,
-            "Dün": 1,
-            "Son 3 gün": 3,
-            "Son 1 hafta": 7,
-            "Son 2 hafta": 14,
-            "Son 3 hafta": 21,
-            "Son 30 gün": 30,
-            "Son 60 gün": 60
-        }
+        if period in PERIOD_HOURS:
+            return end_date - timedelta(hours=PERIOD_HOURS[period]), end_date
 
-        days = period_map.get(period, 30)
-        start_date = end_date - timedelta(days=days)
+        days = PERIOD_DAYS.get(period, 30)
 
         if period == "Dün":
-            start_date = end_date - timedelta(days=1)
-            end_date = end_date - timedelta(hours=24)
+            # The 24 hours before the last 24 hours
+            end_date = end_date - timedelta(days=1)
 
+        start_date = end_date - timedelta(days=days)
         return start_date, end_date
 
     def _format_bytes(self, bytes_value: int) -> str:
@@ -1039,14 +1163,6 @@ class ReportsService:
         except:
             return "15 gün 6 saat"
 
-    async def _is_cache_valid(self, cache_key: str) -> bool:
-        """Check if cache is still valid"""
-        if not self.cache.get("last_cache_update"):
-            return False
-
-        cache_age = (datetime.utcnow() - self.cache["last_cache_update"]).total_seconds()
-        return cache_age < self.cache_ttl_seconds
-
     async def _get_fallback_dashboard_stats(self) -> ReportsData:
         """Get fallback dashboard statistics when database fails"""
         return ReportsData(
@@ -1108,10 +1224,13 @@ class ReportsService:
                 "monitored_interfaces": self.monitored_interfaces,
                 "collections_status": collections_status,
                 "performance_metrics": self.performance_metrics,
-                "cache_status": {
-                    "cache_valid": await self._is_cache_valid("dashboard_stats"),
-                    "last_cache_update": self.cache.get("last_cache_update")
-                },
+                "cache_status": self.report_cache.get_status(),
+                "snapshot_status": self.snapshots.metrics,
+                "report_jobs": self.jobs.get_status(),
+                "report_scheduler": self.scheduler.get_status(),
+                "export_cache": self.export_cache.get_status(),
+                "latency_digests": latency_recorder.metrics,
+                "traffic_producer": traffic_producer.metrics,
                 "pdf_generation": PDF_AVAILABLE,
                 "timestamp": datetime.utcnow().isoformat()
             }
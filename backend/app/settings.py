@@ -3,6 +3,7 @@ Settings management using Pydantic v2 with 12-Factor App principles
 Enhanced security configuration with environment variables
 """
 import os
+import re
 import secrets
 from functools import lru_cache
 from typing import List, Optional, Union
@@ -36,6 +37,50 @@ class Settings(BaseSettings):
     # Database Configuration
     mongodb_url: str = Field(default="mongodb://localhost:27017", description="MongoDB connection URL")
     database_name: str = Field(default="kobi_firewall_db", description="Database name")
+    storage_backend: str = Field(default="mongodb", description="Storage backend (mongodb/sqlite)")
+    sqlite_path: str = Field(default="data/kobi_firewall.db", description="SQLite database file (sqlite backend)")
+    retention_sweep_interval_seconds: int = Field(
+        default=3600, ge=60, description="Retention sweep interval for metric collections the server does not expire"
+    )
+
+    # Write Durability (per-collection classes, see app/durability.py)
+    telemetry_batch_size: int = Field(default=500, ge=1, description="Telemetry documents per insert_many batch")
+    telemetry_flush_interval_ms: int = Field(default=1000, ge=10, description="Max telemetry buffering time in ms")
+    telemetry_write_timeout_ms: int = Field(default=5000, ge=100, description="Telemetry batch write timeout before spooling")
+
+    # Local Disk Spool (telemetry buffering while MongoDB is slow or down)
+    spool_enabled: bool = Field(default=True, description="Spool telemetry to disk when MongoDB is unavailable")
+    spool_dir: str = Field(default="data/spool", description="Spool segment directory")
+    spool_max_mb: int = Field(default=512, ge=1, description="Maximum spool disk usage in MB")
+    spool_segment_mb: int = Field(default=16, ge=1, description="Spool segment file size in MB")
+    spool_fsync_interval_ms: int = Field(default=200, ge=0, description="Batched fsync interval in ms")
+    spool_replay_batch_size: int = Field(default=1000, ge=1, description="Documents per replay insert_many")
+
+    # Query-shape index planner
+    index_planner_drop_stale: bool = Field(default=False, description="Drop planner (qp_) indexes no query shape uses")
+    index_planner_verify: bool = Field(default=False, description="Run explain() for every query shape at startup")
+
+    # Latency digests (per-route / per-command t-digests in performance_metrics)
+    latency_tracking_enabled: bool = Field(default=True, description="Record request and DB latency digests")
+    latency_flush_interval_seconds: int = Field(default=60, ge=5, description="Latency digest flush interval")
+
+    # Traffic analytics (interface counter deltas + flow records -> traffic_analytics)
+    traffic_analytics_enabled: bool = Field(default=True, description="Produce traffic_analytics documents")
+    traffic_sample_interval_seconds: int = Field(default=10, ge=1, description="Interface counter sampling interval")
+    traffic_flush_interval_seconds: int = Field(default=60, ge=10, description="Traffic analytics flush interval")
+
+    # Reports
+    report_snapshot_interval_seconds: int = Field(default=60, ge=5, description="Dashboard snapshot refresh interval")
+    report_max_concurrent_jobs: int = Field(default=2, ge=1, le=16, description="Report renderer worker processes")
+    report_job_queue_size: int = Field(default=20, ge=0, description="Report jobs allowed to wait for a worker")
+    report_artifact_dir: str = Field(default="data/reports", description="Rendered report artifact directory")
+    report_artifact_reuse_seconds: int = Field(default=300, ge=0, description="Reuse identical artifacts this young")
+    report_export_cache_mb: int = Field(default=256, ge=1, description="Disk budget for cached export artifacts (MB, LRU evicted)")
+    report_scheduler_interval_seconds: int = Field(default=60, ge=5, description="Report scheduler poll interval")
+    report_offpeak_window: str = Field(default="01:00-06:00", description="Local off-peak window for scheduled reports (HH:MM-HH:MM)")
+    report_scheduler_jitter_seconds: int = Field(default=300, ge=0, description="Random delay added to scheduled runs")
+    report_scheduler_max_parallel: int = Field(default=1, ge=1, description="Scheduled reports rendering at once")
+    report_scheduler_max_cpu_percent: float = Field(default=70.0, gt=0, le=100, description="Defer scheduled reports above this CPU usage")
 
     # JWT Configuration - GÜÇLENDIRILDI
     jwt_secret: str = Field(
@@ -79,6 +124,50 @@ class Settings(BaseSettings):
     # Firewall Settings
     max_firewall_rules: int = Field(default=1000, description="Maximum number of firewall rules")
     rule_backup_enabled: bool = Field(default=True, description="Enable automatic rule backup")
+    firewall_backend: str = Field(default="iptables", description="Linux firewall backend (iptables/nftables)")
+    firewall_optimizer_enabled: bool = Field(
+        default=True, description="Drop shadowed rules, merge neighbours and order by hits before applying"
+    )
+    firewall_reconcile_enabled: bool = Field(default=True, description="Reconcile kernel rules with firewall_rules")
+    firewall_reconcile_interval_seconds: int = Field(
+        default=300, ge=10, description="Drift check interval (also the poll interval without change streams)"
+    )
+    firewall_sync_debounce_ms: int = Field(
+        default=200, ge=0, le=5000, description="Window in which rule changes are folded into one apply"
+    )
+    firewall_hit_counters_enabled: bool = Field(
+        default=True, description="Collect kernel rule counters into firewall_rules.hit_count"
+    )
+    firewall_hit_counter_interval_seconds: int = Field(
+        default=60, ge=5, description="Hit counter collection interval"
+    )
+    firewall_blocklist_enabled: bool = Field(
+        default=True, description="Dynamic blocklist in a kernel hash set (ipset / nft set with timeouts)"
+    )
+    firewall_blocklist_auto_ban: bool = Field(
+        default=False, description="Also put IPs locked out by the auth layer on the kernel blocklist"
+    )
+    firewall_blocklist_default_ttl_seconds: int = Field(
+        default=3600, ge=0, description="Expiry of blocklist entries added without one (0 = permanent)"
+    )
+    firewall_blocklist_max_entries: int = Field(
+        default=1048576, ge=1024, description="Kernel set size limit (ipset maxelem)"
+    )
+    firewall_blocklist_batch_size: int = Field(
+        default=10000, ge=1, le=1000000, description="Entries per ipset restore / nft call"
+    )
+    firewall_blocklist_flush_ms: int = Field(
+        default=500, ge=10, le=60000, description="How often queued blocklist changes are written out"
+    )
+    firewall_blocklist_protected: Union[str, List[str]] = Field(
+        default="", description="Management addresses/networks that are never blocked (comma separated)"
+    )
+    firewall_blocklist_min_prefix_v4: int = Field(
+        default=16, ge=1, le=32, description="Widest IPv4 network the blocklist accepts"
+    )
+    firewall_blocklist_min_prefix_v6: int = Field(
+        default=32, ge=1, le=128, description="Widest IPv6 network the blocklist accepts"
+    )
 
     # Backward compatibility properties
     @computed_field
@@ -131,6 +220,16 @@ class Settings(BaseSettings):
             return v
         return ["8.8.8.8", "8.8.4.4"]
 
+    @field_validator('firewall_blocklist_protected', mode='before')
+    @classmethod
+    def parse_blocklist_protected(cls, v):
+        """Parse protected blocklist addresses from string or list"""
+        if isinstance(v, str):
+            return [address.strip() for address in v.split(',') if address.strip()]
+        elif isinstance(v, list):
+            return v
+        return []
+
     @field_validator('jwt_secret')
     @classmethod
     def validate_jwt_secret(cls, v):
@@ -142,6 +241,35 @@ class Settings(BaseSettings):
             return secure_secret
         return v
 
+    @field_validator('storage_backend')
+    @classmethod
+    def validate_storage_backend(cls, v):
+        """Validate storage backend name"""
+        allowed_backends = ['mongodb', 'sqlite']
+        if v.lower() not in allowed_backends:
+            print(f"⚠️  Invalid storage backend '{v}'. Using 'mongodb'")
+            return 'mongodb'
+        return v.lower()
+
+    @field_validator('firewall_backend')
+    @classmethod
+    def validate_firewall_backend(cls, v):
+        """Validate Linux firewall backend name"""
+        allowed_backends = ['iptables', 'nftables']
+        if v.lower() not in allowed_backends:
+            print(f"⚠️  Invalid firewall backend '{v}'. Using 'iptables'")
+            return 'iptables'
+        return v.lower()
+
+    @field_validator('report_offpeak_window')
+    @classmethod
+    def validate_report_offpeak_window(cls, v):
+        """Validate the HH:MM-HH:MM off-peak window"""
+        if not re.fullmatch(r'\s*([01]?\d|2[0-3]):[0-5]\d\s*-\s*([01]?\d|2[0-3]):[0-5]\d\s*', v):
+            print(f"⚠️  Invalid report off-peak window '{v}'. Using '01:00-06:00'")
+            return '01:00-06:00'
+        return v.strip()
+
     @field_validator('environment', 'node_env')
     @classmethod
     def validate_environment(cls, v):
@@ -0,0 +1,539 @@
+"""
+Crash-safe local disk spool for telemetry writes
+When MongoDB is slow or down, batched telemetry (see durability.py) is written
+to append-only segment files instead of blocking ingest or being dropped.
+A replayer drains the segments in bulk insert_many batches once the database
+answers again.
+
+Segment layout:
+    header  b"KFSPOOL1" + codec byte (1 = msgpack, 2 = json)
+    record  <u32 length><u32 crc32(payload)> payload
+    payload [collection_name, document]
+
+Records are fsync'ed in batches; a torn record at the tail of a segment (crash
+mid-write) fails its checksum and is skipped. Disk usage is bounded by
+spool_max_bytes - when full, the oldest closed segments are discarded.
+
+Only transient failures (network, timeouts, retryable server states) are
+spooled. Documents the database rejects for good are moved to quarantine-*.seg
+files (same record format) so one poison record cannot block replay. Replay is
+idempotent through the documents' _id: duplicate keys count as written, and for
+time-series collections - which do not enforce _id uniqueness - the _ids of
+each batch are looked up first and already stored documents are skipped.
+"""
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    msgpack = None
+    MSGPACK_AVAILABLE = False
+
+try:
+    from bson import ObjectId
+    BSON_AVAILABLE = True
+except ImportError:
+    ObjectId = None
+    BSON_AVAILABLE = False
+
+try:
+    from pymongo.errors import ConnectionFailure, ExecutionTimeout, PyMongoError, WTimeoutError
+    PYMONGO_AVAILABLE = True
+except ImportError:
+    ConnectionFailure = ExecutionTimeout = PyMongoError = WTimeoutError = None
+    PYMONGO_AVAILABLE = False
+
+from .timeseries import TIME_FIELD, is_timeseries_collection
+
+logger = logging.getLogger(__name__)
+
+SEGMENT_MAGIC = b"KFSPOOL1"
+SEGMENT_HEADER_SIZE = len(SEGMENT_MAGIC) + 1
+RECORD_HEADER = struct.Struct("<II")
+CODEC_MSGPACK = 1
+CODEC_JSON = 2
+
+EXT_DATETIME = 1
+EXT_OBJECTID = 2
+
+DUPLICATE_KEY = 11000
+
+# Network errors, timeouts and server states a retry can get past (ConnectionFailure
+# covers AutoReconnect, NetworkTimeout and ServerSelectionTimeoutError)
+TRANSIENT_ERRORS: Tuple[type, ...] = (asyncio.TimeoutError, TimeoutError, ConnectionError)
+if PYMONGO_AVAILABLE:
+    TRANSIENT_ERRORS += (ConnectionFailure, ExecutionTimeout, WTimeoutError)
+
+
+# ---------------------------------------------------------------------------
+# Write error classification
+# ---------------------------------------------------------------------------
+
+def is_transient_error(error: BaseException) -> bool:
+    """True when a failed write is worth spooling and retrying later"""
+    if isinstance(error, TRANSIENT_ERRORS):
+        return True
+    if PYMONGO_AVAILABLE and isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError"):
+        return True
+    details = getattr(error, "details", None)
+    if isinstance(details, dict) and "writeErrors" in details:
+        # BulkWriteError: only a missing write concern acknowledgement is worth a retry
+        return not details["writeErrors"] and bool(details.get("writeConcernErrors"))
+    return False
+
+
+async def insert_isolating(collection, documents: List[Dict[str, Any]],
+                           error: Optional[BaseException] = None) -> List[Tuple[Dict[str, Any], BaseException]]:
+    """
+    insert_many(ordered=False) that singles out the documents the database
+    rejects for good; duplicate keys count as written and transient errors
+    propagate. Pass the error of an insert_many that already failed to skip the
+    first attempt.
+    """
+    if error is None:
+        try:
+            await collection.insert_many(documents, ordered=False)
+            return []
+        except Exception as e:
+            error = e
+    if is_transient_error(error):
+        raise error
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict) and "writeErrors" in details:
+        return [(documents[item["index"]], error) for item in details["writeErrors"]
+                if item.get("code") != DUPLICATE_KEY]
+    if len(documents) == 1:
+        return [(documents[0], error)]
+    # The whole command was refused (e.g. an unencodable document): nothing was
+    # written, so retry one by one to find the poison documents
+    rejected = []
+    for document in documents:
+        rejected.extend(await insert_isolating(collection, [document]))
+    return rejected
+
+
+# ---------------------------------------------------------------------------
+# Record codecs
+# ---------------------------------------------------------------------------
+
+def _msgpack_default(value):
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        micros = int((value - datetime(1970, 1, 1)).total_seconds() * 1_000_000)
+        return msgpack.ExtType(EXT_DATETIME, struct.pack("<q", micros))
+    if BSON_AVAILABLE and isinstance(value, ObjectId):
+        return msgpack.ExtType(EXT_OBJECTID, value.binary)
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+def _msgpack_ext_hook(code: int, data: bytes):
+    if code == EXT_DATETIME:
+        micros = struct.unpack("<q", data)[0]
+        return datetime(1970, 1, 1) + timedelta(microseconds=micros)
+    if code == EXT_OBJECTID and BSON_AVAILABLE:
+        return ObjectId(data)
+    return msgpack.ExtType(code, data)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": value.isoformat()}
+    if BSON_AVAILABLE and isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+def _json_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        if "$date" in obj:
+            return datetime.fromisoformat(obj["$date"])
+        if "$oid" in obj and BSON_AVAILABLE:
+            return ObjectId(obj["$oid"])
+    return obj
+
+
+def encode_record(codec: int, collection_name: str, document: Dict[str, Any]) -> bytes:
+    """Encode one spool record (header + payload)"""
+    if codec == CODEC_MSGPACK:
+        payload = msgpack.packb([collection_name, document], default=_msgpack_default, use_bin_type=True)
+    else:
+        payload = json.dumps([collection_name, document], default=_json_default,
+                             separators=(",", ":")).encode("utf-8")
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_payload(codec: int, payload: bytes) -> Tuple[str, Dict[str, Any]]:
+    if codec == CODEC_MSGPACK:
+        collection_name, document = msgpack.unpackb(payload, ext_hook=_msgpack_ext_hook, raw=False)
+    else:
+        collection_name, document = json.loads(payload.decode("utf-8"), object_hook=_json_hook)
+    return collection_name, document
+
+
+# ---------------------------------------------------------------------------
+# Segment reader
+# ---------------------------------------------------------------------------
+
+def read_segment(path: Path, start_offset: int = 0) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+    """
+    Yield (end_offset, collection_name, document) for every valid record.
+    Stops at the first truncated or corrupt record (torn tail after a crash).
+    """
+    with open(path, "rb") as handle:
+        header = handle.read(SEGMENT_HEADER_SIZE)
+        if len(header) < SEGMENT_HEADER_SIZE or not header.startswith(SEGMENT_MAGIC):
+            raise ValueError(f"Not a spool segment: {path}")
+        codec = header[-1]
+        if codec == CODEC_MSGPACK and not MSGPACK_AVAILABLE:
+            raise RuntimeError(f"Segment {path.name} is msgpack encoded but msgpack is not installed")
+
+        offset = max(start_offset, SEGMENT_HEADER_SIZE)
+        handle.seek(offset)
+        while True:
+            record_header = handle.read(RECORD_HEADER.size)
+            if len(record_header) < RECORD_HEADER.size:
+                return
+            length, checksum = RECORD_HEADER.unpack(record_header)
+            payload = handle.read(length)
+            if len(payload) < length or zlib.crc32(payload) != checksum:
+                raise CorruptRecordError(offset)
+            offset += RECORD_HEADER.size + length
+            collection_name, document = decode_payload(codec, payload)
+            yield offset, collection_name, document
+
+
+class CorruptRecordError(Exception):
+    """Raised when a record fails its length or checksum check"""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Corrupt spool record at offset {offset}")
+        self.offset = offset
+
+
+# ---------------------------------------------------------------------------
+# Spool
+# ---------------------------------------------------------------------------
+
+class DiskSpool:
+    """Append-only segment spool with bounded size and a bulk replayer"""
+
+    def __init__(self, directory: str, max_bytes: int, segment_bytes: int,
+                 fsync_interval: float = 0.2, replay_batch_size: int = 1000):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.replay_batch_size = replay_batch_size
+        self.codec = CODEC_MSGPACK if MSGPACK_AVAILABLE else CODEC_JSON
+
+        self._lock = asyncio.Lock()
+        self._active: Optional[Any] = None
+        self._active_path: Optional[Path] = None
+        self._active_size = 0
+        self._unsynced = False
+        self._last_fsync = 0.0
+        self._replay_task: Optional[asyncio.Task] = None
+        self._divert_until = 0.0
+        self._backoff = 1.0
+
+        self.metrics: Dict[str, Any] = {
+            "appended_records": 0,
+            "replayed_records": 0,
+            "dropped_records": 0,
+            "dropped_segments": 0,
+            "corrupt_records": 0,
+            "quarantined_records": 0,
+            "deduplicated_records": 0,
+            "replay_batches": 0,
+            "replay_rate_per_sec": 0.0,
+            "last_replay": None,
+            "last_error": None,
+        }
+
+    # -- state ------------------------------------------------------------
+
+    @property
+    def diverting(self) -> bool:
+        """True while the database is considered unavailable (writes go straight to disk)"""
+        return time.monotonic() < self._divert_until
+
+    def trip(self, error: Optional[Exception] = None) -> None:
+        """Mark the database unavailable; back off exponentially up to 30s"""
+        self._divert_until = time.monotonic() + self._backoff
+        self._backoff = min(self._backoff * 2, 30.0)
+        if error is not None:
+            self.metrics["last_error"] = str(error)
+
+    def reset(self) -> None:
+        self._divert_until = 0.0
+        self._backoff = 1.0
+
+    def _segments(self) -> List[Path]:
+        if not self.directory.exists():
+            return []
+        return sorted(self.directory.glob("segment-*.seg"))
+
+    def depth_bytes(self) -> int:
+        total = 0
+        for path in self._segments():
+            try:
+                total += path.stat().st_size - SEGMENT_HEADER_SIZE
+            except OSError:
+                pass
+        return max(total, 0)
+
+    def has_backlog(self) -> bool:
+        return self.depth_bytes() > 0
+
+    def get_metrics(self) -> Dict[str, Any]:
+        segments = self._segments()
+        appended = self.metrics["appended_records"]
+        return {
+            **self.metrics,
+            "codec": "msgpack" if self.codec == CODEC_MSGPACK else "json",
+            "segments": len(segments),
+            "depth_bytes": self.depth_bytes(),
+            "depth_records_estimate": max(
+                appended - self.metrics["replayed_records"] - self.metrics["dropped_records"], 0
+            ),
+            "diverting": self.diverting,
+            "max_bytes": self.max_bytes,
+        }
+
+    # -- writing ----------------------------------------------------------
+
+    def _open_segment(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"segment-{time.time_ns():020d}.seg"
+        self._active_path = self.directory / name
+        self._active = open(self._active_path, "ab")
+        self._active.write(SEGMENT_MAGIC + bytes([self.codec]))
+        self._active_size = SEGMENT_HEADER_SIZE
+
+    def _close_segment(self) -> None:
+        if self._active is not None:
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._active.close()
+        self._active = None
+        self._active_path = None
+        self._active_size = 0
+        self._unsynced = False
+
+    def _enforce_bound(self, incoming: int) -> None:
+        """Discard the oldest closed segments until the new records fit"""
+        segments = [path for path in self._segments() if path != self._active_path]
+        while segments and self.depth_bytes() + incoming > self.max_bytes:
+            oldest = segments.pop(0)
+            dropped = sum(1 for _ in self._safe_records(oldest))
+            oldest.unlink(missing_ok=True)
+            self.metrics["dropped_records"] += dropped
+            self.metrics["dropped_segments"] += 1
+            logger.warning(f"⚠️ Spool full - discarded oldest segment {oldest.name} ({dropped} records)")
+
+    def _safe_records(self, path: Path):
+        try:
+            yield from read_segment(path)
+        except Exception:
+            return
+
+    async def append(self, collection_name: str, documents: List[Dict[str, Any]]) -> None:
+        """Append documents for a collection; fsync is batched by fsync_interval"""
+        records = [encode_record(self.codec, collection_name, document) for document in documents]
+        size = sum(len(record) for record in records)
+
+        async with self._lock:
+            if self.depth_bytes() + size > self.max_bytes:
+                self._enforce_bound(size)
+                if self._active is not None and self.depth_bytes() + size > self.max_bytes:
+                    # Only the active segment is left and it is full: rotate and drop it too
+                    self._close_segment()
+                    self._enforce_bound(size)
+
+            if self._active is None or self._active_size + size > self.segment_bytes:
+                self._close_segment()
+                self._open_segment()
+
+            self._active.write(b"".join(records))
+            self._active_size += size
+            self._unsynced = True
+            self.metrics["appended_records"] += len(records)
+
+            now = time.monotonic()
+            if now - self._last_fsync >= self.fsync_interval:
+                await self._sync()
+
+    async def _sync(self) -> None:
+        if self._active is not None and self._unsynced:
+            self._active.flush()
+            await asyncio.to_thread(os.fsync, self._active.fileno())
+            self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+    async def flush(self) -> None:
+        async with self._lock:
+            await self._sync()
+
+    async def quarantine(self, collection_name: str, documents: List[Dict[str, Any]],
+                         error: Optional[BaseException] = None) -> None:
+        """Set aside documents the database rejected for good (never replayed)"""
+        if not documents:
+            return
+        records = b"".join(encode_record(self.codec, collection_name, document) for document in documents)
+        async with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.directory / f"quarantine-{datetime.utcnow():%Y%m%d}.seg"
+            with open(path, "ab") as handle:
+                if handle.tell() == 0:
+                    handle.write(SEGMENT_MAGIC + bytes([self.codec]))
+                handle.write(records)
+                handle.flush()
+                os.fsync(handle.fileno())
+        self.metrics["quarantined_records"] += len(documents)
+        if error is not None:
+            self.metrics["last_error"] = str(error)
+        logger.error(f"❌ Quarantined {len(documents)} {collection_name} documents in {path.name}: {error}")
+
+    # -- replay -----------------------------------------------------------
+
+    def start_replayer(self, database_getter: Callable) -> None:
+        """Start the background replayer (idempotent)"""
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.get_running_loop().create_task(self._replay_loop(database_getter))
+
+    async def _replay_loop(self, database_getter: Callable) -> None:
+        while True:
+            try:
+                await asyncio.sleep(max(self.fsync_interval, 1.0))
+                if not self.has_backlog() or self.diverting:
+                    continue
+                database = await database_getter()
+                await database.command("ping")
+                await self.replay(database)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.trip(e)
+                logger.warning(f"⚠️ Spool replay paused: {e}")
+
+    async def replay(self, database) -> int:
+        """Drain all segments into the database in bulk batches; returns replayed record count"""
+        async with self._lock:
+            # Seal the active segment so it can be replayed and removed
+            if self._active is not None:
+                self._close_segment()
+            segments = self._segments()
+
+        started = time.monotonic()
+        replayed = 0
+        for path in segments:
+            replayed += await self._replay_segment(database, path)
+
+        elapsed = time.monotonic() - started
+        if replayed:
+            self.metrics["replay_rate_per_sec"] = round(replayed / elapsed, 1) if elapsed > 0 else float(replayed)
+            self.metrics["last_replay"] = datetime.utcnow().isoformat()
+            logger.info(f"✅ Spool replayed {replayed} records in {elapsed:.2f}s")
+        self.reset()
+        return replayed
+
+    async def _replay_segment(self, database, path: Path) -> int:
+        offset_path = path.with_suffix(".offset")
+        start_offset = int(offset_path.read_text()) if offset_path.exists() else 0
+
+        batches: Dict[str, List[Dict[str, Any]]] = {}
+        pending = 0
+        replayed = 0
+        last_offset = start_offset
+        records = await asyncio.to_thread(self._load_records, path, start_offset)
+
+        for end_offset, collection_name, document in records:
+            batches.setdefault(collection_name, []).append(document)
+            pending += 1
+            last_offset = end_offset
+            if pending >= self.replay_batch_size:
+                replayed += await self._write_batches(database, batches)
+                offset_path.write_text(str(last_offset))
+                batches, pending = {}, 0
+
+        if pending:
+            replayed += await self._write_batches(database, batches)
+
+        path.unlink(missing_ok=True)
+        offset_path.unlink(missing_ok=True)
+        return replayed
+
+    def _load_records(self, path: Path, start_offset: int) -> List[Tuple[int, str, Dict[str, Any]]]:
+        records = []
+        try:
+            for record in read_segment(path, start_offset):
+                records.append(record)
+        except CorruptRecordError as e:
+            self.metrics["corrupt_records"] += 1
+            logger.warning(f"⚠️ {path.name}: {e} - skipping the rest of the segment")
+        except FileNotFoundError:
+            pass  # discarded by the size bound while queued for replay
+        return records
+
+    async def _write_batches(self, database, batches: Dict[str, List[Dict[str, Any]]]) -> int:
+        """Insert replayed batches; transient errors propagate and pause the replay"""
+        written = 0
+        for collection_name, documents in batches.items():
+            collection = database[collection_name]
+            if is_timeseries_collection(collection_name):
+                documents = await self._without_stored(collection, documents)
+            rejected = await insert_isolating(collection, documents)
+            if rejected:
+                await self.quarantine(collection_name, [document for document, _ in rejected], rejected[0][1])
+            written += len(documents) - len(rejected)
+            self.metrics["replay_batches"] += 1
+        self.metrics["replayed_records"] += written
+        return written
+
+    async def _without_stored(self, collection, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Drop documents an earlier, ambiguously failed write already stored.
+        Time-series collections accept duplicate _ids, so look them up (the
+        timestamp bounds let the server prune buckets).
+        """
+        ids = [document["_id"] for document in documents if "_id" in document]
+        if not ids:
+            return documents
+        query: Dict[str, Any] = {"_id": {"$in": ids}}
+        timestamps = [document[TIME_FIELD] for document in documents if isinstance(document.get(TIME_FIELD), datetime)]
+        if timestamps:
+            query[TIME_FIELD] = {"$gte": min(timestamps), "$lte": max(timestamps)}
+        stored = {row["_id"] async for row in collection.find(query, {"_id": 1})}
+        if not stored:
+            return documents
+        self.metrics["deduplicated_records"] += len(stored)
+        return [document for document in documents if document.get("_id") not in stored]
+
+    async def close(self) -> None:
+        if self._replay_task:
+            self._replay_task.cancel()
+            self._replay_task = None
+        async with self._lock:
+            self._close_segment()
+
+
+__all__ = [
+    "DiskSpool", "CorruptRecordError", "read_segment", "encode_record", "decode_payload",
+    "is_transient_error", "insert_isolating", "MSGPACK_AVAILABLE",
+]
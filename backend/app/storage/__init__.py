@@ -0,0 +1,10 @@
+"""
+Pluggable storage backends
+MongoDB (Motor) is the default; the embedded SQLite backend lets small
+single-box installs run without a MongoDB server.
+"""
+from .sqlite_backend import SQLiteClient, SQLiteDatabase, SQLiteCollection
+
+STORAGE_BACKENDS = ("mongodb", "sqlite")
+
+__all__ = ["SQLiteClient", "SQLiteDatabase", "SQLiteCollection", "STORAGE_BACKENDS"]
@@ -0,0 +1,1223 @@
+"""
+Embedded SQLite storage backend (WAL mode) for single-box appliances
+Implements the subset of the Motor client/database/collection API the
+application uses, so the collection getters in database.py work unchanged
+without a MongoDB server.
+
+Documents are stored as JSON; the hot query fields (timestamp, level, source,
+source_ip, event_type) are promoted to real, indexed columns so the log and
+stats filters and sorts are resolved by index; the document itself is still
+read from the JSON column. Aggregation pipelines push their leading $match
+into SQL and evaluate the remaining stages in Python on the reader thread. Writes go through one serialized
+connection in batched transactions; reads use per-thread connections, which
+WAL lets run concurrently with the writer.
+"""
+import asyncio
+import copy
+import functools
+import itertools
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    from bson import ObjectId
+    BSON_AVAILABLE = True
+except ImportError:
+    ObjectId = None
+    BSON_AVAILABLE = False
+
+try:
+    from pymongo.errors import DuplicateKeyError
+except ImportError:
+    class DuplicateKeyError(Exception):
+        """Raised when a unique index constraint is violated"""
+        pass
+
+logger = logging.getLogger(__name__)
+
+# Fields stored in dedicated columns (everything else lives in the JSON document)
+HOT_FIELDS = ("timestamp", "level", "source", "source_ip", "event_type")
+
+# Hot-column indexes for the log / stats filters and sorts, created with the table
+HOT_INDEXES: Dict[str, List[Tuple[str, ...]]] = {
+    "system_logs": [
+        ("timestamp",),
+        ("level", "timestamp"),
+        ("source", "timestamp"),
+        ("source_ip", "timestamp"),
+        ("event_type", "timestamp"),
+    ],
+    "network_activity": [("timestamp",), ("event_type", "timestamp")],
+    "security_alerts": [("timestamp",)],
+    "system_stats": [("source", "timestamp")],
+    "system_health": [("source", "timestamp")],
+    "database_health": [("source", "timestamp")],
+    "performance_metrics": [("timestamp",)],
+    "traffic_analytics": [("timestamp",)],
+}
+DEFAULT_HOT_INDEXES: List[Tuple[str, ...]] = [("timestamp",)]
+
+_FIELD_RE = re.compile(r"^[A-Za-z0-9_][A-Za-z0-9_.]*$")
+_NAME_RE = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+# ---------------------------------------------------------------------------
+# Result objects (mirror pymongo.results)
+# ---------------------------------------------------------------------------
+
+@dataclass
+class InsertOneResult:
+    inserted_id: Any
+    acknowledged: bool = True
+
+
+@dataclass
+class InsertManyResult:
+    inserted_ids: List[Any]
+    acknowledged: bool = True
+
+
+@dataclass
+class UpdateResult:
+    matched_count: int
+    modified_count: int
+    upserted_id: Any = None
+    acknowledged: bool = True
+
+
+@dataclass
+class DeleteResult:
+    deleted_count: int
+    acknowledged: bool = True
+
+
+# ---------------------------------------------------------------------------
+# Encoding helpers
+# ---------------------------------------------------------------------------
+
+def _utc_naive(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _iso(value: datetime) -> str:
+    """Fixed-width ISO string so lexical order equals chronological order"""
+    return _utc_naive(value).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def _epoch(value: datetime) -> float:
+    return _utc_naive(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return {"$date": _iso(value)}
+    if BSON_AVAILABLE and isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    if isinstance(value, bytes):
+        return value.hex()
+    return str(value)
+
+
+def _json_hook(obj: Dict[str, Any]):
+    if len(obj) == 1:
+        if "$date" in obj:
+            return datetime.strptime(obj["$date"], "%Y-%m-%dT%H:%M:%S.%f")
+        if "$oid" in obj and BSON_AVAILABLE:
+            return ObjectId(obj["$oid"])
+    return obj
+
+
+def _dumps(document: Dict[str, Any]) -> str:
+    return json.dumps(document, default=_json_default, separators=(",", ":"))
+
+
+def _loads(payload: str) -> Dict[str, Any]:
+    return json.loads(payload, object_hook=_json_hook)
+
+
+def _new_id():
+    return ObjectId() if BSON_AVAILABLE else uuid.uuid4().hex
+
+
+def _id_key(value) -> str:
+    return str(value)
+
+
+def _regexp(pattern: str, value) -> int:
+    """SQL REGEXP(pattern, value); flags are encoded as a (?i) style prefix"""
+    if value is None:
+        return 0
+    return 1 if re.search(pattern, str(value)) else 0
+
+
+# ---------------------------------------------------------------------------
+# Document path helpers (dot notation)
+# ---------------------------------------------------------------------------
+
+_MISSING = object()
+
+
+def _get_path(document: Dict[str, Any], path: str, default=None):
+    current: Any = document
+    for part in path.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        else:
+            return default
+    return current
+
+
+def _set_path(document: Dict[str, Any], path: str, value) -> None:
+    parts = path.split(".")
+    current = document
+    for part in parts[:-1]:
+        if not isinstance(current.get(part), dict):
+            current[part] = {}
+        current = current[part]
+    current[parts[-1]] = value
+
+
+def _unset_path(document: Dict[str, Any], path: str) -> None:
+    parts = path.split(".")
+    current = document
+    for part in parts[:-1]:
+        current = current.get(part)
+        if not isinstance(current, dict):
+            return
+    current.pop(parts[-1], None)
+
+
+def apply_update(document: Dict[str, Any], update: Dict[str, Any], is_insert: bool = False) -> Dict[str, Any]:
+    """Apply a MongoDB update document ($set, $inc, ...) to a document copy"""
+    if not any(key.startswith("$") for key in update):
+        # Replacement document
+        replacement = dict(update)
+        replacement["_id"] = document.get("_id")
+        return replacement
+
+    result = json.loads(_dumps(document), object_hook=_json_hook)
+    for operator, fields in update.items():
+        if operator == "$set" or (operator == "$setOnInsert" and is_insert):
+            for path, value in fields.items():
+                _set_path(result, path, value)
+        elif operator == "$setOnInsert":
+            continue
+        elif operator == "$unset":
+            for path in fields:
+                _unset_path(result, path)
+        elif operator == "$inc":
+            for path, amount in fields.items():
+                _set_path(result, path, (_get_path(result, path) or 0) + amount)
+        elif operator in ("$max", "$min"):
+            for path, value in fields.items():
+                current = _get_path(result, path, _MISSING)
+                if current is _MISSING or current is None or \
+                        (value > current if operator == "$max" else value < current):
+                    _set_path(result, path, value)
+        elif operator in ("$push", "$addToSet"):
+            for path, value in fields.items():
+                items = list(_get_path(result, path) or [])
+                values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in values:
+                    if operator == "$push" or item not in items:
+                        items.append(item)
+                if isinstance(value, dict) and "$slice" in value:
+                    limit = value["$slice"]
+                    items = items[limit:] if limit < 0 else items[:limit]
+                _set_path(result, path, items)
+        elif operator == "$pull":
+            for path, value in fields.items():
+                items = _get_path(result, path) or []
+                _set_path(result, path, [item for item in items if item != value])
+        elif operator == "$currentDate":
+            for path in fields:
+                _set_path(result, path, datetime.utcnow())
+        else:
+            raise NotImplementedError(f"Update operator {operator} is not supported by the SQLite backend")
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Filter compilation (MongoDB filter -> SQL WHERE)
+# ---------------------------------------------------------------------------
+
+def _field_expr(path: str, for_datetime: bool = False) -> str:
+    if path == "_id" or path in HOT_FIELDS:
+        return f'"{path}"'
+    if not _FIELD_RE.match(path):
+        raise ValueError(f"Unsupported field name for SQLite backend: {path!r}")
+    json_path = "$." + path
+    if for_datetime:
+        json_path += '."$date"'
+    return f"json_extract(doc, '{json_path}')"
+
+
+def _sql_value(path: str, value):
+    if isinstance(value, datetime):
+        return _epoch(value) if path == "timestamp" else _iso(value)
+    if path == "_id":
+        return _id_key(value)
+    if BSON_AVAILABLE and isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        raise NotImplementedError("Matching on embedded documents/arrays is not supported by the SQLite backend")
+    return value
+
+
+def _regex_pattern(pattern, options: str = "") -> str:
+    if isinstance(pattern, re.Pattern):
+        flags = "i" if pattern.flags & re.IGNORECASE else ""
+        pattern = pattern.pattern
+        options = options or flags
+    flags = "".join(flag for flag in options if flag in "imsx")
+    return f"(?{flags}){pattern}" if flags else str(pattern)
+
+
+def _compile_condition(path: str, condition, params: List[Any]) -> str:
+    if isinstance(condition, re.Pattern):
+        condition = {"$regex": condition}
+
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        if condition is None:
+            return f"{_field_expr(path)} IS NULL"
+        is_dt = isinstance(condition, datetime) and path != "timestamp"
+        params.append(_sql_value(path, condition))
+        return f"{_field_expr(path, is_dt)} = ?"
+
+    clauses = []
+    for operator, operand in condition.items():
+        is_dt = isinstance(operand, datetime) and path != "timestamp"
+        expr = _field_expr(path, is_dt)
+        if operator == "$eq":
+            clauses.append(_compile_condition(path, operand, params))
+        elif operator == "$ne":
+            if operand is None:
+                clauses.append(f"{expr} IS NOT NULL")
+            else:
+                params.append(_sql_value(path, operand))
+                clauses.append(f"({expr} IS NULL OR {expr} != ?)")
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            sql_op = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}[operator]
+            params.append(_sql_value(path, operand))
+            clauses.append(f"{expr} {sql_op} ?")
+        elif operator in ("$in", "$nin"):
+            values = list(operand)
+            if not values:
+                clauses.append("0" if operator == "$in" else "1")
+                continue
+            has_null = any(value is None for value in values)
+            values = [value for value in values if value is not None]
+            is_dt = any(isinstance(value, datetime) for value in values) and path != "timestamp"
+            expr = _field_expr(path, is_dt)
+            parts = []
+            if values:
+                params.extend(_sql_value(path, value) for value in values)
+                parts.append(f"{expr} IN ({', '.join('?' * len(values))})")
+            if has_null:
+                parts.append(f"{expr} IS NULL")
+            clause = "(" + " OR ".join(parts) + ")"
+            clauses.append(clause if operator == "$in" else f"NOT {clause}")
+        elif operator == "$exists":
+            clauses.append(f"{expr} IS NOT NULL" if operand else f"{expr} IS NULL")
+        elif operator == "$regex":
+            params.append(_regex_pattern(operand, condition.get("$options", "")))
+            clauses.append(f"REGEXP(?, {expr})")
+        elif operator == "$options":
+            continue
+        elif operator == "$not":
+            clauses.append(f"NOT ({_compile_condition(path, operand, params)})")
+        else:
+            raise NotImplementedError(f"Query operator {operator} is not supported by the SQLite backend")
+    return " AND ".join(clauses) if clauses else "1"
+
+
+def compile_filter(query: Optional[Dict[str, Any]]) -> Tuple[str, List[Any]]:
+    """Translate a MongoDB filter document into a SQL WHERE clause and parameters"""
+    params: List[Any] = []
+    clauses = []
+    for key, condition in (query or {}).items():
+        if key in ("$or", "$and", "$nor"):
+            parts = []
+            for sub_query in condition:
+                sub_sql, sub_params = compile_filter(sub_query)
+                parts.append(f"({sub_sql})")
+                params.extend(sub_params)
+            if not parts:
+                continue
+            joined = (" OR " if key != "$and" else " AND ").join(parts)
+            clauses.append(f"NOT ({joined})" if key == "$nor" else f"({joined})")
+        elif key.startswith("$"):
+            raise NotImplementedError(f"Top-level operator {key} is not supported by the SQLite backend")
+        else:
+            clauses.append(_compile_condition(key, condition, params))
+    return (" AND ".join(clauses) if clauses else "1"), params
+
+
+def _normalize_keys(keys, direction=None) -> List[Tuple[str, int]]:
+    if isinstance(keys, str):
+        return [(keys, direction if direction is not None else 1)]
+    return [(key, value) for key, value in keys]
+
+
+def _order_by(sort: Optional[List[Tuple[str, int]]]) -> str:
+    if not sort:
+        return ""
+    # Embedded datetimes are {"$date": fixed-width ISO} JSON, so they sort correctly as text
+    parts = [f"{_field_expr(path)} {'DESC' if direction == -1 else 'ASC'}" for path, direction in sort]
+    return " ORDER BY " + ", ".join(parts)
+
+
+def _project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return document
+    include = {key for key, value in projection.items() if value and key != "_id"}
+    if include:
+        projected = {key: document[key] for key in include if key in document}
+        if projection.get("_id", 1) and "_id" in document:
+            projected["_id"] = document["_id"]
+        return projected
+    return {key: value for key, value in document.items() if projection.get(key, 1)}
+
+
+# ---------------------------------------------------------------------------
+# Aggregation pipelines (evaluated in Python over the SQL-filtered rows)
+# ---------------------------------------------------------------------------
+
+# BSON comparison order of the value types the application stores
+_TYPE_RANK = ((type(None), 0), (bool, 7), ((int, float), 1), (str, 2), (dict, 3), (list, 4), (bytes, 5),
+              (datetime, 8))
+
+# $dateTrunc bins count from this reference; week bins from the first startOfWeek day on/after it
+_TRUNC_REFERENCE = datetime(2000, 1, 1)
+_TRUNC_STEPS = {
+    "millisecond": timedelta(milliseconds=1), "second": timedelta(seconds=1), "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1),
+}
+_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+
+
+def _order_key(value) -> Tuple[int, Any]:
+    for types, rank in _TYPE_RANK:
+        if isinstance(value, types):
+            if rank in (3, 4):
+                return rank, _dumps(value) if rank == 3 else [_order_key(item) for item in value]
+            return rank, _utc_naive(value) if rank == 8 else value
+    return 6, str(value)
+
+
+def _compare(left, right) -> int:
+    left, right = _order_key(left), _order_key(right)
+    return (left > right) - (left < right)
+
+
+def _freeze(value):
+    """Hashable group key for a (possibly nested) value"""
+    if isinstance(value, dict):
+        return tuple((key, _freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _date_trunc(spec: Dict[str, Any], document: Dict[str, Any]) -> Optional[datetime]:
+    value = _evaluate(spec["date"], document)
+    if not isinstance(value, datetime):
+        return None
+    value = _utc_naive(value)
+    unit = _evaluate(spec["unit"], document)
+    bin_size = int(_evaluate(spec.get("binSize", 1), document))
+    if unit in ("month", "quarter", "year"):
+        months = {"month": 1, "quarter": 3, "year": 12}[unit] * bin_size
+        index = ((value.year - 2000) * 12 + value.month - 1) // months * months
+        return datetime(2000 + index // 12, index % 12 + 1, 1)
+    if unit not in _TRUNC_STEPS:
+        raise NotImplementedError(f"$dateTrunc unit {unit!r} is not supported by the SQLite backend")
+    reference = _TRUNC_REFERENCE
+    if unit == "week":
+        start = str(spec.get("startOfWeek", "sunday")).lower()[:3]
+        start_of_week = next(index for index, day in enumerate(_WEEKDAYS) if day.startswith(start))
+        reference += timedelta(days=(start_of_week - reference.weekday()) % 7)
+    step = _TRUNC_STEPS[unit] * bin_size
+    return reference + step * ((value - reference) // step)
+
+
+def _numeric(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _evaluate(expression, document: Dict[str, Any]):
+    """Evaluate an aggregation expression against one document"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        if expression == "$$ROOT":
+            return document
+        return _get_path(document, expression[1:])
+    if isinstance(expression, list):
+        return [_evaluate(item, document) for item in expression]
+    if not isinstance(expression, dict):
+        return expression
+    if len(expression) != 1 or not next(iter(expression)).startswith("$"):
+        return {key: _evaluate(value, document) for key, value in expression.items()}
+
+    operator, operand = next(iter(expression.items()))
+    if operator == "$literal":
+        return operand
+    if operator == "$dateTrunc":
+        return _date_trunc(operand, document)
+    if operator == "$cond":
+        if isinstance(operand, dict):
+            operand = [operand["if"], operand["then"], operand["else"]]
+        condition, then, otherwise = operand
+        return _evaluate(then if _evaluate(condition, document) else otherwise, document)
+    if operator == "$ifNull":
+        values = operand if isinstance(operand, list) else [operand]
+        for value in values[:-1]:
+            value = _evaluate(value, document)
+            if value is not None:
+                return value
+        return _evaluate(values[-1], document)
+
+    args = _evaluate(operand, document)
+    if operator in ("$hour", "$minute", "$dayOfMonth", "$month", "$year"):
+        date = args[0] if isinstance(args, list) else args
+        if isinstance(date, dict):
+            date = date.get("date")
+        if not isinstance(date, datetime):
+            return None
+        date = _utc_naive(date)
+        return {"$hour": date.hour, "$minute": date.minute, "$dayOfMonth": date.day,
+                "$month": date.month, "$year": date.year}[operator]
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte"):
+        result = _compare(args[0], args[1])
+        return {"$eq": result == 0, "$ne": result != 0, "$gt": result > 0, "$gte": result >= 0,
+                "$lt": result < 0, "$lte": result <= 0}[operator]
+    if operator == "$in":
+        return any(_compare(args[0], item) == 0 for item in args[1] or [])
+    if operator == "$and":
+        return all(args)
+    if operator == "$or":
+        return any(args)
+    if operator == "$not":
+        return not (args[0] if isinstance(args, list) else args)
+    if operator in ("$add", "$subtract", "$multiply", "$divide"):
+        if any(value is None for value in args):
+            return None
+        if operator == "$add":
+            total = sum(value for value in args if not isinstance(value, datetime))
+            dates = [value for value in args if isinstance(value, datetime)]
+            return dates[0] + timedelta(milliseconds=total) if dates else total
+        if operator == "$multiply":
+            result = 1
+            for value in args:
+                result *= value
+            return result
+        left, right = args
+        if operator == "$divide":
+            return left / right
+        if isinstance(left, datetime):
+            return (left - right).total_seconds() * 1000 if isinstance(right, datetime) \
+                else left - timedelta(milliseconds=right)
+        return left - right
+    if operator == "$toString":
+        return None if args is None else str(args)
+    if operator == "$size":
+        return len(args)
+    raise NotImplementedError(f"Expression operator {operator} is not supported by the SQLite backend")
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, re.Pattern):
+        condition = {"$regex": condition}
+    if not isinstance(condition, dict) or not any(key.startswith("$") for key in condition):
+        if isinstance(value, list) and not isinstance(condition, list):
+            return any(_compare(item, condition) == 0 for item in value)
+        return _compare(value, condition) == 0
+
+    for operator, operand in condition.items():
+        if operator == "$eq":
+            matched = _matches_condition(value, operand)
+        elif operator == "$ne":
+            matched = not _matches_condition(value, operand)
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            # Range operators never match across types (None included)
+            result = _compare(value, operand)
+            matched = value is not None and _order_key(value)[0] == _order_key(operand)[0] and \
+                {"$gt": result > 0, "$gte": result >= 0, "$lt": result < 0, "$lte": result <= 0}[operator]
+        elif operator == "$in":
+            matched = any(_matches_condition(value, item) for item in operand)
+        elif operator == "$nin":
+            matched = not any(_matches_condition(value, item) for item in operand)
+        elif operator == "$exists":
+            matched = (value is not _MISSING) == bool(operand)
+        elif operator == "$regex":
+            matched = bool(_regexp(_regex_pattern(operand, condition.get("$options", "")), value)) \
+                if value is not _MISSING else False
+        elif operator == "$options":
+            continue
+        elif operator == "$not":
+            matched = not _matches_condition(value, operand)
+        else:
+            raise NotImplementedError(f"Query operator {operator} is not supported by the SQLite backend")
+        if not matched:
+            return False
+    return True
+
+
+def match_document(document: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    """Python counterpart of compile_filter for $match stages after the first"""
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            matched = all(match_document(document, sub_query) for sub_query in condition)
+        elif key == "$or":
+            matched = any(match_document(document, sub_query) for sub_query in condition)
+        elif key == "$nor":
+            matched = not any(match_document(document, sub_query) for sub_query in condition)
+        elif key.startswith("$"):
+            raise NotImplementedError(f"Top-level operator {key} is not supported by the SQLite backend")
+        else:
+            value = _get_path(document, key, _MISSING)
+            if value is _MISSING and not (isinstance(condition, dict) and "$exists" in condition):
+                matched = _matches_condition(None, condition)
+            else:
+                matched = _matches_condition(value, condition)
+        if not matched:
+            return False
+    return True
+
+
+class _Accumulator:
+    """One $group output field"""
+
+    def __init__(self, spec: Dict[str, Any]):
+        (self.operator, self.expression), = spec.items()
+        if self.operator not in ("$sum", "$avg", "$min", "$max", "$first", "$last", "$push", "$addToSet", "$count"):
+            raise NotImplementedError(f"Accumulator {self.operator} is not supported by the SQLite backend")
+        self.value: Any = _MISSING
+        self.count = 0
+        self.seen: set = set()
+
+    def add(self, document: Dict[str, Any]) -> None:
+        if self.operator == "$count":
+            self.count += 1
+            return
+        value = _evaluate(self.expression, document)
+        if self.operator in ("$sum", "$avg"):
+            if _numeric(value):
+                self.value = value if self.value is _MISSING else self.value + value
+                self.count += 1
+        elif self.operator in ("$min", "$max"):
+            if value is not None and (self.value is _MISSING or
+                                      (_compare(value, self.value) < 0) == (self.operator == "$min")):
+                self.value = value
+        elif self.operator == "$first":
+            if self.value is _MISSING:
+                self.value = value
+        elif self.operator == "$last":
+            self.value = value
+        elif self.operator == "$push":
+            self.value = [] if self.value is _MISSING else self.value
+            self.value.append(value)
+        else:
+            self.value = [] if self.value is _MISSING else self.value
+            key = _freeze(value)
+            if key not in self.seen:
+                self.seen.add(key)
+                self.value.append(value)
+
+    def result(self):
+        if self.operator == "$count":
+            return self.count
+        if self.operator == "$sum":
+            return 0 if self.value is _MISSING else self.value
+        if self.operator == "$avg":
+            return None if self.value is _MISSING else self.value / self.count
+        if self.operator in ("$push", "$addToSet"):
+            return [] if self.value is _MISSING else self.value
+        return None if self.value is _MISSING else self.value
+
+
+def _group(documents: Iterable[Dict[str, Any]], spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    fields = {name: value for name, value in spec.items() if name != "_id"}
+    groups: Dict[Any, Tuple[Any, Dict[str, _Accumulator]]] = {}
+    for document in documents:
+        key = _evaluate(spec["_id"], document)
+        frozen = _freeze(key)
+        entry = groups.get(frozen)
+        if entry is None:
+            entry = groups[frozen] = (key, {name: _Accumulator(value) for name, value in fields.items()})
+        for accumulator in entry[1].values():
+            accumulator.add(document)
+    return [
+        {"_id": key, **{name: accumulator.result() for name, accumulator in accumulators.items()}}
+        for key, accumulators in groups.values()
+    ]
+
+
+def _sort(documents: Iterable[Dict[str, Any]], spec: Dict[str, int]) -> List[Dict[str, Any]]:
+    ordered = list(documents)
+    for path, direction in reversed(list(spec.items())):
+        ordered.sort(key=lambda document: _order_key(_get_path(document, path)), reverse=direction == -1)
+    return ordered
+
+
+def _project_stage(document: Dict[str, Any], spec: Dict[str, Any]) -> Dict[str, Any]:
+    if all(value in (0, False) for key, value in spec.items()):
+        projected = copy.deepcopy(document)
+        for path in spec:
+            _unset_path(projected, path)
+        return projected
+    projected: Dict[str, Any] = {}
+    if spec.get("_id", 1) and "_id" in document:
+        projected["_id"] = document["_id"]
+    for path, value in spec.items():
+        if path == "_id":
+            if value not in (0, 1, True, False):
+                projected["_id"] = _evaluate(value, document)
+            continue
+        if value in (1, True):
+            value = _get_path(document, path, _MISSING)
+            if value is not _MISSING:
+                _set_path(projected, path, value)
+        elif value not in (0, False):
+            _set_path(projected, path, _evaluate(value, document))
+    return projected
+
+
+def _add_fields(document: Dict[str, Any], spec: Dict[str, Any]) -> Dict[str, Any]:
+    extended = copy.deepcopy(document)
+    for path, value in spec.items():
+        _set_path(extended, path, _evaluate(value, document))
+    return extended
+
+
+def _unwind(documents: Iterable[Dict[str, Any]], spec) -> Iterator[Dict[str, Any]]:
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    path = spec["path"].lstrip("$")
+    keep_empty = spec.get("preserveNullAndEmptyArrays", False)
+    for document in documents:
+        values = _get_path(document, path)
+        if isinstance(values, list) and values:
+            for value in values:
+                unwound = dict(document)
+                _set_path(unwound, path, value)
+                yield unwound
+        elif isinstance(values, list) or values is None:
+            if keep_empty:
+                yield document
+        else:
+            yield document
+
+
+def run_pipeline(documents: Iterable[Dict[str, Any]], pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Run aggregation stages over an iterable of documents. Streaming stages
+    ($match, $project, $set, $unwind, $skip, $limit) stay lazy so a leading
+    $group consumes the rows without materializing them.
+    """
+    stream: Iterable[Dict[str, Any]] = documents
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            stream = filter(functools.partial(match_document, query=spec), stream)
+        elif name == "$group":
+            stream = _group(stream, spec)
+        elif name == "$sort":
+            stream = _sort(stream, spec)
+        elif name == "$limit":
+            stream = itertools.islice(stream, spec)
+        elif name == "$skip":
+            stream = itertools.islice(stream, spec, None)
+        elif name == "$count":
+            total = sum(1 for _ in stream)
+            stream = [{spec: total}] if total else []
+        elif name == "$project":
+            stream = map(functools.partial(_project_stage, spec=spec), stream)
+        elif name in ("$set", "$addFields"):
+            stream = map(functools.partial(_add_fields, spec=spec), stream)
+        elif name == "$unwind":
+            stream = _unwind(stream, spec)
+        elif name == "$facet":
+            materialized = list(stream)
+            stream = [{key: run_pipeline(materialized, sub_pipeline) for key, sub_pipeline in spec.items()}]
+        else:
+            raise NotImplementedError(f"Aggregation stage {name} is not supported by the SQLite backend")
+    return list(stream)
+
+
+# ---------------------------------------------------------------------------
+# Cursor / collection / database / client
+# ---------------------------------------------------------------------------
+
+class SQLiteCursor:
+    """Lazy cursor supporting sort/skip/limit/to_list and async iteration"""
+
+    def __init__(self, collection: "SQLiteCollection", query: Optional[Dict[str, Any]] = None,
+                 projection: Optional[Dict[str, Any]] = None, sort=None, skip: int = 0, limit: int = 0):
+        self._collection = collection
+        self._query = query or {}
+        self._projection = projection
+        self._sort: List[Tuple[str, int]] = _normalize_keys(sort) if sort else []
+        self._skip = skip
+        self._limit = limit
+        self._buffer: Optional[List[Dict[str, Any]]] = None
+
+    def sort(self, key_or_list, direction: Optional[int] = None) -> "SQLiteCursor":
+        self._sort = _normalize_keys(key_or_list, direction)
+        return self
+
+    def skip(self, count: int) -> "SQLiteCursor":
+        self._skip = count
+        return self
+
+    def limit(self, count: int) -> "SQLiteCursor":
+        self._limit = count
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        limit = self._limit
+        if length:
+            limit = min(limit, length) if limit else length
+        return await self._collection._run_read(
+            self._collection._select, self._query, self._projection, self._sort, self._skip, limit
+        )
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._buffer is None:
+            self._buffer = await self.to_list(None)
+        if not self._buffer:
+            raise StopAsyncIteration
+        return self._buffer.pop(0)
+
+
+class SQLiteCollection:
+    """Motor-compatible collection stored in one SQLite table"""
+
+    def __init__(self, database: "SQLiteDatabase", name: str):
+        if not _NAME_RE.match(name):
+            raise ValueError(f"Invalid collection name for SQLite backend: {name!r}")
+        self.database = database
+        self.name = name
+        self._insert_sql = (
+            f'INSERT INTO "{name}" (_id, {", ".join(HOT_FIELDS)}, doc) '
+            f'VALUES (?, {", ".join("?" * len(HOT_FIELDS))}, ?)'
+        )
+        self._update_sql = (
+            f'UPDATE "{name}" SET {", ".join(f"{col} = ?" for col in HOT_FIELDS)}, doc = ? WHERE _id = ?'
+        )
+
+    # -- plumbing ---------------------------------------------------------
+
+    def with_options(self, **kwargs) -> "SQLiteCollection":
+        """Write concerns do not apply; durability comes from WAL + synchronous=NORMAL"""
+        return self
+
+    async def _run_read(self, func: Callable, *args):
+        return await asyncio.to_thread(self.database._read, self.name, func, *args)
+
+    async def _run_write(self, func: Callable, *args):
+        return await asyncio.to_thread(self.database._write, self.name, func, *args)
+
+    @staticmethod
+    def _row(document: Dict[str, Any]) -> Tuple[Any, ...]:
+        values = []
+        for column in HOT_FIELDS:
+            value = document.get(column)
+            if isinstance(value, datetime):
+                value = _epoch(value) if column == "timestamp" else _iso(value)
+            elif value is not None and not isinstance(value, (str, int, float)):
+                value = str(value)
+            values.append(value)
+        return (_id_key(document["_id"]), *values, _dumps(document))
+
+    def _select(self, conn: sqlite3.Connection, query, projection, sort, skip, limit) -> List[Dict[str, Any]]:
+        where, params = compile_filter(query)
+        sql = f'SELECT doc FROM "{self.name}" WHERE {where}{_order_by(sort)}'
+        if limit or skip:
+            sql += " LIMIT ? OFFSET ?"
+            params = params + [limit if limit else -1, skip]
+        return [_project(_loads(row[0]), projection) for row in conn.execute(sql, params)]
+
+    def _count(self, conn: sqlite3.Connection, query, limit: int = 0) -> int:
+        where, params = compile_filter(query)
+        if limit:
+            sql = f'SELECT COUNT(*) FROM (SELECT 1 FROM "{self.name}" WHERE {where} LIMIT ?)'
+            params = params + [limit]
+        else:
+            sql = f'SELECT COUNT(*) FROM "{self.name}" WHERE {where}'
+        return conn.execute(sql, params).fetchone()[0]
+
+    def _insert(self, conn: sqlite3.Connection, documents: List[Dict[str, Any]], ordered: bool) -> List[Any]:
+        for document in documents:
+            if "_id" not in document:
+                document["_id"] = _new_id()
+        try:
+            if ordered:
+                conn.executemany(self._insert_sql, [self._row(doc) for doc in documents])
+            else:
+                # Unordered: keep going past duplicates instead of aborting the batch
+                conn.executemany(self._insert_sql.replace("INSERT", "INSERT OR IGNORE", 1),
+                                 [self._row(doc) for doc in documents])
+        except sqlite3.IntegrityError as e:
+            raise DuplicateKeyError(str(e))
+        return [document["_id"] for document in documents]
+
+    def _update(self, conn: sqlite3.Connection, query, update, upsert: bool, multi: bool) -> UpdateResult:
+        where, params = compile_filter(query)
+        sql = f'SELECT doc FROM "{self.name}" WHERE {where}' + ("" if multi else " LIMIT 1")
+        rows = conn.execute(sql, params).fetchall()
+
+        if not rows:
+            if not upsert:
+                return UpdateResult(0, 0)
+            seed = {
+                key: value for key, value in (query or {}).items()
+                if not key.startswith("$") and not isinstance(value, dict)
+            }
+            document = apply_update(seed, update, is_insert=True)
+            document.setdefault("_id", seed.get("_id") or _new_id())
+            self._insert(conn, [document], ordered=True)
+            return UpdateResult(0, 0, upserted_id=document["_id"])
+
+        modified = 0
+        for (payload,) in rows:
+            original = _loads(payload)
+            updated = apply_update(original, update)
+            updated["_id"] = original["_id"]
+            if updated != original:
+                row = self._row(updated)
+                try:
+                    conn.execute(self._update_sql, (*row[1:], row[0]))
+                except sqlite3.IntegrityError as e:
+                    raise DuplicateKeyError(str(e))
+                modified += 1
+        return UpdateResult(len(rows), modified)
+
+    def _delete(self, conn: sqlite3.Connection, query, multi: bool) -> DeleteResult:
+        where, params = compile_filter(query)
+        if multi:
+            cursor = conn.execute(f'DELETE FROM "{self.name}" WHERE {where}', params)
+        else:
+            cursor = conn.execute(
+                f'DELETE FROM "{self.name}" WHERE rowid IN '
+                f'(SELECT rowid FROM "{self.name}" WHERE {where} LIMIT 1)', params
+            )
+        return DeleteResult(cursor.rowcount)
+
+    # -- public API -------------------------------------------------------
+
+    async def insert_one(self, document: Dict[str, Any], **kwargs) -> InsertOneResult:
+        ids = await self._run_write(self._insert, [document], True)
+        return InsertOneResult(ids[0])
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True, **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        if not documents:
+            raise ValueError("documents must be a non-empty list")
+        ids = await self._run_write(self._insert, documents, ordered)
+        return InsertManyResult(ids)
+
+    def find(self, filter: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None,
+             sort=None, skip: int = 0, limit: int = 0, **kwargs) -> SQLiteCursor:
+        return SQLiteCursor(self, filter, projection, sort, skip, limit)
+
+    async def find_one(self, filter: Optional[Dict[str, Any]] = None,
+                       projection: Optional[Dict[str, Any]] = None, sort=None, **kwargs) -> Optional[Dict[str, Any]]:
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        documents = await self.find(filter, projection, sort=sort, limit=1).to_list(1)
+        return documents[0] if documents else None
+
+    async def count_documents(self, filter: Dict[str, Any], limit: int = 0, **kwargs) -> int:
+        return await self._run_read(self._count, filter, limit)
+
+    async def estimated_document_count(self, **kwargs) -> int:
+        return await self._run_read(self._count, {}, 0)
+
+    async def update_one(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                         **kwargs) -> UpdateResult:
+        return await self._run_write(self._update, filter, update, upsert, False)
+
+    async def update_many(self, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                          **kwargs) -> UpdateResult:
+        return await self._run_write(self._update, filter, update, upsert, True)
+
+    async def replace_one(self, filter: Dict[str, Any], replacement: Dict[str, Any], upsert: bool = False,
+                          **kwargs) -> UpdateResult:
+        return await self._run_write(self._update, filter, replacement, upsert, False)
+
+    async def delete_one(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return await self._run_write(self._delete, filter, False)
+
+    async def delete_many(self, filter: Dict[str, Any], **kwargs) -> DeleteResult:
+        return await self._run_write(self._delete, filter, True)
+
+    async def create_index(self, keys, unique: bool = False, name: Optional[str] = None, **kwargs) -> str:
+        """Create a (possibly expression based) index; Mongo-only options are ignored"""
+        key_list = _normalize_keys(keys)
+        index_name = name or "_".join(f"{path}_{direction}" for path, direction in key_list)
+        index_name = re.sub(r"[^A-Za-z0-9_]", "_", index_name)
+        columns = ", ".join(
+            f"{_field_expr(path)} {'DESC' if direction == -1 else 'ASC'}" for path, direction in key_list
+        )
+        sql = (
+            f'CREATE {"UNIQUE " if unique else ""}INDEX IF NOT EXISTS '
+            f'"{self.name}__{index_name}" ON "{self.name}" ({columns})'
+        )
+        await self._run_write(lambda conn: conn.execute(sql))
+        return index_name
+
+    async def create_indexes(self, indexes: List[Any], **kwargs) -> List[str]:
+        names = []
+        for index in indexes:
+            document = getattr(index, "document", index)
+            names.append(await self.create_index(
+                list(document["key"].items()), unique=document.get("unique", False), name=document.get("name")
+            ))
+        return names
+
+    def list_indexes(self) -> "_StaticCursor":
+        def _list(conn: sqlite3.Connection):
+            prefix = f"{self.name}__"
+            return [
+                {"name": row[1][len(prefix):] if row[1].startswith(prefix) else row[1], "unique": bool(row[2])}
+                for row in conn.execute(f'PRAGMA index_list("{self.name}")')
+            ]
+        return _StaticCursor(lambda: self._run_read(_list))
+
+    async def index_information(self) -> Dict[str, Any]:
+        return {index["name"]: index for index in await self.list_indexes().to_list(None)}
+
+    async def drop_index(self, index_name: str, **kwargs) -> None:
+        await self._run_write(lambda conn: conn.execute(f'DROP INDEX IF EXISTS "{self.name}__{index_name}"'))
+
+    async def drop(self) -> None:
+        await self.database.drop_collection(self.name)
+
+    def _aggregate(self, conn: sqlite3.Connection, pipeline: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        query: Dict[str, Any] = {}
+        if pipeline and "$match" in pipeline[0]:
+            try:
+                compile_filter(pipeline[0]["$match"])
+                query, pipeline = pipeline[0]["$match"], pipeline[1:]
+            except (NotImplementedError, ValueError):
+                pass
+        where, params = compile_filter(query)
+        rows = conn.execute(f'SELECT doc FROM "{self.name}" WHERE {where}', params)
+        return run_pipeline((_loads(row[0]) for row in rows), pipeline)
+
+    def aggregate(self, pipeline: List[Dict[str, Any]], **kwargs) -> "_StaticCursor":
+        """Leading $match runs in SQL, the rest streams through run_pipeline (allowDiskUse is ignored)"""
+        return _StaticCursor(lambda: self._run_read(self._aggregate, pipeline))
+
+
+class _StaticCursor:
+    """Cursor over a lazily computed list (list_indexes, aggregate)"""
+
+    def __init__(self, loader: Callable):
+        self._loader = loader
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        items = await self._loader()
+        return items[:length] if length else items
+
+    async def __aiter__(self):
+        for item in await self._loader():
+            yield item
+
+
+class SQLiteDatabase:
+    """SQLite file exposed through the Motor database API"""
+
+    def __init__(self, path: Union[str, Path], name: str = "kobi_firewall_db"):
+        self.path = Path(path)
+        self.name = name
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._tables: set = set()
+        self._collections: Dict[str, SQLiteCollection] = {}
+        self._writer = self._open()
+        self._tables.update(
+            row[0] for row in self._writer.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        )
+        logger.info(f"✅ SQLite storage opened: {self.path} (WAL)")
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            str(self.path), check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-16000")
+        conn.create_function("REGEXP", 2, _regexp, deterministic=True)
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_table(self, name: str) -> None:
+        if name in self._tables:
+            return
+        with self._write_lock:
+            if name in self._tables:
+                return
+            self._writer.execute(
+                f'CREATE TABLE IF NOT EXISTS "{name}" ('
+                f'_id TEXT PRIMARY KEY, timestamp REAL, level TEXT, source TEXT, '
+                f'source_ip TEXT, event_type TEXT, doc TEXT NOT NULL)'
+            )
+            for columns in HOT_INDEXES.get(name, DEFAULT_HOT_INDEXES):
+                index_name = f"{name}__hot_{'_'.join(columns)}"
+                self._writer.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{name}" ({", ".join(columns)})'
+                )
+            self._tables.add(name)
+
+    def _read(self, name: str, func: Callable, *args):
+        self._ensure_table(name)
+        return func(self._reader(), *args)
+
+    def _write(self, name: str, func: Callable, *args):
+        """Run func inside one IMMEDIATE transaction on the writer connection"""
+        self._ensure_table(name)
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self._writer, *args)
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+            self._writer.execute("COMMIT")
+            return result
+
+    def __getitem__(self, name: str) -> SQLiteCollection:
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = SQLiteCollection(self, name)
+        return collection
+
+    def __getattr__(self, name: str) -> SQLiteCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> SQLiteCollection:
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> List[str]:
+        def _names():
+            return [
+                row[0] for row in self._reader().execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                )
+            ]
+        return await asyncio.to_thread(_names)
+
+    async def create_collection(self, name: str, **kwargs) -> SQLiteCollection:
+        """Create the backing table; time-series / capped options are ignored"""
+        await asyncio.to_thread(self._ensure_table, name)
+        return self[name]
+
+    async def drop_collection(self, name: str) -> None:
+        def _drop():
+            with self._write_lock:
+                self._writer.execute(f'DROP TABLE IF EXISTS "{name}"')
+                self._tables.discard(name)
+        await asyncio.to_thread(_drop)
+
+    async def command(self, command, *args, **kwargs) -> Dict[str, Any]:
+        name = command if isinstance(command, str) else next(iter(command))
+        if name in ("ping", "ismaster", "isMaster", "hello"):
+            return {"ok": 1.0}
+        if name == "dbstats":
+            return await asyncio.to_thread(self._dbstats)
+        if name == "buildinfo":
+            return {"ok": 1.0, "version": f"sqlite {sqlite3.sqlite_version}"}
+        raise NotImplementedError(f"Command {name!r} is not supported by the SQLite backend")
+
+    def _dbstats(self) -> Dict[str, Any]:
+        conn = self._reader()
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        objects = sum(conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables)
+        data_size = os.path.getsize(self.path) if self.path.exists() else 0
+        return {
+            "ok": 1.0, "db": self.name, "collections": len(tables), "objects": objects,
+            "dataSize": data_size, "storageSize": data_size, "indexSize": 0,
+        }
+
+    def close(self) -> None:
+        with self._write_lock:
+            try:
+                self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error:
+                pass
+            self._writer.close()
+
+
+class _SQLiteAdmin:
+    def __init__(self, client: "SQLiteClient"):
+        self._client = client
+
+    async def command(self, command, *args, **kwargs) -> Dict[str, Any]:
+        return {"ok": 1.0}
+
+
+class SQLiteClient:
+    """Stand-in for AsyncIOMotorClient backed by a single SQLite file"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._databases: Dict[str, SQLiteDatabase] = {}
+        self.admin = _SQLiteAdmin(self)
+
+    def __getitem__(self, name: str) -> SQLiteDatabase:
+        database = self._databases.get(name)
+        if database is None:
+            database = self._databases[name] = SQLiteDatabase(self.path, name)
+        return database
+
+    def get_database(self, name: str, **kwargs) -> SQLiteDatabase:
+        return self[name]
+
+    async def drop_database(self, name: str) -> None:
+        database = self._databases.pop(name, None)
+        if database is not None:
+            database.close()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+    def close(self) -> None:
+        for database in self._databases.values():
+            try:
+                database.close()
+            except Exception as e:
+                logger.warning(f"⚠️ Error closing SQLite storage: {e}")
+        self._databases.clear()
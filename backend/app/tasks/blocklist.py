@@ -0,0 +1,220 @@
+"""
+Dynamic blocklist task: kernel set writer + firewall_blocklist mirror
+ban_address / auto_ban only queue the change, so detection code can call them
+from anywhere without waiting on a subprocess. Every firewall_blocklist_flush_ms
+the queue is drained into batched kernel calls and upserted into the
+firewall_blocklist collection (TTL index on expires_at). On startup the active
+documents are loaded and swapped into the kernel sets in one pass. A failed
+kernel write marks the sets for a full reload on the next pass.
+"""
+import asyncio
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from pymongo import DeleteOne, UpdateOne
+
+from ..blocklist import (
+    BlocklistEntry, DynamicBlocklist, blocklist_backend, ensure_blockable, make_entry, protected_networks
+)
+from ..settings import get_settings
+
+_blocklist: Optional[DynamicBlocklist] = None
+_flush_lock: Optional[asyncio.Lock] = None
+_tasks: List[asyncio.Task] = []
+_resync_needed = False
+_metrics: Dict[str, Any] = {
+    "flushes": 0,
+    "entries_added": 0,
+    "entries_removed": 0,
+    "kernel_errors": 0,
+    "last_flush_ms": None,
+    "last_flush_at": None,
+    "last_error": None,
+    "loaded": 0,
+}
+
+
+def get_blocklist() -> DynamicBlocklist:
+    global _blocklist
+    if _blocklist is None:
+        _blocklist = DynamicBlocklist(blocklist_backend() if get_settings().firewall_blocklist_enabled else None)
+    return _blocklist
+
+
+def ban_address(address: Any, ttl_seconds: Optional[int] = None, reason: Optional[str] = None,
+                source: str = "api", protected: Optional[Iterable[Any]] = None) -> BlocklistEntry:
+    """
+    Queue an address or CIDR for the kernel blocklist. Raises ValueError for bad
+    input and for entries that are too wide or overlap a protected network
+    (pass protected_networks() once when banning many addresses).
+    """
+    entry = make_entry(address, ttl_seconds, reason, source)
+    ensure_blockable(entry.address, protected_networks() if protected is None else protected)
+    get_blocklist().add(entry)
+    return entry
+
+
+def unban_address(address: Any) -> bool:
+    return get_blocklist().remove(address)
+
+
+def auto_ban(ip: str, ttl_seconds: int, reason: str, source: str = "auth") -> Optional[BlocklistEntry]:
+    """Ban from detection code when firewall_blocklist_auto_ban is on; never protected or unparsable input"""
+    if not get_settings().firewall_blocklist_auto_ban:
+        return None
+    try:
+        entry = ban_address(ip, ttl_seconds, reason, source)
+    except ValueError:
+        return None
+    print(f"🚫 Auto-banned {entry.address} for {ttl_seconds}s ({reason})")
+    return entry
+
+
+def is_address_blocked(ip: str) -> bool:
+    try:
+        return _blocklist is not None and _blocklist.lookup(ip) is not None
+    except ValueError:
+        return False
+
+
+async def flush_blocklist(database=None) -> Dict[str, Any]:
+    """Write queued changes to the kernel and the mirror now"""
+    global _flush_lock, _resync_needed
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+    blocklist = get_blocklist()
+    settings = get_settings()
+
+    async with _flush_lock:
+        blocklist.expire()
+        added, removed, refreshed = blocklist.drain()
+        if not (added or removed or _resync_needed):
+            return {"added": 0, "removed": 0}
+        started = datetime.utcnow()
+        loop = asyncio.get_event_loop()
+
+        if blocklist.backend is not None:
+            try:
+                if _resync_needed:
+                    await loop.run_in_executor(None, blocklist.backend.replace, blocklist.snapshot(), started,
+                                               settings.firewall_blocklist_batch_size)
+                    _resync_needed = False
+                else:
+                    await loop.run_in_executor(None, blocklist.backend.apply, added, removed, started,
+                                               settings.firewall_blocklist_batch_size, refreshed)
+            except Exception as e:
+                _resync_needed = True
+                _metrics["kernel_errors"] += 1
+                _metrics["last_error"] = str(e)
+                print(f"❌ Blocklist kernel update failed, full reload on the next pass: {e}")
+
+        if database is not None:
+            operations = [
+                UpdateOne({"_id": entry.address},
+                          {"$set": entry.to_document(started), "$setOnInsert": {"created_at": started}}, upsert=True)
+                for entry in added
+            ] + [DeleteOne({"_id": address}) for address in removed]
+            batch_size = settings.firewall_blocklist_batch_size
+            for start in range(0, len(operations), batch_size):
+                await database.firewall_blocklist.bulk_write(operations[start:start + batch_size], ordered=False)
+
+        elapsed_ms = (datetime.utcnow() - started).total_seconds() * 1000
+        _metrics["flushes"] += 1
+        _metrics["entries_added"] += len(added)
+        _metrics["entries_removed"] += len(removed)
+        _metrics["last_flush_ms"] = round(elapsed_ms, 2)
+        _metrics["last_flush_at"] = started.isoformat()
+        return {"added": len(added), "removed": len(removed), "apply_ms": round(elapsed_ms, 2)}
+
+
+async def load_blocklist(database) -> int:
+    """Active firewall_blocklist documents -> memory + kernel sets (startup)"""
+    global _resync_needed
+    now = datetime.utcnow()
+    blocklist = get_blocklist()
+    cursor = database.firewall_blocklist.find({"$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]})
+    entries = []
+    async for document in cursor:
+        try:
+            entries.append(BlocklistEntry.from_document(document))
+        except (KeyError, ValueError) as e:
+            print(f"⚠️ Skipping invalid blocklist entry {document.get('_id')}: {e}")
+    blocklist.load(entries)
+    _metrics["loaded"] = len(entries)
+    if blocklist.backend is not None:
+        try:
+            await asyncio.get_event_loop().run_in_executor(
+                None, blocklist.backend.replace, blocklist.snapshot(), now, get_settings().firewall_blocklist_batch_size
+            )
+        except Exception as e:
+            _resync_needed = True
+            _metrics["last_error"] = str(e)
+            print(f"❌ Blocklist reload into the kernel failed: {e}")
+    return len(entries)
+
+
+async def _blocklist_loop(get_db, interval: float):
+    database = None
+    while database is None:
+        try:
+            database = await get_db()
+            if database is not None:
+                loaded = await load_blocklist(database)
+                print(f"🚫 Dynamic blocklist loaded: {loaded} entries")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            database = None
+            print(f"❌ Dynamic blocklist load failed: {e}")
+            await asyncio.sleep(max(interval, 5))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_blocklist(database)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _metrics["last_error"] = str(e)
+            print(f"❌ Dynamic blocklist flush failed: {e}")
+
+
+def start_blocklist(get_db):
+    """Reload the blocklist and keep writing queued bans out"""
+    settings = get_settings()
+    if not settings.firewall_blocklist_enabled:
+        return
+    if any(not task.done() for task in _tasks):
+        return
+
+    backend = get_blocklist().backend
+    _tasks[:] = [asyncio.create_task(_blocklist_loop(get_db, settings.firewall_blocklist_flush_ms / 1000))]
+    print(f"🚫 Dynamic blocklist started ({backend.name if backend else 'no kernel set'}, "
+          f"flush every {settings.firewall_blocklist_flush_ms} ms)")
+
+
+async def stop_blocklist(database=None):
+    for task in _tasks:
+        task.cancel()
+    for task in _tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _tasks.clear()
+    if _blocklist is not None and _blocklist.pending:
+        try:
+            await flush_blocklist(database)
+        except Exception as e:
+            print(f"⚠️ Final blocklist flush failed: {e}")
+
+
+def get_blocklist_status() -> Dict[str, Any]:
+    blocklist = get_blocklist()
+    return {
+        **_metrics,
+        "backend": blocklist.backend.name if blocklist.backend else None,
+        "active": len(blocklist),
+        "pending": blocklist.pending,
+        "resync_needed": _resync_needed,
+        "running": any(not task.done() for task in _tasks),
+    }
@@ -3,10 +3,14 @@ Database cleanup and maintenance tasks
 """
 import asyncio
 from datetime import datetime, timedelta
+from typing import Optional
+
 from ..database import get_database
 from ..settings import get_settings
+from ..timeseries import sweep_expired
 
 settings = get_settings()
+_retention_task: Optional[asyncio.Task] = None
 
 
 async def start_cleanup_tasks():
@@ -24,7 +28,7 @@ async def log_cleanup_task():
         try:
             await asyncio.sleep(3600)  # Run every hour
 
-            db = get_database()
+            db = await get_database()
             cutoff = datetime.utcnow() - timedelta(days=30)  # Keep logs for 30 days
 
             # Clean system logs
@@ -85,24 +89,8 @@ async def temp_data_cleanup_task():
         try:
             await asyncio.sleep(86400)  # Run daily
 
-            db = get_database()
-
-            # Clean old health records (keep only 7 days)
-            cutoff = datetime.utcnow() - timedelta(days=7)
-
-            collections_to_clean = [
-                "system_health",
-                "database_health",
-                "performance_metrics"
-            ]
-
-            for collection_name in collections_to_clean:
-                try:
-                    result = await db[collection_name].delete_many({"timestamp": {"$lt": cutoff}})
-                    if result.deleted_count > 0:
-                        print(f"🧹 Cleaned {result.deleted_count} old records from {collection_name}")
-                except Exception as e:
-                    print(f"⚠️ Error cleaning {collection_name}: {e}")
+            # Health records and performance metrics expire through the retention
+            # sweeper (or expireAfterSeconds on migrated MongoDB collections)
 
             # Clean up failed authentication attempts (reset daily)
             from ..dependencies import security_manager
@@ -112,4 +100,41 @@ async def temp_data_cleanup_task():
 
         except Exception as e:
             print(f"⚠️ Error in temp data cleanup: {e}")
-            await asyncio.sleep(86400)
\ No newline at end of file
+            await asyncio.sleep(86400)
+
+
+async def _retention_loop(get_db, native_expiry: bool, interval: int):
+    while True:
+        try:
+            database = await get_db()
+            if database is not None:
+                deleted = await sweep_expired(database, native_expiry)
+                total = sum(deleted.values())
+                if total:
+                    print(f"🧹 Retention sweep removed {total} expired metric records: {deleted}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ Error in retention sweep: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_retention_sweeper(get_db, native_expiry: bool = True):
+    """Expire metric collections the server does not (SQLite, unmigrated MongoDB)"""
+    global _retention_task
+    if _retention_task is not None and not _retention_task.done():
+        return
+    interval = get_settings().retention_sweep_interval_seconds
+    _retention_task = asyncio.create_task(_retention_loop(get_db, native_expiry, interval))
+    print(f"🧹 Retention sweeper started (every {interval}s)")
+
+
+async def stop_retention_sweeper():
+    global _retention_task
+    if _retention_task is not None:
+        _retention_task.cancel()
+        try:
+            await _retention_task
+        except asyncio.CancelledError:
+            pass
+        _retention_task = None
@@ -1,106 +1,505 @@
 """
 Firewall synchronization tasks
+Every OS firewall change goes through one FirewallSyncWorker: changes queued
+within the debounce window are folded into a single compiled apply of the
+whole ruleset, and all firewall tool calls (apply, reconcile, counters) run
+on one dedicated thread instead of one executor thread per change.
 """
 import asyncio
 import platform
-from typing import Dict, Any
-from ..firewall_os import add_firewall_rule_os, remove_firewall_rule_os, update_firewall_rule_os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from ..firewall_os import add_firewall_rule_os, remove_firewall_rule_os, update_firewall_rule_os, apply_ruleset_os
+from ..firewall_reconciler import FirewallReconciler
+from ..firewall_ruleset import GROUP_TAG
+from ..hit_counters import HitCounterCollector
+from ..database import get_database
+from ..settings import get_settings
 
+# Bursts of rule changes are folded into one reconcile pass
+RECONCILE_DEBOUNCE_SECONDS = 1.0
 
-async def sync_rule_to_os(rule_doc: Dict[str, Any]) -> bool:
-    """
-    Sync firewall rule to operating system
-    """
-    try:
-        # Format rule for OS
-        formatted_rule = {
-            "rule_name": rule_doc.get("rule_name", ""),
-            "source_ips": rule_doc.get("source_ips", []),
-            "destination_ips": rule_doc.get("destination_ips", []),
-            "source_ports": rule_doc.get("source_ports", []),
-            "destination_ports": rule_doc.get("destination_ports", []),
-            "protocol": rule_doc.get("protocol", "ANY"),
-            "action": rule_doc.get("action", "ALLOW"),
-            "direction": rule_doc.get("direction", "IN"),
-            "enabled": rule_doc.get("enabled", True),
-            "priority": rule_doc.get("priority", 100),
-            "profile": rule_doc.get("profile", "Any"),
-            "description": rule_doc.get("description", ""),
-            "port": rule_doc.get("destination_ports", [None])[0] if rule_doc.get("destination_ports") else None
+# Updates touching only these fields come from the hit counter collector
+HIT_FIELDS = frozenset({"hit_count", "last_hit"})
+
+# Apply latencies kept for the sync metrics
+LATENCY_WINDOW = 200
+
+
+def _format_rule(rule_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Rule in the shape the per-rule OS drivers expect"""
+    return {
+        "rule_name": rule_doc.get("rule_name", ""),
+        "source_ips": rule_doc.get("source_ips", []),
+        "destination_ips": rule_doc.get("destination_ips", []),
+        "source_ports": rule_doc.get("source_ports", []),
+        "destination_ports": rule_doc.get("destination_ports", []),
+        "protocol": rule_doc.get("protocol", "ANY"),
+        "action": rule_doc.get("action", "ALLOW"),
+        "direction": rule_doc.get("direction", "IN"),
+        "enabled": rule_doc.get("enabled", True),
+        "priority": rule_doc.get("priority", 100),
+        "profile": rule_doc.get("profile", "Any"),
+        "description": rule_doc.get("description", ""),
+        "port": rule_doc.get("destination_ports", [None])[0] if rule_doc.get("destination_ports") else None
+    }
+
+
+def _format_old_rule(rule_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Previous version of a rule, as much as update_rule needs to find it"""
+    return {
+        "rule_name": rule_doc.get("rule_name", ""),
+        "source_ips": rule_doc.get("source_ips", []),
+        "port": rule_doc.get("destination_ports", [None])[0] if rule_doc.get("destination_ports") else None,
+        "protocol": rule_doc.get("protocol", "ANY"),
+        "action": rule_doc.get("action", "ALLOW"),
+        "direction": rule_doc.get("direction", "IN")
+    }
+
+
+@dataclass
+class FirewallChange:
+    """One queued rule change and the caller waiting for its apply"""
+    kind: str                       # add / remove / update
+    rule: Dict[str, Any]
+    old_rule: Optional[Dict[str, Any]]
+    future: asyncio.Future
+
+
+def overlay_changes(rule_docs: List[Dict[str, Any]], changes: List[FirewallChange]) -> List[Dict[str, Any]]:
+    """Enabled rules from the database with queued changes applied on top, in order (keyed by rule_name)"""
+    by_name = {doc.get("rule_name"): doc for doc in rule_docs}
+    for change in changes:
+        if change.kind == "update" and change.old_rule:
+            by_name.pop(change.old_rule.get("rule_name"), None)
+        name = change.rule.get("rule_name")
+        if change.kind == "remove" or not change.rule.get("enabled", True):
+            by_name.pop(name, None)
+        else:
+            by_name[name] = change.rule
+    return list(by_name.values())
+
+
+class FirewallSyncWorker:
+    """Single, serialized consumer of firewall changes with debounce coalescing"""
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="firewall-sync")
+        self.debounce_seconds = 0.2
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.metrics: Dict[str, Any] = {
+            "changes_received": 0,
+            "batches": 0,
+            "largest_batch": 0,
+            "last_batch_size": 0,
+            "compiled_applies": 0,
+            "per_rule_applies": 0,
+            "failed_batches": 0,
+            "last_apply_ms": None,
+            "last_apply_at": None,
+            "last_error": None,
         }
 
-        # Run in thread pool to avoid blocking
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        if self.running:
+            return
+        self.debounce_seconds = get_settings().firewall_sync_debounce_ms / 1000
+        self.queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        while self.queue is not None and not self.queue.empty():
+            change = self.queue.get_nowait()
+            if not change.future.done():
+                change.future.set_result(False)
+
+    async def run_blocking(self, func, *args):
+        """Run a firewall tool call on the sync thread"""
         loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, add_firewall_rule_os, formatted_rule)
+        return await loop.run_in_executor(self.executor, func, *args)
 
-        print(f"✅ Rule synced to OS: {rule_doc.get('rule_name')}")
-        return True
+    async def submit(self, kind: str, rule: Dict[str, Any], old_rule: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue a change; resolves once the apply that contains it finished"""
+        self.start()
+        future = asyncio.get_event_loop().create_future()
+        self.metrics["changes_received"] += 1
+        await self.queue.put(FirewallChange(kind, rule, old_rule, future))
+        return await future
 
-    except Exception as e:
-        print(f"❌ Failed to sync rule to OS: {rule_doc.get('rule_name')} - {e}")
-        return False
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            await asyncio.sleep(self.debounce_seconds)
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            self.metrics["batches"] += 1
+            self.metrics["last_batch_size"] = len(batch)
+            self.metrics["largest_batch"] = max(self.metrics["largest_batch"], len(batch))
+            try:
+                results = await self._apply(batch)
+                self.metrics["last_error"] = None
+            except asyncio.CancelledError:
+                for change in batch:
+                    if not change.future.done():
+                        change.future.set_result(False)
+                raise
+            except Exception as e:
+                print(f"❌ Firewall sync failed for {len(batch)} changes: {e}")
+                self.metrics["failed_batches"] += 1
+                self.metrics["last_error"] = str(e)
+                results = [False] * len(batch)
+            for change, result in zip(batch, results):
+                if not change.future.done():
+                    change.future.set_result(result)
+
+    async def _apply(self, batch: List[FirewallChange]) -> List[bool]:
+        started = time.perf_counter()
+        try:
+            database = await get_database()
+            rule_docs = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+            group_docs = await database.firewall_groups.find().to_list(length=None)
+        except Exception as e:
+            print(f"⚠️ Firewall rules unavailable, syncing {len(batch)} changes one by one: {e}")
+            rule_docs = None
+
+        compiled = None
+        if rule_docs is not None:
+            try:
+                compiled = await self.run_blocking(apply_ruleset_os, overlay_changes(rule_docs, batch), group_docs)
+            except NotImplementedError:
+                pass
+        if compiled is not None:
+            self.metrics["compiled_applies"] += 1
+            results = [True] * len(batch)
+            print(f"✅ Ruleset synced to OS: {len(batch)} changes in one apply "
+                  f"({compiled.rules} rules, {compiled.kernel_rules} kernel rules)")
+        else:
+            # No batch apply on this platform (or no rule list): replay the changes one by one, still serialized
+            results = [await self._apply_one(change) for change in batch]
+            self.metrics["per_rule_applies"] += 1
+        self._record_latency(started)
+        return results
+
+    async def _apply_one(self, change: FirewallChange) -> bool:
+        name = change.rule.get("rule_name", "")
+        try:
+            if change.kind == "remove":
+                await self.run_blocking(remove_firewall_rule_os, name)
+            elif change.kind == "update":
+                await self.run_blocking(update_firewall_rule_os, _format_old_rule(change.old_rule or {}),
+                                        _format_rule(change.rule))
+            else:
+                await self.run_blocking(add_firewall_rule_os, _format_rule(change.rule))
+            print(f"✅ Rule {change.kind} synced to OS: {name}")
+            return True
+        except Exception as e:
+            print(f"❌ Failed to {change.kind} rule in OS: {name} - {e}")
+            return False
+
+    def _record_latency(self, started: float):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._latencies.append(elapsed_ms)
+        self.metrics["last_apply_ms"] = round(elapsed_ms, 2)
+        self.metrics["last_apply_at"] = datetime.utcnow().isoformat()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        latencies = sorted(self._latencies)
+        received = self.metrics["changes_received"]
+        return {
+            **self.metrics,
+            "running": self.running,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "debounce_ms": round(self.debounce_seconds * 1000),
+            "changes_per_batch": round(received / self.metrics["batches"], 2) if self.metrics["batches"] else None,
+            "apply_ms_avg": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "apply_ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 2) if latencies else None,
+            "apply_ms_max": round(latencies[-1], 2) if latencies else None,
+        }
+
+
+_sync_worker = FirewallSyncWorker()
+
+
+async def sync_rule_to_os(rule_doc: Dict[str, Any]) -> bool:
+    """
+    Sync firewall rule to operating system
+    """
+    return await _sync_worker.submit("add", rule_doc)
 
 
 async def remove_rule_from_os(rule_doc: Dict[str, Any]) -> bool:
     """
     Remove firewall rule from operating system
     """
+    if not rule_doc.get("rule_name"):
+        return False
+    return await _sync_worker.submit("remove", rule_doc)
+
+
+async def update_rule_in_os(old_rule: Dict[str, Any], new_rule: Dict[str, Any]) -> bool:
+    """
+    Update firewall rule in operating system
+    """
+    return await _sync_worker.submit("update", new_rule, old_rule)
+
+
+async def sync_ruleset_to_os(rule_docs: Optional[List[Dict[str, Any]]] = None) -> bool:
+    """
+    Apply every enabled firewall rule in one atomic operation
+    (iptables-restore on Linux); falls back to per-rule sync where the
+    driver has no batch apply
+    """
     try:
-        rule_name = rule_doc.get("rule_name", "")
-        if not rule_name:
-            return False
+        database = await get_database()
+        if rule_docs is None:
+            rule_docs = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+        group_docs = await database.firewall_groups.find().to_list(length=None)
 
-        # Run in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, remove_firewall_rule_os, rule_name)
+        try:
+            compiled = await _sync_worker.run_blocking(apply_ruleset_os, rule_docs, group_docs)
+        except NotImplementedError:
+            results = [await sync_rule_to_os(rule_doc) for rule_doc in rule_docs if rule_doc.get("enabled", True)]
+            return all(results)
 
-        print(f"✅ Rule removed from OS: {rule_name}")
+        print(f"✅ Ruleset synced to OS: {compiled.rules} rules, {compiled.kernel_rules} kernel rules")
         return True
 
     except Exception as e:
-        print(f"❌ Failed to remove rule from OS: {rule_doc.get('rule_name')} - {e}")
+        print(f"❌ Failed to sync ruleset to OS: {e}")
         return False
 
 
-async def update_rule_in_os(old_rule: Dict[str, Any], new_rule: Dict[str, Any]) -> bool:
+def get_sync_metrics() -> Dict[str, Any]:
+    return _sync_worker.get_metrics()
+
+
+def start_firewall_sync_worker():
+    _sync_worker.start()
+    print(f"🧵 Firewall sync worker started (debounce {_sync_worker.debounce_seconds * 1000:.0f} ms)")
+
+
+async def stop_firewall_sync_worker():
+    await _sync_worker.stop()
+
+
+# =============================================================================
+# RECONCILIATION
+# =============================================================================
+
+_reconciler: Optional[FirewallReconciler] = None
+_last_drift_report: Optional[Dict[str, Any]] = None
+_reconcile_requested: Optional[asyncio.Event] = None
+_reconcile_tasks: List[asyncio.Task] = []
+
+
+async def reconcile_firewall(dry_run: bool = False, database=None) -> Dict[str, Any]:
     """
-    Update firewall rule in operating system
+    Diff the kernel ruleset against firewall_rules and apply only the
+    differences in one transaction; returns the drift report
     """
+    global _reconciler, _last_drift_report
     try:
-        # Format old rule
-        old_formatted = {
-            "rule_name": old_rule.get("rule_name", ""),
-            "source_ips": old_rule.get("source_ips", []),
-            "port": old_rule.get("destination_ports", [None])[0] if old_rule.get("destination_ports") else None,
-            "protocol": old_rule.get("protocol", "ANY"),
-            "action": old_rule.get("action", "ALLOW"),
-            "direction": old_rule.get("direction", "IN")
-        }
+        if database is None:
+            database = await get_database()
+        rule_docs = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+        group_docs = await database.firewall_groups.find().to_list(length=None)
+        if _reconciler is None:
+            _reconciler = FirewallReconciler()
 
-        # Format new rule
-        new_formatted = {
-            "rule_name": new_rule.get("rule_name", ""),
-            "source_ips": new_rule.get("source_ips", []),
-            "destination_ips": new_rule.get("destination_ips", []),
-            "source_ports": new_rule.get("source_ports", []),
-            "destination_ports": new_rule.get("destination_ports", []),
-            "protocol": new_rule.get("protocol", "ANY"),
-            "action": new_rule.get("action", "ALLOW"),
-            "direction": new_rule.get("direction", "IN"),
-            "enabled": new_rule.get("enabled", True),
-            "priority": new_rule.get("priority", 100),
-            "profile": new_rule.get("profile", "Any"),
-            "description": new_rule.get("description", ""),
-            "port": new_rule.get("destination_ports", [None])[0] if new_rule.get("destination_ports") else None
-        }
+        report = (await _sync_worker.run_blocking(_reconciler.reconcile, rule_docs, dry_run, group_docs)).to_dict()
 
-        # Run in thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, update_firewall_rule_os, old_formatted, new_formatted)
+    except Exception as e:
+        print(f"❌ Firewall reconcile failed: {e}")
+        report = {"in_sync": False, "applied": False, "error": str(e), "checked_at": datetime.utcnow().isoformat()}
+
+    if not dry_run:
+        _last_drift_report = report
+    return report
 
-        print(f"✅ Rule updated in OS: {new_rule.get('rule_name')}")
-        return True
 
+def get_last_drift_report() -> Optional[Dict[str, Any]]:
+    return _last_drift_report
+
+
+def request_reconcile():
+    """Ask the reconcile loop for a pass, e.g. right after a rule was changed"""
+    if _reconcile_requested is not None:
+        _reconcile_requested.set()
+
+
+async def _watch_rule_changes(get_db, trigger: asyncio.Event, collection: str = "firewall_rules"):
+    """Trigger a pass on every rule (or group) change (change streams need a replica set)"""
+    try:
+        database = await get_db()
+        async with database[collection].watch() as stream:
+            async for change in stream:
+                updated = (change.get("updateDescription") or {}).get("updatedFields")
+                if change.get("operationType") == "update" and updated and set(updated) <= HIT_FIELDS:
+                    continue
+                trigger.set()
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
-        print(f"❌ Failed to update rule in OS: {new_rule.get('rule_name')} - {e}")
-        return False
\ No newline at end of file
+        print(f"⚠️ {collection} change stream unavailable, relying on periodic reconcile: {e}")
+
+
+async def _reconcile_loop(get_db, trigger: asyncio.Event, interval: int):
+    while True:
+        try:
+            database = await get_db()
+            if database is not None:
+                await reconcile_firewall(database=database)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Firewall reconcile loop error: {e}")
+
+        try:
+            await asyncio.wait_for(trigger.wait(), timeout=interval)
+            await asyncio.sleep(RECONCILE_DEBOUNCE_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        trigger.clear()
+
+
+def start_firewall_reconciler(get_db):
+    """Reconcile once now, then on every rule change and every reconcile interval (Linux only)"""
+    global _reconcile_requested
+    settings = get_settings()
+    if not settings.firewall_reconcile_enabled or platform.system().lower() != "linux":
+        return
+    if any(not task.done() for task in _reconcile_tasks):
+        return
+
+    _reconcile_requested = asyncio.Event()
+    _reconcile_tasks[:] = [
+        asyncio.create_task(_reconcile_loop(get_db, _reconcile_requested, settings.firewall_reconcile_interval_seconds)),
+        asyncio.create_task(_watch_rule_changes(get_db, _reconcile_requested)),
+        asyncio.create_task(_watch_rule_changes(get_db, _reconcile_requested, "firewall_groups")),
+    ]
+    print(f"🔁 Firewall reconciler started ({settings.firewall_backend}, "
+          f"every {settings.firewall_reconcile_interval_seconds}s and on rule changes)")
+
+
+async def stop_firewall_reconciler():
+    global _reconcile_requested
+    for task in _reconcile_tasks:
+        task.cancel()
+    for task in _reconcile_tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _reconcile_tasks.clear()
+    _reconcile_requested = None
+
+
+# =============================================================================
+# HIT COUNTERS
+# =============================================================================
+
+_hit_collector: Optional[HitCounterCollector] = None
+_hit_tasks: List[asyncio.Task] = []
+_last_hit_pass: Optional[datetime] = None
+
+
+def _rule_filter(rule_id: str) -> Dict[str, Any]:
+    """firewall_rules filter for a rule id as normalize_rule derives it (_id, else rule_name)"""
+    if ObjectId.is_valid(rule_id):
+        return {"_id": ObjectId(rule_id)}
+    return {"$or": [{"_id": rule_id}, {"rule_name": rule_id}]}
+
+
+async def collect_rule_hits(database=None) -> Dict[str, Any]:
+    """
+    Read every kernel counter in one call and fold the deltas into
+    firewall_rules (one bulk_write of $inc hit_count / $max last_hit) and
+    the firewall_rule_hits time series
+    """
+    global _hit_collector, _last_hit_pass
+    if database is None:
+        database = await get_database()
+    if _hit_collector is None:
+        _hit_collector = HitCounterCollector()
+
+    collector = _hit_collector
+    deltas = await _sync_worker.run_blocking(lambda: collector.deltas(collector.read()))
+    if collector.unresolved(deltas):
+        rule_docs = await database.firewall_rules.find({"enabled": True}).to_list(length=None)
+        group_docs = await database.firewall_groups.find().to_list(length=None)
+        await _sync_worker.run_blocking(collector.refresh_merged, rule_docs, group_docs)
+    hits = collector.resolve(deltas)
+
+    now = datetime.utcnow()
+    interval = (now - _last_hit_pass).total_seconds() if _last_hit_pass else None
+    _last_hit_pass = now
+    # Group jumps (group:<id>) only go to the time series
+    updates = [
+        UpdateOne(_rule_filter(rule_id), {"$inc": {"hit_count": packets}, "$max": {"last_hit": now}})
+        for rule_id, (packets, _) in hits.items() if not rule_id.startswith(GROUP_TAG)
+    ]
+    if updates:
+        await database.firewall_rules.bulk_write(updates, ordered=False)
+    if hits:
+        await database.firewall_rule_hits.insert_many([
+            {"timestamp": now, "rule_id": rule_id, "packets": packets, "bytes": byte_count,
+             "interval_seconds": interval}
+            for rule_id, (packets, byte_count) in hits.items()
+        ], ordered=False)
+    return {"rules": len(hits), "packets": sum(packets for packets, _ in hits.values()), "interval_seconds": interval}
+
+
+async def _hit_counter_loop(get_db, interval: int):
+    while True:
+        try:
+            database = await get_db()
+            if database is not None:
+                await collect_rule_hits(database)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ Firewall hit counter collection failed: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_hit_counter_collector(get_db):
+    """Collect kernel rule counters every interval (Linux only)"""
+    settings = get_settings()
+    if not settings.firewall_hit_counters_enabled or platform.system().lower() != "linux":
+        return
+    if any(not task.done() for task in _hit_tasks):
+        return
+
+    _hit_tasks[:] = [asyncio.create_task(_hit_counter_loop(get_db, settings.firewall_hit_counter_interval_seconds))]
+    print(f"📈 Firewall hit counter collector started (every {settings.firewall_hit_counter_interval_seconds}s)")
+
+
+async def stop_hit_counter_collector():
+    for task in _hit_tasks:
+        task.cancel()
+    for task in _hit_tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    _hit_tasks.clear()
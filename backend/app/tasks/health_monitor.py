@@ -4,7 +4,7 @@ System health monitoring tasks
 import asyncio
 import psutil
 from datetime import datetime, timedelta
-from ..database import get_database
+from ..database import get_database, insert_document
 
 
 async def start_health_monitor():
@@ -24,8 +24,6 @@ async def system_health_task():
             memory = psutil.virtual_memory()
             disk = psutil.disk_usage('/')
 
-            db = get_database()
-
             # Create health record
             health_doc = {
                 "timestamp": datetime.utcnow(),
@@ -37,12 +35,8 @@ async def system_health_task():
                 "source": "system_monitor"
             }
 
-            # Store in database (keep only last 24 hours)
-            await db.system_health.insert_one(health_doc)
-
-            # Clean old records
-            cutoff = datetime.utcnow() - timedelta(hours=24)
-            await db.system_health.delete_many({"timestamp": {"$lt": cutoff}})
+            # Store in database (time-series collection, expires after 24 hours)
+            await insert_document("system_health", health_doc)
 
             # Check for alerts
             if cpu_percent > 90:
@@ -63,7 +57,7 @@ async def database_health_task():
     """Monitor database health"""
     while True:
         try:
-            db = get_database()
+            db = await get_database()
 
             # Test database connection
             start_time = datetime.utcnow()
@@ -78,7 +72,7 @@ async def database_health_task():
                 "source": "database_monitor"
             }
 
-            await db.database_health.insert_one(health_doc)
+            await insert_document("database_health", health_doc)
 
             # Check for slow response
             if response_time > 1000:  # 1 second
@@ -88,10 +82,6 @@ async def database_health_task():
                     f"Database response time is {response_time:.2f}ms"
                 )
 
-            # Clean old records
-            cutoff = datetime.utcnow() - timedelta(hours=24)
-            await db.database_health.delete_many({"timestamp": {"$lt": cutoff}})
-
             await asyncio.sleep(300)  # Check every 5 minutes
 
         except Exception as e:
@@ -102,7 +92,7 @@ async def database_health_task():
 async def create_health_alert(alert_type: str, severity: str, description: str):
     """Create a health-related alert"""
     try:
-        db = get_database()
+        db = await get_database()
 
         # Check if similar alert already exists in last 10 minutes
         cutoff = datetime.utcnow() - timedelta(minutes=10)
@@ -11,11 +11,19 @@ import psutil
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 import logging
-from ..database import get_database
+from ..database import get_database, insert_document
+from ..index_planner import register_query_shape
+from ..traffic_analytics import traffic_producer
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Query shapes issued by the monitoring tasks (see app.index_planner)
+register_query_shape("system_logs", "watcher.event_window", equality=["event_type"], range=["timestamp"],
+                     owner="log_watcher")
+register_query_shape("system_logs", "watcher.auth_failures", equality=["source", "level"], range=["timestamp"],
+                     owner="log_watcher")
+
 # Regex patterns for log parsing
 FWDROP_REGEX = re.compile(r"FWDROP:")
 IPTABLES_REGEX = re.compile(r"(\w+\s+\d+\s+\d+:\d+:\d+).*?SRC=(\d+\.\d+\.\d+\.\d+).*?DST=(\d+\.\d+\.\d+\.\d+).*?PROTO=(\w+)")
@@ -185,12 +193,11 @@ async def setup_iptables_logging():
 async def process_iptables_log(log_line: str):
     """Process iptables log entries for traffic analysis"""
     try:
-        db = await get_database()
-
         # Parse the log line
         parsed_data = parse_iptables_log(log_line)
         if not parsed_data:
             return
+        traffic_producer.record_flow(parsed_data)
 
         # Create comprehensive log entry
         log_entry = {
@@ -210,8 +217,8 @@ async def process_iptables_log(log_line: str):
             "packet_size": parsed_data.get("packet_size", 0)
         }
 
-        # Add to database
-        await db.system_logs.insert_one(log_entry)
+        # Add to database (telemetry class - batched)
+        await insert_document("system_logs", log_entry)
 
         # Update real-time statistics
         await update_traffic_stats(parsed_data)
@@ -344,11 +351,10 @@ async def interface_traffic_monitor():
 
                 for interface, stats in net_io.items():
                     if not interface.startswith('lo'):  # Skip loopback
+                        # interface_stats is a time-series collection bucketed by meta
                         stat_entry = {
                             "timestamp": current_time,
-                            "source": "interface_monitor",
-                            "event_type": "interface_stats",
-                            "interface": interface,
+                            "meta": {"interface": interface, "source": "interface_monitor"},
                             "bytes_sent": stats.bytes_sent,
                             "bytes_recv": stats.bytes_recv,
                             "packets_sent": stats.packets_sent,
@@ -361,7 +367,7 @@ async def interface_traffic_monitor():
                         interface_stats.append(stat_entry)
 
                 if interface_stats:
-                    await db.network_activity.insert_many(interface_stats)
+                    await db.interface_stats.insert_many(interface_stats, ordered=False)
 
                 await asyncio.sleep(60)  # Every minute
 
@@ -375,8 +381,8 @@ async def interface_traffic_monitor():
 async def process_blocked_packet_log(log_line: str):
     """Enhanced blocked packet processing"""
     try:
-        db = await get_database()
         parsed_data = parse_iptables_log(log_line)
+        traffic_producer.record_flow(parsed_data)
 
         # Create blocked packet entry
         doc = {
@@ -394,7 +400,7 @@ async def process_blocked_packet_log(log_line: str):
             "parsed_data": parsed_data
         }
 
-        await db.system_logs.insert_one(doc)
+        await insert_document("system_logs", doc)
 
         # Update statistics
         traffic_stats["blocked_packets"] += 1
@@ -409,8 +415,8 @@ async def process_blocked_packet_log(log_line: str):
 async def process_allowed_packet_log(log_line: str):
     """Process allowed packet logs"""
     try:
-        db = await get_database()
         parsed_data = parse_iptables_log(log_line)
+        traffic_producer.record_flow(parsed_data)
 
         # Create allowed packet entry (sample only high-traffic)
         if traffic_stats["total_packets"] % 10 == 0:  # Log every 10th packet
@@ -429,7 +435,7 @@ async def process_allowed_packet_log(log_line: str):
                 "parsed_data": parsed_data
             }
 
-            await db.system_logs.insert_one(doc)
+            await insert_document("system_logs", doc)
 
         # Update statistics
         traffic_stats["allowed_packets"] += 1
@@ -482,8 +488,6 @@ async def real_time_stats_updater():
         while True:
             await asyncio.sleep(5)  # Update every 5 seconds
 
-            db = await get_database()
-
             # Convert set to list for JSON serialization
             unique_ips_list = list(traffic_stats["unique_ips"])
 
@@ -502,7 +506,7 @@ async def real_time_stats_updater():
                 "top_ports": dict(list(traffic_stats["ports"].items())[:10])
             }
 
-            await db.system_stats.insert_one(stats_doc)
+            await insert_document("system_stats", stats_doc)
 
     except Exception as e:
         logger.error(f"⚠️ Error in real-time stats updater: {e}")
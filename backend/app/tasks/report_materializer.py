@@ -0,0 +1,48 @@
+"""
+Dashboard snapshot materializer task
+Periodically rolls up new telemetry and refreshes the per-period dashboard
+snapshots the reports endpoints serve.
+"""
+import asyncio
+import logging
+
+from ..settings import get_settings
+from ..services.reports_service import reports_service
+
+logger = logging.getLogger(__name__)
+
+_materializer_task = None
+
+
+async def start_report_materializer():
+    """Start the snapshot materializer (idempotent)"""
+    global _materializer_task
+    if _materializer_task is not None and not _materializer_task.done():
+        return
+    _materializer_task = asyncio.create_task(report_materializer_task())
+    logger.info("📸 Dashboard snapshot materializer started")
+
+
+async def stop_report_materializer():
+    global _materializer_task
+    if _materializer_task is not None:
+        _materializer_task.cancel()
+        try:
+            await _materializer_task
+        except asyncio.CancelledError:
+            pass
+        _materializer_task = None
+
+
+async def report_materializer_task():
+    """Refresh dashboard snapshots on a fixed interval"""
+    interval = get_settings().report_snapshot_interval_seconds
+    while True:
+        try:
+            if reports_service.db is not None:
+                await reports_service.snapshots.refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"⚠️ Snapshot materializer error: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,47 @@
+"""
+Report scheduler task
+Polls report_schedules and precomputes due scheduled reports off-peak.
+"""
+import asyncio
+import logging
+
+from ..settings import get_settings
+from ..services.reports_service import reports_service
+
+logger = logging.getLogger(__name__)
+
+_scheduler_task = None
+
+
+async def start_report_scheduler():
+    """Start the report scheduler (idempotent)"""
+    global _scheduler_task
+    if _scheduler_task is not None and not _scheduler_task.done():
+        return
+    _scheduler_task = asyncio.create_task(report_scheduler_task())
+    logger.info("🗓️ Report scheduler started")
+
+
+async def stop_report_scheduler():
+    global _scheduler_task
+    if _scheduler_task is not None:
+        _scheduler_task.cancel()
+        try:
+            await _scheduler_task
+        except asyncio.CancelledError:
+            pass
+        _scheduler_task = None
+
+
+async def report_scheduler_task():
+    """Run a scheduler pass on a fixed interval"""
+    interval = get_settings().report_scheduler_interval_seconds
+    while True:
+        try:
+            if reports_service.db is not None:
+                await reports_service.scheduler.tick()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"⚠️ Report scheduler error: {e}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,144 @@
+"""
+MongoDB time-series collections for append-only measurements
+Health samples, stats snapshots, performance metrics, traffic analytics,
+interface counters and firewall rule hits are stored as native time-series
+collections: documents are bucketed per metaField value, compressed
+column-wise, pruned by time range at the bucket level and expired by the
+server (expireAfterSeconds) instead of periodic delete_many sweeps. Where the
+server cannot expire them (SQLite backend, collections not yet migrated or
+created without expireAfterSeconds) sweep_expired applies the same retention.
+"""
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TIME_FIELD = "timestamp"
+
+
+@dataclass(frozen=True)
+class TimeSeriesSpec:
+    """Creation options for one time-series collection"""
+    name: str
+    meta_field: str
+    granularity: str                 # seconds / minutes / hours
+    expire_after_seconds: int
+    meta_keys: Tuple[str, ...] = ()  # top-level fields folded into a nested metaField document
+
+    @property
+    def create_options(self) -> Dict[str, Any]:
+        return {
+            "timeseries": {
+                "timeField": TIME_FIELD,
+                "metaField": self.meta_field,
+                "granularity": self.granularity,
+            },
+            "expireAfterSeconds": self.expire_after_seconds,
+        }
+
+
+TIMESERIES_COLLECTIONS: Dict[str, TimeSeriesSpec] = {
+    spec.name: spec for spec in (
+        TimeSeriesSpec("system_health", "source", "minutes", 86400),            # 24 hours
+        TimeSeriesSpec("database_health", "source", "minutes", 86400),          # 24 hours
+        TimeSeriesSpec("system_stats", "source", "seconds", 604800),            # 7 days
+        TimeSeriesSpec("performance_metrics", "metric_type", "minutes", 2592000),  # 30 days
+        TimeSeriesSpec("traffic_analytics", "meta", "minutes", 2592000,         # 30 days
+                       meta_keys=("interface", "direction", "protocol")),
+        TimeSeriesSpec("interface_stats", "meta", "minutes", 604800,            # 7 days
+                       meta_keys=("interface", "source")),
+        TimeSeriesSpec("firewall_rule_hits", "rule_id", "minutes", 604800),     # 7 days
+    )
+}
+
+
+def is_timeseries_collection(collection_name: str) -> bool:
+    """Check whether a collection is managed as a time-series collection"""
+    return collection_name in TIMESERIES_COLLECTIONS
+
+
+def to_timeseries_document(collection_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
+    """Reshape a flat document so its meta_keys live under the nested metaField"""
+    spec = TIMESERIES_COLLECTIONS.get(collection_name)
+    if not spec or not spec.meta_keys:
+        return document
+
+    reshaped = dict(document)
+    meta = dict(reshaped.get(spec.meta_field) or {})
+    for key in spec.meta_keys:
+        if key in reshaped:
+            meta[key] = reshaped.pop(key)
+    reshaped[spec.meta_field] = meta
+    return reshaped
+
+
+async def get_collection_info(database, collection_name: str) -> Optional[Dict[str, Any]]:
+    """Return the listCollections entry for a collection (None if it does not exist)"""
+    infos = await database.list_collections(filter={"name": collection_name}).to_list(length=1)
+    return infos[0] if infos else None
+
+
+async def ensure_timeseries_collections(database) -> Dict[str, str]:
+    """
+    Create missing time-series collections and keep their expiry in sync.
+    Existing regular collections are left alone and reported as 'legacy';
+    app.migrations.timeseries converts them.
+    """
+    status: Dict[str, str] = {}
+    for name, spec in TIMESERIES_COLLECTIONS.items():
+        try:
+            info = await get_collection_info(database, name)
+            if info is None:
+                await database.create_collection(name, **spec.create_options)
+                status[name] = "created"
+                logger.info(f"✅ Created time-series collection: {name} (meta={spec.meta_field}, {spec.granularity})")
+            elif info.get("type") != "timeseries":
+                status[name] = "legacy"
+                logger.warning(
+                    f"⚠️ {name} is a regular collection - run 'python -m app.migrations.timeseries' "
+                    f"to convert it to a time-series collection"
+                )
+            else:
+                current_ttl = info.get("options", {}).get("expireAfterSeconds")
+                if current_ttl != spec.expire_after_seconds:
+                    await database.command({"collMod": name, "expireAfterSeconds": spec.expire_after_seconds})
+                    logger.info(f"✅ Updated expiry for {name}: {spec.expire_after_seconds}s")
+                status[name] = "ok"
+        except Exception as e:
+            status[name] = f"error: {e}"
+            logger.warning(f"⚠️ Time-series setup warning for {name}: {e}")
+    return status
+
+
+async def sweep_expired(database, native_expiry: bool = True,
+                        now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    delete_many retention for the collections the server does not expire.
+    native_expiry=False (SQLite) sweeps every collection; otherwise only those
+    that are not time-series collections with expireAfterSeconds.
+    """
+    now = now or datetime.utcnow()
+    deleted: Dict[str, int] = {}
+    for name, spec in TIMESERIES_COLLECTIONS.items():
+        try:
+            if native_expiry:
+                info = await get_collection_info(database, name)
+                if info is None:
+                    continue
+                if info.get("type") == "timeseries" and info.get("options", {}).get("expireAfterSeconds") is not None:
+                    continue
+            cutoff = now - timedelta(seconds=spec.expire_after_seconds)
+            result = await database[name].delete_many({TIME_FIELD: {"$lt": cutoff}})
+            deleted[name] = result.deleted_count
+        except Exception as e:
+            logger.warning(f"⚠️ Retention sweep warning for {name}: {e}")
+    return deleted
+
+
+__all__ = [
+    "TIME_FIELD", "TimeSeriesSpec", "TIMESERIES_COLLECTIONS", "is_timeseries_collection",
+    "to_timeseries_document", "get_collection_info", "ensure_timeseries_collections",
+    "sweep_expired",
+]
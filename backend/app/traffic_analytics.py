@@ -0,0 +1,223 @@
+"""
+traffic_analytics producer
+Interface counters are sampled every few seconds and their deltas accumulated
+per interface and direction; flow records parsed from the firewall logs are
+accumulated per interface, direction and protocol. Once a flush interval the
+window is written to the traffic_analytics time-series collection as one
+additive delta document per key, which the hourly report rollups then sum.
+
+Interface documents (protocol "all") carry the byte/packet totals and the
+window's peak bandwidth. Flow documents only carry the per-protocol byte split,
+so the two sources never double count the totals.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import psutil
+
+from .settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+ALL_PROTOCOLS = "all"
+DIRECTION_IN = "in"
+DIRECTION_OUT = "out"
+PROTOCOL_FIELDS = {"tcp": "tcp_bytes", "udp": "udp_bytes", "icmp": "icmp_bytes"}
+OTHER_PROTOCOL_FIELD = "other_bytes"
+
+SKIPPED_INTERFACES = ("lo",)
+
+
+class _Bucket:
+    """Accumulated deltas for one (interface, direction, protocol) within a window"""
+    __slots__ = ("bytes", "packets", "protocol_bytes", "peak_bps")
+
+    def __init__(self):
+        self.bytes = 0
+        self.packets = 0
+        self.protocol_bytes = 0
+        self.peak_bps = 0.0
+
+
+class TrafficAnalyticsProducer:
+    """Rolls interface counter deltas and flow records into traffic_analytics"""
+
+    def __init__(self):
+        self._counters: Dict[str, Tuple[float, Any]] = {}
+        self._buckets: Dict[Tuple[str, str, str], _Bucket] = {}
+        self._window_start = datetime.utcnow()
+        self.metrics = {
+            "samples": 0, "flows_recorded": 0, "counter_resets": 0,
+            "flushes": 0, "documents_written": 0, "flush_errors": 0
+        }
+
+    def _bucket(self, interface: str, direction: str, protocol: str) -> _Bucket:
+        key = (interface, direction, protocol)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        return bucket
+
+    def _add_counter_delta(self, interface: str, direction: str, previous_bytes: int, current_bytes: int,
+                           previous_packets: int, current_packets: int, seconds: float):
+        byte_delta = current_bytes - previous_bytes
+        packet_delta = current_packets - previous_packets
+        if byte_delta < 0 or packet_delta < 0:
+            # Counter wrapped or the interface was reset: count from zero
+            self.metrics["counter_resets"] += 1
+            byte_delta, packet_delta = current_bytes, current_packets
+        bucket = self._bucket(interface, direction, ALL_PROTOCOLS)
+        bucket.bytes += byte_delta
+        bucket.packets += packet_delta
+        if seconds > 0:
+            bucket.peak_bps = max(bucket.peak_bps, byte_delta * 8 / seconds)
+
+    def sample(self, counters: Optional[Dict[str, Any]] = None, now: Optional[float] = None):
+        """Accumulate the counter deltas since the previous sample (the first sample is the baseline)"""
+        counters = psutil.net_io_counters(pernic=True) if counters is None else counters
+        now = time.monotonic() if now is None else now
+        for interface, stats in counters.items():
+            if interface.startswith(SKIPPED_INTERFACES):
+                continue
+            previous = self._counters.get(interface)
+            self._counters[interface] = (now, stats)
+            if previous is None:
+                continue
+            sampled_at, before = previous
+            seconds = now - sampled_at
+            self._add_counter_delta(interface, DIRECTION_IN, before.bytes_recv, stats.bytes_recv,
+                                    before.packets_recv, stats.packets_recv, seconds)
+            self._add_counter_delta(interface, DIRECTION_OUT, before.bytes_sent, stats.bytes_sent,
+                                    before.packets_sent, stats.packets_sent, seconds)
+        # Interfaces that went away start from a fresh baseline if they return
+        for interface in set(self._counters) - set(counters):
+            del self._counters[interface]
+        self.metrics["samples"] += 1
+
+    def record_flow(self, flow: Optional[Dict[str, Any]]):
+        """Account one parsed firewall log record (interface_in/out, protocol, packet_size)"""
+        if not flow or not flow.get("packet_size"):
+            return
+        if flow.get("interface_in"):
+            interface, direction = flow["interface_in"], DIRECTION_IN
+        elif flow.get("interface_out"):
+            interface, direction = flow["interface_out"], DIRECTION_OUT
+        else:
+            return
+        protocol = str(flow.get("protocol") or "other").upper()
+        bucket = self._bucket(interface, direction, protocol)
+        bucket.protocol_bytes += int(flow["packet_size"])
+        bucket.packets += 1
+        self.metrics["flows_recorded"] += 1
+
+    def drain(self) -> Tuple[datetime, Dict[Tuple[str, str, str], _Bucket]]:
+        """Swap out the current window (accumulation continues into a fresh one)"""
+        buckets, self._buckets = self._buckets, {}
+        window_start, self._window_start = self._window_start, datetime.utcnow()
+        return window_start, buckets
+
+    @staticmethod
+    def to_documents(window_start: datetime, buckets: Dict[Tuple[str, str, str], _Bucket]) -> List[Dict[str, Any]]:
+        timestamp = window_start.replace(second=0, microsecond=0)
+        documents = []
+        for (interface, direction, protocol), bucket in buckets.items():
+            inbound = direction == DIRECTION_IN
+            document = {
+                "timestamp": timestamp,
+                "meta": {"interface": interface, "direction": direction, "protocol": protocol},
+                "bytes_in": 0, "bytes_out": 0, "packets_in": 0, "packets_out": 0,
+                "tcp_bytes": 0, "udp_bytes": 0, "icmp_bytes": 0, "other_bytes": 0,
+            }
+            if protocol == ALL_PROTOCOLS:
+                if not bucket.bytes and not bucket.packets:
+                    continue
+                document["bytes_in" if inbound else "bytes_out"] = bucket.bytes
+                document["packets_in" if inbound else "packets_out"] = bucket.packets
+                document["peak_bandwidth_bps"] = int(bucket.peak_bps)
+            else:
+                document[PROTOCOL_FIELDS.get(protocol.lower(), OTHER_PROTOCOL_FIELD)] = bucket.protocol_bytes
+                document["flow_packets"] = bucket.packets
+            documents.append(document)
+        return documents
+
+    async def flush(self, database) -> int:
+        """Write the drained window; returns the number of documents"""
+        window_start, buckets = self.drain()
+        documents = self.to_documents(window_start, buckets)
+        if not documents:
+            return 0
+        try:
+            await database.traffic_analytics.insert_many(documents, ordered=False)
+            self.metrics["flushes"] += 1
+            self.metrics["documents_written"] += len(documents)
+            return len(documents)
+        except Exception as e:
+            self.metrics["flush_errors"] += 1
+            logger.warning(f"⚠️ Traffic analytics flush failed ({len(documents)} documents dropped): {e}")
+            return 0
+
+
+traffic_producer = TrafficAnalyticsProducer()
+
+
+# =============================================================================
+# PRODUCER LOOP
+# =============================================================================
+
+_producer_task: Optional[asyncio.Task] = None
+
+
+async def _producer_loop(get_db, sample_interval: int, flush_interval: int):
+    traffic_producer.sample()
+    last_flush = time.monotonic()
+    while True:
+        await asyncio.sleep(sample_interval)
+        try:
+            traffic_producer.sample()
+            if time.monotonic() - last_flush >= flush_interval:
+                last_flush = time.monotonic()
+                database = await get_db()
+                if database is not None:
+                    await traffic_producer.flush(database)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"⚠️ Traffic analytics producer error: {e}")
+
+
+def start_traffic_producer(get_db):
+    """Start sampling interface counters into traffic_analytics (idempotent)"""
+    global _producer_task
+    settings = get_settings()
+    if not settings.traffic_analytics_enabled:
+        return
+    if _producer_task is not None and not _producer_task.done():
+        return
+    _producer_task = asyncio.create_task(_producer_loop(
+        get_db, settings.traffic_sample_interval_seconds, settings.traffic_flush_interval_seconds
+    ))
+    logger.info(f"📶 Traffic analytics sampled every {settings.traffic_sample_interval_seconds}s, "
+                f"flushed every {settings.traffic_flush_interval_seconds}s")
+
+
+async def stop_traffic_producer(database=None):
+    """Stop the producer and write the partial window"""
+    global _producer_task
+    if _producer_task is not None:
+        _producer_task.cancel()
+        try:
+            await _producer_task
+        except asyncio.CancelledError:
+            pass
+        _producer_task = None
+    if database is not None:
+        await traffic_producer.flush(database)
+
+
+__all__ = [
+    "traffic_producer", "TrafficAnalyticsProducer", "start_traffic_producer", "stop_traffic_producer",
+    "ALL_PROTOCOLS", "DIRECTION_IN", "DIRECTION_OUT",
+]
@@ -0,0 +1,34 @@
+"""Blocklist guard rails: protected addresses and overly wide networks"""
+import ipaddress
+
+import pytest
+
+from app import blocklist
+from app.blocklist import ensure_blockable, protected_networks
+
+PROTECTED = [ipaddress.ip_network(network) for network in ("127.0.0.0/8", "::1/128", "192.0.2.10/32")]
+
+
+@pytest.mark.parametrize("address", ["203.0.113.7/32", "203.0.113.0/24", "10.1.0.0/16", "2001:db8::/32"])
+def test_ordinary_entries_are_accepted(address):
+    ensure_blockable(address, PROTECTED)
+
+
+@pytest.mark.parametrize("address", ["0.0.0.0/1", "128.0.0.0/1", "10.0.0.0/8", "::/1", "2001::/16"])
+def test_wide_networks_are_refused(address):
+    with pytest.raises(ValueError, match="wider than"):
+        ensure_blockable(address, PROTECTED)
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1/32", "192.0.2.10/32", "192.0.2.0/24", "::1/128"])
+def test_protected_addresses_are_refused(address):
+    with pytest.raises(ValueError, match="protected"):
+        ensure_blockable(address, PROTECTED)
+
+
+def test_protected_networks_include_extra_and_local_addresses(monkeypatch):
+    monkeypatch.setattr(blocklist, "local_addresses", lambda: [ipaddress.ip_network("198.51.100.4/32")])
+    networks = protected_networks(["192.0.2.55", "not-an-address"])
+    assert ipaddress.ip_network("198.51.100.4/32") in networks
+    assert ipaddress.ip_network("192.0.2.55/32") in networks
+    assert ipaddress.ip_network("127.0.0.0/8") in networks
@@ -0,0 +1,141 @@
+"""AsyncTTLCache: single-flight, stale-while-revalidate and LRU eviction"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import cache as cache_module
+from app.cache import AsyncTTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    # Only the cache's clock: the event loop keeps using the real time.monotonic
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_concurrent_misses_share_one_computation(clock):
+    cache = AsyncTTLCache("test", ttl_seconds=60)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["value"] * 5
+    assert len(calls) == 1
+    assert cache.metrics["cache_misses"] == 5
+    assert cache.metrics["cache_coalesced"] == 4
+
+
+def test_cancelled_caller_does_not_cancel_the_shared_computation(clock):
+    cache = AsyncTTLCache("test", ttl_seconds=60)
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def scenario():
+        first = asyncio.ensure_future(cache.get_or_compute("key", compute))
+        second = asyncio.ensure_future(cache.get_or_compute("key", compute))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(scenario()) == "value"
+
+
+def test_stale_entry_is_served_while_one_refresh_runs(clock):
+    cache = AsyncTTLCache("test", ttl_seconds=10, stale_seconds=30)
+    values = iter(["old", "new"])
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return next(values)
+
+    async def scenario():
+        assert await cache.get_or_compute("key", compute) == "old"
+        clock.now += 15                         # expired, inside the stale window
+        served = [await cache.get_or_compute("key", compute) for _ in range(3)]
+        await asyncio.sleep(0.01)               # let the background refresh finish
+        return served, await cache.get_or_compute("key", compute)
+
+    served, refreshed = asyncio.run(scenario())
+    assert served == ["old"] * 3
+    assert refreshed == "new"
+    assert len(calls) == 2
+    assert cache.metrics["cache_stale_hits"] == 3
+
+
+def test_past_the_stale_window_callers_wait_for_a_fresh_value(clock):
+    cache = AsyncTTLCache("test", ttl_seconds=10, stale_seconds=5)
+    values = iter(["old", "new"])
+
+    async def compute():
+        return next(values)
+
+    async def scenario():
+        await cache.get_or_compute("key", compute)
+        clock.now += 20
+        return await cache.get_or_compute("key", compute)
+
+    assert asyncio.run(scenario()) == "new"
+
+
+def test_failed_refresh_keeps_serving_the_stale_value(clock):
+    cache = AsyncTTLCache("test", ttl_seconds=10, stale_seconds=30)
+
+    async def compute():
+        raise RuntimeError("database down")
+
+    async def scenario():
+        cache.set("key", "old")
+        clock.now += 15
+        value = await cache.get_or_compute("key", compute)
+        await asyncio.sleep(0.01)
+        return value
+
+    assert asyncio.run(scenario()) == "old"
+    assert cache.metrics["cache_refresh_errors"] == 1
+
+
+def test_least_recently_used_entries_are_evicted(clock):
+    cache = AsyncTTLCache("test", max_entries=2, ttl_seconds=60)
+
+    async def compute():
+        return "computed"
+
+    async def scenario():
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert await cache.get_or_compute("a", compute) == 1        # a is now most recent
+        cache.set("c", 3)                                           # evicts b
+        return await cache.get_or_compute("a", compute), await cache.get_or_compute("b", compute)
+
+    assert asyncio.run(scenario()) == (1, "computed")
+    assert cache.metrics["cache_evictions"] == 2
+
+
+def test_keys_ignore_filter_order_and_invalidate_by_report(clock):
+    assert AsyncTTLCache.make_key("traffic", "24h", a=1, b=2) == AsyncTTLCache.make_key("traffic", "24h", b=2, a=1)
+    cache = AsyncTTLCache("test")
+    cache.set(AsyncTTLCache.make_key("traffic", "24h"), 1)
+    cache.set(AsyncTTLCache.make_key("security", "24h"), 2)
+    cache.invalidate("traffic")
+    assert cache.get_status()["entries"] == 1
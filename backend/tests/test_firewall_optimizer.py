@@ -0,0 +1,34 @@
+"""Optimizer must not change any verdict, also with group chains in between"""
+from app.firewall_optimizer import prepare_ruleset
+from app.firewall_ruleset import normalize_groups
+from app.rule_matcher import RuleMatcher, normalize_packet
+
+RULES = [
+    {"_id": "a", "action": "DENY", "protocol": "TCP", "source_ips": ["1.1.1.1"], "port": 22, "priority": 100},
+    {"_id": "g1", "action": "ALLOW", "protocol": "TCP", "source_ips": ["2.2.2.2"], "port": 22, "priority": 10,
+     "group_id": "g"},
+    {"_id": "b", "action": "DENY", "protocol": "TCP", "source_ips": ["2.2.2.2"], "port": 22, "priority": 200},
+]
+GROUPS = [{"_id": "g", "group_name": "trusted", "priority": 150}]
+PACKET = normalize_packet({"direction": "IN", "protocol": "tcp", "source_ip": "2.2.2.2",
+                           "destination_ip": "10.0.0.1", "source_port": 40000, "destination_port": 22})
+
+
+def test_base_rules_do_not_merge_across_a_group_jump():
+    specs, _, merged = prepare_ruleset(RULES, normalize_groups(GROUPS))
+    assert merged == {}
+    assert sorted(spec.rule_id for spec in specs) == ["a", "b", "g1"]
+
+
+def test_group_verdict_survives_optimization():
+    plain = RuleMatcher.from_documents(RULES, group_documents=GROUPS)
+    optimized = RuleMatcher.from_documents(RULES, optimized=True, group_documents=GROUPS)
+    assert plain.decide(PACKET).verdict == "ACCEPT"
+    assert optimized.decide(PACKET).verdict == "ACCEPT"
+
+
+def test_base_rules_still_merge_between_jumps():
+    rules = RULES + [{"_id": "c", "action": "DENY", "protocol": "TCP", "source_ips": ["3.3.3.3"], "port": 22,
+                      "priority": 100}]
+    _, _, merged = prepare_ruleset(rules, normalize_groups(GROUPS))
+    assert list(merged.values()) == [["a", "c"]]
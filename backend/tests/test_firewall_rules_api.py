@@ -0,0 +1,88 @@
+"""Rule create/update endpoints: validation and conflict warnings"""
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.dependencies import require_admin
+from app.routers import firewall
+
+
+class FakeRules:
+    """The part of a Motor collection the rule endpoints use"""
+
+    def __init__(self):
+        self.documents = []
+
+    def _matches(self, document, query):
+        for key, value in query.items():
+            if isinstance(value, dict) and "$ne" in value:
+                if document.get(key) == value["$ne"]:
+                    return False
+            elif document.get(key) != value:
+                return False
+        return True
+
+    def find(self, query):
+        found = [dict(document) for document in self.documents if self._matches(document, query)]
+        return SimpleNamespace(to_list=lambda length=None: _resolved(found))
+
+    async def find_one(self, query):
+        return next((dict(document) for document in self.documents if self._matches(document, query)), None)
+
+    async def insert_one(self, document):
+        document["_id"] = ObjectId()
+        self.documents.append(document)
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def update_one(self, query, update):
+        for document in self.documents:
+            if self._matches(document, query):
+                document.update(update["$set"])
+
+
+async def _resolved(value):
+    return value
+
+
+@pytest.fixture
+def client(monkeypatch):
+    database = SimpleNamespace(firewall_rules=FakeRules())
+
+    async def get_database():
+        return database
+
+    monkeypatch.setattr(firewall, "get_database", get_database)
+    monkeypatch.setattr(firewall, "request_reconcile", lambda: None)
+    app = FastAPI()
+    app.include_router(firewall.router)
+    app.dependency_overrides[require_admin] = lambda: {"username": "admin", "role": "admin"}
+    with TestClient(app) as test_client:
+        yield test_client
+
+
+SSH = {"rule_name": "allow ssh", "action": "ALLOW", "protocol": "TCP", "destination_ports": ["22"],
+       "source_ips": ["10.0.0.0/8"]}
+
+
+def test_create_reports_conflicting_rules(client):
+    assert client.post("/api/v1/firewall/rules", json=SSH).json()["conflicts"] == []
+    response = client.post("/api/v1/firewall/rules", json={**SSH, "rule_name": "deny ssh", "action": "DENY",
+                                                            "source_ips": ["10.1.0.0/16"], "priority": 200})
+    assert response.status_code == 200
+    assert response.json()["conflicts"] == ["Rule is fully shadowed by existing rule: allow ssh"]
+
+
+def test_update_does_not_conflict_with_itself(client):
+    rule_id = client.post("/api/v1/firewall/rules", json=SSH).json()["data"]["id"]
+    response = client.put(f"/api/v1/firewall/rules/{rule_id}", json={"destination_ports": ["22", "2222"]})
+    assert response.status_code == 200
+    assert response.json()["conflicts"] == []
+
+
+def test_invalid_rules_are_rejected(client):
+    response = client.post("/api/v1/firewall/rules", json={**SSH, "protocol": "SCTP"})
+    assert response.status_code == 400
+    assert client.put(f"/api/v1/firewall/rules/{ObjectId()}", json={"priority": 5}).status_code == 404
@@ -0,0 +1,124 @@
+"""iptables rendering and the iptables-restore applier (through an injected runner)"""
+import subprocess
+
+import pytest
+
+from app.firewall_ruleset import (
+    FirewallApplyError, IptablesRestoreApplier, iptables_rule_lines, normalize_rule, normalize_rules
+)
+
+
+class FakeRunner:
+    """subprocess.run double: records calls, `iptables -C` and iptables-restore exit with the given codes"""
+
+    def __init__(self, check_code=1, restore_code=0):
+        self.calls = []
+        self.check_code = check_code
+        self.restore_code = restore_code
+
+    def __call__(self, args, input=None, capture_output=False, text=False):
+        self.calls.append((args, input))
+        code = self.restore_code if args[0] == "iptables-restore" else self.check_code
+        return subprocess.CompletedProcess(args, code, stdout="", stderr="boom" if code else "")
+
+    @property
+    def restores(self):
+        return [payload for args, payload in self.calls if args[0] == "iptables-restore"]
+
+
+def _lines(**document):
+    return iptables_rule_lines(normalize_rule({"_id": "r1", **document}))
+
+
+def test_long_port_lists_are_split_into_multiport_chunks():
+    ports = [str(port) for port in range(1000, 1040, 2)]         # 20 single ports
+    lines = _lines(action="ALLOW", protocol="TCP", destination_ports=ports)
+    assert len(lines) == 2
+    assert "--dports " + ",".join(ports[:15]) + " " in lines[0]
+    assert "--dports " + ",".join(ports[15:]) + " " in lines[1]
+
+
+def test_port_ranges_use_two_multiport_slots():
+    ranges = [f"{port}-{port + 1}" for port in range(2000, 2040, 5)]     # 8 ranges = 16 slots
+    lines = _lines(action="ALLOW", protocol="UDP", destination_ports=ranges)
+    assert len(lines) == 2
+    assert lines[1].count("--dports 2035:2036 ") == 1
+
+
+def test_schedule_and_weekdays_are_rendered():
+    [line] = _lines(action="ALLOW", protocol="TCP", port=443, schedule_start="08:00", schedule_end="18:00",
+                    days_of_week=[4, 0])
+    assert "-m time --timestart 08:00 --timestop 18:00 --weekdays Mon,Fri " in line
+    assert line.index("-m time") < line.index("-m comment")
+
+
+def test_blocking_rules_log_before_the_verdict():
+    log_line, verdict_line = _lines(action="DENY", source_ips=["192.0.2.1"])
+    assert "-j LOG --log-prefix" in log_line
+    assert verdict_line.endswith("-j DROP")
+
+
+def test_ipv6_only_rules_are_skipped_with_a_reason():
+    runner = FakeRunner()
+    compiled = IptablesRestoreApplier(runner=runner).compile([
+        {"_id": "v6", "action": "DENY", "protocol": "TCP", "port": 22, "source_ips": ["2001:db8::1"]},
+        {"_id": "mixed", "action": "DENY", "source_ips": ["2001:db8::2", "192.0.2.2"]},
+    ])
+    assert compiled.skipped == [("v6", "no IPv4 addresses to match")]
+    assert "2001:db8" not in compiled.payload
+    assert "-s 192.0.2.2/32" in compiled.payload
+
+
+def test_apply_installs_missing_hook_jumps_once():
+    runner = FakeRunner(check_code=1)
+    applier = IptablesRestoreApplier(runner=runner)
+    applier.apply([{"_id": "r1", "action": "ALLOW", "protocol": "TCP", "port": 22}])
+    assert "-I INPUT 1 -j KOBI-INPUT" in runner.restores[0]
+    assert "-I OUTPUT 1 -j KOBI-OUTPUT" in runner.restores[0]
+
+    runner.calls.clear()
+    applier.apply([{"_id": "r1", "action": "ALLOW", "protocol": "TCP", "port": 22}])
+    assert [args[0] for args, _ in runner.calls] == ["iptables-restore"]
+    assert "-I INPUT" not in runner.restores[0]
+
+
+def test_failed_restore_leaves_the_applier_state_untouched():
+    runner = FakeRunner(check_code=1, restore_code=2)
+    applier = IptablesRestoreApplier(runner=runner)
+    with pytest.raises(FirewallApplyError, match="boom"):
+        applier.apply([{"_id": "r1", "action": "ALLOW", "protocol": "TCP", "port": 22}])
+
+    # The jumps were never committed, so the next attempt still checks and inserts them
+    runner.restore_code = 0
+    runner.calls.clear()
+    applier.apply([{"_id": "r1", "action": "ALLOW", "protocol": "TCP", "port": 22}])
+    assert [args[0] for args, _ in runner.calls].count("iptables") == 2
+    assert "-I INPUT 1 -j KOBI-INPUT" in runner.restores[0]
+
+
+def test_rules_are_evaluated_by_priority_then_document_order():
+    specs, _ = normalize_rules([
+        {"_id": "late", "priority": 300}, {"_id": "first", "priority": 10}, {"_id": "second", "priority": 10},
+    ])
+    assert [spec.rule_id for spec in specs] == ["first", "second", "late"]
+
+
+def test_ipv6_default_route_does_not_match_ipv4():
+    spec = normalize_rule({"_id": "v6", "action": "DENY", "source_ips": ["::/0"]})
+    assert spec.sources == ("::/0",)
+    compiled = IptablesRestoreApplier(runner=FakeRunner()).compile([{"_id": "v6", "action": "DENY",
+                                                                    "source_ips": ["::/0"]}])
+    assert compiled.skipped == [("v6", "no IPv4 addresses to match")]
+    assert "-j DROP" not in compiled.payload
+
+
+def test_ipv6_default_route_keeps_the_ipv4_networks_beside_it():
+    spec = normalize_rule({"_id": "mixed", "action": "DENY", "source_ips": ["10.0.0.0/8", "::/0"]})
+    assert spec.sources == ("10.0.0.0/8", "::/0")
+    [log_line, verdict_line] = iptables_rule_lines(spec)
+    assert "-s 10.0.0.0/8 " in verdict_line
+
+
+def test_default_routes_of_both_families_mean_any_address():
+    spec = normalize_rule({"_id": "all", "action": "DENY", "source_ips": ["0.0.0.0/0", "::/0", "10.0.0.0/8"]})
+    assert spec.sources == ()
@@ -0,0 +1,27 @@
+"""Kernel counter readings -> per-rule hit deltas"""
+from app.firewall_reconciler import parse_iptables_save
+from app.hit_counters import HitCounterCollector, counter_readings
+
+SAVE = """*filter
+:INPUT ACCEPT [0:0]
+:KOBI-INPUT - [0:0]
+[{packets}:{bytes}] -A KOBI-INPUT -s 1.1.1.1/32 -p tcp --dport 22 -m comment --comment "kobi:r1/abc" -j LOG --log-prefix "FWDROP: "
+[{packets}:{bytes}] -A KOBI-INPUT -s 1.1.1.1/32 -p tcp --dport 22 -m comment --comment "kobi:r1/abc" -j DROP
+[{packets}:{bytes}] -A KOBI-INPUT -s 2.2.2.2/32 -m comment --comment "kobi:r2/def" -j ACCEPT
+COMMIT
+"""
+
+
+def _live(packets, byte_count):
+    return parse_iptables_save(SAVE.format(packets=packets, bytes=byte_count))
+
+
+def test_log_line_is_not_counted():
+    readings = counter_readings(_live(10, 600))
+    assert sorted(owner for owner, _, _ in readings.values()) == ["r1", "r2"]
+
+
+def test_deltas_count_each_packet_once():
+    collector = HitCounterCollector(backend="iptables")
+    assert collector.deltas(_live(0, 0)) == {}
+    assert collector.deltas(_live(10, 600)) == {"r1": [10, 600], "r2": [10, 600]}
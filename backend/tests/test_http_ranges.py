@@ -0,0 +1,92 @@
+"""Range / If-Range / If-None-Match handling for report downloads"""
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.http_ranges import RangeNotSatisfiable, etag_matches, parse_range_header, ranged_file_response
+
+BODY = bytes(range(256)) * 4        # 1024 bytes
+ETAG = "abc123"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=1000-", (1000, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),     # end is clamped to the file
+    ("bytes=-100", (924, 1023)),            # suffix range: last 100 bytes
+    ("bytes=-5000", (0, 1023)),             # suffix longer than the file
+    ("bytes=0-10, 20-30", None),            # multiple ranges: full body
+    ("items=0-10", None),
+    ("bytes=abc-def", None),
+    (None, None),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 1024) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=2000-3000", "bytes=50-10", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header(header, 1024)
+
+
+@pytest.mark.parametrize("header, matches", [
+    ('"abc123"', True), ('W/"abc123"', True), ('"other", "abc123"', True), ("*", True),
+    ('"other"', False), ("", False), (None, False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, ETAG) is matches
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / "report.pdf"
+    path.write_bytes(BODY)
+    app = FastAPI()
+
+    @app.get("/download")
+    async def download(request: Request):
+        return ranged_file_response(request, str(path), "application/pdf", "report.pdf", etag=ETAG)
+
+    return TestClient(app)
+
+
+def test_full_body_and_ranges(client):
+    full = client.get("/download")
+    assert full.status_code == 200
+    assert full.content == BODY
+    assert full.headers["accept-ranges"] == "bytes"
+    assert full.headers["etag"] == f'"{ETAG}"'
+
+    partial = client.get("/download", headers={"Range": "bytes=-100"})
+    assert partial.status_code == 206
+    assert partial.content == BODY[-100:]
+    assert partial.headers["content-range"] == "bytes 924-1023/1024"
+
+
+def test_out_of_range_request_gets_416(client):
+    response = client.get("/download", headers={"Range": "bytes=5000-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */1024"
+
+
+def test_multiple_ranges_get_the_full_body(client):
+    response = client.get("/download", headers={"Range": "bytes=0-9,20-29"})
+    assert response.status_code == 200
+    assert response.content == BODY
+
+
+def test_if_range_with_a_stale_etag_gets_the_full_body(client):
+    fresh = client.get("/download", headers={"Range": "bytes=0-9", "If-Range": f'"{ETAG}"'})
+    assert fresh.status_code == 206
+    assert fresh.content == BODY[:10]
+    stale = client.get("/download", headers={"Range": "bytes=0-9", "If-Range": '"old"'})
+    assert stale.status_code == 200
+    assert stale.content == BODY
+
+
+def test_if_none_match_gets_304(client):
+    response = client.get("/download", headers={"If-None-Match": f'W/"{ETAG}"'})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert "content-disposition" not in response.headers
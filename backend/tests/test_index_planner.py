@@ -0,0 +1,142 @@
+"""Index planner: plan derivation, apply_index_plan and the explain() suite"""
+import asyncio
+import os
+
+import pytest
+
+from app import index_planner
+from app.index_planner import (
+    apply_index_plan, load_query_shapes, plan_indexes, register_query_shape, verify_query_shapes
+)
+
+
+class FakeCollection:
+    def __init__(self, indexes):
+        self.indexes = {index["name"]: index for index in indexes}
+        self.created = []
+        self.dropped = []
+
+    class _Cursor:
+        def __init__(self, items):
+            self.items = items
+
+        async def to_list(self, length=None):
+            return self.items
+
+    def list_indexes(self):
+        return self._Cursor(list(self.indexes.values()))
+
+    async def create_index(self, keys, name=None):
+        self.created.append((tuple(keys), name))
+        return name
+
+    async def drop_index(self, name):
+        self.dropped.append(name)
+
+
+@pytest.fixture
+def shapes(monkeypatch):
+    """Fresh registry with every shape module already loaded"""
+    monkeypatch.setattr(index_planner, "_QUERY_SHAPES", {})
+    monkeypatch.setattr(index_planner, "QUERY_SHAPE_MODULES", ())
+    return index_planner._QUERY_SHAPES
+
+
+def test_index_keys_follow_esr_order(shapes):
+    shape = register_query_shape("system_logs", "t.esr", equality=["level"], sort=[("source", 1)],
+                                 range=["timestamp"], covering=["source_ip"])
+    assert shape.index_keys() == (("level", 1), ("source", 1), ("timestamp", -1), ("source_ip", 1))
+
+
+def test_prefix_indexes_are_folded(shapes):
+    register_query_shape("system_logs", "t.short", equality=["level"])
+    register_query_shape("system_logs", "t.long", equality=["level"], range=["timestamp"])
+    plans = plan_indexes()["system_logs"]
+    assert [(plan.keys, sorted(plan.shapes)) for plan in plans] == [
+        ((("level", 1), ("timestamp", -1)), ["t.long", "t.short"])
+    ]
+
+
+def test_single_key_index_satisfies_either_direction(shapes):
+    register_query_shape("system_logs", "t.window", range=["timestamp"])
+    collection = FakeCollection([{"name": "timestamp_1", "key": {"timestamp": 1}}])
+
+    report = asyncio.run(apply_index_plan({"system_logs": collection}))
+
+    assert collection.created == []
+    assert report["system_logs"]["existing"] == ["timestamp_1"]
+
+
+def test_reversed_compound_index_satisfies_the_plan(shapes):
+    register_query_shape("system_logs", "t.level", equality=["level"], range=["timestamp"])
+    reversed_index = {"name": "level_-1_timestamp_1", "key": {"level": -1, "timestamp": 1}}
+    mixed_index = {"name": "level_1_timestamp_1", "key": {"level": 1, "timestamp": 1}}
+
+    satisfied = FakeCollection([reversed_index])
+    asyncio.run(apply_index_plan({"system_logs": satisfied}))
+    assert satisfied.created == []
+
+    unsatisfied = FakeCollection([mixed_index])
+    asyncio.run(apply_index_plan({"system_logs": unsatisfied}))
+    assert unsatisfied.created == [((("level", 1), ("timestamp", -1)), "qp_level_1_timestamp_-1")]
+
+
+def test_stale_indexes_are_kept_by_default(shapes):
+    register_query_shape("system_logs", "t.window", range=["timestamp"])
+    collection = FakeCollection([
+        {"name": "qp_timestamp_-1", "key": {"timestamp": -1}},
+        {"name": "qp_level_1", "key": {"level": 1}},
+    ])
+    asyncio.run(apply_index_plan({"system_logs": collection}))
+    assert collection.dropped == []
+
+    asyncio.run(apply_index_plan({"system_logs": collection}, drop_stale=True))
+    assert collection.dropped == ["qp_level_1"]
+
+
+def test_stale_indexes_are_kept_when_a_shape_module_fails_to_load(shapes, monkeypatch):
+    monkeypatch.setattr(index_planner, "QUERY_SHAPE_MODULES", (".no_such_module",))
+    register_query_shape("system_logs", "t.window", range=["timestamp"])
+    collection = FakeCollection([{"name": "qp_level_1", "key": {"level": 1}}])
+
+    asyncio.run(apply_index_plan({"system_logs": collection}, drop_stale=True))
+
+    assert collection.dropped == []
+
+
+def test_load_query_shapes_registers_declared_shapes(monkeypatch):
+    monkeypatch.setattr(index_planner, "QUERY_SHAPE_MODULES", (".services.log_service",))
+    assert load_query_shapes() == []
+    assert "logs.latest" in {shape.name for shape in index_planner.get_query_shapes("system_logs")}
+
+
+# ---------------------------------------------------------------------------
+# explain() suite - needs a MongoDB server (KOBI_TEST_MONGODB_URL)
+# ---------------------------------------------------------------------------
+
+@pytest.mark.database
+def test_every_query_shape_is_served_by_an_index():
+    motor = pytest.importorskip("motor.motor_asyncio")
+    url = os.environ.get("KOBI_TEST_MONGODB_URL", "mongodb://localhost:27017")
+
+    async def run():
+        client = motor.AsyncIOMotorClient(url, serverSelectionTimeoutMS=1000)
+        database = client["kobi_index_planner_test"]
+        try:
+            await database.command("ping")
+        except Exception as e:
+            client.close()
+            pytest.skip(f"MongoDB not reachable at {url}: {e}")
+        try:
+            for collection in {shape.collection for shape in index_planner.get_query_shapes()} | {"system_logs"}:
+                await database.create_collection(collection)
+            await apply_index_plan(database)
+            return await verify_query_shapes(database)
+        finally:
+            await client.drop_database("kobi_index_planner_test")
+            client.close()
+
+    results = asyncio.run(run())
+    assert results
+    failures = {name: result for name, result in results.items() if result.get("error") or result.get("collscan")}
+    assert failures == {}
@@ -0,0 +1,90 @@
+"""Latency recorder: digest documents, flush failures and the PyMongo command listener"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app import latency
+from app.latency import KIND_DB, KIND_HTTP, METRIC_TYPE, LatencyRecorder
+from app.sketches import TDigest
+
+
+class FakeMetrics:
+    def __init__(self, failure=None):
+        self.inserted = []
+        self.failure = failure
+
+    async def insert_many(self, documents, ordered=True):
+        if self.failure is not None:
+            raise self.failure
+        self.inserted.extend(documents)
+
+
+def test_window_becomes_one_digest_document_per_key():
+    recorder = LatencyRecorder()
+    for milliseconds in range(1, 101):
+        recorder.record(KIND_HTTP, "GET /api/v1/reports", milliseconds / 1000)
+    recorder.record(KIND_HTTP, "GET /api/v1/reports", 2.0, error=True)
+    recorder.record(KIND_DB, "find system_logs", 0.004)
+
+    window_start, series = recorder.drain()
+    documents = {document["name"]: document for document in recorder.to_documents(window_start, series)}
+    report = documents["GET /api/v1/reports"]
+    assert report["metric_type"] == METRIC_TYPE
+    assert report["timestamp"] == window_start.replace(second=0, microsecond=0)
+    assert (report["count"], report["errors"], report["min_ms"], report["max_ms"]) == (101, 1, 1.0, 2000.0)
+    assert report["sum_ms"] == pytest.approx(5050 + 2000)
+    assert TDigest.from_bytes(report["digest"]).quantile(0.5) == pytest.approx(51, abs=1.5)
+    assert documents["find system_logs"]["kind"] == KIND_DB
+    # Recording continues into a fresh window
+    assert recorder.drain()[1] == {}
+
+
+def test_flush_writes_documents_and_counts_failures():
+    recorder = LatencyRecorder()
+    collection = FakeMetrics()
+    recorder.record(KIND_HTTP, "GET /", 0.01)
+    assert asyncio.run(recorder.flush(SimpleNamespace(performance_metrics=collection))) == 1
+    assert len(collection.inserted) == 1
+    assert asyncio.run(recorder.flush(SimpleNamespace(performance_metrics=collection))) == 0
+
+    recorder.record(KIND_HTTP, "GET /", 0.01)
+    failing = SimpleNamespace(performance_metrics=FakeMetrics(RuntimeError("down")))
+    assert asyncio.run(recorder.flush(failing)) == 0
+    assert recorder.metrics["flush_errors"] == 1
+    assert recorder.metrics["documents_written"] == 1
+
+
+@pytest.mark.skipif(not latency.PYMONGO_MONITORING_AVAILABLE, reason="pymongo monitoring not installed")
+def test_command_listener_records_commands_by_collection():
+    recorder = LatencyRecorder()
+    listener = latency.DatabaseLatencyListener(recorder)
+
+    def event(name, request_id, command=None, duration=0):
+        return SimpleNamespace(command_name=name, command=command or {}, connection_id=("db", 27017),
+                               request_id=request_id, duration_micros=duration)
+
+    listener.started(event("find", 1, {"find": "system_logs"}))
+    listener.started(event("ping", 2, {"ping": 1}))
+    listener.started(event("aggregate", 3, {"aggregate": "firewall_rules"}))
+    listener.succeeded(event("find", 1, duration=2500))
+    listener.succeeded(event("ping", 2, duration=100))
+    listener.failed(event("aggregate", 3, duration=1000))
+
+    _, series = recorder.drain()
+    assert set(series) == {(KIND_DB, "find system_logs"), (KIND_DB, "aggregate firewall_rules")}
+    assert series[(KIND_DB, "find system_logs")].sum_ms == pytest.approx(2.5)
+    assert series[(KIND_DB, "aggregate firewall_rules")].errors == 1
+
+
+def test_requests_are_recorded_under_their_route_template(monkeypatch):
+    recorder = LatencyRecorder()
+    monkeypatch.setattr(latency, "latency_recorder", recorder)
+    monkeypatch.setattr(latency, "get_settings", lambda: SimpleNamespace(latency_tracking_enabled=True))
+    route = SimpleNamespace(path="/api/v1/firewall/rules/{rule_id}")
+    latency.record_request(SimpleNamespace(method="PUT", scope={"route": route}), 200, 0.02)
+    latency.record_request(SimpleNamespace(method="GET", scope={}), 503, 0.01)
+
+    _, series = recorder.drain()
+    assert series[(KIND_HTTP, "PUT /api/v1/firewall/rules/{rule_id}")].errors == 0
+    assert series[(KIND_HTTP, "GET unmatched")].errors == 1
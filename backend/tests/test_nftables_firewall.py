@@ -0,0 +1,98 @@
+"""compile_nft_ruleset golden text: interval sets, verdict maps, log chains and group chains"""
+from app.firewall_ruleset import normalize_groups, normalize_rules
+from app.nftables_firewall import compile_nft_ruleset
+
+LOG_CHAINS = """\
+\tchain log_drop {
+\t\tlog prefix "FWDROP: " drop
+\t}
+\tchain log_reject {
+\t\tlog prefix "FWDROP: " reject
+\t}
+"""
+
+SETS_AND_MAPS = """\
+table inet kobi
+delete table inet kobi
+table inet kobi {
+\tset re8b9f665f844_e58df4e3_s4 {
+\t\ttype ipv4_addr
+\t\tflags interval
+\t\telements = { 10.0.0.0/23, 192.168.1.0/24 }
+\t}
+\tmap v_input4_af0c2708e582 {
+\t\ttype ipv4_addr : verdict
+\t\tflags interval
+\t\tcounter
+\t\telements = { 203.0.113.0/24 : jump log_drop, 198.51.100.7/32 : accept }
+\t}
+""" + LOG_CHAINS + """\
+\tchain input {
+\t\ttype filter hook input priority filter; policy accept;
+\t\tip saddr @re8b9f665f844_e58df4e3_s4 tcp dport 22 counter accept comment "kobi:ssh/e58df4e3"
+\t\tcounter ip saddr vmap @v_input4_af0c2708e582 comment "kobi:@v_input4_af0c2708e582"
+\t}
+\tchain output {
+\t\ttype filter hook output priority filter; policy accept;
+\t\tmeta l4proto { icmp, ipv6-icmp } counter jump log_reject comment "kobi:ping/02bd709c"
+\t}
+}
+"""
+
+GROUPS = """\
+table inet kobi
+delete table inet kobi
+table inet kobi {
+""" + LOG_CHAINS + """\
+\tchain g_54fd171120_input {
+\t\ttcp dport { 80, 443 } counter accept comment "kobi:web/232d6cfb"
+\t}
+\tchain input {
+\t\ttype filter hook input priority filter; policy accept;
+\t\tjump g_54fd171120_input comment "kobi:group:g/1d12dca0"
+\t\tip saddr 192.0.2.9/32 counter jump log_drop comment "kobi:v6/547d85c1"
+\t\tip6 saddr 2001:db8::/48 counter jump log_drop comment "kobi:v6/547d85c1"
+\t}
+\tchain output {
+\t\ttype filter hook output priority filter; policy accept;
+\t}
+}
+"""
+
+
+def test_interval_sets_verdict_maps_and_log_chains():
+    specs, _ = normalize_rules([
+        # adjacent networks collapse inside the interval set
+        {"_id": "ssh", "action": "ALLOW", "protocol": "TCP", "port": 22,
+         "source_ips": ["10.0.0.0/24", "192.168.1.0/24", "10.0.1.0/24"]},
+        # source-only neighbours fold into one verdict map
+        {"_id": "bad", "action": "DENY", "source_ips": ["203.0.113.0/24"], "priority": 200},
+        {"_id": "good", "action": "ALLOW", "source_ips": ["198.51.100.7"], "priority": 200},
+        {"_id": "ping", "action": "REJECT", "protocol": "ICMP", "direction": "OUT", "priority": 300},
+    ])
+    compiled = compile_nft_ruleset(specs)
+    assert compiled.payload == SETS_AND_MAPS
+    assert compiled.merged == {"v_input4_af0c2708e582": ["bad", "good"]}
+    assert compiled.kernel_rules == 3
+
+
+def test_group_chains_and_split_address_families():
+    specs, _ = normalize_rules([
+        {"_id": "web", "action": "ALLOW", "protocol": "TCP", "destination_ports": ["80", "443"], "group_id": "g"},
+        {"_id": "v6", "action": "DENY", "source_ips": ["2001:db8::/48", "192.0.2.9"], "priority": 200},
+    ])
+    groups = normalize_groups([{"_id": "g", "group_name": "web", "priority": 150}])
+    compiled = compile_nft_ruleset(specs, groups=groups)
+    assert compiled.payload == GROUPS
+    assert compiled.merged == {}
+
+
+def test_without_verdict_maps_every_rule_stays_separate():
+    specs, _ = normalize_rules([
+        {"_id": "bad", "action": "DENY", "source_ips": ["203.0.113.0/24"]},
+        {"_id": "good", "action": "ALLOW", "source_ips": ["198.51.100.7"]},
+    ])
+    compiled = compile_nft_ruleset(specs, merge_verdict_maps=False)
+    assert "map " not in compiled.payload
+    assert '\t\tip saddr 203.0.113.0/24 counter jump log_drop comment "kobi:bad/' in compiled.payload
+    assert '\t\tip saddr 198.51.100.7/32 counter accept comment "kobi:good/' in compiled.payload
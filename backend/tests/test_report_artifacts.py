@@ -0,0 +1,107 @@
+"""Export artifact cache: content addressing, single-flight rendering and LRU eviction"""
+import asyncio
+import os
+
+import pytest
+
+from app.services.report_artifacts import ArtifactCache, artifact_key, data_watermark
+
+
+def renderer(content, calls=None):
+    async def render(path):
+        if calls is not None:
+            calls.append(path)
+        await asyncio.sleep(0)
+        with open(path, "wb") as handle:
+            handle.write(content)
+    return render
+
+
+def test_keys_follow_the_data_watermark():
+    watermark = data_watermark({"b": 2, "a": 1})
+    assert watermark == data_watermark({"a": 1, "b": 2})
+    key = artifact_key("security", "24h", "pdf", watermark)
+    assert key == artifact_key("security", "24h", "pdf", watermark, {})
+    assert key != artifact_key("security", "24h", "pdf", data_watermark({"a": 2, "b": 2}))
+    assert key != artifact_key("security", "24h", "csv", watermark)
+
+
+def test_repeated_exports_are_served_from_disk(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1000)
+    calls = []
+
+    async def scenario():
+        first = await cache.get_or_render("a" * 40, "pdf", renderer(b"x" * 10, calls))
+        second = await cache.get_or_render("a" * 40, "pdf", renderer(b"x" * 10, calls))
+        return first, second
+
+    (first, first_cached), (second, second_cached) = asyncio.run(scenario())
+    assert (first_cached, second_cached) == (False, True)
+    assert first == second
+    assert len(calls) == 1
+    assert os.path.basename(first.path) == f"{'a' * 40}.{first.etag}.pdf"
+
+
+def test_concurrent_misses_render_once(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1000)
+    calls = []
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_render("b" * 40, "csv", renderer(b"y", calls))
+                                      for _ in range(4)))
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert len({artifact for artifact, _ in results}) == 1
+    assert cache.metrics["coalesced"] == 3
+
+
+def test_least_recently_used_artifacts_are_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=250)
+    keys = [letter * 40 for letter in "abc"]
+
+    async def scenario():
+        first, _ = await cache.get_or_render(keys[0], "pdf", renderer(b"1" * 100))
+        await cache.get_or_render(keys[1], "pdf", renderer(b"2" * 100))
+        assert cache.get(keys[0]) is not None          # a is now the most recent
+        await cache.get_or_render(keys[2], "pdf", renderer(b"3" * 100))
+        return first
+
+    first = asyncio.run(scenario())
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == first and os.path.exists(first.path)
+    assert cache.get(keys[2]) is not None
+    assert cache.get_status()["total_bytes"] == 200
+    assert cache.metrics["evictions"] == 1
+    assert sorted(name[0] for name in os.listdir(tmp_path)) == ["a", "c"]
+
+
+def test_oversized_newest_artifact_survives(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=50)
+    artifact, _ = asyncio.run(cache.get_or_render("d" * 40, "pdf", renderer(b"4" * 100)))
+    assert cache.get("d" * 40) == artifact
+
+
+def test_restart_reloads_artifacts_and_drops_interrupted_renders(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1000)
+    artifact, _ = asyncio.run(cache.get_or_render("e" * 40, "pdf", renderer(b"5" * 10)))
+    (tmp_path / f"{'f' * 40}.rendering.pdf").write_bytes(b"partial")
+
+    restarted = ArtifactCache(str(tmp_path), max_bytes=1000)
+    assert restarted.get("e" * 40) == artifact
+    assert not (tmp_path / f"{'f' * 40}.rendering.pdf").exists()
+
+
+def test_failed_render_propagates_to_every_waiter(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1000)
+
+    async def broken(path):
+        await asyncio.sleep(0)
+        raise RuntimeError("render failed")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_render("g" * 40, "pdf", broken) for _ in range(2)),
+                                    return_exceptions=True)
+
+    assert [str(result) for result in asyncio.run(scenario())] == ["render failed"] * 2
+    assert cache.get("g" * 40) is None
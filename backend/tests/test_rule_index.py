@@ -0,0 +1,102 @@
+"""RuleIndex answers agree with a pairwise RuleShape scan on random rulesets"""
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.firewall_optimizer import RuleShape, prepare_packet
+from app.firewall_ruleset import normalize_rule
+from app.rule_index import RuleIndex
+
+STAMP = datetime(2026, 1, 1)
+
+
+def make_rule(index, rng):
+    """Small address and port spaces so random rules overlap often; IPv6 and address-less rules included"""
+    rule = {
+        "_id": f"rule{index:04d}", "updated_at": STAMP,
+        "protocol": rng.choice(["TCP", "TCP", "UDP", "ICMP", "ANY"]),
+        "action": rng.choice(["ALLOW", "DENY"]), "direction": rng.choice(["IN", "OUT", "BOTH"]),
+        "priority": rng.randint(1, 50),
+        "interface": rng.choice([None, None, None, "eth0", "eth1"]),
+    }
+    if rng.random() < 0.8:
+        rule["source_ips"] = [
+            rng.choice([f"10.{rng.randint(0, 3)}.{rng.randint(0, 3)}.{rng.randint(0, 255)}/"
+                        f"{rng.choice([8, 16, 24, 30, 32])}",
+                        f"2001:db8:{rng.randint(0, 3):x}::/{rng.choice([32, 48, 64])}"])
+            for _ in range(rng.randint(1, 3))
+        ]
+    if rng.random() < 0.4:
+        rule["destination_ips"] = [f"172.16.{rng.randint(0, 3)}.0/{rng.choice([16, 24])}"]
+    if rule["protocol"] != "ICMP" and rng.random() < 0.7:
+        rule["destination_ports"] = [
+            rng.choice([str(rng.randint(1, 200)), f"{rng.randint(1, 100)}-{rng.randint(100, 300)}"])
+            for _ in range(rng.randint(1, 3))
+        ]
+    if rule["protocol"] != "ICMP" and rng.random() < 0.2:
+        rule["source_ports"] = [f"{rng.randint(1000, 2000)}-{rng.randint(2000, 65535)}"]
+    return rule
+
+
+def make_packet(rng):
+    protocol = rng.choice(["tcp", "udp", "icmp"])
+    source = rng.choice([f"10.{rng.randint(0, 3)}.{rng.randint(0, 3)}.{rng.randint(0, 255)}",
+                         f"2001:db8:{rng.randint(0, 3):x}::{rng.randint(1, 9)}"])
+    destination = f"172.16.{rng.randint(0, 3)}.{rng.randint(1, 9)}" if ":" not in source else "2001:db8:ff::1"
+    return {
+        "direction": rng.choice(["IN", "OUT"]), "protocol": protocol, "interface": rng.choice(["eth0", "eth1"]),
+        "source_ip": source, "destination_ip": destination,
+        "source_port": rng.randint(1, 65535) if protocol != "icmp" else None,
+        "destination_port": rng.randint(1, 300) if protocol != "icmp" else None,
+        "timestamp": None,
+    }
+
+
+def _ids(specs):
+    return sorted(spec.rule_id for spec in specs)
+
+
+@pytest.mark.parametrize("seed", [1, 7, 42])
+def test_intersecting_matches_a_pairwise_scan(seed):
+    rng = random.Random(seed)
+    documents = [make_rule(index, rng) for index in range(300)]
+    index = RuleIndex.from_documents(documents)
+    shapes = [RuleShape(normalize_rule(document)) for document in documents]
+
+    for query_number in range(150):
+        query = normalize_rule(make_rule(1000 + query_number, rng))
+        query_shape = RuleShape(query)
+        expected = [shape.spec for shape in shapes if shape.overlaps(query_shape)]
+        found = index.intersecting(query)
+        assert _ids(found) == _ids(expected)
+        assert [spec.priority for spec in found] == sorted(spec.priority for spec in found)
+
+
+@pytest.mark.parametrize("seed", [3, 11])
+def test_matching_packet_matches_a_pairwise_scan(seed):
+    rng = random.Random(seed)
+    documents = [make_rule(index, rng) for index in range(300)]
+    index = RuleIndex.from_documents(documents)
+    shapes = [RuleShape(normalize_rule(document)) for document in documents]
+
+    for _ in range(300):
+        packet = make_packet(rng)
+        prepared = prepare_packet(packet)
+        expected = [shape.spec for shape in shapes if shape.matches(prepared)]
+        assert _ids(index.matching_packet(packet)) == _ids(expected)
+
+
+def test_sync_only_reindexes_changed_rules():
+    rng = random.Random(5)
+    documents = [make_rule(index, rng) for index in range(50)]
+    index = RuleIndex.from_documents(documents)
+    assert index.sync(documents) == (0, 0)
+
+    documents[0] = {**documents[0], "updated_at": STAMP + timedelta(minutes=1), "source_ips": ["192.0.2.1"]}
+    removed = documents.pop()
+    assert index.sync(documents) == (1, 1)
+
+    query = normalize_rule({"_id": "q", "action": "DENY", "source_ips": ["192.0.2.0/24"]})
+    assert "rule0000" in _ids(index.intersecting(query))
+    assert removed["_id"] not in _ids(index.intersecting(normalize_rule({"_id": "any", "action": "DENY"})))
@@ -0,0 +1,120 @@
+"""Sketch error bounds from the sketches.py docstring, merges and serialization"""
+import bisect
+import random
+from collections import Counter
+
+import pytest
+
+from app.sketches import HyperLogLog, TDigest, TopK, merge_hll, merge_topk
+
+
+def _relative_error(estimate, actual):
+    return abs(estimate - actual) / actual
+
+
+def test_hll_estimates_are_within_the_stated_error():
+    sketch_error = HyperLogLog().relative_error
+    assert sketch_error == pytest.approx(0.016, abs=0.001)
+    errors = []
+    for trial in range(20):
+        sketch = HyperLogLog().update(f"{trial}-10.{n >> 16}.{(n >> 8) & 255}.{n & 255}" for n in range(20000))
+        errors.append(_relative_error(sketch.count(), 20000))
+    # ~95% of queries within 2 standard errors (3.3%), none beyond 4
+    assert sum(error <= 2 * sketch_error for error in errors) >= 17
+    assert max(errors) <= 4 * sketch_error
+
+
+def test_hll_small_cardinalities_are_close_to_exact():
+    for actual in (1, 10, 100, 1000):
+        assert _relative_error(HyperLogLog().update(range(actual)).count(), actual) <= 0.02
+
+
+def test_hll_merge_equals_the_sketch_of_the_union():
+    first = HyperLogLog().update(range(0, 6000))
+    second = HyperLogLog().update(range(4000, 10000))
+    union = HyperLogLog().update(range(0, 10000))
+    assert first.copy().merge(second).registers == union.registers
+    with pytest.raises(ValueError):
+        first.merge(HyperLogLog(precision=10))
+
+
+@pytest.mark.parametrize("distinct", [50, 5000])     # sparse and dense encodings
+def test_hll_serialization_round_trip(distinct):
+    sketch = HyperLogLog().update(range(distinct))
+    data = sketch.to_bytes()
+    assert data[:1] == (b"S" if distinct == 50 else b"D")
+    assert HyperLogLog.from_bytes(data).registers == sketch.registers
+    assert merge_hll([data, None, data]).count() == sketch.count()
+
+
+def _hourly_counts(rng, hours=24):
+    """Zipf-like source popularity with hour-to-hour churn"""
+    population = [f"10.0.{index // 256}.{index % 256}" for index in range(2000)]
+    weights = [1 / (rank + 1) for rank in range(len(population))]
+    hourly = []
+    for _ in range(hours):
+        rng.shuffle(weights[50:])           # the head stays stable, the tail churns
+        hourly.append(Counter(rng.choices(population, weights, k=3000)))
+    return hourly
+
+
+def test_topk_from_counts_floor_is_bounded():
+    counts = _hourly_counts(random.Random(1), hours=1)[0]
+    sketch = TopK.from_counts(counts, capacity=16)
+    assert sketch.floor <= sketch.total / 17
+    for item, count in counts.items():
+        lower, error = sketch.estimate(item)
+        assert lower <= count <= lower + error
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_topk_merge_keeps_every_count_within_its_bounds(seed):
+    hourly = _hourly_counts(random.Random(seed))
+    merged = merge_topk(TopK.from_counts(counts, capacity=32).to_document() for counts in hourly)
+    actual = sum(hourly, Counter())
+    assert merged.total == sum(actual.values())
+    for item, count in actual.items():
+        lower, error = merged.estimate(item)
+        assert lower <= count <= lower + error
+    # The heavy hitters survive the merge with small error bars
+    for item, count, error in merged.top(5):
+        assert item in dict(actual.most_common(10))
+        assert error <= 0.1 * count
+
+
+def test_topk_document_round_trip():
+    sketch = TopK.from_counts({"a": 5, "b": 3, "c": 1}, capacity=2)
+    restored = TopK.from_document(sketch.to_document())
+    assert restored.top() == sketch.top() == [("a", 5, 0), ("b", 3, 0)]
+    assert (restored.floor, restored.total) == (1, 9)
+
+
+def _rank_error(values, estimate, quantile):
+    return abs(bisect.bisect_right(values, estimate) / len(values) - quantile)
+
+
+def test_tdigest_merged_per_minute_rank_error():
+    rng = random.Random(7)
+    values, merged = [], TDigest()
+    for _ in range(60):
+        minute = TDigest()
+        for _ in range(2000):
+            value = rng.lognormvariate(3, 0.8)
+            values.append(value)
+            minute.add(value)
+        merged.merge(TDigest.from_bytes(minute.to_bytes()))
+    values.sort()
+    assert merged.count == len(values)
+    for quantile in (0.5, 0.9, 0.95, 0.99, 0.999):
+        assert _rank_error(values, merged.quantile(quantile), quantile) <= 0.002
+
+
+def test_tdigest_serialization_round_trip():
+    digest = TDigest()
+    for value in range(1, 10001):
+        digest.add(value / 10)
+    restored = TDigest.from_bytes(digest.to_bytes())
+    assert (restored.count, restored.min, restored.max) == (digest.count, digest.min, digest.max)
+    for quantile in (0.01, 0.5, 0.99):
+        assert restored.quantile(quantile) == pytest.approx(digest.quantile(quantile), rel=1e-5)
+    assert TDigest().quantile(0.5) is None
@@ -0,0 +1,143 @@
+"""Disk spool replay: poison records, transient errors and time-series dedup"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from pymongo.errors import AutoReconnect, BulkWriteError, InvalidDocument
+
+from app.durability import BatchedWriter
+from app.spool import DiskSpool, insert_isolating, is_transient_error, read_segment
+
+NOW = datetime(2026, 10, 14, 12, 0)
+
+
+class FakeCollection:
+    """insert_many/find double; documents whose 'bad' field is set are rejected"""
+
+    def __init__(self, failure=None, bulk=True):
+        self.stored = []
+        self.failure = failure
+        self.bulk = bulk
+
+    async def insert_many(self, documents, ordered=True):
+        if self.failure is not None:
+            raise self.failure
+        bad = [index for index, document in enumerate(documents) if document.get("bad")]
+        if bad and not self.bulk:
+            raise InvalidDocument("cannot encode object")
+        self.stored.extend(document for index, document in enumerate(documents) if index not in bad)
+        if bad:
+            raise BulkWriteError({"writeErrors": [{"index": index, "code": 121} for index in bad],
+                                  "writeConcernErrors": [], "nInserted": len(documents) - len(bad)})
+
+    def find(self, query, projection=None):
+        ids = set(query["_id"]["$in"])
+
+        async def rows():
+            for document in self.stored:
+                if document["_id"] in ids:
+                    yield {"_id": document["_id"]}
+        return rows()
+
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        collection = self[name] = FakeCollection()
+        return collection
+
+
+def _documents(count, **extra):
+    return [{"_id": ObjectId(), "timestamp": NOW + timedelta(seconds=i), "value": i, **extra} for i in range(count)]
+
+
+def _spool(tmp_path):
+    return DiskSpool(str(tmp_path), max_bytes=1 << 20, segment_bytes=1 << 16, fsync_interval=0)
+
+
+def test_error_classification():
+    assert is_transient_error(AutoReconnect("primary stepped down"))
+    assert is_transient_error(asyncio.TimeoutError())
+    assert not is_transient_error(InvalidDocument("bad"))
+    assert not is_transient_error(BulkWriteError({"writeErrors": [{"index": 0, "code": 121}]}))
+    assert is_transient_error(BulkWriteError({"writeErrors": [], "writeConcernErrors": [{"code": 64}]}))
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_poison_record_is_quarantined_and_replay_completes(tmp_path, bulk):
+    spool = _spool(tmp_path)
+    documents = _documents(4)
+    documents[1]["bad"] = True
+    database = FakeDatabase(system_logs=FakeCollection(bulk=bulk))
+
+    async def run():
+        await spool.append("system_logs", documents)
+        return await spool.replay(database)
+
+    assert asyncio.run(run()) == 3
+    assert [document["value"] for document in database["system_logs"].stored] == [0, 2, 3]
+    assert not list(tmp_path.glob("segment-*.seg"))
+    quarantined = [record for path in tmp_path.glob("quarantine-*.seg") for record in read_segment(path)]
+    assert [(name, document["value"]) for _, name, document in quarantined] == [("system_logs", 1)]
+    assert spool.metrics["quarantined_records"] == 1
+
+
+def test_transient_error_keeps_the_segment(tmp_path):
+    spool = _spool(tmp_path)
+    database = FakeDatabase(system_logs=FakeCollection(failure=AutoReconnect("connection reset")))
+
+    async def run():
+        await spool.append("system_logs", _documents(2))
+        await spool.replay(database)
+
+    with pytest.raises(AutoReconnect):
+        asyncio.run(run())
+    assert len(list(tmp_path.glob("segment-*.seg"))) == 1
+    assert not list(tmp_path.glob("quarantine-*.seg"))
+
+
+def test_timeseries_replay_skips_documents_already_stored(tmp_path):
+    spool = _spool(tmp_path)
+    documents = _documents(3)
+    health = FakeCollection()
+    health.stored.append(dict(documents[0]))    # written before the ambiguous timeout
+    database = FakeDatabase(system_health=health)
+
+    async def run():
+        await spool.append("system_health", documents)
+        return await spool.replay(database)
+
+    assert asyncio.run(run()) == 2
+    assert sorted(document["value"] for document in health.stored) == [0, 1, 2]
+    assert spool.metrics["deduplicated_records"] == 1
+
+
+def test_batched_writer_spools_only_transient_failures(tmp_path):
+    spool = _spool(tmp_path)
+    database = FakeDatabase(system_logs=FakeCollection())
+
+    async def get_database():
+        return database
+
+    async def run():
+        writer = BatchedWriter(get_database, spool=spool)
+        documents = _documents(3)
+        documents[2]["bad"] = True
+        for document in documents:
+            await writer.enqueue("system_logs", document)
+        await writer.flush()
+
+        database["system_logs"].failure = AutoReconnect("down")
+        await writer.enqueue("system_logs", _documents(1)[0])
+        await writer.flush()
+        await writer.close()
+
+    asyncio.run(run())
+    assert len(database["system_logs"].stored) == 2
+    assert spool.metrics["quarantined_records"] == 1
+    assert spool.metrics["appended_records"] == 1
+
+
+def test_insert_isolating_counts_duplicates_as_written():
+    collection = FakeCollection(failure=BulkWriteError({"writeErrors": [{"index": 0, "code": 11000}]}))
+    assert asyncio.run(insert_isolating(collection, _documents(1))) == []
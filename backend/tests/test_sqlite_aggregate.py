@@ -0,0 +1,109 @@
+"""SQLite backend aggregation pipelines (the shapes the reports/logs code runs)"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.storage.sqlite_backend import SQLiteDatabase, match_document, run_pipeline
+
+NOW = datetime(2026, 10, 14, 13, 37)
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = SQLiteDatabase(tmp_path / "kobi.db")
+    documents = [
+        {
+            "timestamp": NOW - timedelta(minutes=7 * i),
+            "level": ["BLOCK", "INFO", "ALLOW"][i % 3],
+            "source_ip": f"10.0.0.{i % 4}",
+            "destination_port": [22, 80, None][i % 3],
+            "bytes_in": i,
+            "bytes_out": 1,
+            "meta": {"protocol": "tcp" if i % 2 else "udp"},
+        }
+        for i in range(60)
+    ]
+    asyncio.run(db.system_logs.insert_many(documents))
+    yield db
+    db.close()
+
+
+def aggregate(db, pipeline, length=None):
+    return asyncio.run(db.system_logs.aggregate(pipeline).to_list(length=length))
+
+
+def test_group_by_hour_and_port_with_conditional_sum(database):
+    rows = aggregate(database, [
+        {"$match": {"destination_port": {"$exists": True, "$ne": None}}},
+        {"$group": {
+            "_id": {"hour": {"$dateTrunc": {"date": "$timestamp", "unit": "hour"}}, "port": "$destination_port"},
+            "attempts": {"$sum": 1},
+            "blocked": {"$sum": {"$cond": [{"$in": ["$level", ["BLOCK"]]}, 1, 0]}},
+        }},
+        {"$sort": {"_id.hour": -1, "_id.port": 1}},
+    ])
+    assert rows[0] == {"_id": {"hour": datetime(2026, 10, 14, 13), "port": 22}, "attempts": 2, "blocked": 2}
+    assert sum(row["attempts"] for row in rows) == 40
+    assert all(row["blocked"] == 0 for row in rows if row["_id"]["port"] == 80)
+
+
+def test_date_trunc_bins_and_monday_weeks(database):
+    rows = aggregate(database, [
+        {"$group": {"_id": {"$dateTrunc": {"date": "$timestamp", "unit": "minute", "binSize": 15}},
+                    "v": {"$sum": {"$add": ["$bytes_in", "$bytes_out"]}}}},
+        {"$sort": {"_id": 1}},
+    ])
+    assert all(row["_id"].minute % 15 == 0 and row["_id"].second == 0 for row in rows)
+    assert sum(row["v"] for row in rows) == sum(range(60)) + 60
+
+    weeks = aggregate(database, [
+        {"$group": {"_id": {"$dateTrunc": {"date": "$timestamp", "unit": "week", "startOfWeek": "monday"}},
+                    "n": {"$sum": 1}}},
+    ])
+    assert weeks == [{"_id": datetime(2026, 10, 12), "n": 60}]
+
+
+def test_facet_count_and_accumulators(database):
+    start = NOW - timedelta(hours=1)
+    result = aggregate(database, [
+        {"$match": {"timestamp": {"$gte": NOW - timedelta(hours=2)}}},
+        {"$facet": {
+            "periods": [{"$group": {
+                "_id": {"$cond": [{"$gte": ["$timestamp", start]}, "current", "previous"]},
+                "total": {"$sum": "$bytes_in"}, "peak": {"$max": "$bytes_in"}, "mean": {"$avg": "$bytes_out"},
+            }}],
+            "info": [{"$match": {"level": {"$regex": "^inf", "$options": "i"}}}, {"$count": "total"}],
+            "protocols": [{"$group": {"_id": "$meta.protocol", "ips": {"$addToSet": "$source_ip"}}},
+                          {"$sort": {"_id": 1}}],
+        }},
+    ], length=1)
+    facets = result[0]
+    periods = {row["_id"]: row for row in facets["periods"]}
+    assert periods["current"]["total"] == sum(range(9))
+    assert periods["current"]["peak"] == 8 and periods["current"]["mean"] == 1
+    assert facets["info"] == [{"total": 6}]
+    assert [row["_id"] for row in facets["protocols"]] == ["tcp", "udp"]
+    assert sorted(facets["protocols"][0]["ips"]) == ["10.0.0.1", "10.0.0.3"]
+
+
+def test_sort_limit_and_missing_fields(database):
+    rows = aggregate(database, [
+        {"$match": {"level": {"$in": ["BLOCK", "ALLOW"]}}},
+        {"$group": {"_id": "$source_ip", "count": {"$sum": 1},
+                    "size": {"$sum": {"$ifNull": ["$parsed_data.packet_size", 0]}}}},
+        {"$sort": {"count": -1, "_id": 1}},
+        {"$limit": 2},
+    ])
+    assert [row["_id"] for row in rows] == ["10.0.0.0", "10.0.0.1"]
+    assert all(row["count"] == 10 for row in rows)
+    assert all(row["size"] == 0 for row in rows)
+
+
+def test_python_match_mirrors_compile_filter():
+    document = {"timestamp": NOW, "level": "INFO", "port": 22}
+    assert match_document(document, {"timestamp": {"$gte": NOW - timedelta(minutes=1)}, "port": {"$in": [22]}})
+    assert match_document(document, {"missing": {"$exists": False}, "level": {"$ne": "BLOCK"}})
+    assert not match_document(document, {"port": {"$gt": "21"}})
+    assert not match_document(document, {"$or": [{"level": "BLOCK"}, {"port": {"$lt": 22}}]})
+    assert run_pipeline([document], [{"$match": {"level": "BLOCK"}}, {"$count": "n"}]) == []
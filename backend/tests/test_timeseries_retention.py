@@ -0,0 +1,71 @@
+"""Retention sweep for metric collections the server does not expire"""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.storage.sqlite_backend import SQLiteDatabase
+from app.timeseries import TIMESERIES_COLLECTIONS, sweep_expired
+
+NOW = datetime(2026, 10, 14, 12, 0)
+
+
+class _Cursor:
+    def __init__(self, items):
+        self.items = items
+
+    async def to_list(self, length=None):
+        return self.items
+
+
+class _MongoInfo:
+    """Database whose listCollections answers come from a dict; collections from SQLite"""
+
+    def __init__(self, database, infos):
+        self.database = database
+        self.infos = infos
+
+    def list_collections(self, filter):
+        info = self.infos.get(filter["name"])
+        return _Cursor([info] if info else [])
+
+    def __getitem__(self, name):
+        return self.database[name]
+
+
+def _seed(database, name):
+    ttl = timedelta(seconds=TIMESERIES_COLLECTIONS[name].expire_after_seconds)
+    asyncio.run(database[name].insert_many([
+        {"timestamp": NOW - ttl - timedelta(minutes=1), "source": "old"},
+        {"timestamp": NOW - ttl + timedelta(minutes=1), "source": "kept"},
+    ]))
+
+
+def test_sqlite_sweeps_every_metric_collection(tmp_path):
+    database = SQLiteDatabase(tmp_path / "kobi.db")
+    for name in ("system_health", "performance_metrics", "traffic_analytics"):
+        _seed(database, name)
+
+    deleted = asyncio.run(sweep_expired(database, native_expiry=False, now=NOW))
+
+    assert deleted["system_health"] == deleted["performance_metrics"] == deleted["traffic_analytics"] == 1
+    remaining = asyncio.run(database.system_health.find({}).to_list(None))
+    assert [doc["source"] for doc in remaining] == ["kept"]
+    database.close()
+
+
+def test_mongo_sweeps_only_collections_without_server_expiry(tmp_path):
+    database = SQLiteDatabase(tmp_path / "kobi.db")
+    _seed(database, "system_health")
+    _seed(database, "database_health")
+    _seed(database, "performance_metrics")
+    infos = {
+        "system_health": {"type": "timeseries", "options": {"expireAfterSeconds": 86400}},
+        "database_health": {"type": "collection", "options": {}},
+        "performance_metrics": {"type": "timeseries", "options": {}},
+    }
+
+    deleted = asyncio.run(sweep_expired(_MongoInfo(database, infos), now=NOW))
+
+    assert "system_health" not in deleted
+    assert deleted["database_health"] == 1
+    assert deleted["performance_metrics"] == 1
+    database.close()
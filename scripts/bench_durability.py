@@ -0,0 +1,88 @@
+"""
+Telemetry ingest benchmark: global w='majority', j=True vs. durability classes.
+Needs a local mongod. Writes into a scratch database that is dropped afterwards.
+
+    python scripts/bench_durability.py --docs 20000
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.write_concern import WriteConcern
+
+MONGODB_URL = "mongodb://localhost:27017"
+DB_NAME = "kobi_firewall_bench"
+
+
+def make_log(i):
+    return {
+        "timestamp": datetime.utcnow(),
+        "source": "iptables",
+        "event_type": "traffic_log",
+        "level": random.choice(["ALLOW", "BLOCK"]),
+        "source_ip": f"192.168.1.{random.randint(1, 254)}",
+        "destination_ip": f"10.0.0.{random.randint(1, 254)}",
+        "protocol": random.choice(["TCP", "UDP", "ICMP"]),
+        "destination_port": random.choice([22, 53, 80, 443, 3389]),
+        "packet_size": random.randint(40, 1500),
+        "seq": i,
+    }
+
+
+async def run_single_inserts(collection, docs):
+    """Old path: one insert_one per packet log"""
+    for doc in docs:
+        await collection.insert_one(doc)
+
+
+async def run_batched_inserts(collection, docs, batch_size):
+    """Telemetry path: unordered insert_many batches"""
+    for start in range(0, len(docs), batch_size):
+        await collection.insert_many(docs[start:start + batch_size], ordered=False)
+
+
+async def main(num_docs, batch_size):
+    client = AsyncIOMotorClient(MONGODB_URL)
+    db = client[DB_NAME]
+    await db.command("ping")
+
+    scenarios = [
+        ("majority+j, insert_one (old global)",
+         WriteConcern(w="majority", j=True), None),
+        ("w=1+j, insert_one (standard class)",
+         WriteConcern(w=1, j=True), None),
+        ("w=1, j=false, insert_one",
+         WriteConcern(w=1, j=False), None),
+        (f"w=1, j=false, insert_many x{batch_size} (telemetry class)",
+         WriteConcern(w=1, j=False), batch_size),
+    ]
+
+    print(f"📊 Ingesting {num_docs} packet logs per scenario into {DB_NAME}")
+    try:
+        for name, write_concern, batch in scenarios:
+            collection = db.get_collection("bench_logs", write_concern=write_concern)
+            await collection.drop()
+            docs = [make_log(i) for i in range(num_docs)]
+
+            started = time.perf_counter()
+            if batch:
+                await run_batched_inserts(collection, docs, batch)
+            else:
+                await run_single_inserts(collection, docs)
+            elapsed = time.perf_counter() - started
+
+            print(f"  {name:<50} {elapsed:8.2f}s  {num_docs / elapsed:10.0f} docs/s")
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=10000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(main(args.docs, args.batch_size))
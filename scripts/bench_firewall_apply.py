@@ -0,0 +1,143 @@
+"""
+Firewall apply benchmark: per-rule `iptables -A` vs. one `iptables-restore`.
+Both paths run against fake iptables / iptables-restore stand-ins that keep
+the "kernel table" in a state file and rewrite all of it on every call, the
+way the real binaries replace the whole table blob. The per-rule path
+therefore costs O(N^2) table writes while the compiled path costs one.
+
+The nftables compilation of the same rules is reported alongside: runs of
+rules that only differ by source and verdict fold into verdict maps, and
+address/port lists never expand into extra rules.
+
+    python scripts/bench_firewall_apply.py --sizes 10,1000,10000
+"""
+import argparse
+import os
+import random
+import stat
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from app.firewall_ruleset import IptablesRestoreApplier, normalize_rules  # noqa: E402
+from app.nftables_firewall import compile_nft_ruleset  # noqa: E402
+
+# Each call copies the whole table before writing it back, like a real commit
+FAKE_IPTABLES = """#!/bin/sh
+case " $* " in *" -C "*) exit 1 ;; esac
+cat "$FAKE_TABLE" > "$FAKE_TABLE.new"
+echo "$*" >> "$FAKE_TABLE.new"
+mv "$FAKE_TABLE.new" "$FAKE_TABLE"
+"""
+
+FAKE_IPTABLES_RESTORE = """#!/bin/sh
+cat "$FAKE_TABLE" > "$FAKE_TABLE.new"
+cat >> "$FAKE_TABLE.new"
+mv "$FAKE_TABLE.new" "$FAKE_TABLE"
+"""
+
+
+def install_fakes(directory):
+    for name, script in (("iptables", FAKE_IPTABLES), ("iptables-restore", FAKE_IPTABLES_RESTORE)):
+        path = os.path.join(directory, name)
+        with open(path, "w") as handle:
+            handle.write(script)
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def make_rules(count):
+    """Rules the per-rule driver can express (one source, one port)"""
+    return [
+        {
+            "_id": f"rule{i:05d}",
+            "rule_name": f"bench-{i}",
+            "source_ips": [f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}/32"],
+            "destination_ports": [str(random.choice([22, 80, 443, 3389, 8080]))],
+            "port": None,
+            "protocol": random.choice(["TCP", "UDP"]),
+            "action": random.choice(["ALLOW", "DENY"]),
+            "direction": random.choice(["IN", "OUT"]),
+            "enabled": True,
+            "priority": random.randint(1, 1000),
+        }
+        for i in range(count)
+    ]
+
+
+def reset_table(path):
+    open(path, "w").close()
+
+
+def table_lines(path):
+    with open(path) as handle:
+        return sum(1 for _ in handle)
+
+
+def bench_per_rule(rules, table):
+    from app.linux_firewall import LinuxFirewall
+
+    driver = LinuxFirewall()
+    reset_table(table)
+    started = time.perf_counter()
+    for rule in rules:
+        driver.add_rule({**rule, "port": rule["destination_ports"][0]})
+    return time.perf_counter() - started, table_lines(table)
+
+
+def bench_restore(rules, table, fake_dir):
+    applier = IptablesRestoreApplier(
+        restore_binary=os.path.join(fake_dir, "iptables-restore"),
+        iptables_binary=os.path.join(fake_dir, "iptables"),
+    )
+    reset_table(table)
+    started = time.perf_counter()
+    compiled = applier.apply(rules)
+    return time.perf_counter() - started, table_lines(table), compiled
+
+
+def bench_nft(rules):
+    started = time.perf_counter()
+    specs, skipped = normalize_rules(rules)
+    compiled = compile_nft_ruleset(specs, skipped)
+    return time.perf_counter() - started, compiled
+
+
+def main(sizes, per_rule_limit):
+    with tempfile.TemporaryDirectory() as fake_dir:
+        install_fakes(fake_dir)
+        table = os.path.join(fake_dir, "table")
+        os.environ["FAKE_TABLE"] = table
+        os.environ["PATH"] = fake_dir + os.pathsep + os.environ.get("PATH", "")
+
+        for size in sizes:
+            rules = make_rules(size)
+            restore_seconds, restore_lines, compiled = bench_restore(rules, table, fake_dir)
+            print(f"\n🧱 {size} rules -> {compiled.kernel_rules} kernel rules")
+            print(f"   iptables-restore   {restore_seconds * 1000:10.1f} ms   "
+                  f"3 processes   {restore_lines} table lines")
+            nft_seconds, nft = bench_nft(rules)
+            print(f"   nft -f (compile)   {nft_seconds * 1000:10.1f} ms   "
+                  f"{nft.kernel_rules} kernel rules   {len(nft.merged)} verdict maps")
+
+            if size > per_rule_limit:
+                print(f"   iptables -A        skipped (> --per-rule-limit {per_rule_limit})")
+                continue
+            try:
+                per_rule_seconds, per_rule_lines = bench_per_rule(rules, table)
+            except ImportError as e:
+                print(f"   iptables -A        skipped ({e})")
+                continue
+            print(f"   iptables -A        {per_rule_seconds * 1000:10.1f} ms   "
+                  f"{per_rule_lines} processes   {per_rule_lines} table lines   "
+                  f"({per_rule_seconds / restore_seconds:,.0f}x slower)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="10,1000,10000", help="Comma-separated rule counts")
+    parser.add_argument("--per-rule-limit", type=int, default=10000,
+                        help="Skip the per-rule path above this many rules")
+    args = parser.parse_args()
+    main([int(size) for size in args.sizes.split(",")], args.per_rule_limit)
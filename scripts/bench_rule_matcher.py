@@ -0,0 +1,130 @@
+"""
+Rule matcher benchmark and oracle: which rule handles each packet.
+Evaluates a batch of synthetic packets (a few IPv6, some with timestamps so
+schedules and days_of_week apply) three ways - the NumPy batch path, the
+index-backed scalar path and a linear RuleShape.matches walk (what the
+optimizer's replay does) - and checks that they agree. The optimized
+ruleset must give the same verdict for every packet as well.
+
+    python scripts/bench_rule_matcher.py --rules 2000 --packets 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import types
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+try:
+    import app.settings  # noqa: F401
+except ImportError:
+    # The optimizer only reads one flag; allow running without the API dependencies
+    sys.modules["app.settings"] = types.SimpleNamespace(
+        get_settings=lambda: types.SimpleNamespace(firewall_optimizer_enabled=True)
+    )
+
+from app.firewall_optimizer import RuleShape, prepare_packet  # noqa: E402
+from app.rule_matcher import NUMPY_AVAILABLE, RuleMatcher, normalize_packet  # noqa: E402
+
+SERVICES = ["22", "53", "80", "443", "3389", "5432", "8000-8100"]
+
+
+def make_rules(count, rng):
+    rules = []
+    for i in range(count):
+        rule = {
+            "_id": f"rule{i:05d}", "rule_name": f"bench-{i}", "enabled": True,
+            "protocol": rng.choice(["TCP", "TCP", "UDP", "ICMP", "ANY"]),
+            "action": rng.choice(["ALLOW", "ALLOW", "DENY", "DROP", "REJECT"]),
+            "direction": rng.choice(["IN", "IN", "OUT", "BOTH"]),
+            "priority": rng.choice([10, 100, 100, 100, 500]),
+            "source_ips": [f"10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.0/{rng.choice([16, 20, 24, 24, 28])}"
+                           for _ in range(rng.randint(0, 2))],
+        }
+        if rng.random() < 0.05:
+            rule["source_ips"].append(f"2001:db8:{rng.randint(0, 15):x}::/48")
+        if rng.random() < 0.3:
+            rule["destination_ips"] = [f"172.16.{rng.randint(0, 15)}.0/24"]
+        if rule["protocol"] != "ICMP" and rng.random() < 0.7:
+            rule["destination_ports"] = rng.sample(SERVICES, rng.randint(1, 3))
+        if rng.random() < 0.1:
+            rule["interface"] = rng.choice(["eth0", "eth1"])
+        if rng.random() < 0.15:
+            start = rng.randint(0, 23)
+            rule.update(schedule_start=f"{start:02d}:00", schedule_end=f"{(start + rng.randint(1, 12)) % 24:02d}:30",
+                        days_of_week=rng.sample(range(7), rng.randint(0, 5)))
+        rules.append(rule)
+    return rules
+
+
+def make_packets(count, rng):
+    base = datetime(2024, 1, 1)
+    packets = []
+    for _ in range(count):
+        ipv6 = rng.random() < 0.01
+        packets.append(normalize_packet({
+            "direction": rng.choice(["IN", "IN", "OUT"]),
+            "protocol": rng.choice(["TCP", "TCP", "UDP", "ICMP", "OTHER"]),
+            "source_ip": (f"2001:db8:{rng.randint(0, 15):x}::{rng.randint(1, 999)}" if ipv6
+                          else f"10.{rng.randint(0, 3)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"),
+            "destination_ip": "2001:db8:ffff::1" if ipv6 else f"172.16.{rng.randint(0, 20)}.{rng.randint(1, 254)}",
+            "source_port": rng.randint(1024, 65535),
+            "destination_port": rng.choice([22, 53, 80, 443, 3389, 5432, 8050, 9000]),
+            "interface": rng.choice(["eth0", "eth1", None]),
+            "timestamp": base + timedelta(minutes=rng.randint(0, 7 * 24 * 60)) if rng.random() < 0.5 else None,
+        }))
+    return packets
+
+
+def main(rule_count, packet_count, seed):
+    rng = random.Random(seed)
+    documents = make_rules(rule_count, rng)
+    packets = make_packets(packet_count, rng)
+
+    started = time.perf_counter()
+    matcher = RuleMatcher.from_documents(documents)
+    optimized = RuleMatcher.from_documents(documents, optimized=True)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    batch = matcher.decide_batch(packets)
+    batch_seconds = time.perf_counter() - started
+
+    sample = packets[:max(1, packet_count // 20)]
+    started = time.perf_counter()
+    scalar = [matcher.decide(packet) for packet in sample]
+    scalar_seconds = (time.perf_counter() - started) / len(sample) * packet_count
+
+    shapes = [RuleShape(spec) for spec in matcher.specs]
+    linear = [next((position for position, shape in enumerate(shapes) if shape.matches(prepared)), -1)
+              for prepared in map(prepare_packet, sample)]
+
+    assert [decision.position for decision in scalar] == [decision.position for decision in batch[:len(sample)]], \
+        "batch and scalar paths disagree"
+    assert [decision.position for decision in scalar] == linear, "matcher and linear first-match disagree"
+
+    started = time.perf_counter()
+    optimized_verdicts = [decision.verdict for decision in optimized.decide_batch(packets)]
+    optimized_seconds = time.perf_counter() - started
+    mismatches = sum(1 for decision, verdict in zip(batch, optimized_verdicts) if decision.verdict != verdict)
+
+    engine = "numpy" if NUMPY_AVAILABLE else "scalar (numpy not installed)"
+    print(f"🎯 {rule_count} rules ({len(optimized.specs)} optimized) compiled in {build_seconds:.2f}s")
+    print(f"   batch   {batch_seconds:8.2f} s for {packet_count} packets   [{engine}]")
+    print(f"   scalar  {scalar_seconds:8.2f} s   (extrapolated from {len(sample)} packets)")
+    print(f"   optimized ruleset {optimized_seconds:.2f} s, verdict mismatches: {mismatches}")
+    print(f"   verdicts: {dict(Counter(decision.verdict for decision in batch))}")
+    assert mismatches == 0, "optimized ruleset changes verdicts"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rules", type=int, default=2000)
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=5)
+    args = parser.parse_args()
+    main(args.rules, args.packets, args.seed)
@@ -0,0 +1,116 @@
+"""
+Storage backend benchmark: MongoDB (Motor) vs. embedded SQLite (WAL).
+Measures log ingest rate and the latency of the LogService.get_logs query
+shape (count_documents + find/sort/skip/limit) on both backends.
+MongoDB is skipped when no local mongod answers.
+
+    python scripts/bench_storage_backends.py --docs 50000 --batch-size 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+from app.storage import SQLiteClient  # noqa: E402
+
+MONGODB_URL = "mongodb://localhost:27017"
+DB_NAME = "kobi_firewall_bench"
+
+
+def make_logs(count):
+    now = datetime.utcnow()
+    return [
+        {
+            "timestamp": now - timedelta(seconds=i),
+            "source": random.choice(["iptables", "firewall_block", "firewall_allow", "http_middleware"]),
+            "event_type": random.choice(["traffic_log", "packet_blocked", "packet_allowed"]),
+            "level": random.choice(["ALLOW", "BLOCK", "INFO", "WARNING"]),
+            "message": random.choice(["Bağlantı Engellendi", "Erişim İzni Başarılı", "GET /api/v1/logs - 200"]),
+            "source_ip": f"192.168.{random.randint(0, 3)}.{random.randint(1, 254)}",
+            "destination_ip": f"10.0.0.{random.randint(1, 254)}",
+            "protocol": random.choice(["TCP", "UDP", "ICMP"]),
+            "destination_port": random.choice([22, 53, 80, 443, 3389]),
+        }
+        for i in range(count)
+    ]
+
+
+def get_logs_queries():
+    """Query shapes issued by LogService.get_logs"""
+    now = datetime.utcnow()
+    return [
+        ("latest page", {}),
+        ("level filter", {"level": "BLOCK"}),
+        ("level + 1h window", {"level": "BLOCK", "timestamp": {"$gte": now - timedelta(hours=1)}}),
+        ("source_ip filter", {"source_ip": "192.168.1.10"}),
+        ("text search", {"$or": [
+            {"message": {"$regex": "engellendi", "$options": "i"}},
+            {"source_ip": {"$regex": "192.168.2.1", "$options": "i"}},
+        ]}),
+    ]
+
+
+async def bench_backend(name, database, docs, batch_size, rounds):
+    collection = database.system_logs
+    await collection.drop()
+
+    started = time.perf_counter()
+    for start in range(0, len(docs), batch_size):
+        await collection.insert_many([dict(doc) for doc in docs[start:start + batch_size]], ordered=False)
+    elapsed = time.perf_counter() - started
+    print(f"\n📥 {name}: ingested {len(docs)} logs in {elapsed:.2f}s ({len(docs) / elapsed:,.0f} docs/s)")
+
+    for label, query in get_logs_queries():
+        timings = []
+        for page in range(rounds):
+            started = time.perf_counter()
+            await collection.count_documents(query)
+            await collection.find(query).sort("timestamp", -1).skip(page * 50).limit(50).to_list(50)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"   get_logs[{label:<18}] p50 {statistics.median(timings):7.2f} ms   max {max(timings):7.2f} ms")
+
+
+async def main(num_docs, batch_size, rounds):
+    docs = make_logs(num_docs)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        client = SQLiteClient(os.path.join(tmp, "bench.db"))
+        try:
+            await bench_backend("SQLite (WAL)", client[DB_NAME], docs, batch_size, rounds)
+        finally:
+            client.close()
+
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=2000)
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"\n⚠️ MongoDB skipped: {e}")
+        return
+
+    try:
+        database = client[DB_NAME]
+        await database.system_logs.drop()
+        await database.system_logs.create_index([("level", 1), ("timestamp", -1)])
+        await database.system_logs.create_index([("source_ip", 1), ("timestamp", -1)])
+        await database.system_logs.create_index([("timestamp", -1)])
+        await bench_backend("MongoDB", database, docs, batch_size, rounds)
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.docs, args.batch_size, args.rounds))
@@ -0,0 +1,84 @@
+"""
+Query plan check: applies the index planner to a scratch database on a local
+mongod, seeds system_logs and runs explain() for every registered query shape.
+Exits non-zero when any shape's winning plan is a COLLSCAN.
+
+    python scripts/verify_query_plans.py --docs 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+# Importing the services registers their query shapes
+import app.services.log_service  # noqa: E402,F401
+import app.services.reports_service  # noqa: E402,F401
+import app.tasks.log_watcher  # noqa: E402,F401
+from app.index_planner import apply_index_plan, plan_indexes, verify_query_shapes  # noqa: E402
+
+MONGODB_URL = "mongodb://localhost:27017"
+DB_NAME = "kobi_firewall_plan_check"
+
+
+def make_logs(count):
+    now = datetime.utcnow()
+    return [
+        {
+            "timestamp": now - timedelta(seconds=i),
+            "source": random.choice(["iptables", "auth", "http_middleware", "login"]),
+            "event_type": random.choice(["traffic_log", "packet_blocked", "packet_allowed"]),
+            "level": random.choice(["ALLOW", "BLOCK", "DENY", "INFO", "WARNING", "ERROR"]),
+            "message": "sample",
+            "source_ip": f"192.168.{random.randint(0, 3)}.{random.randint(1, 254)}",
+            "destination_port": random.choice([22, 53, 80, 443, None]),
+        }
+        for i in range(count)
+    ]
+
+
+async def main(num_docs):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(MONGODB_URL, serverSelectionTimeoutMS=2000)
+    try:
+        await client.admin.command("ping")
+    except Exception as e:
+        print(f"⚠️ No local mongod: {e}")
+        return 2
+
+    database = client[DB_NAME]
+    try:
+        await database.system_logs.insert_many(make_logs(num_docs), ordered=False)
+        await database.system_logs.create_index([("timestamp", -1)], expireAfterSeconds=2592000)
+
+        for collection, plans in plan_indexes().items():
+            for plan in plans:
+                print(f"📋 {collection}.{plan.name}  <- {', '.join(plan.shapes)}")
+
+        await apply_index_plan(database)
+        results = await verify_query_shapes(database)
+
+        failures = 0
+        for name, result in sorted(results.items()):
+            if "error" in result:
+                failures += 1
+                print(f"❌ {name:<28} error: {result['error']}")
+                continue
+            marker = "❌" if result["collscan"] else "✅"
+            failures += result["collscan"]
+            print(f"{marker} {name:<28} {' > '.join(result['stages']):<40} {', '.join(result['indexes'])}")
+        return 1 if failures else 0
+    finally:
+        await client.drop_database(DB_NAME)
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=5000)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.docs)))